@@ -1,6 +1,6 @@
-import services.google_calendar as google_calendar
 import datetime
-from services.calendar_utils import parse_dt, is_event_on, event_label
+from services.calendar_index import calendar_index, resolve_overlaps
+from services.calendar_utils import parse_dt, event_label
 
 class CalendarAgentService:
   @staticmethod
@@ -17,19 +17,19 @@ class CalendarAgentService:
     today_str = today.strftime('%Y-%m-%d')
     tomorrow_str = tomorrow.strftime('%Y-%m-%d')
 
-    # Get all events from the calendar service (replace this with your service call)
-    events = google_calendar.get_all_events()
-
     # Filter events based on the requested day (today or tomorrow)
+    index = calendar_index()
     if day == "today":
-        events = [event for event in events if is_event_on(event, today_str)]
+        entries = index.on(today_str)
     elif day == "tomorrow":
-        events = [event for event in events if is_event_on(event, tomorrow_str)]
+        entries = index.on(tomorrow_str)
+    else:
+        entries = index.entries
 
-    if not events:
+    if not entries:
         return f"You have no events for {day}."
 
-    events = CalendarAgentService._resolve_overlaps(events)
+    events = CalendarAgentService._resolve_overlaps(entries)
 
     # Format the events for TTS
     events_text = f"Here are your events for {day}: "
@@ -37,38 +37,9 @@ class CalendarAgentService:
     return events_text
 
   @staticmethod
-  def _resolve_overlaps(events: list) -> list:
-    """Drop untitled events that overlap with a titled event in the same list."""
-    def get_range(event):
-      start_str = event['start'].get('dateTime', event['start'].get('date'))
-      end_str = event['end'].get('dateTime', event['end'].get('date'))
-      try:
-        return parse_dt(start_str), parse_dt(end_str)
-      except Exception:
-        return None, None
-
-    def overlaps(a_start, a_end, b_start, b_end):
-      return a_start < b_end and b_start < a_end
-
-    titled = [e for e in events if e.get('summary')]
-    untitled = [e for e in events if not e.get('summary')]
-
-    surviving_untitled = []
-    for u in untitled:
-      u_start, u_end = get_range(u)
-      if u_start is None:
-        surviving_untitled.append(u)
-        continue
-      if not any(
-        overlaps(u_start, u_end, *get_range(t))
-        for t in titled
-        if get_range(t)[0] is not None
-      ):
-        surviving_untitled.append(u)
-
-    all_events = titled + surviving_untitled
-    all_events.sort(key=lambda e: e['start'].get('dateTime', e['start'].get('date', '')))
-    return all_events
+  def _resolve_overlaps(entries: list) -> list:
+    """Drop untitled events that overlap with a titled event in the same list (calendar_index entries in, events out)."""
+    return [entry.event for entry in resolve_overlaps(entries)]
 
   @staticmethod
   def _format_events(events):
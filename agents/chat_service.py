@@ -3,22 +3,32 @@
 Responsibilities:
   - Intent routing via AgentService
   - Reply generation via PersonaAgent
-  - Memory extraction (fires in background before returning, before any image
-    resolution the caller may trigger — avoids the _in_progress GPU-check race)
+  - Memory extraction (queued before returning via MemoryService.submit_exchange,
+    which coalesces bursts into one combined call and defers while the GPU is busy)
 
 Returns {'reply': str, 'mood': str | None}.
 Image resolution is the caller's responsibility.
+
+Streaming frontends pass on_event(event, data) to handle(); it receives:
+  - ('phase',    {'phase': 'routing' | 'relay' | 'open'})
+  - ('thinking', {'chars': int})   think-phase progress, throttled
+  - ('token',    {'text': str})    answer chunks as the backend streams them
 """
 
-import threading
+THINKING_EVENT_EVERY = 200  # chars of reasoning between 'thinking' progress events
 
 
 class ChatService:
     @classmethod
-    def handle(cls, query: str, history: list | None = None) -> dict:
+    def handle(cls, query: str, history: list | None = None, on_event=None) -> dict:
         from agents.persona.agent import PersonaAgent
         from agents.persona.states import MOOD_MODIFIERS
 
+        emit = on_event or (lambda event, data: None)
+        on_token = (lambda text: emit('token', {'text': text})) if on_event else None
+        on_progress = cls._thinking_progress(emit) if on_event else None
+
+        emit('phase', {'phase': 'routing'})
         history_str = cls._build_history_str(history or [])
 
         mood = None
@@ -41,16 +51,22 @@ class ChatService:
         try:
             if factual:
                 print('[ChatService] → factual relay')
-                reply = PersonaAgent.generate_factual_relay(query, factual, history_str, mood)
+                emit('phase', {'phase': 'relay'})
+                reply = PersonaAgent.generate_factual_relay(query, factual, history_str, mood, on_token=on_token)
             else:
                 print('[ChatService] → open answer')
-                reply = PersonaAgent.generate_open_answer(query, history_str, mood)
+                emit('phase', {'phase': 'open'})
+                reply = PersonaAgent.generate_open_answer(query, history_str, mood,
+                                                          on_token=on_token, on_progress=on_progress)
         except Exception as e:
             print(f'[ChatService] generation error: {e}')
             reply = "Sorry, something went wrong on my end."
 
-        exchange = f"User: {query}\nPersona: {reply}"
-        threading.Thread(target=cls._extract_memory, args=(exchange,), daemon=True).start()
+        try:
+            from agents.memory_service import MemoryService
+            MemoryService.submit_exchange(f"User: {query}\nPersona: {reply}")
+        except Exception as e:
+            print(f'[ChatService] memory extraction error: {e}')
 
         try:
             from agents.stats_service import on_chat
@@ -60,6 +76,17 @@ class ChatService:
 
         return {'reply': reply, 'mood': mood}
 
+    @staticmethod
+    def _thinking_progress(emit):
+        """Return an on_progress callback that emits a 'thinking' event every THINKING_EVENT_EVERY chars."""
+        last = [0]
+
+        def on_progress(chars: int) -> None:
+            if chars - last[0] >= THINKING_EVENT_EVERY:
+                last[0] = chars
+                emit('thinking', {'chars': chars})
+        return on_progress
+
     @staticmethod
     def _build_history_str(history: list) -> str | None:
         lines = [
@@ -68,12 +95,3 @@ class ChatService:
             if isinstance(t, (list, tuple)) and len(t) == 2
         ]
         return '\n\n'.join(lines) if lines else None
-
-    @staticmethod
-    def _extract_memory(exchange: str) -> None:
-        try:
-            from agents.memory_service import MemoryService
-            MemoryService.extract_from_exchange(exchange)
-            MemoryService.extract_persona_from_exchange(exchange)
-        except Exception as e:
-            print(f'[ChatService] memory extraction error: {e}')
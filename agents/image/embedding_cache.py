@@ -0,0 +1,150 @@
+"""Prompt-embedding cache shared by image/image_gen_service.py (Flask) and image/hq_gen_worker.py.
+
+Every job ran the CLIP text encoder twice through Compel — once for the prompt and once for the
+negative prompt, which is the same long NEGATIVE_PROMPT (+ TI prefix) for nearly every job —
+and MQ then UHQ encoded the very same prompts the fast tier already had.
+
+- Key: sha1 of (text-encoder identity, clip_skip, text). The identity (encoder_identity()) is the
+  model id, dtype and loaded TI tokens — everything that changes what the encoder returns.
+- Memory: an LRU of EMBED_CACHE_ITEMS CPU tensors per process.
+- Disk: EMBED_CACHE_DIR/{key}.safetensors, written to a tmp file and renamed, so the other process
+  never reads a partial file. A disk hit touches the file; the least recently used files are
+  pruned beyond EMBED_CACHE_MAX_FILES.
+- encode() returns the padded (prompt, negative) pair plus a per-job timing dict that the callers
+  log; encode_batch() pads and stacks several pairs for one batched diffusion run. stats() keeps
+  this process's totals — the Flask side is served at /persona/image/embeddings.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import torch
+from safetensors.torch import load_file, save_file
+
+EMBED_CACHE_DIR       = Path("env/embed_cache")
+EMBED_CACHE_ITEMS     = 64    # tensors kept in memory per process
+EMBED_CACHE_MAX_FILES = 512   # ~100–500 KB each at fp16; oldest pruned beyond this
+
+_mem: OrderedDict[str, torch.Tensor] = OrderedDict()
+_lock = threading.Lock()
+_stats = {'jobs': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'encode_s': 0.0, 'disk_errors': 0}
+
+
+def encoder_identity(model_id: str, dtype, ti_prefix: str) -> str:
+    """Identity of a loaded text encoder: same identity + same text → same embedding."""
+    return f"{model_id}|{dtype}|{ti_prefix}"
+
+
+def _key(identity: str, clip_skip: int, text: str) -> str:
+    return hashlib.sha1(f"{identity}\0{clip_skip}\0{text}".encode()).hexdigest()
+
+
+def _remember(key: str, tensor: torch.Tensor) -> None:
+    with _lock:
+        _mem[key] = tensor
+        _mem.move_to_end(key)
+        while len(_mem) > EMBED_CACHE_ITEMS:
+            _mem.popitem(last=False)
+
+
+def _load(key: str) -> torch.Tensor | None:
+    path = EMBED_CACHE_DIR / f"{key}.safetensors"
+    if not path.exists():
+        return None
+    try:
+        tensor = load_file(str(path))['embeds']
+        os.utime(path)  # LRU order for pruning
+        return tensor
+    except Exception as e:
+        _stats['disk_errors'] += 1
+        print(f"[EmbedCache] Unreadable {path.name}, re-encoding: {e}")
+        path.unlink(missing_ok=True)
+        return None
+
+
+def _store(key: str, tensor: torch.Tensor) -> None:
+    try:
+        EMBED_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        path = EMBED_CACHE_DIR / f"{key}.safetensors"
+        tmp = EMBED_CACHE_DIR / f"{key}.{os.getpid()}.tmp"
+        save_file({'embeds': tensor.contiguous()}, str(tmp))
+        os.replace(tmp, path)
+        files = list(EMBED_CACHE_DIR.glob("*.safetensors"))
+        if len(files) > EMBED_CACHE_MAX_FILES:
+            files.sort(key=lambda p: p.stat().st_mtime)
+            for old in files[:len(files) - EMBED_CACHE_MAX_FILES]:
+                old.unlink(missing_ok=True)
+    except Exception as e:
+        _stats['disk_errors'] += 1
+        print(f"[EmbedCache] Could not store embedding: {e}")
+
+
+def _embed(compel, identity: str, clip_skip: int, text: str) -> tuple[torch.Tensor, str]:
+    """(CPU embedding, 'memory' | 'disk' | 'miss') for one text."""
+    key = _key(identity, clip_skip, text)
+    with _lock:
+        tensor = _mem.get(key)
+        if tensor is not None:
+            _mem.move_to_end(key)
+    if tensor is not None:
+        _stats['memory_hits'] += 1
+        return tensor, 'memory'
+    tensor = _load(key)
+    if tensor is not None:
+        _stats['disk_hits'] += 1
+        _remember(key, tensor)
+        return tensor, 'disk'
+    with torch.no_grad():
+        tensor = compel(text).detach().to('cpu')
+    _stats['misses'] += 1
+    _remember(key, tensor)
+    _store(key, tensor)
+    return tensor, 'miss'
+
+
+def encode(compel, identity: str, clip_skip: int, prompt: str, negative: str,
+           device: str | None = None) -> tuple[torch.Tensor, torch.Tensor, dict]:
+    """Padded (prompt_embeds, negative_embeds) on device (CPU if None), plus
+    {'encode_ms', 'prompt', 'negative'} where the last two say where each came from."""
+    prompt_embeds, negative_embeds, enc = encode_batch(compel, identity, clip_skip, [(prompt, negative)], device)
+    (prompt_src, negative_src), = enc['sources']
+    return prompt_embeds, negative_embeds, {
+        'encode_ms': enc['encode_ms'], 'prompt': prompt_src, 'negative': negative_src,
+    }
+
+
+def encode_batch(compel, identity: str, clip_skip: int, pairs: list[tuple[str, str]],
+                 device: str | None = None) -> tuple[torch.Tensor, torch.Tensor, dict]:
+    """encode() for a batch of (prompt, negative) pairs: every tensor is padded to the longest
+    in the batch and stacked, so row i of both outputs belongs to pairs[i].
+    Returns {'encode_ms', 'sources': [(prompt source, negative source), ...]}."""
+    t0 = time.perf_counter()
+    tensors, sources = [], []
+    for prompt, negative in pairs:
+        prompt_embeds, prompt_src = _embed(compel, identity, clip_skip, prompt)
+        negative_embeds, negative_src = _embed(compel, identity, clip_skip, negative)
+        tensors += [prompt_embeds, negative_embeds]
+        sources.append((prompt_src, negative_src))
+    tensors = compel.pad_conditioning_tensors_to_same_length(tensors)
+    prompt_embeds, negative_embeds = torch.cat(tensors[0::2]), torch.cat(tensors[1::2])
+    if device is not None:
+        prompt_embeds, negative_embeds = prompt_embeds.to(device), negative_embeds.to(device)
+    elapsed = time.perf_counter() - t0
+    _stats['jobs'] += len(pairs)
+    _stats['encode_s'] += elapsed
+    return prompt_embeds, negative_embeds, {'encode_ms': round(elapsed * 1000, 1), 'sources': sources}
+
+
+def stats() -> dict:
+    s = dict(_stats)
+    lookups = s['memory_hits'] + s['disk_hits'] + s['misses']
+    return {
+        **{k: v for k, v in s.items() if k != 'encode_s'},
+        'hit_rate': round((s['memory_hits'] + s['disk_hits']) / lookups, 3) if lookups else None,
+        'avg_encode_ms': round(s['encode_s'] * 1000 / s['jobs'], 1) if s['jobs'] else None,
+        'memory_items': len(_mem),
+        'disk_files': len(list(EMBED_CACHE_DIR.glob("*.safetensors"))) if EMBED_CACHE_DIR.exists() else 0,
+    }
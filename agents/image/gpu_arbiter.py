@@ -0,0 +1,367 @@
+"""GPU arbiter shared by image/image_gen_service.py (Flask) and image/hq_gen_worker.py.
+
+Replaces the env/gpu.lock flock, the priority_queue marker files the worker polled, and
+SIGTERM-ing the worker when Flask needed the GPU (which then paid a respawn and a full
+pipeline reload).
+
+- One lease (one GPU). The arbiter runs as a thread in the Flask process, on a Unix stream socket
+  (ARBITER_SOCKET_PATH). Flask code takes leases in-process; the worker connects over the socket —
+  one connection per lease, newline-delimited JSON: acquire → granted, yield, release.
+- Leases are granted by priority (FOREGROUND before BACKGROUND), FIFO within a priority.
+- Preemption is cooperative: a FOREGROUND request that finds a BACKGROUND holder sends it a
+  'yield'. The worker checks Lease.step_callback between diffusion steps, aborts the run,
+  offloads the pipeline and releases; its job goes back to the queue.
+- A holder's connection dropping (worker died) releases its lease, as the flock did.
+- on_request() hooks run before each request is queued (residency.py moves the idle fast
+  pipeline off the GPU there).
+- stats(): grants, yields, waiters, and the latency of every handoff — yield → release (how long
+  the holder took to stop) and release → grant delivered (the arbiter's own handoff) — served at
+  /persona/image/gpu.
+"""
+import heapq
+import itertools
+import json
+import math
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+ARBITER_SOCKET_PATH = Path("env/gpu_arbiter.sock")
+
+FOREGROUND = 0   # fast-tier generation the user is waiting for, LLM response calls
+BACKGROUND = 1   # MQ/UHQ worker jobs — asked to yield when FOREGROUND arrives
+PRIORITY_NAMES = {FOREGROUND: 'foreground', BACKGROUND: 'background'}
+
+_CONNECT_RETRY = 1.0   # seconds between attempts when no arbiter is listening (worker side)
+_LATENCY_HISTORY = 200
+
+
+class LeaseYielded(Exception):
+    """Raised from Lease.step_callback when the arbiter asked the holder to give up the GPU."""
+
+
+class _Request:
+    __slots__ = ('key', 'priority', 'seq', 'on_grant', 'on_yield', 'requested_at',
+                 'granted_at', 'yield_sent_at', 'preempting')
+
+    def __init__(self, key: str, priority: int, seq: int, on_grant, on_yield):
+        self.key = key
+        self.priority = priority
+        self.seq = seq
+        self.on_grant = on_grant
+        self.on_yield = on_yield
+        self.requested_at = time.monotonic()
+        self.granted_at: float | None = None
+        self.yield_sent_at: float | None = None
+        self.preempting = False  # this request made the holder yield
+
+    def __lt__(self, other: '_Request') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+# ------------------------------------------------------------------ #
+#  Arbiter (runs in the Flask process)                                 #
+# ------------------------------------------------------------------ #
+
+class GPUArbiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._holder: _Request | None = None
+        self._waiting: list[_Request] = []
+        self._seq = itertools.count()
+        self._released_at: float | None = None
+        self._counters = {'grants': 0, 'immediate': 0, 'yields': 0, 'cancelled': 0, 'dropped': 0}
+        self._yield_ms: deque = deque(maxlen=_LATENCY_HISTORY)
+        self._handoff_ms: deque = deque(maxlen=_LATENCY_HISTORY)
+        self._preempt_wait_ms: deque = deque(maxlen=_LATENCY_HISTORY)
+        self._serving = False
+        self._request_hooks: list = []
+
+    def request(self, key: str, priority: int, on_grant, on_yield) -> _Request:
+        """Queue a lease request; on_grant() is called (possibly right away) when it is granted.
+        Hooks run first, in the requesting thread (see on_request())."""
+        for hook in self._request_hooks:
+            try:
+                hook(key, priority)
+            except Exception as e:
+                print(f"[GPUArbiter] Request hook failed for {key}: {e}")
+        req = _Request(key, priority, next(self._seq), on_grant, on_yield)
+        with self._lock:
+            if self._holder is None and not self._waiting:
+                self._counters['immediate'] += 1
+                self._grant(req)
+            else:
+                heapq.heappush(self._waiting, req)
+                holder = self._holder
+                if holder is not None and priority < holder.priority and holder.yield_sent_at is None:
+                    holder.yield_sent_at = time.monotonic()
+                    req.preempting = True
+                    self._counters['yields'] += 1
+                    holder.on_yield()
+        return req
+
+    def release(self, req: _Request) -> None:
+        """Release a granted lease, or withdraw a request still waiting."""
+        with self._lock:
+            if self._holder is req:
+                now = time.monotonic()
+                if req.yield_sent_at is not None:
+                    self._yield_ms.append((now - req.yield_sent_at) * 1000)
+                self._holder = None
+                self._released_at = now
+                if self._waiting:
+                    self._grant(heapq.heappop(self._waiting))
+            elif req in self._waiting:
+                self._waiting.remove(req)
+                heapq.heapify(self._waiting)
+                self._counters['cancelled'] += 1
+
+    def _grant(self, req: _Request) -> None:
+        """Caller holds _lock."""
+        now = time.monotonic()
+        req.granted_at = now
+        self._holder = req
+        self._counters['grants'] += 1
+        if req.preempting:
+            self._preempt_wait_ms.append((now - req.requested_at) * 1000)
+        try:
+            req.on_grant()
+        except OSError:
+            # The requester vanished between asking and being granted
+            self._counters['dropped'] += 1
+            self._holder = None
+            if self._waiting:
+                self._grant(heapq.heappop(self._waiting))
+            return
+        if self._released_at is not None and req.requested_at < self._released_at:
+            self._handoff_ms.append((time.monotonic() - self._released_at) * 1000)
+
+    def idle(self) -> bool:
+        with self._lock:
+            return self._holder is None and not self._waiting
+
+    # ---- socket side ---------------------------------------------------
+
+    def serve(self) -> None:
+        """Listen on ARBITER_SOCKET_PATH in a daemon thread (idempotent)."""
+        with self._lock:
+            if self._serving:
+                return
+            self._serving = True
+        ARBITER_SOCKET_PATH.parent.mkdir(parents=True, exist_ok=True)
+        ARBITER_SOCKET_PATH.unlink(missing_ok=True)  # stale socket from a previous run
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(ARBITER_SOCKET_PATH))
+        server.listen(8)
+        threading.Thread(target=self._accept_loop, args=(server,), daemon=True, name="gpu-arbiter").start()
+        print(f"[GPUArbiter] Listening on {ARBITER_SOCKET_PATH}.")
+
+    def _accept_loop(self, server: socket.socket) -> None:
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=self._session, args=(conn,), daemon=True, name="gpu-arbiter-conn").start()
+
+    def _session(self, conn: socket.socket) -> None:
+        """One remote lease: acquire, then release or disconnect."""
+        send_lock = threading.Lock()
+
+        def send(msg: dict) -> None:
+            with send_lock:
+                conn.sendall((json.dumps(msg) + "\n").encode())
+
+        req = None
+        try:
+            with conn, conn.makefile('rb') as reader:
+                for line in reader:
+                    msg = json.loads(line)
+                    if msg.get('op') == 'acquire' and req is None:
+                        req = self.request(msg.get('key', '?'), int(msg.get('priority', BACKGROUND)),
+                                           on_grant=lambda: send({'op': 'granted'}),
+                                           on_yield=lambda: _send_quietly(send, {'op': 'yield'}))
+                    elif msg.get('op') == 'release':
+                        break
+        except (OSError, ValueError):
+            pass
+        finally:
+            if req is not None:
+                self.release(req)
+
+    def stats(self) -> dict:
+        with self._lock:
+            holder = self._holder
+            now = time.monotonic()
+            return {
+                **self._counters,
+                'serving': self._serving,
+                'holder': {'key': holder.key, 'priority': PRIORITY_NAMES.get(holder.priority),
+                           'held_s': round(now - holder.granted_at, 2),
+                           'yield_requested': holder.yield_sent_at is not None} if holder else None,
+                'waiting': [{'key': r.key, 'priority': PRIORITY_NAMES.get(r.priority),
+                             'waiting_s': round(now - r.requested_at, 2)} for r in sorted(self._waiting)],
+                'yield_ms': _summary(self._yield_ms),
+                'handoff_ms': _summary(self._handoff_ms),
+                'preempt_wait_ms': _summary(self._preempt_wait_ms),
+            }
+
+
+def _send_quietly(send, msg: dict) -> None:
+    try:
+        send(msg)
+    except OSError:
+        pass  # the holder is gone; its session thread releases the lease
+
+
+def _summary(samples: deque) -> dict | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {'n': len(ordered), 'avg': round(sum(ordered) / len(ordered), 2),
+            'p95': round(ordered[max(0, math.ceil(0.95 * len(ordered)) - 1)], 2), 'max': round(ordered[-1], 2)}
+
+
+_arbiter = GPUArbiter()
+
+
+def serve() -> None:
+    """Start the arbiter in this process (Flask, at startup)."""
+    _arbiter.serve()
+
+
+def idle() -> bool:
+    """No lease held or waiting — only meaningful in the process running the arbiter."""
+    return _arbiter.idle()
+
+
+def on_request(hook) -> None:
+    """hook(key, priority) runs before every lease request reaches the arbiter in this process —
+    used to move idle-resident weights off the GPU before another holder can start."""
+    _arbiter._request_hooks.append(hook)
+
+
+def stats() -> dict:
+    return _arbiter.stats()
+
+
+# ------------------------------------------------------------------ #
+#  Leases                                                              #
+# ------------------------------------------------------------------ #
+
+class Lease:
+    """A held GPU lease. yield_requested turns True when a higher-priority request is waiting."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.yield_requested = False
+
+    def step_callback(self, pipe, step: int, timestep, callback_kwargs: dict) -> dict:
+        """diffusers callback_on_step_end: abort the run between steps when asked to yield."""
+        if self.yield_requested:
+            raise LeaseYielded(f"{self.key} yielded the GPU at step {step}")
+        return callback_kwargs
+
+
+_client_only = False
+
+
+def client_only() -> None:
+    """Never host the arbiter in this process — wait for Flask's instead (the HQ worker)."""
+    global _client_only
+    _client_only = True
+
+
+@contextmanager
+def lease(key: str, priority: int = FOREGROUND, skip_if=None):
+    """Hold the GPU for the duration of the block. In the arbiter's process the lease is taken
+    directly, elsewhere over the socket; a process that finds no arbiter listening starts one
+    (unless client_only()). skip_if() → True runs the block without a lease."""
+    if skip_if is not None and skip_if():
+        yield Lease(key)
+        return
+    sock = None
+    if not _arbiter._serving:
+        sock = _connect(wait=_client_only)
+        if sock is None:
+            _arbiter.serve()
+    if sock is None:
+        with _local_lease(key, priority) as held:
+            yield held
+    else:
+        with _remote_lease(sock, key, priority) as held:
+            yield held
+
+
+@contextmanager
+def _local_lease(key: str, priority: int):
+    held = Lease(key)
+    granted = threading.Event()
+
+    def on_yield():
+        held.yield_requested = True
+
+    req = _arbiter.request(key, priority, on_grant=granted.set, on_yield=on_yield)
+    try:
+        granted.wait()
+        yield held
+    finally:
+        _arbiter.release(req)
+
+
+@contextmanager
+def _remote_lease(sock: socket.socket, key: str, priority: int):
+    held = Lease(key)
+    try:
+        sock.sendall((json.dumps({'op': 'acquire', 'key': key, 'priority': priority}) + "\n").encode())
+        reader = sock.makefile('rb')
+        while True:
+            line = reader.readline()
+            if not line:
+                raise ConnectionError("GPU arbiter closed the connection before granting")
+            if json.loads(line).get('op') == 'granted':
+                break
+
+        def watch():
+            # 'yield' — or the arbiter going away — means stop using the GPU
+            try:
+                for line in reader:
+                    if json.loads(line).get('op') == 'yield':
+                        held.yield_requested = True
+            except (OSError, ValueError):
+                pass
+            held.yield_requested = True
+
+        threading.Thread(target=watch, daemon=True, name="gpu-lease-watch").start()
+        yield held
+        try:
+            sock.sendall(b'{"op": "release"}\n')
+        except OSError:
+            pass
+    finally:
+        # shutdown, not just close: the reader file keeps the fd open, and the arbiter
+        # releases the lease on EOF (also the path when the block raised, e.g. LeaseYielded)
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+
+def _connect(wait: bool) -> socket.socket | None:
+    """Connect to the arbiter. wait=True retries until it comes up (the worker can boot before
+    Flask listens); otherwise None when nothing is listening."""
+    logged = False
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(ARBITER_SOCKET_PATH))
+            return sock
+        except OSError:
+            sock.close()
+            if not wait:
+                return None
+            if not logged:
+                print(f"[GPUArbiter] No arbiter at {ARBITER_SOCKET_PATH} yet — waiting.")
+                logged = True
+            time.sleep(_CONNECT_RETRY)
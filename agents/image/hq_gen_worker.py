@@ -3,11 +3,18 @@
 Standalone HQ image generation worker (SD 1.5, 768×768, 30 steps).
 
 Auto-started by ImageGenService.start_upgrade_scheduler() as a subprocess.
-Polls env/hq_queue/ for job files written by ImageGenService.generate().
-Uses env/gpu.lock to coordinate GPU access with the Flask process.
+Claims MQ/UHQ jobs from agents/image/job_queue.py (queued by ImageGenService.generate() and
+friends) and sleeps on its wakeup socket while the queue is empty.
+Claims up to HQ_BATCH_SIZE / UHQ_BATCH_SIZE jobs of one tier at a time and renders them in one
+batched diffusion run (one generator per job, so seeds stay deterministic).
+Takes GPU leases from the arbiter in the Flask process (gpu_arbiter) and yields between
+diffusion steps when a foreground generation needs the GPU. While jobs keep coming and
+nothing asks for the GPU, the lease and the pipeline stay on the GPU between batches.
 Writes results to tmp/persona/{state}_hq.png.
+
+    python -m agents.image.hq_gen_worker --bench --tier mq --batch-sizes 1,2,4 -n 8
 """
-import json
+import argparse
 import os
 import signal
 import sys
@@ -15,8 +22,8 @@ import threading
 import time
 import traceback
 import warnings
+from contextlib import ExitStack
 from datetime import datetime
-from pathlib import Path
 
 import services.log_config as log_config
 log_config.configure()
@@ -27,10 +34,10 @@ import torch
 from compel import Compel, DiffusersTextualInversionManager
 from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler, AutoencoderKL
 
-from agents.image.gpu_lock import WORKER_PID_PATH, WORKER_HEARTBEAT_PATH, gpu_lock, PRIORITY_QUEUE_DIR, cleanup_stale_priority
-from agents.image.hq_worker_manager import WORKER_BOOT_PATH
+from agents.image import embedding_cache, gpu_arbiter, job_queue
+from agents.image.hq_worker_manager import WORKER_BOOT_PATH, WORKER_PID_PATH, WORKER_HEARTBEAT_PATH
 from agents.image.image_gen_service import (
-    MODEL_ID, VAE_ID, FIXED_SEED, OUTPUT_DIR, HQ_QUEUE_DIR, UHQ_QUEUE_DIR,
+    MODEL_ID, VAE_ID, FIXED_SEED, OUTPUT_DIR,
     DEVICE, TORCH_DTYPE,
     ImageGenService,
 )
@@ -47,7 +54,8 @@ HQ_GUIDANCE     = 6.5               # CFG scale
 HQ_CLIP_SKIP    = 2                 # CLIP skip layers (2 = standard for anime models)
 # Scheduler kwargs forwarded to DPMSolverMultistepScheduler.from_config()
 HQ_SCHEDULER_KW = dict(use_karras_sigmas=True, algorithm_type="dpmsolver++")
-_MQ_CFG  = dict(tier="MQ",  steps=HQ_STEPS,  size=HQ_SIZE,  guidance=HQ_GUIDANCE,  clip_skip=HQ_CLIP_SKIP,  path_fn=ImageGenService._hq_path)
+HQ_BATCH_SIZE   = 4                 # MQ jobs per diffusion run (halved automatically on OOM)
+_MQ_CFG  = dict(tier="MQ",  model_id=HQ_MODEL_ID, steps=HQ_STEPS,  size=HQ_SIZE,  guidance=HQ_GUIDANCE,  clip_skip=HQ_CLIP_SKIP,  path_fn=ImageGenService._hq_path)
 # ---------------------------------------------------------------------------
 
 # ---------------------------------------------------------------------------
@@ -60,7 +68,8 @@ UHQ_SIZE         = 1024
 UHQ_GUIDANCE     = 6.5
 UHQ_CLIP_SKIP    = 2
 UHQ_SCHEDULER_KW = dict(use_karras_sigmas=True, algorithm_type="dpmsolver++")
-_UHQ_CFG = dict(tier="UHQ", steps=UHQ_STEPS, size=UHQ_SIZE, guidance=UHQ_GUIDANCE, clip_skip=UHQ_CLIP_SKIP, path_fn=ImageGenService._uhq_path)
+UHQ_BATCH_SIZE   = 2
+_UHQ_CFG = dict(tier="UHQ", model_id=UHQ_MODEL_ID or HQ_MODEL_ID, steps=UHQ_STEPS, size=UHQ_SIZE, guidance=UHQ_GUIDANCE, clip_skip=UHQ_CLIP_SKIP, path_fn=ImageGenService._uhq_path)
 # ---------------------------------------------------------------------------
 
 _pipeline: StableDiffusionPipeline | None = None
@@ -137,90 +146,134 @@ def _get_uhq_pipeline() -> tuple[StableDiffusionPipeline, Compel]:
     return _uhq_pipeline, _uhq_compel
 
 
-def _has_priority_requests() -> bool:
-    return PRIORITY_QUEUE_DIR.exists() and bool(list(PRIORITY_QUEUE_DIR.glob("*.json")))
-
+# ---------------------------------------------------------------------------
+# Batched generation
+# ---------------------------------------------------------------------------
 
-def _process_job(cfg, get_pipe_fn, state, scene_prompt, seed, output_stem, logical_state, save_fn):
-    """Shared generation body. cfg is _MQ_CFG or _UHQ_CFG; save_fn handles the result."""
-    effective_state = logical_state or state
-    tier = cfg["tier"]
-    if output_stem:
-        save_path = OUTPUT_DIR / f"{output_stem}.png"
-        if save_path.exists():
-            print(f"[HQWorker] Skipping '{output_stem}' — experiment file already exists.")
+_TIERS = {'mq': (_MQ_CFG, _get_pipeline), 'uhq': (_UHQ_CFG, _get_uhq_pipeline)}
+# Jobs per diffusion run; halved for the rest of the process when a batch runs out of VRAM
+_batch_limit = {'mq': HQ_BATCH_SIZE, 'uhq': UHQ_BATCH_SIZE}
+
+
+class _GPUSession:
+    """The GPU lease plus the pipeline moved onto the GPU, kept across consecutive batches —
+    the CPU↔GPU transfer costs seconds and used to be paid per job. close() offloads and
+    releases; the worker closes when the queue runs dry, a foreground request asks for the GPU,
+    a different pipeline is needed, or a batch fails."""
+
+    def __init__(self):
+        self._stack: ExitStack | None = None
+        self._held: gpu_arbiter.Lease | None = None
+        self._pipe: StableDiffusionPipeline | None = None
+        self.transfer_ms = 0.0  # last pipe.to(DEVICE)
+
+    def acquire(self, key: str, pipe: StableDiffusionPipeline) -> gpu_arbiter.Lease:
+        if self._held is not None and (self._pipe is not pipe or self._held.yield_requested):
+            self.close()
+        if self._held is None:
+            # Leases are granted by priority, so a waiting foreground generation goes first
+            stack = ExitStack()
+            held = stack.enter_context(gpu_arbiter.lease(key, gpu_arbiter.BACKGROUND))
+            try:
+                t0 = time.perf_counter()
+                pipe.to(DEVICE)
+                torch.cuda.empty_cache()
+                self.transfer_ms = (time.perf_counter() - t0) * 1000
+            except BaseException:
+                pipe.to('cpu')
+                stack.close()
+                raise
+            self._stack, self._held, self._pipe = stack, held, pipe
+        return self._held
+
+    def close(self) -> None:
+        if self._held is None:
             return
-    else:
-        if cfg["path_fn"](state).exists():
-            print(f"[HQWorker] Skipping '{state}' — {tier} already exists.")
-            return
-
-    pipe, compel = get_pipe_fn()
-
-    full_prompt = build_full_prompt(scene_prompt, effective_state)
-    negative    = build_negative_prompt(effective_state, _ti_negative_prefix)
-
-    label = output_stem or f"'{state}'"
-    print(f"[HQWorker] Generating {label} ({tier}) at {cfg['size']}×{cfg['size']}, {cfg['steps']} steps...")
-    print(f"[HQWorker] Prompt: {full_prompt}")
-
-    # Compute embeddings on CPU before acquiring the GPU lock.
-    prompt_embeds = compel(full_prompt)
-    negative_embeds = compel(negative)
-    [prompt_embeds, negative_embeds] = compel.pad_conditioning_tensors_to_same_length(
-        [prompt_embeds, negative_embeds]
-    )
-
-    # Final priority check — yield rather than race if claim_gpu() arrived during embedding.
-    if _has_priority_requests():
-        _wlog(f"[HQWorker] Priority request — deferring {tier} {label}.")
-        return
-
-    with gpu_lock():
-        pipe.to(DEVICE)
-        torch.cuda.empty_cache()
+        stack, pipe = self._stack, self._pipe
+        self._stack = self._held = self._pipe = None
         try:
-            generator = torch.Generator(DEVICE).manual_seed(seed)
-            image = pipe(
-                prompt_embeds=prompt_embeds.to(DEVICE),
-                negative_prompt_embeds=negative_embeds.to(DEVICE),
-                num_inference_steps=cfg["steps"],
-                guidance_scale=cfg["guidance"],
-                clip_skip=cfg["clip_skip"],
-                generator=generator,
-                width=cfg["size"],
-                height=cfg["size"],
-            ).images[0]
-        finally:
             pipe.to('cpu')
             torch.cuda.empty_cache()
+        finally:
+            stack.close()
+
 
+def _prepare(cfg: dict, job: dict) -> dict | None:
+    """A claimed job resolved to its prompts and output, or None when the output already exists."""
+    state, output_stem = job['job_key'], job['output_stem']
+    effective_state = job['state'] if output_stem else state
     if output_stem:
+        if (OUTPUT_DIR / f"{output_stem}.png").exists():
+            print(f"[HQWorker] Skipping '{output_stem}' — experiment file already exists.")
+            return None
+    elif cfg["path_fn"](state).exists():
+        print(f"[HQWorker] Skipping '{state}' — {cfg['tier']} already exists.")
+        return None
+    return {
+        'job': job, 'state': state, 'output_stem': output_stem,
+        'scene_prompt': job['scene_prompt'],
+        'seed': job['seed'] if job['seed'] is not None else FIXED_SEED,
+        'full_prompt': build_full_prompt(job['scene_prompt'], effective_state),
+        'effective_state': effective_state,
+        'label': output_stem or f"'{state}'",
+    }
+
+
+def _render(cfg: dict, pipe, compel, items: list[dict], session: _GPUSession) -> list:
+    """One diffusion run for all items; returns their images in order. Each item gets its own
+    generator, so an image depends on its seed only, not on what it was batched with.
+    Raises gpu_arbiter.LeaseYielded when a foreground request interrupts the run."""
+    tier = cfg["tier"]
+    print(f"[HQWorker] Generating {len(items)} {tier} image(s) at {cfg['size']}×{cfg['size']}, "
+          f"{cfg['steps']} steps: {', '.join(item['label'] for item in items)}")
+    for item in items:
+        print(f"[HQWorker] Prompt ({item['label']}): {item['full_prompt']}")
+
+    # The negative needs the TI prefix, which is only known once the pipeline has loaded
+    negatives = [build_negative_prompt(item['effective_state'], _ti_negative_prefix) for item in items]
+    # Embeddings are cached across jobs and processes; encoded before the lease when it is not held yet
+    prompt_embeds, negative_embeds, enc = embedding_cache.encode_batch(
+        compel, embedding_cache.encoder_identity(cfg["model_id"], TORCH_DTYPE, _ti_negative_prefix),
+        cfg["clip_skip"], list(zip((item['full_prompt'] for item in items), negatives)),
+    )
+    print(f"[HQWorker] Text encoding {enc['encode_ms']}ms "
+          f"({', '.join(f'{p}/{n}' for p, n in enc['sources'])})")
+
+    # Once held, a foreground request makes the step callback abort the run; the caller closes
+    # the session (offload, then release — the connection closing releases it if the worker dies)
+    held = session.acquire(f"{tier}:batch", pipe)
+    return pipe(
+        prompt_embeds=prompt_embeds.to(DEVICE),
+        negative_prompt_embeds=negative_embeds.to(DEVICE),
+        num_inference_steps=cfg["steps"],
+        guidance_scale=cfg["guidance"],
+        clip_skip=cfg["clip_skip"],
+        generator=[torch.Generator(DEVICE).manual_seed(item['seed']) for item in items],
+        width=cfg["size"],
+        height=cfg["size"],
+        callback_on_step_end=held.step_callback,
+    ).images
+
+
+def _save(cfg: dict, item: dict, image) -> None:
+    tier, state, seed = cfg["tier"], item['state'], item['seed']
+    if item['output_stem']:
         from PIL.PngImagePlugin import PngInfo
+        save_path = OUTPUT_DIR / f"{item['output_stem']}.png"
         info = PngInfo()
-        info.add_text("scene_prompt", scene_prompt)
+        info.add_text("scene_prompt", item['scene_prompt'])
         info.add_text("tier", f"experiment_{tier.lower()}")
         info.add_text("seed", str(seed))
         tmp = save_path.with_suffix('.tmp.png')
         image.save(tmp, pnginfo=info)
         tmp.rename(save_path)
         print(f"[HQWorker] Experiment {tier} saved: {save_path.name} ({save_path.stat().st_size // 1024}KB)")
+    elif tier == "MQ":
+        ImageGenService._save_hq(state, image, item['scene_prompt'])
+        if not ImageGenService._uhq_path(state).exists():
+            ImageGenService._queue_uhq(state, item['scene_prompt'], seed=seed, priority=item['job']['priority'])
     else:
-        save_fn(state, image, scene_prompt)
-
-
-def _process_mq(state: str, scene_prompt: str, seed: int = FIXED_SEED,
-                output_stem: str | None = None, logical_state: str | None = None):
-    def _save(s, img, prompt):
-        ImageGenService._save_hq(s, img, prompt)
-        if not ImageGenService._uhq_path(s).exists():
-            ImageGenService._queue_uhq(s, prompt, seed=seed)
-    _process_job(_MQ_CFG, _get_pipeline, state, scene_prompt, seed, output_stem, logical_state, _save)
-
-
-def _process_uhq(state: str, scene_prompt: str, seed: int = FIXED_SEED,
-                 output_stem: str | None = None, logical_state: str | None = None):
-    _process_job(_UHQ_CFG, _get_uhq_pipeline, state, scene_prompt, seed, output_stem, logical_state, ImageGenService._save_uhq)
+        ImageGenService._save_uhq(state, image, item['scene_prompt'])
 
 
 def _is_canonical_worker() -> bool:
@@ -264,6 +317,9 @@ def _install_sigterm_handler():
     signal.signal(signal.SIGTERM, _handle)
 
 
+_IDLE_WAIT = 30.0  # seconds — fallback re-check of the queue when no wakeup arrives
+
+
 def _heartbeat_loop():
     while True:
         time.sleep(30)
@@ -273,29 +329,131 @@ def _heartbeat_loop():
             pass
 
 
-def _dispatch_queue(queue_dir: Path, process_fn, tier_label: str) -> bool:
-    """Process the first pending job in queue_dir. Returns True if a job was dispatched."""
-    jobs = sorted(queue_dir.glob("*.json"))
-    if not jobs:
-        return False
-    job_file = jobs[0]
-    state = job_file.stem
+def _log_failure(job: dict, tier_label: str, e: Exception) -> None:
+    retry = job_queue.fail(job, f"{type(e).__name__}: {e}")
+    _wlog(f"[HQWorker][ERROR] {tier_label} job '{job['job_key']}' failed ({type(e).__name__}): {e}"
+          f" — {'will retry' if retry else 'giving up'} (attempt {job['attempts'] + 1}/{job_queue.MAX_ATTEMPTS}).")
+
+
+def _dispatch(jobs: list[dict], session: _GPUSession) -> None:
+    """Render one claimed batch (same tier), then ack, release or fail each job. Ack comes AFTER
+    the save — a worker killed mid-batch leaves its jobs 'running' and job_queue.recover()
+    requeues them on boot."""
+    tier = jobs[0]['tier']
+    cfg, get_pipe_fn = _TIERS[tier]
+    items = []
+    for job in jobs:
+        item = _prepare(cfg, job)
+        if item is None:
+            job_queue.ack(job)
+        else:
+            items.append(item)
+    if not items:
+        return
+
+    t0 = time.perf_counter()
     try:
-        data = json.loads(job_file.read_text())
-        process_fn(state, data["scene_prompt"], seed=data.get("seed", FIXED_SEED),
-                   output_stem=data.get("output_stem"), logical_state=data.get("state"))
-        job_file.unlink(missing_ok=True)  # unlink AFTER success — survives SIGTERM
+        pipe, compel = get_pipe_fn()
+        images = _render(cfg, pipe, compel, items, session)
+    except gpu_arbiter.LeaseYielded as e:
+        session.close()
+        for item in items:
+            job_queue.release(item['job'])
+        _wlog(f"[HQWorker] {e} — {len(items)} {cfg['tier']} job(s) requeued.")
+        return
     except Exception as e:
-        _wlog(f"[HQWorker][ERROR] {tier_label} job '{state}' failed ({type(e).__name__}): {e}")
+        session.close()
+        if isinstance(e, torch.cuda.OutOfMemoryError) and len(items) > 1:
+            # Not the jobs' fault — retry them in smaller batches without spending an attempt
+            _batch_limit[tier] = max(1, len(items) // 2)
+            for item in items:
+                job_queue.release(item['job'])
+            _wlog(f"[HQWorker] Out of VRAM at batch size {len(items)} — {cfg['tier']} batches "
+                  f"capped at {_batch_limit[tier]}, jobs requeued.")
+            return
+        for item in items:
+            _log_failure(item['job'], cfg['tier'], e)
         try:
             traceback.print_exc(file=sys.stderr)
         except OSError:
             pass
-        job_file.unlink(missing_ok=True)
-    return True
+        return
+
+    elapsed = time.perf_counter() - t0
+    print(f"[HQWorker] {cfg['tier']} batch of {len(items)} done in {elapsed:.1f}s "
+          f"({len(items) * 60 / elapsed:.1f} images/min).")
+    for item, image in zip(items, images):
+        try:
+            _save(cfg, item, image)
+        except Exception as e:
+            _log_failure(item['job'], cfg['tier'], e)
+            continue
+        job_queue.ack(item['job'])
 
 
-def main():
+# ---------------------------------------------------------------------------
+# Benchmark — python -m agents.image.hq_gen_worker --bench
+# ---------------------------------------------------------------------------
+
+_BENCH_SCENES = (
+    "sitting at a desk, typing on a keyboard, warm lamp light",
+    "holding a mug of tea by a rainy window",
+    "waving at the viewer in a sunny park",
+    "reading a book on a sofa, cozy living room",
+)
+
+
+def _bench(tier: str, batch_sizes: list[int], images: int) -> None:
+    """Images per minute for each batch size, rendered with the worker's own pipeline and
+    settings (a GPU lease is taken like any background job). Images are discarded; nothing in
+    OUTPUT_DIR or the job queue is touched. The one-off CPU→GPU transfer is reported
+    separately — the worker pays it once per busy period, not per batch."""
+    cfg, get_pipe_fn = _TIERS[tier]
+    pipe, compel = get_pipe_fn()
+    session = _GPUSession()
+    results = []
+    cuda = DEVICE == "cuda"
+    try:
+        session.acquire(f"{cfg['tier']}:bench", pipe)
+        print(f"[HQWorker] Bench: pipeline to GPU in {session.transfer_ms:.0f}ms.")
+        for size in batch_sizes:
+            items = [{'label': f"bench{i}", 'seed': FIXED_SEED + i,
+                      'full_prompt': build_full_prompt(_BENCH_SCENES[i % len(_BENCH_SCENES)], "bench"),
+                      'effective_state': "bench"}
+                     for i in range(images)]
+            _render(cfg, pipe, compel, items[:size], session)  # warm-up (allocator, kernels)
+            if cuda:
+                torch.cuda.synchronize()
+                torch.cuda.reset_peak_memory_stats()
+            t0 = time.perf_counter()
+            for start in range(0, images, size):
+                _render(cfg, pipe, compel, items[start:start + size], session)
+            if cuda:
+                torch.cuda.synchronize()
+            elapsed = time.perf_counter() - t0
+            results.append((size, elapsed, torch.cuda.max_memory_allocated() / 2**30 if cuda else 0.0))
+    finally:
+        session.close()
+
+    print(f"\n{cfg['tier']} {cfg['size']}×{cfg['size']}, {cfg['steps']} steps, {images} images per batch size")
+    print(f"{'batch':>5}  {'total s':>8}  {'s/image':>8}  {'images/min':>10}  {'peak GiB':>8}")
+    for size, elapsed, peak in results:
+        print(f"{size:>5}  {elapsed:>8.1f}  {elapsed / images:>8.2f}  {images * 60 / elapsed:>10.2f}  {peak:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m agents.image.hq_gen_worker",
+                                     description="MQ/UHQ image worker (started by Flask).")
+    parser.add_argument("--bench", action="store_true",
+                        help="measure images/min per batch size instead of running the worker")
+    parser.add_argument("--tier", choices=sorted(_TIERS), default="mq")
+    parser.add_argument("--batch-sizes", default="1,2,4", help="comma-separated, e.g. 1,2,4")
+    parser.add_argument("-n", "--images", type=int, default=8, help="images rendered per batch size")
+    args = parser.parse_args(argv)
+    if args.bench:
+        _bench(args.tier, [int(b) for b in args.batch_sizes.split(",")], args.images)
+        return
+
     if not _is_canonical_worker():
         WORKER_BOOT_PATH.unlink(missing_ok=True)
         sys.exit(0)
@@ -307,25 +465,26 @@ def main():
 
     threading.Thread(target=_heartbeat_loop, daemon=True).start()
 
-    HQ_QUEUE_DIR.mkdir(parents=True, exist_ok=True)
-    UHQ_QUEUE_DIR.mkdir(parents=True, exist_ok=True)
+    gpu_arbiter.client_only()
+    job_queue.listen()
+    recovered = job_queue.recover()
+    if recovered:
+        _wlog(f"[HQWorker] Requeued {recovered} job(s) interrupted by the previous worker.")
 
-    # Clear stale priority files from a previous Flask crash (Flask does this too, belt-and-suspenders).
-    cleanup_stale_priority()
-
-    _wlog(f"[HQWorker] Started (PID {os.getpid()}). Watching MQ and UHQ queues...")
+    _wlog(f"[HQWorker] Started (PID {os.getpid()}). Waiting for MQ and UHQ jobs...")
 
+    session = _GPUSession()
     try:
         while True:
-            # Priority guard: Flask is generating — do not touch the GPU
-            if _has_priority_requests():
-                time.sleep(2)
-                continue
-            if _dispatch_queue(HQ_QUEUE_DIR, _process_mq, "MQ"):
-                continue
-            if _dispatch_queue(UHQ_QUEUE_DIR, _process_uhq, "UHQ"):
+            jobs = job_queue.claim_batch(_batch_limit)
+            if jobs:
+                _dispatch(jobs, session)
                 continue
-            time.sleep(30)
+            # Idle: give the GPU back, then sleep until a job is queued (wakeup socket)
+            # or a backed-off job is due
+            session.close()
+            due = job_queue.next_due()
+            job_queue.wait(min(due, _IDLE_WAIT) if due is not None else _IDLE_WAIT)
 
     except (KeyboardInterrupt, SystemExit):
         pass
@@ -8,8 +8,8 @@ import threading
 import time
 from pathlib import Path
 
-from agents.image.gpu_lock import GPU_LOCK_PATH, WORKER_HEARTBEAT_PATH, WORKER_PID_PATH
-
+WORKER_PID_PATH       = Path("env/hq_worker.pid")
+WORKER_HEARTBEAT_PATH = Path("env/hq_worker.heartbeat")
 WORKER_BOOT_PATH      = Path("env/hq_worker.booting")
 _WORKER_HEARTBEAT_TTL = 90.0  # seconds — 3× the worker's 30s heartbeat write interval
 
@@ -70,7 +70,7 @@ def start_hq_worker() -> None:
         # Register the atexit handler only ONCE for the lifetime of this Flask process.
         # We must NOT capture `proc` in the closure — doing so creates a new closure per
         # worker restart, accumulating stale atexit handlers that send SIGTERM to recycled
-        # PIDs and delete gpu.lock while the *current* worker still holds it.
+        # PIDs while the *current* worker keeps running.
         if not _atexit_registered:
             _pid_file_path = pid_file  # stable Path reference; content changes with restarts
 
@@ -85,7 +85,6 @@ def start_hq_worker() -> None:
                 _pid_file_path.unlink(missing_ok=True)
                 WORKER_BOOT_PATH.unlink(missing_ok=True)
                 WORKER_HEARTBEAT_PATH.unlink(missing_ok=True)
-                GPU_LOCK_PATH.unlink(missing_ok=True)
 
             atexit.register(_shutdown_worker)
             _atexit_registered = True
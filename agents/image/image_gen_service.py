@@ -1,5 +1,3 @@
-import gc
-import json
 import random
 import threading
 import time
@@ -16,11 +14,8 @@ from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler, Auto
 from PIL import Image
 from PIL.PngImagePlugin import PngInfo
 
-from agents.image.gpu_lock import (
-    claim_gpu as _claim_gpu_impl,
-    cleanup_stale_lock, cleanup_stale_priority,
-)
-from agents.image.hq_worker_manager import WORKER_BOOT_PATH, start_hq_worker
+from agents.image import embedding_cache, gpu_arbiter, job_queue, residency
+from agents.image.hq_worker_manager import WORKER_BOOT_PATH, WORKER_HEARTBEAT_PATH, start_hq_worker
 from agents.image.image_prompt import build_full_prompt, build_negative_prompt, _load_textual_inversions
 from agents.image.realesrgan_upscaler import FINAL_SIZE as _FINAL_SIZE
 from agents.image.realesrgan_upscaler import upscale as _realesrgan_upscale
@@ -29,33 +24,22 @@ MODEL_ID    = "Lykon/dreamshaper-8"
 VAE_ID      = "stabilityai/sd-vae-ft-mse"
 FIXED_SEED  = 42
 OUTPUT_DIR  = Path("tmp/persona")
-HQ_QUEUE_DIR          = Path("env/hq_queue")
+HQ_QUEUE_DIR          = Path("env/hq_queue")    # legacy file queues — imported into job_queue at startup
 UHQ_QUEUE_DIR         = Path("env/uhq_queue")
 
 DEVICE     = "cuda" if torch.cuda.is_available() else "cpu"
 TORCH_DTYPE = torch.float16 if DEVICE == "cuda" else torch.float32
 
-PIPELINE_EVICT_IDLE = 60.0  # seconds idle before unloading pipeline from RAM
+FAST_CLIP_SKIP = 2
 
 if DEVICE == "cpu":
     print("WARNING: CUDA is not available. Image generation will run on CPU and be very slow.")
 
 
-def _write_job_file(queue_dir: Path, label: str, state: str, scene_prompt: str,
-                    seed: int | None, output_stem: str | None, force: bool) -> None:
-    queue_dir.mkdir(parents=True, exist_ok=True)
-    job_stem = output_stem or state
-    job_file = queue_dir / f"{job_stem}.json"
-    if not force and job_file.exists():
-        return
-    data: dict = {"scene_prompt": scene_prompt}
-    if seed is not None:
-        data["seed"] = seed
-    if output_stem is not None:
-        data["output_stem"] = output_stem
-        data["state"] = state
-    job_file.write_text(json.dumps(data))
-    print(f"[ImageGen] {label} job queued: {job_stem}")
+def _enqueue_job(tier: str, state: str, scene_prompt: str, seed: int | None,
+                 output_stem: str | None, force: bool, priority: int) -> None:
+    if job_queue.enqueue(tier, state, scene_prompt, seed, output_stem, priority, force) or force:
+        print(f"[ImageGen] {tier.upper()} job queued ({job_queue.PRIORITY_NAMES[priority]}): {output_stem or state}")
 
 
 def _atomic_save(img, dst: Path, scene_prompt: str, tier: str) -> None:
@@ -70,14 +54,13 @@ def _atomic_save(img, dst: Path, scene_prompt: str, tier: str) -> None:
 
 
 class ImageGenService:
-    _pipeline: StableDiffusionPipeline | None = None
     _compel: Compel | None = None
     _ti_negative_prefix: str = ""
     _lock = threading.Lock()
     _in_progress: set[str] = set()
 
-    _evict_timer: threading.Timer | None = None
-    _evict_lock = threading.Lock()  # protects _evict_timer only; never held alongside _lock
+    # Where the fast pipeline lives between generations (GPU / CPU / unloaded) — see residency.py
+    _residency: residency.PipelineResidency
 
     # Startup upscale scheduler (legacy images with no stored prompt → Real-ESRGAN)
     _upgrade_queue: deque = deque()
@@ -89,58 +72,41 @@ class ImageGenService:
     # ------------------------------------------------------------------ #
 
     @classmethod
-    def _get_pipeline(cls) -> StableDiffusionPipeline:
-        if cls._pipeline is None:
-            print(f"[ImageGen] Loading pipeline on {DEVICE}...")
-            vae = AutoencoderKL.from_pretrained(VAE_ID, torch_dtype=TORCH_DTYPE).to(DEVICE)
-            cls._pipeline = StableDiffusionPipeline.from_pretrained(
-                MODEL_ID,
-                vae=vae,
-                torch_dtype=TORCH_DTYPE,
-                safety_checker=None,
-            ).to(DEVICE)
-            cls._pipeline.scheduler = DPMSolverMultistepScheduler.from_config(
-                cls._pipeline.scheduler.config,
-                use_karras_sigmas=True,
-                algorithm_type="dpmsolver++",
-            )
-            cls._pipeline.enable_attention_slicing()
-            cls._ti_negative_prefix = _load_textual_inversions(cls._pipeline)
-            cls._compel = Compel(
-                tokenizer=cls._pipeline.tokenizer,
-                text_encoder=cls._pipeline.text_encoder,
-                textual_inversion_manager=DiffusersTextualInversionManager(cls._pipeline),
-                truncate_long_prompts=False,
-            )
-        return cls._pipeline
+    def _load_pipeline(cls) -> tuple[StableDiffusionPipeline, dict]:
+        """Load the fast pipeline on the CPU; the residency manager moves components to the GPU.
 
-    @classmethod
-    def _cancel_eviction(cls) -> None:
-        with cls._evict_lock:
-            if cls._evict_timer is not None:
-                cls._evict_timer.cancel()
-                cls._evict_timer = None
-
-    @classmethod
-    def _schedule_eviction(cls) -> None:
-        with cls._evict_lock:
-            if cls._evict_timer is not None:
-                cls._evict_timer.cancel()
-            cls._evict_timer = threading.Timer(PIPELINE_EVICT_IDLE, cls._evict_pipeline)
-            cls._evict_timer.daemon = True
-            cls._evict_timer.start()
+        The text encoder is taken out of the pipeline and only used through Compel: with
+        prompt_embeds the pipeline never calls it, and a CPU-resident module left inside would
+        let diffusers pick the CPU as the pipeline's execution device.
+        """
+        print(f"[ImageGen] Loading {MODEL_ID}...")
+        vae = AutoencoderKL.from_pretrained(VAE_ID, torch_dtype=TORCH_DTYPE)
+        pipe = StableDiffusionPipeline.from_pretrained(
+            MODEL_ID,
+            vae=vae,
+            torch_dtype=TORCH_DTYPE,
+            safety_checker=None,
+        )
+        pipe.scheduler = DPMSolverMultistepScheduler.from_config(
+            pipe.scheduler.config,
+            use_karras_sigmas=True,
+            algorithm_type="dpmsolver++",
+        )
+        pipe.enable_attention_slicing()
+        cls._ti_negative_prefix = _load_textual_inversions(pipe)
+        text_encoder = pipe.text_encoder
+        cls._compel = Compel(
+            tokenizer=pipe.tokenizer,
+            text_encoder=text_encoder,
+            textual_inversion_manager=DiffusersTextualInversionManager(pipe),
+            truncate_long_prompts=False,
+        )
+        pipe.register_modules(text_encoder=None)
+        return pipe, {'unet': pipe.unet, 'vae': pipe.vae, 'text_encoder': text_encoder}
 
     @classmethod
-    def _evict_pipeline(cls) -> None:
-        with cls._lock:
-            if cls._pipeline is not None:
-                cls._pipeline = None
-                cls._compel = None
-                gc.collect()
-                torch.cuda.empty_cache()
-                print(f"[ImageGen] Pipeline evicted from RAM after {PIPELINE_EVICT_IDLE:.0f}s idle.")
-        with cls._evict_lock:
-            cls._evict_timer = None
+    def _drop_pipeline(cls) -> None:
+        cls._compel = None
 
     @classmethod
     def get_cached(cls, state: str) -> Path | None:
@@ -159,15 +125,12 @@ class ImageGenService:
                   output_path: Path, tier: str = "fast") -> None:
         """Synchronously generate a 512×512 image and save to output_path.
 
-        Acquires both the threading lock (prevents concurrent Flask generations)
-        and the cross-process GPU lock (yields to this call over the HQ worker).
-        Moves the pipeline to CPU and clears VRAM cache on exit.
+        Holds the threading lock (prevents concurrent Flask generations) and a
+        foreground GPU lease (the HQ worker yields at its next diffusion step).
+        On exit the residency manager decides whether the pipeline stays on the GPU.
         """
-        cls._cancel_eviction()
-        with cls._lock, _claim_gpu_impl(key=state, on_worker_killed=start_hq_worker):
-            pipe = cls._get_pipeline()
-            pipe.to(DEVICE)
-            torch.cuda.empty_cache()
+        with cls._lock, gpu_arbiter.lease(cls._residency.lease_key(state), gpu_arbiter.FOREGROUND):
+            pipe = cls._residency.acquire()
             try:
                 generator = torch.Generator(DEVICE).manual_seed(seed)
                 full_prompt = build_full_prompt(scene_prompt, state)
@@ -175,17 +138,18 @@ class ImageGenService:
                 print(f"[ImageGen] Generating '{state}' tier={tier} seed={seed}" +
                       (" (dark)" if state.endswith("_dark") else ""))
                 print(f"[ImageGen] Prompt: {full_prompt}")
-                prompt_embeds = cls._compel(full_prompt)
-                negative_embeds = cls._compel(negative)
-                [prompt_embeds, negative_embeds] = cls._compel.pad_conditioning_tensors_to_same_length(
-                    [prompt_embeds, negative_embeds]
+                prompt_embeds, negative_embeds, enc = embedding_cache.encode(
+                    cls._compel, embedding_cache.encoder_identity(MODEL_ID, TORCH_DTYPE, cls._ti_negative_prefix),
+                    FAST_CLIP_SKIP, full_prompt, negative, device=DEVICE,
                 )
+                print(f"[ImageGen] Text encoding {enc['encode_ms']}ms "
+                      f"(prompt: {enc['prompt']}, negative: {enc['negative']})")
                 image = pipe(
                     prompt_embeds=prompt_embeds,
                     negative_prompt_embeds=negative_embeds,
                     num_inference_steps=20,
                     guidance_scale=6.5,
-                    clip_skip=2,
+                    clip_skip=FAST_CLIP_SKIP,
                     generator=generator,
                     width=512,
                     height=512,
@@ -196,13 +160,10 @@ class ImageGenService:
                 info.add_text("seed", str(seed))
                 image.save(output_path, pnginfo=info)
             finally:
-                # Release VRAM so the HQ worker can use it
-                pipe.to('cpu')
-                torch.cuda.empty_cache()
-        cls._schedule_eviction()
+                cls._residency.release()
 
     @classmethod
-    def generate(cls, state: str, scene_prompt: str, seed: int | None = None) -> Path:
+    def generate(cls, state: str, scene_prompt: str, seed: int | None = None, queue_hq: bool = True) -> Path:
         OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
         output_path = OUTPUT_DIR / f"{state}.png"
 
@@ -217,19 +178,19 @@ class ImageGenService:
         finally:
             cls._in_progress.discard(state)
 
-        if not cls._hq_path(state).exists():
+        if queue_hq and not cls._hq_path(state).exists():
             cls._queue_hq(state, scene_prompt, seed=effective_seed)
 
         return output_path
 
     # ------------------------------------------------------------------ #
-    #  HQ queue — jobs consumed by hq_gen_worker.py                      #
+    #  HQ queue — jobs consumed by hq_gen_worker.py (see job_queue)      #
     # ------------------------------------------------------------------ #
 
     @classmethod
     def _queue_hq(cls, state: str, scene_prompt: str, seed: int | None = None,
-                  output_stem: str | None = None, force: bool = False):
-        _write_job_file(HQ_QUEUE_DIR, "HQ", state, scene_prompt, seed, output_stem, force)
+                  output_stem: str | None = None, force: bool = False, priority: int = job_queue.CURRENT):
+        _enqueue_job('mq', state, scene_prompt, seed, output_stem, force, priority)
 
     # ------------------------------------------------------------------ #
     #  HQ paths + save (shared with hq_gen_worker.py)                    #
@@ -259,19 +220,16 @@ class ImageGenService:
 
     @classmethod
     def _queue_uhq(cls, state: str, scene_prompt: str, seed: int | None = None,
-                   output_stem: str | None = None, force: bool = False):
-        _write_job_file(UHQ_QUEUE_DIR, "UHQ", state, scene_prompt, seed, output_stem, force)
+                   output_stem: str | None = None, force: bool = False, priority: int = job_queue.CURRENT):
+        _enqueue_job('uhq', state, scene_prompt, seed, output_stem, force, priority)
 
     # ------------------------------------------------------------------ #
     #  GPU preemption                                                     #
     # ------------------------------------------------------------------ #
 
     @classmethod
-    def claim_gpu(cls):
-        return _claim_gpu_impl(
-            skip_if=lambda: bool(cls._in_progress),
-            on_worker_killed=start_hq_worker,
-        )
+    def claim_gpu(cls, key: str = "_claim"):
+        return gpu_arbiter.lease(key, gpu_arbiter.FOREGROUND, skip_if=lambda: bool(cls._in_progress))
 
     # ------------------------------------------------------------------ #
     #  PNG tEXt metadata                                                  #
@@ -345,7 +303,7 @@ class ImageGenService:
     # ------------------------------------------------------------------ #
 
     @classmethod
-    def requeue(cls, state: str, tier: str = 'mq') -> bool:
+    def requeue(cls, state: str, tier: str = 'mq', priority: int = job_queue.CURRENT) -> bool:
         """Re-queue a tier for regeneration using the same seed (retry, not re-roll)."""
         meta = cls._read_meta(state)
         if not meta:
@@ -354,10 +312,10 @@ class ImageGenService:
         seed = int(meta['seed']) if meta.get('seed') else None
         if tier == 'mq':
             cls._hq_path(state).unlink(missing_ok=True)
-            cls._queue_hq(state, scene_prompt, seed=seed)
+            cls._queue_hq(state, scene_prompt, seed=seed, priority=priority)
         elif tier == 'uhq':
             cls._uhq_path(state).unlink(missing_ok=True)
-            cls._queue_uhq(state, scene_prompt, seed=seed)
+            cls._queue_uhq(state, scene_prompt, seed=seed, priority=priority)
         return True
 
     @classmethod
@@ -384,8 +342,7 @@ class ImageGenService:
         elif tier == 'all':
             for path in [OUTPUT_DIR / f"{state}.png", cls._hq_path(state), cls._uhq_path(state)]:
                 path.unlink(missing_ok=True)
-            (HQ_QUEUE_DIR / f"{state}.json").unlink(missing_ok=True)
-            (UHQ_QUEUE_DIR / f"{state}.json").unlink(missing_ok=True)
+            job_queue.cancel(state)
             path = cls.generate(state, scene_prompt, seed=new_seed)
             return path, new_seed
         else:
@@ -400,10 +357,14 @@ class ImageGenService:
         if cls._upgrade_scheduler_started:
             return
         cls._upgrade_scheduler_started = True
-        cleanup_stale_lock()
-        cleanup_stale_priority()
+        gpu_arbiter.serve()
+        WORKER_HEARTBEAT_PATH.unlink(missing_ok=True)  # a previous run's worker must not look healthy
         WORKER_BOOT_PATH.unlink(missing_ok=True)
 
+        imported = job_queue.import_legacy(HQ_QUEUE_DIR, 'mq') + job_queue.import_legacy(UHQ_QUEUE_DIR, 'uhq')
+        if imported:
+            print(f"[ImageGen] Imported {imported} job file(s) into the job queue.")
+
         prompt_queued = 0
         legacy_queued = 0
         if OUTPUT_DIR.exists():
@@ -416,11 +377,11 @@ class ImageGenService:
                     continue
                 if stem.endswith("_hq") or stem.endswith("_uhq") or stem.endswith("_exp"):
                     continue
-                if cls._hq_path(stem).exists() or (HQ_QUEUE_DIR / f"{stem}.json").exists():
+                if cls._hq_path(stem).exists() or job_queue.pending('mq', stem):
                     continue
                 meta = cls._read_meta(stem)
                 if meta:
-                    cls._queue_hq(stem, meta['scene_prompt'])
+                    cls._queue_hq(stem, meta['scene_prompt'], priority=job_queue.UPGRADE)
                     prompt_queued += 1
                 else:
                     cls._upgrade_queue.append(stem)
@@ -457,3 +418,8 @@ class ImageGenService:
                     cls._upgrade_in_progress.discard(state)
             else:
                 time.sleep(5)
+
+
+ImageGenService._residency = residency.register(residency.PipelineResidency(
+    "fast", DEVICE, ImageGenService._load_pipeline, ImageGenService._drop_pipeline, ImageGenService._lock,
+))
@@ -0,0 +1,315 @@
+"""Durable MQ/UHQ job queue shared by image/image_gen_service.py (Flask) and image/hq_gen_worker.py.
+
+Replaces the JSON job files in env/hq_queue and env/uhq_queue, which the worker found with
+sorted(glob()) and polled every 30 s — a new MQ job could wait half a minute before it started.
+
+- SQLite (env/image_jobs.db, WAL) so both processes see one queue; claim() is a single
+  BEGIN IMMEDIATE transaction, so a job is handed out once (claim_batch(): up to N jobs of one
+  tier for a batched run). ack() removes it after the image is saved; a worker killed mid-job
+  leaves it 'running' and recover() requeues it on boot.
+- Priorities: CURRENT (the state on screen, admin requeues, experiments) > PREDICTED (idle
+  pre-renders) > UPGRADE (startup backfill of older images). MQ before UHQ within a priority,
+  then FIFO.
+- Dedupe on (tier, job key): re-queueing a pending job keeps one row and raises its priority.
+  force=True replaces its prompt/seed (re-rolls, experiments).
+- fail() retries with exponential backoff (RETRY_BACKOFF · 2^n) up to MAX_ATTEMPTS, then
+  keeps the row as 'failed' for inspection.
+- Wakeup: the worker binds a Unix datagram socket (WAKE_SOCKET_PATH) and blocks on it;
+  enqueue() sends one byte, so an idle worker starts within milliseconds. Without AF_UNIX
+  wait() degrades to a plain sleep.
+- stats(): depth per tier and priority, running/failed, oldest wait, and queue wait / run time
+  of the last DONE_HISTORY finished jobs — served at /persona/image/queue.
+"""
+import json
+import select
+import socket
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
+QUEUE_DB_PATH    = Path("env/image_jobs.db")
+WAKE_SOCKET_PATH = Path("env/image_jobs.sock")
+
+CURRENT   = 0   # user-visible: the current state, admin requeue/re-roll, experiments
+PREDICTED = 1   # pre-rendered states that are likely to be shown soon
+UPGRADE   = 2   # startup backfill of images that never got an HQ pass
+PRIORITY_NAMES = {CURRENT: 'current', PREDICTED: 'predicted', UPGRADE: 'upgrade'}
+
+MAX_ATTEMPTS  = 3
+RETRY_BACKOFF = 30.0   # seconds before the first retry; doubles per attempt
+DONE_HISTORY  = 500    # finished jobs kept for wait/run metrics
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    tier         TEXT NOT NULL,
+    job_key      TEXT NOT NULL,
+    state        TEXT NOT NULL,
+    scene_prompt TEXT NOT NULL,
+    seed         INTEGER,
+    output_stem  TEXT,
+    priority     INTEGER NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'queued',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    not_before   REAL NOT NULL DEFAULT 0,
+    enqueued_at  REAL NOT NULL,
+    claimed_at   REAL,
+    last_error   TEXT,
+    UNIQUE (tier, job_key)
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority, tier, enqueued_at);
+CREATE TABLE IF NOT EXISTS done (
+    tier TEXT, priority INTEGER, wait_s REAL, run_s REAL, finished_at REAL
+);
+"""
+
+_initialized = False
+
+
+def _connect() -> sqlite3.Connection:
+    """Autocommit connection; callers open explicit transactions where they need one."""
+    global _initialized
+    QUEUE_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(QUEUE_DB_PATH, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if not _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _initialized = True
+    return conn
+
+
+# ------------------------------------------------------------------ #
+#  Producer side (Flask)                                              #
+# ------------------------------------------------------------------ #
+
+def enqueue(tier: str, state: str, scene_prompt: str, seed: int | None = None,
+            output_stem: str | None = None, priority: int = CURRENT, force: bool = False) -> bool:
+    """Queue a job for tier 'mq' or 'uhq'. Returns False if it was already pending (its priority
+    is raised to priority if higher). force replaces a pending job's prompt and seed."""
+    job_key = output_stem or state
+    now = time.time()
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT id, status FROM jobs WHERE tier = ? AND job_key = ?",
+                           (tier, job_key)).fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT INTO jobs (tier, job_key, state, scene_prompt, seed, output_stem, priority, enqueued_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (tier, job_key, state, scene_prompt, seed, output_stem, priority, now),
+            )
+        elif force or row['status'] == 'failed':
+            conn.execute(
+                "UPDATE jobs SET state = ?, scene_prompt = ?, seed = ?, output_stem = ?, priority = ?,"
+                " status = CASE status WHEN 'running' THEN 'running' ELSE 'queued' END,"
+                " attempts = 0, not_before = 0, enqueued_at = ?, last_error = NULL WHERE id = ?",
+                (state, scene_prompt, seed, output_stem, priority, now, row['id']),
+            )
+        else:
+            conn.execute("UPDATE jobs SET priority = MIN(priority, ?) WHERE id = ?", (priority, row['id']))
+        conn.execute("COMMIT")
+    if row is None or force or row['status'] == 'failed':
+        notify()  # the row ended up 'queued' (or re-armed while running)
+    return row is None
+
+
+def pending(tier: str, job_key: str) -> bool:
+    """True if a queued or running job exists for (tier, job_key)."""
+    with closing(_connect()) as conn:
+        return conn.execute("SELECT 1 FROM jobs WHERE tier = ? AND job_key = ? AND status != 'failed'",
+                            (tier, job_key)).fetchone() is not None
+
+
+def cancel(job_key: str, tiers: tuple[str, ...] = ('mq', 'uhq')) -> int:
+    """Drop queued (not running) jobs for job_key. Returns how many were removed."""
+    with closing(_connect()) as conn:
+        cur = conn.execute(
+            f"DELETE FROM jobs WHERE job_key = ? AND status != 'running' AND tier IN ({','.join('?' * len(tiers))})",
+            (job_key, *tiers),
+        )
+        return cur.rowcount
+
+
+def import_legacy(queue_dir: Path, tier: str, priority: int = UPGRADE) -> int:
+    """Move JSON job files left by the file-based queue into the database."""
+    if not queue_dir.exists():
+        return 0
+    moved = 0
+    for job_file in sorted(queue_dir.glob("*.json")):
+        try:
+            data = json.loads(job_file.read_text())
+            enqueue(tier, data.get("state", job_file.stem), data["scene_prompt"], data.get("seed"),
+                    data.get("output_stem"), priority)
+            moved += 1
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[JobQueue] Skipping unreadable legacy job {job_file.name}: {e}")
+        job_file.unlink(missing_ok=True)
+    return moved
+
+
+# ------------------------------------------------------------------ #
+#  Consumer side (HQ worker)                                          #
+# ------------------------------------------------------------------ #
+
+def claim() -> dict | None:
+    """Atomically take the best due job (priority, MQ before UHQ, FIFO) and mark it running."""
+    jobs = claim_batch()
+    return jobs[0] if jobs else None
+
+
+def claim_batch(batch_sizes: dict[str, int] | None = None) -> list[dict]:
+    """claim() plus up to batch_sizes[tier] - 1 more due jobs of the same tier (priority, then
+    FIFO), all marked running in the same transaction. Jobs of one tier share size, steps and
+    guidance, so the worker renders them in one batched diffusion run."""
+    now = time.time()
+    rows = []
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        head = conn.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' AND not_before <= ?"
+            " ORDER BY priority, tier = 'uhq', enqueued_at LIMIT 1", (now,),
+        ).fetchone()
+        if head is not None:
+            extra = max(1, (batch_sizes or {}).get(head['tier'], 1)) - 1
+            rows = [head] + conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND not_before <= ? AND tier = ? AND id != ?"
+                " ORDER BY priority, enqueued_at LIMIT ?", (now, head['tier'], head['id'], extra),
+            ).fetchall()
+            conn.executemany("UPDATE jobs SET status = 'running', claimed_at = ? WHERE id = ?",
+                             [(now, row['id']) for row in rows])
+        conn.execute("COMMIT")
+    return [dict(row) | {'claimed_at': now} for row in rows]
+
+
+def ack(job: dict) -> None:
+    """The job's image is saved — remove it and record its wait/run time. A job force-requeued
+    while it ran (same row, newer enqueued_at) goes back to the queue instead."""
+    now = time.time()
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if not conn.execute("DELETE FROM jobs WHERE id = ? AND enqueued_at = ?",
+                            (job['id'], job['enqueued_at'])).rowcount:
+            conn.execute("UPDATE jobs SET status = 'queued', claimed_at = NULL WHERE id = ?", (job['id'],))
+        conn.execute("INSERT INTO done (tier, priority, wait_s, run_s, finished_at) VALUES (?, ?, ?, ?, ?)",
+                     (job['tier'], job['priority'], job['claimed_at'] - job['enqueued_at'],
+                      now - job['claimed_at'], now))
+        conn.execute("DELETE FROM done WHERE rowid NOT IN (SELECT rowid FROM done ORDER BY finished_at DESC LIMIT ?)",
+                     (DONE_HISTORY,))
+        conn.execute("COMMIT")
+
+
+def release(job: dict) -> None:
+    """Hand a claimed job back untouched (deferred for a priority request — not a failure)."""
+    with closing(_connect()) as conn:
+        conn.execute("UPDATE jobs SET status = 'queued', claimed_at = NULL WHERE id = ?", (job['id'],))
+
+
+def fail(job: dict, error: str) -> bool:
+    """Record a failed attempt. Returns True if the job will be retried after a backoff."""
+    attempts = job['attempts'] + 1
+    retry = attempts < MAX_ATTEMPTS
+    with closing(_connect()) as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, attempts = ?, not_before = ?, claimed_at = NULL, last_error = ? WHERE id = ?",
+            ('queued' if retry else 'failed', attempts,
+             time.time() + RETRY_BACKOFF * 2 ** (attempts - 1), error[:500], job['id']),
+        )
+    return retry
+
+
+def recover() -> int:
+    """Requeue jobs left 'running' by a worker that died mid-job. Call once at worker boot."""
+    with closing(_connect()) as conn:
+        return conn.execute("UPDATE jobs SET status = 'queued', claimed_at = NULL WHERE status = 'running'").rowcount
+
+
+def next_due() -> float | None:
+    """Seconds until the earliest backed-off job becomes claimable (None if there is none)."""
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT MIN(not_before) FROM jobs WHERE status = 'queued'").fetchone()
+    return max(0.0, row[0] - time.time()) if row and row[0] is not None else None
+
+
+# ------------------------------------------------------------------ #
+#  Wakeup                                                              #
+# ------------------------------------------------------------------ #
+
+_wake_sock: socket.socket | None = None
+
+
+def listen() -> None:
+    """Bind the wakeup socket (worker only). A stale socket file from a dead worker is replaced."""
+    global _wake_sock
+    if not hasattr(socket, 'AF_UNIX'):
+        return
+    WAKE_SOCKET_PATH.parent.mkdir(parents=True, exist_ok=True)
+    WAKE_SOCKET_PATH.unlink(missing_ok=True)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(str(WAKE_SOCKET_PATH))
+    sock.setblocking(False)
+    _wake_sock = sock
+
+
+def wait(timeout: float) -> bool:
+    """Block until notify() or timeout. True if woken by a notification."""
+    if _wake_sock is None:
+        time.sleep(timeout)
+        return False
+    ready, _, _ = select.select([_wake_sock], [], [], timeout)
+    if not ready:
+        return False
+    try:
+        while True:
+            _wake_sock.recv(64)  # drain — several enqueues need one wakeup
+    except (BlockingIOError, OSError):
+        pass
+    return True
+
+
+def notify() -> None:
+    """Wake the worker if it is waiting; a no-op when no worker is listening."""
+    if not hasattr(socket, 'AF_UNIX'):
+        return
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b'1', str(WAKE_SOCKET_PATH))
+    except OSError:
+        pass
+
+
+# ------------------------------------------------------------------ #
+#  Metrics                                                             #
+# ------------------------------------------------------------------ #
+
+def stats() -> dict:
+    now = time.time()
+    with closing(_connect()) as conn:
+        depth: dict[str, dict] = {}
+        for row in conn.execute("SELECT tier, priority, COUNT(*) AS n FROM jobs WHERE status = 'queued'"
+                                " GROUP BY tier, priority"):
+            depth.setdefault(row['tier'], {})[PRIORITY_NAMES.get(row['priority'], row['priority'])] = row['n']
+        counts = {row['status']: row['n'] for row in
+                  conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+        oldest = conn.execute("SELECT MIN(enqueued_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        running = [dict(r) for r in conn.execute(
+            "SELECT tier, job_key, priority, claimed_at FROM jobs WHERE status = 'running'")]
+        failed = [dict(r) for r in conn.execute(
+            "SELECT tier, job_key, attempts, last_error FROM jobs WHERE status = 'failed' ORDER BY enqueued_at DESC LIMIT 10")]
+        done = {}
+        for row in conn.execute("SELECT tier, priority, COUNT(*) AS n, AVG(wait_s) AS wait, MAX(wait_s) AS max_wait,"
+                                " AVG(run_s) AS run FROM done GROUP BY tier, priority"):
+            done[f"{row['tier']}/{PRIORITY_NAMES.get(row['priority'], row['priority'])}"] = {
+                'jobs': row['n'], 'avg_wait_s': round(row['wait'], 1),
+                'max_wait_s': round(row['max_wait'], 1), 'avg_run_s': round(row['run'], 1),
+            }
+    return {
+        'queued': counts.get('queued', 0), 'running': counts.get('running', 0), 'failed': counts.get('failed', 0),
+        'depth': depth,
+        'oldest_wait_s': round(now - oldest, 1) if oldest else None,
+        'in_progress': [{'tier': r['tier'], 'job_key': r['job_key'], 'priority': r['priority'],
+                         'running_s': round(now - r['claimed_at'], 1)} for r in running],
+        'recent_failures': failed,
+        'finished': done,
+    }
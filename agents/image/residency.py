@@ -0,0 +1,253 @@
+"""Residency policy for the fast-tier pipeline in image/image_gen_service.py.
+
+Replaces the fixed PIPELINE_EVICT_IDLE timer (unload after 60 s idle, so the next mood change
+paid a full from_pretrained of the model + VAE) and _run_fast moving the whole pipeline to the
+GPU and back on every call.
+
+- Per component (unet, vae, text_encoder) placement: 'device', 'cpu' or 'unloaded' — the
+  pipeline is loaded and unloaded as a whole, components move between CPU and GPU separately.
+- acquire() (inside _run_fast, under its lock and GPU lease) loads the pipeline if needed and
+  moves the UNet and VAE to the GPU. The text encoder only follows while the embedding cache
+  mostly misses — with cached prompts the CPU copy is enough (partial residency).
+- release() and a TICK thread decide what stays resident from the observed gaps between
+  requests and free memory:
+    GPU while idle < device window — the GAP_QUANTILE gap (×1.25) when that fits under
+                                      DEVICE_KEEP_MAX, else DEVICE_KEEP_MIN
+    RAM while idle < RAM window     — same, between RAM_KEEP_MIN and RAM_KEEP_MAX
+  Free VRAM under VRAM_RESERVE_GB demotes to CPU, MemAvailable under RAM_RESERVE_GB unloads.
+- Any other GPU lease request (the HQ worker, LLM claims) first moves our components off the
+  GPU — gpu_arbiter.on_request() runs the hook before the request is queued, so the other
+  holder never starts next to our weights.
+- stats(): where each request found the pipeline (device / cpu / unloaded), load and transfer
+  times, time spent on them, and demotions by reason — served at /persona/image/residency.
+"""
+import gc
+import statistics
+import threading
+import time
+from collections import deque
+
+import torch
+
+from agents.image import embedding_cache, gpu_arbiter
+from agents.image.gpu_arbiter import _summary
+
+COMPONENTS = ('unet', 'vae', 'text_encoder')
+
+DEVICE_KEEP_MIN = 20.0     # seconds on the GPU after a request with no (or sparse) arrival history
+DEVICE_KEEP_MAX = 300.0
+RAM_KEEP_MIN    = 60.0     # the old PIPELINE_EVICT_IDLE
+RAM_KEEP_MAX    = 1800.0
+GAP_QUANTILE    = 0.75     # share of observed gaps a window should cover
+GAP_HISTORY     = 50
+VRAM_RESERVE_GB = 1.5      # leave this much VRAM free while idle-resident
+RAM_RESERVE_GB  = 2.0      # unload when MemAvailable drops below this
+TEXT_ENCODER_GPU_BELOW_HIT_RATE = 0.5
+TICK            = 5.0
+
+
+def _free_ram_gb() -> float | None:
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 2**20
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _free_vram_gb() -> float | None:
+    if not torch.cuda.is_available():
+        return None
+    try:
+        return torch.cuda.mem_get_info()[0] / 2**30
+    except RuntimeError:
+        return None
+
+
+class PipelineResidency:
+    """Owns where one pipeline lives. load_fn() returns (pipeline on the CPU, {component: module});
+    on_unload() drops the caller's references to it. lock is the caller's generation lock — acquire()/release()
+    run under it, the tick thread and the GPU hook take it themselves."""
+
+    def __init__(self, name: str, device: str, load_fn, on_unload, lock: threading.Lock):
+        self.name = name
+        self._device = device
+        self._load_fn = load_fn
+        self._on_unload = on_unload
+        self._lock = lock
+        self._pipe = None
+        self._modules: dict = {}
+        self._placement = dict.fromkeys(COMPONENTS, 'unloaded')
+        self._last_used: float | None = None
+        self._arrivals: deque = deque(maxlen=GAP_HISTORY + 1)
+        self._hits = {'device': 0, 'cpu': 0, 'unloaded': 0}
+        self._demotions: dict[str, int] = {}
+        self._load_s: deque = deque(maxlen=GAP_HISTORY)
+        self._transfer_ms: deque = deque(maxlen=GAP_HISTORY)
+        self._totals = {'load_s': 0.0, 'transfer_s': 0.0}
+        self._ticker_started = False
+        gpu_arbiter.on_request(self._on_gpu_request)
+
+    def lease_key(self, key: str) -> str:
+        """GPU lease key for our own requests — the arbiter hook leaves those alone."""
+        return f"{self.name}:{key}"
+
+    # ---- request path (caller holds lock and a GPU lease) ---------------
+
+    def acquire(self):
+        now = time.monotonic()
+        self._arrivals.append(now)
+        found = 'unloaded' if self._pipe is None else (
+            'device' if self._placement['unet'] == 'device' else 'cpu')
+        self._hits[found] += 1
+        if self._pipe is None:
+            t0 = time.perf_counter()
+            self._pipe, self._modules = self._load_fn()
+            elapsed = time.perf_counter() - t0
+            self._load_s.append(elapsed)
+            self._totals['load_s'] += elapsed
+            self._placement = dict.fromkeys(COMPONENTS, 'cpu')
+            print(f"[Residency] {self.name} pipeline loaded in {elapsed:.1f}s.")
+        wanted = ['unet', 'vae']
+        if self._text_encoder_on_device():
+            wanted.append('text_encoder')
+        self._move([c for c in wanted if self._placement[c] != 'device'], self._device)
+        if found != 'device':
+            print(f"[Residency] {self.name} request found the pipeline {found}.")
+        self._start_ticker()
+        return self._pipe
+
+    def release(self) -> None:
+        self._last_used = time.monotonic()
+        self._settle()
+
+    def _text_encoder_on_device(self) -> bool:
+        if self._device == 'cpu':
+            return False
+        hit_rate = embedding_cache.stats()['hit_rate']
+        return hit_rate is None or hit_rate < TEXT_ENCODER_GPU_BELOW_HIT_RATE
+
+    def _move(self, components: list[str], device: str) -> None:
+        if not components or self._device == 'cpu':
+            return
+        t0 = time.perf_counter()
+        for c in components:
+            self._modules[c].to(device)
+            self._placement[c] = 'device' if device == self._device else 'cpu'
+        if device == 'cpu':
+            torch.cuda.empty_cache()
+            return
+        elapsed = time.perf_counter() - t0
+        self._transfer_ms.append(elapsed * 1000)
+        self._totals['transfer_s'] += elapsed
+
+    # ---- policy ----------------------------------------------------------
+
+    def _window(self, lo: float, hi: float) -> float:
+        gaps = [b - a for a, b in zip(self._arrivals, list(self._arrivals)[1:])]
+        if len(gaps) < 2:
+            return lo
+        q = statistics.quantiles(gaps, n=20, method='inclusive')[round(GAP_QUANTILE * 20) - 1]
+        return max(lo, q * 1.25) if q * 1.25 <= hi else lo
+
+    def _target(self) -> tuple[str, str]:
+        """(where the pipeline should be now, reason)."""
+        idle = time.monotonic() - self._last_used
+        free_ram = _free_ram_gb()
+        if free_ram is not None and free_ram < RAM_RESERVE_GB:
+            return 'unloaded', 'ram'
+        device_window = self._window(DEVICE_KEEP_MIN, DEVICE_KEEP_MAX)
+        if idle >= max(device_window, self._window(RAM_KEEP_MIN, RAM_KEEP_MAX)):
+            return 'unloaded', 'idle'
+        if idle >= device_window:
+            return 'cpu', 'idle'
+        free_vram = _free_vram_gb()
+        if free_vram is not None and free_vram < VRAM_RESERVE_GB:
+            return 'cpu', 'vram'
+        return 'device', ''
+
+    def _settle(self) -> None:
+        """Apply _target(). Caller holds the lock."""
+        if self._pipe is None or self._last_used is None:
+            return
+        target, reason = self._target()
+        on_device = [c for c in COMPONENTS if self._placement[c] == 'device']
+        if target == 'unloaded':
+            self._pipe, self._modules = None, {}
+            self._placement = dict.fromkeys(COMPONENTS, 'unloaded')
+            self._on_unload()
+            gc.collect()
+            torch.cuda.empty_cache()
+            self._demote(reason, 'unloaded from RAM')
+        elif target == 'cpu' and on_device:
+            self._move(on_device, 'cpu')
+            self._demote(reason, 'moved to CPU')
+
+    def _demote(self, reason: str, what: str) -> None:
+        self._demotions[reason] = self._demotions.get(reason, 0) + 1
+        idle = time.monotonic() - self._last_used
+        print(f"[Residency] {self.name} pipeline {what} ({reason}, idle {idle:.0f}s).")
+
+    def _start_ticker(self) -> None:
+        if self._ticker_started:
+            return
+        self._ticker_started = True
+        threading.Thread(target=self._tick_loop, daemon=True, name=f"residency-{self.name}").start()
+
+    def _tick_loop(self) -> None:
+        while True:
+            time.sleep(TICK)
+            if not self._lock.acquire(blocking=False):
+                continue  # a generation is running; release() settles afterwards
+            try:
+                self._settle()
+            except Exception as e:
+                print(f"[Residency] {self.name} tick failed: {e}")
+            finally:
+                self._lock.release()
+
+    def _on_gpu_request(self, key: str, priority: int) -> None:
+        """gpu_arbiter hook: another lease is about to be requested — get off the GPU first."""
+        if key.startswith(f"{self.name}:"):
+            return
+        with self._lock:
+            on_device = [c for c in COMPONENTS if self._placement[c] == 'device']
+            if on_device:
+                self._move(on_device, 'cpu')
+                self._demote('contention', f"moved to CPU for {key}")
+
+    # ---- stats -----------------------------------------------------------
+
+    def stats(self) -> dict:
+        requests = sum(self._hits.values())
+        free_ram, free_vram = _free_ram_gb(), _free_vram_gb()
+        return {
+            'placement': dict(self._placement),
+            'idle_s': round(time.monotonic() - self._last_used, 1) if self._last_used else None,
+            'requests': requests,
+            'found': dict(self._hits),
+            'hit_rate': round((self._hits['device'] + self._hits['cpu']) / requests, 3) if requests else None,
+            'device_hit_rate': round(self._hits['device'] / requests, 3) if requests else None,
+            'load_s': _summary(self._load_s),
+            'transfer_ms': _summary(self._transfer_ms),
+            'spent_s': {k: round(v, 1) for k, v in self._totals.items()},
+            'windows_s': {'device': round(self._window(DEVICE_KEEP_MIN, DEVICE_KEEP_MAX), 1),
+                          'ram': round(self._window(RAM_KEEP_MIN, RAM_KEEP_MAX), 1)},
+            'demotions': dict(self._demotions),
+            'free_ram_gb': round(free_ram, 2) if free_ram is not None else None,
+            'free_vram_gb': round(free_vram, 2) if free_vram is not None else None,
+        }
+
+
+_managers: dict[str, PipelineResidency] = {}
+
+
+def register(manager: PipelineResidency) -> PipelineResidency:
+    _managers[manager.name] = manager
+    return manager
+
+
+def stats() -> dict:
+    return {name: m.stats() for name, m in _managers.items()}
@@ -0,0 +1,387 @@
+"""Headless LLM benchmark suite — the /llm-bench scenario builders, run from the command line.
+
+    python -m agents.llm.bench_suite run --backend ollama --model llama3.2 -n 10
+    python -m agents.llm.bench_suite run --model large,small,routed --suites classify,memory_extract
+    python -m agents.llm.bench_suite run -n 10 --save-baseline env/llm_bench_baseline.json
+    python -m agents.llm.bench_suite run -n 10 --baseline env/llm_bench_baseline.json
+    python -m agents.llm.bench_suite diff env/llm_bench_baseline.json env/llm_bench_reports/<report>.json
+
+- Suites group the production prompt builders from routes/llm_bench.py (quote, briefing,
+  relay, open, classify, memory_extract) plus the combined memory-extraction prompt.
+- Every case is built once and streamed N times (after --warmup discarded calls) against
+  one backend; per suite it reports p50/p95/p99 latency and TTFT, tokens/s, error
+  rate and output-validity rate (one mood word, JSON that parses, expected memory tag...).
+- --model takes model names or tiers: 'large', 'small' (the backend's configured models) or
+  'routed' (each suite on the tier Config.LLM_TASK_MODELS gives its caller tag). Several
+  comma-separated models are run one after another and reported as suite@model.
+- Reports are JSON files in REPORTS_DIR. With --baseline (or the diff command) each suite
+  is compared to a stored report; the exit code is 1 when any threshold is exceeded.
+"""
+import argparse
+import json
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import requests
+
+import config
+from agents.llm import http_session
+from agents.llm.telemetry import _percentiles
+from agents.llm.think_stream import ThinkStream
+
+REPORTS_DIR = Path("env/llm_bench_reports")
+
+
+# ------------------------------------------------------------------ #
+#  Validity checks — output -> passes?                               #
+# ------------------------------------------------------------------ #
+
+def _sentences(text: str) -> int:
+    return len([s for s in re.split(r'(?<=[.!?~])\s+', text.strip()) if s])
+
+
+def _valid_quote(out: str, expected) -> bool:
+    return bool(out) and '\n' not in out.strip() and len(out.split()) <= 15
+
+
+def _valid_short_reply(out: str, expected) -> bool:
+    return bool(out) and _sentences(out) <= 3
+
+
+def _valid_relay(out: str, expected) -> bool:
+    return expected in out
+
+
+def _valid_mood(out: str, expected) -> bool:
+    from agents.persona.states import MOOD_MODIFIERS
+    return out.strip().strip('.!"\'').lower() in MOOD_MODIFIERS
+
+
+def _valid_memory(out: str, expected) -> bool:
+    """Same rule as the /llm-bench expected-column verdict."""
+    out = out.strip().lower()
+    if expected == 'none':
+        return out == 'none'
+    if expected.startswith('[transient'):
+        return '[transient' in out
+    return '[transient' not in out and out != 'none' and len(out) > 10
+
+
+def _valid_combined(out: str, expected) -> bool:
+    from agents.memory_service import MemoryService
+    return MemoryService._parse_combined(out) is not None
+
+
+# ------------------------------------------------------------------ #
+#  Suites                                                            #
+# ------------------------------------------------------------------ #
+
+def _combined_case() -> tuple[str, str]:
+    from agents.memory_service import MemoryService
+    from routes.llm_bench import _OCCUPANCY_EXCHANGES, _OCCUPANCY_MEMORIES
+    return MemoryService.combined_prompt(_OCCUPANCY_EXCHANGES, _OCCUPANCY_MEMORIES)
+
+
+# suite -> (scenario keys, validator, expected override, production caller tag)
+SUITES = {
+    "quote": (["quote_cold_morning", "quote_in_meeting", "quote_heavy_rain_evening"], _valid_quote, None, "quote"),
+    "briefing": (["briefing_welcome_evening", "briefing_welcome_late_night"], _valid_short_reply, None,
+                 "welcome_briefing"),
+    "relay": (["relay_weather"], _valid_relay, "4°C", "relay"),
+    "open": (["open_answer"], _valid_short_reply, None, "open_answer"),
+    "classify": (["classify_mood"], _valid_mood, None, "classify_mood"),
+    "memory_extract": (["memory_transient", "memory_permanent", "memory_none"], _valid_memory, None,
+                       "memory_extract"),
+    "memory_combined": ([], _valid_combined, None, "memory_combined"),
+}
+
+
+def _cases(suite: str) -> list[dict]:
+    """Expand a suite into [{case, system, user, expected}] — group scenarios contribute every sub-case."""
+    from routes.llm_bench import SCENARIOS
+    keys, _, expected, _ = SUITES[suite]
+    if suite == "memory_combined":
+        system, user = _combined_case()
+        return [{"case": "memory_combined", "system": system, "user": user, "expected": None}]
+    cases = []
+    for key in keys:
+        for case_key in SCENARIOS[key].get("cases", [key]):
+            system, user = SCENARIOS[case_key]["builder"]()
+            cases.append({"case": case_key, "system": system, "user": user,
+                          "expected": expected or SCENARIOS[case_key].get("expected")})
+    return cases
+
+
+# ------------------------------------------------------------------ #
+#  Streaming call                                                    #
+# ------------------------------------------------------------------ #
+
+def _stream_chat(backend: str, model: str, system: str, user: str, timeout: int, think: bool) -> dict:
+    """One streamed chat completion. Returns output, thinking, latency/TTFT and output token count."""
+    t0 = time.monotonic()
+    result = {"output": "", "thinking": None, "latency_ms": None, "ttft_ms": None,
+              "output_tokens": None, "error": None}
+    messages = ([{"role": "system", "content": system}] if system else []) + [{"role": "user", "content": user}]
+    if backend == 'lmstudio':
+        from agents.llm.lmstudio_service import LM_STUDIO_BASE_URL
+        url = f"{LM_STUDIO_BASE_URL}/chat/completions"
+        body = {"model": model, "messages": messages, "stream": True, "stream_options": {"include_usage": True}}
+        if think:
+            body["enable_thinking"] = True
+    else:
+        from agents.llm.ollama_service import OLLAMA_BASE_URL
+        url = f"{OLLAMA_BASE_URL}/api/chat"
+        body = {"model": model, "messages": messages, "stream": True, "think": think}
+
+    stream = ThinkStream()
+    r = None
+    try:
+        r = http_session.post(url, json=body, timeout=timeout, stream=True)
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if time.monotonic() - t0 > timeout:
+                raise requests.exceptions.Timeout()
+            if not line:
+                continue
+            line = line.decode('utf-8') if isinstance(line, bytes) else line
+            if backend == 'lmstudio':
+                if not line.startswith('data: ') or line[6:].strip() == '[DONE]':
+                    continue
+                chunk = json.loads(line[6:])
+                if usage := chunk.get("usage"):
+                    result["output_tokens"] = usage.get("completion_tokens")
+                delta = (chunk.get("choices") or [{}])[0].get("delta", {})
+                text, reasoning = delta.get("content") or "", delta.get("reasoning_content") or ""
+            else:
+                chunk = json.loads(line)
+                if chunk.get("done"):
+                    result["output_tokens"] = chunk.get("eval_count")
+                msg = chunk.get("message", {})
+                text, reasoning = msg.get("content") or "", msg.get("thinking") or ""
+            if (text or reasoning) and result["ttft_ms"] is None:
+                result["ttft_ms"] = int((time.monotonic() - t0) * 1000)
+            stream.feed_thinking(reasoning)
+            stream.feed(text)
+    except requests.exceptions.Timeout:
+        result["error"] = f"Timeout after {timeout}s"
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        if r is not None:
+            http_session.close(r, finished=result["error"] is None)
+
+    result["thinking"], result["output"], _ = stream.close().result()
+    result["latency_ms"] = int((time.monotonic() - t0) * 1000)
+    return result
+
+
+# ------------------------------------------------------------------ #
+#  Run                                                               #
+# ------------------------------------------------------------------ #
+
+def _summarise(calls: list[dict]) -> dict:
+    served = [c for c in calls if not c["error"]]
+    tps = [
+        c["output_tokens"] / ((c["latency_ms"] - c["ttft_ms"]) / 1000)
+        for c in served
+        if c["output_tokens"] and c["ttft_ms"] is not None and c["latency_ms"] > c["ttft_ms"]
+    ]
+    n = len(calls)
+    return {
+        "calls": n,
+        "errors": n - len(served),
+        "error_rate": round((n - len(served)) / n, 3) if n else None,
+        "valid_rate": round(sum(c["valid"] for c in calls) / n, 3) if n else None,
+        "latency_ms": _percentiles([c["latency_ms"] for c in served]),
+        "ttft_ms": _percentiles([c["ttft_ms"] for c in served]),
+        "tokens_per_s": _percentiles([round(t, 1) for t in tps]),
+        "output_chars": _percentiles([len(c["output"]) for c in served]),
+        "thinking_chars": _percentiles([len(c["thinking"] or "") for c in served]),
+    }
+
+
+def _resolve_model(backend: str, model: str, suite: str) -> str:
+    """A model name, or the backend's model for a tier ('large', 'small', 'routed' = per-task tier)."""
+    from agents.llm.endpoints import default_model
+    if model == "routed":
+        model = config.Config.LLM_TASK_MODELS.get(SUITES[suite][3], "large")
+    if model in ("large", "small"):
+        return default_model(backend, model) or default_model(backend)
+    return model
+
+
+def run_suite(backend: str, models: str | list[str], suites: list[str], repetitions: int, warmup: int = 1,
+              timeout: int = 60, think: bool = False, progress=print) -> dict:
+    """Run every case of each suite `repetitions` times per model and return the report dict.
+
+    With one model, suites are keyed by name (as in older reports); with several, by suite@model.
+    """
+    models = [models] if isinstance(models, str) else models
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "backend": backend, "model": ",".join(models),
+        "think": think, "repetitions": repetitions, "warmup": warmup, "suites": {},
+    }
+    for label in models:
+        for suite in suites:
+            key = suite if len(models) == 1 else f"{suite}@{label}"
+            report["suites"][key] = _run_one(backend, _resolve_model(backend, label, suite), suite,
+                                             repetitions, warmup, timeout, think, progress)
+    return report
+
+
+def _run_one(backend: str, model: str, suite: str, repetitions: int, warmup: int, timeout: int,
+             think: bool, progress) -> dict:
+    """One suite on one model: summary stats plus per-case valid rate and p50 latency."""
+    validator = SUITES[suite][1]
+    calls, cases = [], {}
+    for case in _cases(suite):
+        for _ in range(warmup):
+            _stream_chat(backend, model, case["system"], case["user"], timeout, think)
+        case_calls = []
+        for _ in range(repetitions):
+            c = _stream_chat(backend, model, case["system"], case["user"], timeout, think)
+            c["valid"] = not c["error"] and validator(c["output"], case["expected"])
+            case_calls.append(c)
+        calls += case_calls
+        cases[case["case"]] = {
+            "valid_rate": round(sum(c["valid"] for c in case_calls) / len(case_calls), 3),
+            "latency_p50_ms": statistics.median(c["latency_ms"] for c in case_calls),
+            "sample": next((c["output"] for c in case_calls if c["valid"]), case_calls[0]["output"]
+                           or case_calls[0]["error"]),
+        }
+        progress(f"[LLMBenchSuite] {suite}/{case['case']} on {model}: {cases[case['case']]['valid_rate']:.0%} valid, "
+                 f"p50 {cases[case['case']]['latency_p50_ms']:.0f} ms")
+    return {"task": SUITES[suite][3], "model": model} | _summarise(calls) | {"cases": cases}
+
+
+# ------------------------------------------------------------------ #
+#  Baseline diff                                                     #
+# ------------------------------------------------------------------ #
+
+DEFAULT_THRESHOLDS = {
+    "latency": 0.15,   # p50/p95 latency and p50 TTFT may grow by at most 15%
+    "throughput": 0.15,  # p50 tokens/s may drop by at most 15%
+    "validity": 0.05,  # valid_rate may drop by at most 5 points
+    "errors": 0.05,    # error_rate may rise by at most 5 points
+}
+
+
+def diff_reports(baseline: dict, current: dict, thresholds: dict | None = None) -> list[dict]:
+    """Compare suite metrics. Returns one row per metric with a `regressed` flag."""
+    thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    rows = []
+
+    def _add(suite, metric, old, new, limit, higher_is_worse=True, relative=True):
+        if old is None or new is None:
+            return
+        change = (new - old) / old if relative and old else new - old
+        worse = change if higher_is_worse else -change
+        rows.append({"suite": suite, "metric": metric, "baseline": old, "current": new,
+                     "change": round(change, 3), "relative": relative, "regressed": worse > limit})
+
+    pick = lambda stats, key: (stats or {}).get(key)
+    for suite, cur in current["suites"].items():
+        base = baseline["suites"].get(suite)
+        if base is None:
+            continue
+        _add(suite, "latency p50", pick(base["latency_ms"], "p50"), pick(cur["latency_ms"], "p50"), thresholds["latency"])
+        _add(suite, "latency p95", pick(base["latency_ms"], "p95"), pick(cur["latency_ms"], "p95"), thresholds["latency"])
+        _add(suite, "ttft p50", pick(base["ttft_ms"], "p50"), pick(cur["ttft_ms"], "p50"), thresholds["latency"])
+        _add(suite, "tokens/s p50", pick(base["tokens_per_s"], "p50"), pick(cur["tokens_per_s"], "p50"),
+             thresholds["throughput"], higher_is_worse=False)
+        _add(suite, "valid rate", base["valid_rate"], cur["valid_rate"], thresholds["validity"],
+             higher_is_worse=False, relative=False)
+        _add(suite, "error rate", base["error_rate"], cur["error_rate"], thresholds["errors"], relative=False)
+    return rows
+
+
+def _print_diff(rows: list[dict]) -> None:
+    for r in rows:
+        change = f"{r['change']:+.0%}" if r["relative"] else f"{r['change']:+.3f}"
+        flag = "REGRESSED" if r["regressed"] else ""
+        print(f"{r['suite']:<16} {r['metric']:<13} {r['baseline']:>10} -> {r['current']:<10} {change:>7}  {flag}")
+
+
+# ------------------------------------------------------------------ #
+#  CLI                                                               #
+# ------------------------------------------------------------------ #
+
+def _write_json(path: Path, data: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+
+
+def _thresholds(args) -> dict:
+    return {"latency": args.max_latency_regress, "throughput": args.max_throughput_drop,
+            "validity": args.max_validity_drop, "errors": args.max_error_rise}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m agents.llm.bench_suite", description=__doc__.split("\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def _threshold_args(p):
+        p.add_argument("--max-latency-regress", type=float, default=DEFAULT_THRESHOLDS["latency"])
+        p.add_argument("--max-throughput-drop", type=float, default=DEFAULT_THRESHOLDS["throughput"])
+        p.add_argument("--max-validity-drop", type=float, default=DEFAULT_THRESHOLDS["validity"])
+        p.add_argument("--max-error-rise", type=float, default=DEFAULT_THRESHOLDS["errors"])
+
+    run = sub.add_parser("run", help="run the suites and write a report")
+    run.add_argument("--backend", choices=("ollama", "lmstudio"), default=config.Config.LLM_BACKEND)
+    run.add_argument("--model", default="large",
+                     help="comma-separated model names or tiers: large (default), small, routed")
+    run.add_argument("--suites", default=",".join(SUITES), help=f"comma-separated subset of: {', '.join(SUITES)}")
+    run.add_argument("-n", "--repetitions", type=int, default=5)
+    run.add_argument("--warmup", type=int, default=1, help="discarded calls per case before measuring")
+    run.add_argument("--timeout", type=int, default=60)
+    run.add_argument("--think", action="store_true", help="enable reasoning")
+    run.add_argument("--out", type=Path, help=f"report path (default: {REPORTS_DIR}/<time>_<model>.json)")
+    run.add_argument("--baseline", type=Path, help="compare against this report; exit 1 on regression")
+    run.add_argument("--save-baseline", type=Path, help="also write the report here")
+    _threshold_args(run)
+
+    diff = sub.add_parser("diff", help="compare two reports; exit 1 on regression")
+    diff.add_argument("baseline", type=Path)
+    diff.add_argument("current", type=Path)
+    _threshold_args(diff)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "diff":
+        rows = diff_reports(json.loads(args.baseline.read_text(encoding="utf-8")),
+                            json.loads(args.current.read_text(encoding="utf-8")), _thresholds(args))
+        _print_diff(rows)
+        return 1 if any(r["regressed"] for r in rows) else 0
+
+    suites = [s.strip() for s in args.suites.split(",") if s.strip()]
+    if unknown := [s for s in suites if s not in SUITES]:
+        parser.error(f"unknown suite(s): {', '.join(unknown)}")
+    models = [m.strip() for m in args.model.split(",") if m.strip()]
+    report = run_suite(args.backend, models, suites, args.repetitions, args.warmup, args.timeout, args.think)
+
+    name = _resolve_model(args.backend, models[0], suites[0]) if len(models) == 1 else report["model"]
+    out = args.out or REPORTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}_{re.sub(r'[^A-Za-z0-9._-]+', '_', name)}.json"
+    _write_json(out, report)
+    print(f"[LLMBenchSuite] report written to {out}")
+    if args.save_baseline:
+        _write_json(args.save_baseline, report)
+        print(f"[LLMBenchSuite] baseline written to {args.save_baseline}")
+
+    for suite, s in report["suites"].items():
+        lat, ttft, tps = s["latency_ms"] or {}, s["ttft_ms"] or {}, s["tokens_per_s"] or {}
+        print(f"{suite:<16} {s['model']:<28} valid {s['valid_rate']:.0%}  errors {s['error_rate']:.0%}  "
+              f"latency p50/p95/p99 {lat.get('p50')}/{lat.get('p95')}/{lat.get('p99')} ms  "
+              f"ttft p50 {ttft.get('p50')} ms  tok/s p50 {tps.get('p50')}")
+
+    if args.baseline:
+        rows = diff_reports(json.loads(args.baseline.read_text(encoding="utf-8")), report, _thresholds(args))
+        _print_diff(rows)
+        return 1 if any(r["regressed"] for r in rows) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""LLM endpoint pool — the servers llm_router can send a call to, and how each is doing.
+
+- Endpoints come from Config.LLM_ENDPOINTS ([{name, backend, url, model, small_model}], e.g. two Ollama
+  hosts plus LM Studio). When it is empty the pool holds just the Config.LLM_BACKEND server
+  at its module defaults, so a single-backend setup behaves exactly as before.
+- Each endpoint serves a 'large' and optionally a 'small' model tier (Config.LLM_TASK_MODELS
+  picks the tier per caller); without a small model both tiers use the large one.
+- pick(): the healthy endpoint with the fewest outstanding requests (ties: lower latency
+  EWMA, then config order). With nothing healthy, the endpoint that failed longest ago is
+  tried anyway — a failed call costs no more than refusing outright.
+- Health: a probe loop (every Config.LLM_HEALTH_CHECK seconds) marks endpoints up or down;
+  Config.LLM_UNHEALTHY_AFTER consecutive call errors take one out of rotation until a
+  probe or a call succeeds again.
+- stats(): per endpoint health, outstanding requests, call/error/failover/hedge counters
+  and latency/TTFT EWMAs — served at /persona/llm/endpoints.
+"""
+import threading
+import time
+
+import config
+from agents.llm import http_session
+
+_EWMA_ALPHA = 0.2
+
+
+class Endpoint:
+    def __init__(self, name: str, backend: str, url: str, model: str, small_model: str | None = None):
+        self.name = name
+        self.backend = backend
+        self.url = url.rstrip('/')
+        self.model = model
+        self.small_model = small_model
+        self.healthy = True
+        self.outstanding = 0
+        self.consecutive_errors = 0
+        self.last_error: str | None = None
+        self.last_error_at: float | None = None
+        self.last_probe: float | None = None
+        self.latency_ewma: float | None = None  # ms
+        self.ttft_ewma: float | None = None     # ms
+        self.counters = {'calls': 0, 'ok': 0, 'errors': 0, 'timeouts': 0,
+                         'failovers': 0, 'hedges_started': 0, 'hedges_won': 0}
+
+    @property
+    def module(self):
+        """The backend module (ollama_service / lmstudio_service) that speaks this endpoint's API."""
+        if self.backend == 'lmstudio':
+            from agents.llm import lmstudio_service
+            return lmstudio_service
+        from agents.llm import ollama_service
+        return ollama_service
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/v1" if self.backend == 'lmstudio' else self.url
+
+    def model_for(self, tier: str = 'large') -> str:
+        return self.small_model if tier == 'small' and self.small_model else self.model
+
+    def models(self) -> list[str]:
+        """Distinct models this endpoint should keep resident."""
+        return [self.model] + ([self.small_model] if self.small_model and self.small_model != self.model else [])
+
+    def target(self, tier: str = 'large') -> dict:
+        """Keyword arguments that point a backend function at this endpoint's model for a tier."""
+        return {'base_url': self.base_url, 'model': self.model_for(tier)}
+
+    def probe(self) -> bool:
+        path = '/models' if self.backend == 'lmstudio' else '/api/tags'
+        try:
+            http_session.get(f"{self.base_url}{path}", timeout=3).raise_for_status()
+            return True
+        except Exception as e:
+            self.last_error = f"probe: {e}"
+            return False
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend, 'url': self.url, 'model': self.model, 'small_model': self.small_model,
+            'healthy': self.healthy, 'outstanding': self.outstanding,
+            'consecutive_errors': self.consecutive_errors,
+            'last_error': self.last_error, 'last_error_at': self.last_error_at, 'last_probe': self.last_probe,
+            'latency_ewma_ms': round(self.latency_ewma) if self.latency_ewma is not None else None,
+            'ttft_ewma_ms': round(self.ttft_ewma) if self.ttft_ewma is not None else None,
+            **self.counters,
+        }
+
+
+_endpoints: list[Endpoint] | None = None
+_lock = threading.RLock()
+_probe_started = False
+
+
+def _default_url(backend: str) -> str:
+    if backend == 'lmstudio':
+        from agents.llm.lmstudio_service import LM_STUDIO_BASE_URL
+        return LM_STUDIO_BASE_URL.removesuffix('/v1')
+    from agents.llm.ollama_service import OLLAMA_BASE_URL
+    return OLLAMA_BASE_URL
+
+
+def default_model(backend: str, tier: str = 'large') -> str | None:
+    """The backend module's configured model for a tier (None: no small model configured)."""
+    if backend == 'lmstudio':
+        from agents.llm.lmstudio_service import LM_STUDIO_MODEL, LM_STUDIO_SMALL_MODEL
+        return LM_STUDIO_SMALL_MODEL if tier == 'small' else LM_STUDIO_MODEL
+    from agents.llm.ollama_service import OLLAMA_MODEL, OLLAMA_SMALL_MODEL
+    return OLLAMA_SMALL_MODEL if tier == 'small' else OLLAMA_MODEL
+
+
+def endpoints() -> list[Endpoint]:
+    global _endpoints
+    if _endpoints is None:
+        with _lock:
+            if _endpoints is None:
+                specs = config.Config.LLM_ENDPOINTS or [{'backend': config.Config.LLM_BACKEND}]
+                pool = []
+                for spec in specs:
+                    backend = spec.get('backend', 'ollama')
+                    url = spec.get('url') or _default_url(backend)
+                    pool.append(Endpoint(spec.get('name') or f"{backend}@{url.split('//')[-1]}",
+                                         backend, url, spec.get('model') or default_model(backend),
+                                         spec.get('small_model') or default_model(backend, 'small')))
+                _endpoints = pool
+    return _endpoints
+
+
+def primary() -> Endpoint:
+    return endpoints()[0]
+
+
+def pick(exclude=(), idle_only: bool = False) -> Endpoint | None:
+    """Least-outstanding healthy endpoint not in exclude; None if there is nothing left to try.
+
+    idle_only: only endpoints with no outstanding request (used for hedging, so a hedge
+    never queues behind another call).
+    """
+    with _lock:
+        candidates = [(i, ep) for i, ep in enumerate(endpoints()) if ep not in exclude]
+        if idle_only:
+            candidates = [(i, ep) for i, ep in candidates if ep.healthy and ep.outstanding == 0]
+        if not candidates:
+            return None
+        healthy = [(i, ep) for i, ep in candidates if ep.healthy]
+        if healthy:
+            return min(healthy, key=lambda c: (c[1].outstanding, c[1].latency_ewma or 0, c[0]))[1]
+        return min(candidates, key=lambda c: (c[1].last_error_at or 0, c[0]))[1]
+
+
+def begin(ep: Endpoint) -> None:
+    with _lock:
+        ep.outstanding += 1
+        ep.counters['calls'] += 1
+
+
+def end(ep: Endpoint, trace: dict, started: float) -> None:
+    """Record one finished attempt from its telemetry trace (outcome, first_chunk_at)."""
+    now = time.monotonic()
+    outcome = trace.get('outcome')
+    with _lock:
+        ep.outstanding -= 1
+        if outcome == 'error':
+            ep.counters['errors'] += 1
+            ep.consecutive_errors += 1
+            ep.last_error = trace.get('error') or 'call failed'
+            ep.last_error_at = time.time()
+            if ep.healthy and ep.consecutive_errors >= config.Config.LLM_UNHEALTHY_AFTER:
+                ep.healthy = False
+                print(f"[LLMEndpoints] {ep.name}: {ep.consecutive_errors} errors in a row — out of rotation")
+            return
+        if outcome == 'preempted':
+            return
+        ep.counters['timeouts' if outcome == 'timeout' else 'ok'] += 1
+        ep.consecutive_errors = 0
+        if not ep.healthy:
+            # The probe loop doesn't run for a single endpoint or with LLM_HEALTH_CHECK = 0
+            ep.healthy = True
+            print(f"[LLMEndpoints] {ep.name}: call succeeded — back in rotation")
+        latency = (now - started) * 1000
+        ep.latency_ewma = latency if ep.latency_ewma is None else (
+            _EWMA_ALPHA * latency + (1 - _EWMA_ALPHA) * ep.latency_ewma)
+        if trace.get('first_chunk_at') is not None:
+            ttft = (trace['first_chunk_at'] - started) * 1000
+            ep.ttft_ewma = ttft if ep.ttft_ewma is None else _EWMA_ALPHA * ttft + (1 - _EWMA_ALPHA) * ep.ttft_ewma
+
+
+def count(ep: Endpoint, counter: str) -> None:
+    with _lock:
+        ep.counters[counter] += 1
+
+
+def start_health_checks() -> None:
+    """Start the probe loop once; a no-op for a single-endpoint pool."""
+    global _probe_started
+    if _probe_started or len(endpoints()) < 2 or not config.Config.LLM_HEALTH_CHECK:
+        return
+    _probe_started = True
+    threading.Thread(target=_probe_loop, daemon=True, name='llm-endpoint-probe').start()
+
+
+def _probe_loop() -> None:
+    while True:
+        for ep in endpoints():
+            ok = ep.probe()
+            with _lock:
+                ep.last_probe = time.time()
+                if ok and not ep.healthy:
+                    ep.consecutive_errors = 0
+                    print(f"[LLMEndpoints] {ep.name}: healthy again")
+                elif not ok and ep.healthy:
+                    print(f"[LLMEndpoints] {ep.name}: probe failed — out of rotation")
+                ep.healthy = ok
+        time.sleep(config.Config.LLM_HEALTH_CHECK)
+
+
+def stats() -> dict:
+    with _lock:
+        return {ep.name: ep.stats() for ep in endpoints()}
@@ -0,0 +1,84 @@
+"""Shared keep-alive HTTP session for all LLM backend traffic.
+
+One requests.Session with a pooled adapter is reused by llm_router, both backends
+and the LLM bench, so a quote or chat turn no longer pays TCP setup to
+localhost:11434 / :1234 on every call.
+
+- Pool size and connect timeout come from config (LLM_HTTP_POOL_SIZE, LLM_CONNECT_TIMEOUT).
+- timeouts(read) splits a caller's timeout into (connect, read); read is the max gap
+  between streamed chunks — overall deadlines stay in the backend loops.
+- close(resp, finished=True) drains the tail of a completed stream so the socket
+  returns to the pool; closing an unfinished stream drops the socket, which is also
+  how the backend learns to stop generating.
+- stats() reports per-host request counts and connection reuse rates.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+_session: requests.Session | None = None
+_adapter: HTTPAdapter | None = None
+_init_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    global _session, _adapter
+    if _session is None:
+        with _init_lock:
+            if _session is None:
+                pool_size = config.Config.LLM_HTTP_POOL_SIZE
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _adapter = adapter
+                _session = session
+    return _session
+
+
+def timeouts(read: float) -> tuple[float, float]:
+    """Return a requests (connect, read) timeout tuple for the given read timeout."""
+    return min(config.Config.LLM_CONNECT_TIMEOUT, read), read
+
+
+def get(url: str, timeout: float, **kwargs) -> requests.Response:
+    return _get_session().get(url, timeout=timeouts(timeout), **kwargs)
+
+
+def post(url: str, timeout: float, **kwargs) -> requests.Response:
+    return _get_session().post(url, timeout=timeouts(timeout), **kwargs)
+
+
+def close(resp: requests.Response, finished: bool = False) -> None:
+    """Release a streamed response back to the pool (finished) or drop its socket."""
+    try:
+        if finished:
+            for _ in resp.iter_content(chunk_size=None):
+                pass
+    except Exception:
+        pass
+    finally:
+        resp.close()
+
+
+def stats() -> dict:
+    """Per-host request count, new connections opened and the resulting reuse rate."""
+    if _adapter is None:
+        return {}
+    pools = _adapter.poolmanager.pools
+    result = {}
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        reqs = pool.num_requests
+        conns = pool.num_connections
+        result[f"{pool.host}:{pool.port}"] = {
+            'requests': reqs,
+            'connections_opened': conns,
+            'reuse_rate': round(1 - conns / reqs, 3) if reqs else None,
+        }
+    return result
@@ -1,48 +1,402 @@
-"""LLM backend router — the only file that knows which backend is active.
+"""LLM backend router — the only file that knows which backends are in use.
 
-All callers import call_llm() and collect_thinking() from here.
-To add a new backend: add a branch in each function below and implement
-the backend in its own module under agents/llm/.
+All callers import call_llm(), call_llm_json() and collect_thinking() from here.
+To add a new backend: implement it in its own module under agents/llm/ with the
+same _call/_collect_thinking/is_resident/preload signatures and map it in
+agents/llm/endpoints.py.
+
+Endpoints: calls go to the pool in agents/llm/endpoints.py (Config.LLM_ENDPOINTS, or
+just LLM_BACKEND). Each call takes the least-loaded healthy endpoint. A call that
+fails with a connection/HTTP error before its first chunk fails over to the next one.
+Interactive calls are hedged: with no first chunk after Config.LLM_HEDGE_AFTER seconds
+the same request also goes to an idle endpoint, and whichever streams first wins.
+
+Every call goes through the shared LLMScheduler (agents/llm/scheduler.py), which
+orders callers by priority class and may cancel low-priority streams mid-flight.
+Small-tier calls take slots from their own pool, so they run next to a large-tier stream
+on the same endpoint instead of queueing in front of it.
+
+Telemetry: every call is recorded (caller tag, queue wait, TTFT, latency, sizes,
+outcome) in agents/llm/telemetry.py; pass caller= so /llm/metrics can group by it.
+
+Task routing: Config.LLM_TASK_MODELS maps caller tags to a model tier, so classification
+and extraction run on a small model (OLLAMA_SMALL_MODEL / LM_STUDIO_SMALL_MODEL or an
+endpoint's small_model) while persona voice stays on the large one.
+
+Structured output: call_llm_json() constrains decoding to a JSON schema, validates the
+answer (agents/llm/structured.py) and re-prompts with the validation errors up to
+Config.LLM_JSON_REPAIRS times, instead of discarding an expensive generation.
+
+Model residency: every request carries Config.LLM_KEEP_ALIVE (Ollama keep_alive /
+LM Studio ttl), and a background loop reloads each model every LLM_RESIDENCY_CHECK
+seconds if the backend evicted it, so the hot quote path never pays a cold load.
 """
+import queue
+import threading
+import time
+
 import config
+from agents.llm import endpoints, structured, telemetry
+from agents.llm.scheduler import (
+    LLMScheduler, PRIORITY_INTERACTIVE, PRIORITY_NOTIFY, PRIORITY_BACKGROUND,
+)
+
+
+def _pool_slots() -> dict:
+    """One large-tier stream per endpoint, plus one small-tier stream per endpoint with its own small model.
+
+    Running both at once needs the server to keep both models loaded and serve requests in
+    parallel: OLLAMA_MAX_LOADED_MODELS >= 2 and OLLAMA_NUM_PARALLEL >= 2 for Ollama, both
+    models loaded (and parallel requests enabled) in LM Studio. Otherwise the small call just
+    queues server-side, as it did when it shared the endpoint's one slot.
+    """
+    eps = endpoints.endpoints()
+    slots = {'large': len(eps)}
+    small = sum(1 for ep in eps if len(ep.models()) > 1)
+    if small:
+        slots['small'] = small
+    return slots
+
+
+_scheduler = LLMScheduler(slots=_pool_slots())  # small tier falls back to 'large' without a small model
+_residency = {'checks': 0, 'reloads': 0, 'resident': None, 'last_check': None, 'endpoints': {}}
 
 
 def start_backend() -> None:
-    """Start or verify the configured LLM backend."""
+    """Start or verify the local LLM backend, probe the endpoint pool, then keep models resident."""
     if config.Config.LLM_BACKEND == 'lmstudio':
         from agents.llm.lmstudio_service import check_ready
         check_ready()
     else:
         from agents.llm.ollama_service import start
         start()
+    endpoints.start_health_checks()
+    if config.Config.LLM_RESIDENCY_CHECK:
+        threading.Thread(target=_residency_loop, daemon=True).start()
+
+
+def ensure_resident() -> bool:
+    """Reload each healthy endpoint's models (large and small) if evicted. Returns True if all are loaded.
+
+    Reloads run as skip-if-busy background calls in the model's tier pool: if anything else
+    is queued there, that call will load the model anyway.
+    """
+    resident = True
+    for ep in endpoints.endpoints():
+        if not ep.healthy:
+            continue
+        for model in ep.models():
+            tier = 'small' if model != ep.model else 'large'
+            target = {'base_url': ep.base_url, 'model': model}
+            loaded = ep.module.is_resident(**target)
+            if not loaded:
+                print(f"[LLMRouter] {ep.name}: model not resident — preloading {model}")
+                loaded = bool(_scheduler.run(PRIORITY_BACKGROUND, lambda cancel: ep.module.preload(**target),
+                                             skip_if_busy=True, pool=tier))
+                _residency['reloads'] += int(loaded)
+            _residency['endpoints'][f"{ep.name}/{model}"] = loaded
+            resident = resident and loaded
+    _residency['checks'] += 1
+    _residency['last_check'] = time.time()
+    _residency['resident'] = resident
+    return resident
+
+
+def residency_stats() -> dict:
+    """Model residency checks/reloads since startup, plus the configured keep-alive."""
+    backend, model = active_model()
+    return {**_residency, 'endpoints': dict(_residency['endpoints']), 'backend': backend, 'model': model,
+            'keep_alive': config.Config.LLM_KEEP_ALIVE, 'check_interval': config.Config.LLM_RESIDENCY_CHECK}
+
+
+def _residency_loop() -> None:
+    while True:
+        try:
+            ensure_resident()
+        except Exception as e:
+            print(f"[LLMRouter] residency check failed: {e}")
+        time.sleep(config.Config.LLM_RESIDENCY_CHECK)
+
+
+def task_tier(caller: str | None) -> str:
+    """Model tier ('large' or 'small') a caller tag is routed to by Config.LLM_TASK_MODELS."""
+    return config.Config.LLM_TASK_MODELS.get(caller or '', 'large')
+
+
+def active_model(caller: str | None = None) -> tuple[str, str]:
+    """Return (backend, model) of the primary endpoint for caller's tier — used in response cache keys."""
+    ep = endpoints.primary()
+    return ep.backend, ep.model_for(task_tier(caller))
+
+
+def scheduler_stats() -> dict:
+    """Per-priority-class queue wait / run time counters from the shared scheduler."""
+    return _scheduler.stats()
+
+
+def call_metrics(window: float | None = None, caller: str | None = None) -> dict:
+    """Per-caller p50/p95/p99 queue wait, TTFT, latency, sizes and outcome rates."""
+    return telemetry.summary(window, caller)
+
+
+def endpoint_stats() -> dict:
+    """Per-endpoint health, outstanding requests, failover/hedge counters and latency EWMAs."""
+    return endpoints.stats()
+
+
+def structured_stats() -> dict:
+    """Per-caller JSON parse/schema failure rates, repairs and wasted output tokens."""
+    return structured.stats()
+
+
+def http_stats() -> dict:
+    """Per-host request counts and keep-alive reuse rates from the shared HTTP session."""
+    from agents.llm import http_session
+    return http_session.stats()
 
 
 def call_llm(prompt: str, timeout: int = 10, *, system: str | None = None,
              skip_if_busy: bool = False, think: bool = False,
-             use_tools: bool = False) -> str | None:
-    """Send a prompt to the active LLM backend and return the response, or None on failure.
+             use_tools: bool = False, priority: int = PRIORITY_NOTIFY,
+             on_token=None, caller: str | None = None, hedge: bool | None = None,
+             schema: dict | None = None, usage: dict | None = None) -> str | None:
+    """Send a prompt to the LLM endpoint pool and return the response, or None on failure.
 
-    skip_if_busy: return None immediately if another call is in flight.
+    skip_if_busy: return None immediately if another call is in flight or queued.
                   Use for low-priority callers with a fallback (quotes, suggestions).
     use_tools: Ollama-only — passes dummy tool definitions to shift Qwen3 into a
                faster reasoning mode. Ignored by other backends.
+    priority: scheduler class (PRIORITY_* from agents.llm.scheduler). Quote and
+              background calls may be cancelled by an interactive call and return None.
+    on_token: called with each answer chunk as it streams in (for SSE relays).
+    caller: telemetry tag, e.g. 'quote' or 'memory_extract'.
+    hedge: send to a second idle endpoint if no chunk arrives within Config.LLM_HEDGE_AFTER.
+           Defaults to on for PRIORITY_INTERACTIVE calls.
+    schema: constrain the answer to this JSON schema (use call_llm_json() to also validate it).
+    usage: if given, filled with the call's trace (output_tokens, thinking_chars, outcome...).
     """
-    if config.Config.LLM_BACKEND == 'lmstudio':
-        from agents.llm.lmstudio_service import _call
-        return _call(prompt, timeout, system=system, skip_if_busy=skip_if_busy, think=think)
-    from agents.llm.ollama_service import _call
-    return _call(prompt, timeout, system=system, skip_if_busy=skip_if_busy, think=think, use_tools=use_tools)
+    def attempt(ep, target, cancel, trace, tokens):
+        extra = {'use_tools': use_tools} if ep.backend == 'ollama' else {}
+        return ep.module._call(prompt, timeout, system=system, think=think, cancel=cancel,
+                               on_token=tokens, trace=trace, schema=schema, **extra, **target)
+
+    if hedge is None:
+        hedge = priority == PRIORITY_INTERACTIVE
+    fn = lambda cancel, trace: _dispatch(attempt, cancel, trace, on_token, hedge, task_tier(caller))
+    return _run_traced('call', caller, priority, fn, skip_if_busy, usage)
+
+
+def call_llm_json(prompt: str, schema: dict, timeout: int = 30, *, system: str | None = None,
+                  think: bool = False, validate=None, repairs: int | None = None,
+                  priority: int = PRIORITY_NOTIFY, skip_if_busy: bool = False,
+                  caller: str | None = None):
+    """Call the LLM with output constrained to `schema` and return the parsed, validated JSON value.
+
+    The answer is parsed and checked against the schema, then against validate(value), which
+    returns an error message or None for rules a schema cannot express. An invalid answer is
+    sent back with its errors for up to `repairs` (default Config.LLM_JSON_REPAIRS) more calls.
+    Returns None if the call fails or no answer validates.
+    """
+    repairs = config.Config.LLM_JSON_REPAIRS if repairs is None else repairs
+    structured.record(caller, 'calls')
+    user = prompt
+    for attempt in range(repairs + 1):
+        usage = {}
+        raw = call_llm(user, timeout, system=system, think=think, priority=priority, caller=caller,
+                       skip_if_busy=skip_if_busy and attempt == 0, schema=schema, usage=usage)
+        if raw is None:
+            structured.record(caller, 'failed')
+            return None
+        try:
+            value = structured.parse_json(raw)
+        except ValueError as e:
+            errors, event = [str(e)], 'parse_failure'
+        else:
+            errors, event = structured.schema_errors(value, schema), 'schema_failure'
+            if not errors and validate is not None and (problem := validate(value)):
+                errors = [problem]
+        if not errors:
+            structured.record(caller, 'repaired' if attempt else 'ok')
+            return value
+        structured.record(caller, event, usage, raw)
+        print(f"[LLMRouter] {caller or 'call_llm_json'}: invalid answer ({errors[0]}) — "
+              + (f"repair {attempt + 1}/{repairs}" if attempt < repairs else "giving up"))
+        if attempt < repairs:
+            structured.record(caller, 'repairs')
+            user = structured.repair_prompt(prompt, raw, errors)
+    structured.record(caller, 'failed')
+    return None
 
 
 def collect_thinking(prompt: str, think_budget_chars: int = 4000, timeout: int = 60, *,
-                     system: str | None = None, skip_if_busy: bool = False) -> str | None:
+                     system: str | None = None, skip_if_busy: bool = False,
+                     priority: int = PRIORITY_NOTIFY, on_progress=None,
+                     caller: str | None = None) -> str | None:
     """Phase-1 of a two-phase call: stream think=True, collect reasoning up to budget, then stop.
 
     Returns the raw thinking text (not the answer). The caller uses this as context
     for a fast follow-up call with think=False via call_llm().
+    on_progress: called with the running thinking char count as reasoning streams in.
+    caller: telemetry tag, e.g. 'open_think'.
     """
-    if config.Config.LLM_BACKEND == 'lmstudio':
-        from agents.llm.lmstudio_service import _collect_thinking
-        return _collect_thinking(prompt, think_budget_chars, timeout, system=system, skip_if_busy=skip_if_busy)
-    from agents.llm.ollama_service import _collect_thinking
-    return _collect_thinking(prompt, think_budget_chars, timeout, system=system, skip_if_busy=skip_if_busy)
+    def attempt(ep, target, cancel, trace, tokens):
+        return ep.module._collect_thinking(prompt, think_budget_chars, timeout, system=system, cancel=cancel,
+                                           on_progress=on_progress, trace=trace, **target)
+
+    fn = lambda cancel, trace: _dispatch(attempt, cancel, trace, None, False, task_tier(caller))
+    return _run_traced('think', caller, priority, fn, skip_if_busy)
+
+
+# ------------------------------------------------------------------ #
+#  Endpoint dispatch — failover and hedging                          #
+# ------------------------------------------------------------------ #
+
+class _AnyEvent:
+    """Cancel flag that is set when any of the given events is — scheduler preemption or a lost hedge."""
+
+    def __init__(self, *events):
+        self._events = events
+
+    def is_set(self) -> bool:
+        return any(e.is_set() for e in self._events)
+
+
+def _attempt_on(ep, tier: str, attempt, cancel, trace: dict, tokens):
+    """Run one attempt against one endpoint's model for tier, keeping its outstanding count and stats."""
+    target = ep.target(tier)
+    started = time.monotonic()
+    endpoints.begin(ep)
+    try:
+        return attempt(ep, target, cancel, trace, tokens)
+    finally:
+        endpoints.end(ep, trace, started)
+        trace.update(endpoint=ep.name, backend=ep.backend, model=target['model'])
+
+
+def _dispatch(attempt, cancel, trace: dict, on_token, hedge: bool, tier: str = 'large') -> str | None:
+    """Run attempt(endpoint, target, cancel, trace, on_token) on the pool with failover (and hedging).
+
+    An attempt that fails with outcome 'error' before streaming anything is retried on the
+    next endpoint; timeouts, preemption and partially streamed answers are not retried.
+    The winning attempt's trace is copied into `trace` for telemetry.
+    """
+    tried = []
+    # The 'small' scheduler pool is sized by the endpoints that have a small model — go there first
+    large_only = [e for e in endpoints.endpoints() if len(e.models()) < 2] if tier == 'small' else []
+    while True:
+        ep = (large_only and endpoints.pick(exclude=tried + large_only)) or endpoints.pick(exclude=tried)
+        if ep is None:
+            trace.setdefault('outcome', 'error')
+            return None
+        tried.append(ep)
+        if hedge and config.Config.LLM_HEDGE_AFTER and len(endpoints.endpoints()) > 1:
+            result, attempt_trace = _hedged(ep, tier, attempt, cancel, on_token, tried)
+        else:
+            attempt_trace = {}
+            result = _attempt_on(ep, tier, attempt, cancel, attempt_trace, on_token)
+        trace.clear()
+        trace.update(attempt_trace)
+        if (result is not None or trace.get('outcome') != 'error' or trace.get('first_chunk_at') is not None
+                or cancel.is_set() or len(tried) >= len(endpoints.endpoints())):
+            return result
+        endpoints.count(ep, 'failovers')
+        print(f"[LLMRouter] {ep.name} failed — failing over")
+
+
+def _hedged(primary, tier: str, attempt, cancel, on_token, tried: list) -> tuple[str | None, dict]:
+    """Start on `primary`; if no chunk arrives within LLM_HEDGE_AFTER, also start an idle endpoint.
+
+    The first attempt to stream an answer token (or finish with a result) wins: the
+    other is cancelled and its tokens are never forwarded to on_token.
+    """
+    lock = threading.Lock()
+    finished: queue.Queue = queue.Queue()
+    runs = []
+    state = {'winner': None}
+
+    def claim(run) -> bool:
+        """Make run the winner if nobody is yet. Caller holds lock. Returns True if run is the winner."""
+        if state['winner'] is None:
+            state['winner'] = run
+            for other in runs:
+                if other is not run:
+                    other['cancel'].set()
+        return state['winner'] is run
+
+    def launch(ep):
+        run = {'ep': ep, 'cancel': threading.Event(), 'trace': {}}
+
+        def tokens(chunk):
+            with lock:
+                mine = claim(run)
+            if mine and on_token is not None:
+                on_token(chunk)
+
+        def go():
+            result = None
+            try:
+                result = _attempt_on(ep, tier, attempt, _AnyEvent(cancel, run['cancel']), run['trace'], tokens)
+            finally:
+                finished.put((run, result))
+
+        runs.append(run)
+        threading.Thread(target=go, daemon=True, name=f"llm-hedge-{ep.name}").start()
+        return run
+
+    with lock:
+        first = launch(primary)
+    pending = 1
+    deadline = time.monotonic() + config.Config.LLM_HEDGE_AFTER
+    while time.monotonic() < deadline and first['trace'].get('first_chunk_at') is None:
+        try:
+            run, result = finished.get(timeout=0.05)
+            return result, run['trace']  # finished before the hedge deadline — no hedge needed
+        except queue.Empty:
+            pass
+    if first['trace'].get('first_chunk_at') is None and not cancel.is_set():
+        second = endpoints.pick(exclude=tried, idle_only=True)
+        if second is not None:
+            tried.append(second)
+            endpoints.count(second, 'hedges_started')
+            print(f"[LLMRouter] no first chunk from {primary.name} after {config.Config.LLM_HEDGE_AFTER}s — hedging on {second.name}")
+            with lock:
+                if state['winner'] is None:
+                    launch(second)
+                    pending += 1
+
+    last = None
+    while pending:
+        run, result = finished.get()
+        pending -= 1
+        with lock:
+            won = claim(run) if result is not None else state['winner'] is run
+        if won:
+            if run['ep'] is not primary:
+                endpoints.count(run['ep'], 'hedges_won')
+            return result, run['trace']
+        last = (result, run['trace'])
+    return last
+
+
+def _run_traced(kind: str, caller: str | None, priority: int, fn, skip_if_busy: bool,
+                usage: dict | None = None) -> str | None:
+    """Run fn(cancel, trace) through the scheduler and record one telemetry entry for it.
+
+    usage: optional dict that receives a copy of the backend trace.
+    """
+    record = telemetry.begin(kind, caller, priority)
+    trace = None
+    result = None
+
+    def granted(cancel):
+        nonlocal trace
+        trace = telemetry.started(record)
+        return fn(cancel, trace)
+
+    try:
+        result = _scheduler.run(priority, granted, skip_if_busy=skip_if_busy, pool=task_tier(caller))
+        return result
+    finally:
+        telemetry.finish(record, result, trace, skip_if_busy)
+        if usage is not None and trace:
+            usage.update(trace)
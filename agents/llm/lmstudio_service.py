@@ -1,57 +1,84 @@
 import json
 import threading
 import time
+
 import requests
 
+import config
+from agents.llm import http_session
+from agents.llm.think_stream import ThinkStream
+
 LM_STUDIO_BASE_URL = "http://localhost:1234/v1"
+LM_STUDIO_REST_URL = "http://localhost:1234/api/v0"  # native REST API — exposes model load state
 # LM_STUDIO_MODEL = "qwen3.5-9b"  # match the model identifier shown in LM Studio
 LM_STUDIO_MODEL = "huihui-qwen3.5-9b-claude-4.6-opus-abliterated"  # match the model identifier shown in LM Studio
+LM_STUDIO_SMALL_MODEL = None  # e.g. "qwen3-1.7b" — classification/extraction (Config.LLM_TASK_MODELS); None = LM_STUDIO_MODEL
 MODEL_TEMPERATURE = 1.3
 # High ceiling so the model can finish its thinking block and still produce an answer.
 # Tune down once thinking verbosity is understood.
 MAX_TOKENS = 12000
 
-_call_lock = threading.Lock()
-
 
 def check_ready():
     try:
-        requests.get(f"{LM_STUDIO_BASE_URL}/models", timeout=3)
+        http_session.get(f"{LM_STUDIO_BASE_URL}/models", timeout=3)
         print("LM Studio: reachable.")
     except Exception:
         print("WARNING: LM Studio not reachable at startup — LLM calls will fail.")
 
 
-def _split_thinking(raw: str) -> tuple[str | None, str, bool]:
-    """Return (thinking, answer, ended_cleanly).
+def _rest_url(base_url: str) -> str:
+    """Native REST API root for an OpenAI-compatible base URL (…/v1 → …/api/v0)."""
+    if base_url == LM_STUDIO_BASE_URL:
+        return LM_STUDIO_REST_URL
+    return base_url.rstrip('/').removesuffix('/v1') + '/api/v0'
 
-    thinking: content inside <think>...</think>, or None if no clean block found.
-    answer:   content outside the think block, or the full raw if no clean block found.
-    ended_cleanly: True only when both <think> and </think> are present.
-    """
-    think_start = raw.find('<think>')
-    if think_start == -1:
-        return None, raw, True
-    think_end = raw.find('</think>', think_start)
-    if think_end == -1:
-        # No closing tag — can't determine boundary; treat everything as answer
-        return None, raw, False
-    thinking = raw[think_start + 7:think_end].strip()
-    answer = (raw[:think_start] + raw[think_end + 8:]).strip()
-    return thinking, answer, True
+
+def is_resident(base_url: str | None = None, model: str | None = None) -> bool:
+    """True if the model (default LM_STUDIO_MODEL) is currently loaded (native REST API state == 'loaded')."""
+    base_url, model = base_url or LM_STUDIO_BASE_URL, model or LM_STUDIO_MODEL
+    try:
+        resp = http_session.get(f"{_rest_url(base_url)}/models/{model}", timeout=3)
+        resp.raise_for_status()
+        return resp.json().get("state") == "loaded"
+    except Exception as e:
+        print(f"[LMStudio] residency check failed: {e}")
+        return False
+
+
+def preload(base_url: str | None = None, model: str | None = None) -> bool:
+    """JIT-load the model (default LM_STUDIO_MODEL) with a one-token request; ttl keeps it loaded between calls."""
+    base_url, model = base_url or LM_STUDIO_BASE_URL, model or LM_STUDIO_MODEL
+    try:
+        t0 = time.time()
+        resp = http_session.post(
+            f"{base_url}/chat/completions",
+            json={"model": model, "messages": [{"role": "user", "content": "hi"}],
+                  "max_tokens": 1, "stream": False, "ttl": config.Config.LLM_KEEP_ALIVE},
+            timeout=120,
+        )
+        resp.raise_for_status()
+        print(f"[LMStudio] model '{model}' loaded in {time.time()-t0:.1f}s")
+        return True
+    except Exception as e:
+        print(f"[LMStudio] preload failed: {e}")
+        return False
 
 
 def _collect_thinking(prompt: str, think_budget_chars: int = 4000, timeout: int = 60, *,
-                      system: str | None = None, skip_if_busy: bool = False) -> str | None:
+                      system: str | None = None, cancel: threading.Event | None = None,
+                      on_progress=None, trace: dict | None = None,
+                      base_url: str | None = None, model: str | None = None) -> str | None:
     """Stream a think=True call, collect thinking up to budget, then close.
 
-    Called by llm_router.collect_thinking() — do not call directly.
-    Returns the raw thinking text, or None on failure/timeout.
+    Called by llm_router.collect_thinking() inside a scheduler slot — do not call directly.
+    Returns the raw thinking text, or None on failure/timeout/preemption.
+    on_progress: called with the running thinking char count after each thinking chunk.
+    trace: telemetry dict filled in-place (first_chunk_at, thinking_chars, outcome).
+    base_url, model: endpoint chosen by the llm_router pool (default LM_STUDIO_BASE_URL / LM_STUDIO_MODEL).
     """
-    acquired = _call_lock.acquire(blocking=not skip_if_busy)
-    if not acquired:
-        print(f"[LMStudio] collect_thinking: skipped (busy)")
-        return None
+    trace = trace if trace is not None else {}
+    base_url, model = base_url or LM_STUDIO_BASE_URL, model or LM_STUDIO_MODEL
     try:
         print(f"[LMStudio] collect_thinking → budget={think_budget_chars} timeout={timeout}s prompt={prompt[:60]!r}")
         t0 = time.time()
@@ -60,29 +87,33 @@ def _collect_thinking(prompt: str, think_budget_chars: int = 4000, timeout: int
             messages.append({"role": "system", "content": system})
         messages.append({"role": "user", "content": prompt})
 
-        resp = requests.post(
-            f"{LM_STUDIO_BASE_URL}/chat/completions",
-            json={"model": LM_STUDIO_MODEL, "messages": messages, "stream": True,
-                  "temperature": MODEL_TEMPERATURE, "max_tokens": MAX_TOKENS},
+        resp = http_session.post(
+            f"{base_url}/chat/completions",
+            json={"model": model, "messages": messages, "stream": True,
+                  "temperature": MODEL_TEMPERATURE, "max_tokens": MAX_TOKENS,
+                  "ttl": config.Config.LLM_KEEP_ALIVE},
             timeout=timeout,
             stream=True,
         )
         resp.raise_for_status()
 
         deadline = time.time() + timeout
-        buf = []          # raw accumulated content
-        buf_str = ""
-        in_think = False
-        thinking_start = 0
-        thinking_chars = 0
+        stream = ThinkStream(think_budget=think_budget_chars, stop_at_answer=True)
         total_chars = 0
         first_chunk_at = None
         last_progress_log = t0
+        finished = False
 
         for line in resp.iter_lines():
             now = time.time()
+            if cancel is not None and cancel.is_set():
+                print(f"[LMStudio] think phase preempted at {now-t0:.1f}s ({stream.thinking_chars} chars discarded)")
+                trace['outcome'] = 'preempted'
+                resp.close()
+                return None
             if now > deadline:
-                print(f"[LMStudio] think budget deadline hit at {thinking_chars} thinking chars | {total_chars} total chars in buf")
+                print(f"[LMStudio] think budget deadline hit at {stream.thinking_chars} thinking chars | {total_chars} total chars streamed")
+                trace['outcome'] = 'timeout'
                 break
             if not line:
                 continue
@@ -93,69 +124,75 @@ def _collect_thinking(prompt: str, think_budget_chars: int = 4000, timeout: int
             data = line[6:]
             if data.strip() == '[DONE]':
                 print(f"[LMStudio] stream [DONE] at {now-t0:.1f}s | total={total_chars} chars")
+                finished = True
                 break
             try:
                 chunk = json.loads(data)
-                delta = chunk['choices'][0]['delta'].get('content', '')
+                delta = chunk['choices'][0]['delta']
             except (json.JSONDecodeError, KeyError, IndexError) as e:
                 print(f"[LMStudio] parse error: {e} | raw={data[:120]!r}")
                 continue
-            if not delta:
+            text, reasoning = delta.get('content') or '', delta.get('reasoning_content') or ''
+            if not text and not reasoning:
                 continue
 
             if first_chunk_at is None:
                 first_chunk_at = now
+                trace['first_chunk_at'] = time.monotonic()
                 print(f"[LMStudio] first chunk at {now-t0:.1f}s")
 
-            buf.append(delta)
-            buf_str = ''.join(buf)
-            total_chars += len(delta)
-
-            if not in_think:
-                idx = buf_str.find('<think>')
-                if idx != -1:
-                    in_think = True
-                    thinking_start = idx + 7
-                    print(f"[LMStudio] <think> found at {now-t0:.1f}s | buf so far={total_chars} chars | prefix={buf_str[:idx].strip()!r}")
-                elif now - last_progress_log >= 10:
-                    print(f"[LMStudio] waiting for <think> at {now-t0:.1f}s | {total_chars} chars so far | tail={buf_str[-100:]!r}")
-                    last_progress_log = now
-            else:
-                thinking_chars = len(buf_str) - thinking_start
-                end_idx = buf_str.find('</think>', thinking_start)
-                if end_idx != -1:
-                    thinking_chars = end_idx - thinking_start
-                    print(f"[LMStudio] </think> found at {now-t0:.1f}s | {thinking_chars} thinking chars collected (clean end)")
-                    break
-                if thinking_chars >= think_budget_chars:
-                    print(f"[LMStudio] think budget reached: {thinking_chars} chars at {now-t0:.1f}s")
-                    break
-                if now - last_progress_log >= 10:
-                    print(f"[LMStudio] thinking... {thinking_chars}/{think_budget_chars} chars at {now-t0:.1f}s")
-                    last_progress_log = now
-
-        resp.close()
+            total_chars += len(text) + len(reasoning)
+            was_thinking = stream.opened or stream.thinking_chars > 0
+            stream.feed_thinking(reasoning)
+            stream.feed(text)
+            thinking = stream.opened or stream.thinking_chars > 0
+            if thinking and not was_thinking:
+                print(f"[LMStudio] thinking started at {now-t0:.1f}s | {total_chars} chars so far | prefix={stream.answer()!r}")
+            if thinking:
+                trace['thinking_chars'] = stream.thinking_chars
+                if on_progress is not None:
+                    on_progress(stream.thinking_chars)
+            if stream.stop_reason == 'answer':
+                print(f"[LMStudio] thinking ended at {now-t0:.1f}s | {stream.thinking_chars} thinking chars collected (clean end)")
+                break
+            if stream.stop_reason == 'budget':
+                print(f"[LMStudio] think budget reached: {stream.thinking_chars} chars at {now-t0:.1f}s")
+                break
+            if now - last_progress_log >= 10:
+                if thinking:
+                    print(f"[LMStudio] thinking... {stream.thinking_chars}/{think_budget_chars} chars at {now-t0:.1f}s")
+                else:
+                    print(f"[LMStudio] waiting for <think> at {now-t0:.1f}s | {total_chars} chars so far")
+                last_progress_log = now
+
+        http_session.close(resp, finished=finished)
         elapsed = time.time() - t0
-        if in_think:
-            end_idx = buf_str.find('</think>', thinking_start)
-            result = buf_str[thinking_start:end_idx if end_idx != -1 else None].strip()
-            print(f"[LMStudio] collect_thinking ← {elapsed:.1f}s | {len(result)} chars")
-            return result or None
-        print(f"[LMStudio] collect_thinking ← {elapsed:.1f}s | no <think> block found | total={total_chars} chars | buf={buf_str[:300]!r}")
+        if stream.opened or stream.thinking_chars:
+            result = stream.close().thinking()
+            print(f"[LMStudio] collect_thinking ← {elapsed:.1f}s | {len(result or '')} chars")
+            return result
+        print(f"[LMStudio] collect_thinking ← {elapsed:.1f}s | no <think> block found | total={total_chars} chars | buf={stream.answer()[:300]!r}")
         return None
     except Exception as e:
         print(f"[LMStudio] collect_thinking failed: {e}")
+        trace['outcome'] = 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'error'
         return None
-    finally:
-        _call_lock.release()
 
 
 def _call(prompt: str, timeout: int = 10, *, system: str | None = None,
-                  skip_if_busy: bool = False, think: bool = False) -> str | None:
-    acquired = _call_lock.acquire(blocking=not skip_if_busy)
-    if not acquired:
-        print(f"[LMStudio] call: skipped (busy) think={think} prompt={prompt[:60]!r}")
-        return None
+          think: bool = False, cancel: threading.Event | None = None, on_token=None,
+          trace: dict | None = None, base_url: str | None = None, model: str | None = None,
+          schema: dict | None = None) -> str | None:
+    """Called by llm_router.call_llm() inside a scheduler slot — do not call directly.
+
+    cancel: set by the scheduler to preempt this call; the stream is dropped and None returned.
+    on_token: called with each answer chunk as it arrives; the think block is withheld.
+    trace: telemetry dict filled in-place (first_chunk_at, thinking_chars, output_tokens, outcome).
+    base_url, model: endpoint chosen by the llm_router pool (default LM_STUDIO_BASE_URL / LM_STUDIO_MODEL).
+    schema: JSON schema the answer is constrained to (OpenAI-style response_format).
+    """
+    trace = trace if trace is not None else {}
+    base_url, model = base_url or LM_STUDIO_BASE_URL, model or LM_STUDIO_MODEL
     try:
         print(f"[LMStudio] call → think={think} reasoning_effort={'on' if think else 'none'} timeout={timeout}s prompt={prompt[:60]!r}")
         t0 = time.time()
@@ -166,19 +203,31 @@ def _call(prompt: str, timeout: int = 10, *, system: str | None = None,
             messages.append({"role": "system", "content": system})
         messages.append({"role": "user", "content": prompt})
 
-        body = {"model": LM_STUDIO_MODEL, "messages": messages, "stream": True, "temperature": MODEL_TEMPERATURE, "max_tokens": MAX_TOKENS}
+        body = {"model": model, "messages": messages, "stream": True, "temperature": MODEL_TEMPERATURE,
+                "max_tokens": MAX_TOKENS, "ttl": config.Config.LLM_KEEP_ALIVE,
+                "stream_options": {"include_usage": True}}
         if not think:
             body["reasoning_effort"] = "none"
-            
-        resp = requests.post(
-            f"{LM_STUDIO_BASE_URL}/chat/completions",
+        if schema is not None:
+            body["response_format"] = {"type": "json_schema",
+                                       "json_schema": {"name": "response", "strict": True, "schema": schema}}
+
+        resp = http_session.post(
+            f"{base_url}/chat/completions",
             json=body,
             timeout=timeout,
             stream=True,
         )
         resp.raise_for_status()
-        content = []
+        stream = ThinkStream(on_answer=on_token)
+        first_chunk = True
+        finished = False
         for line in resp.iter_lines():
+            if cancel is not None and cancel.is_set():
+                print(f"[LMStudio] preempted at {time.time()-t0:.1f}s — dropping stream")
+                trace['outcome'] = 'preempted'
+                resp.close()
+                return None
             if not line:
                 continue
             if isinstance(line, bytes):
@@ -187,18 +236,27 @@ def _call(prompt: str, timeout: int = 10, *, system: str | None = None,
                 continue
             data = line[6:]
             if data.strip() == '[DONE]':
+                finished = True
                 break
             try:
-                delta = json.loads(data)['choices'][0]['delta'].get('content', '')
-                if delta:
-                    content.append(delta)
+                chunk = json.loads(data)
+                if usage := chunk.get('usage'):
+                    trace['output_tokens'] = usage.get('completion_tokens')
+                delta = chunk['choices'][0]['delta']
+                text, reasoning = delta.get('content') or '', delta.get('reasoning_content') or ''
+                if (text or reasoning) and first_chunk:
+                    first_chunk = False
+                    trace['first_chunk_at'] = time.monotonic()
+                stream.feed_thinking(reasoning)
+                stream.feed(text)
             except (json.JSONDecodeError, KeyError, IndexError):
                 pass
-        raw = ''.join(content).strip()
-        print(raw)
-        thinking_text, answer, ended_cleanly = _split_thinking(raw)
+        http_session.close(resp, finished=finished)
+        thinking_text, answer, ended_cleanly = stream.close().result()
+        raw = stream.raw()
 
         if thinking_text is not None:
+            trace['thinking_chars'] = len(thinking_text)
             print(f"[LMStudio] thinking: {len(thinking_text)} chars")
             if think:
                 print(f"[LMStudio] think:\n{thinking_text}")
@@ -212,6 +270,5 @@ def _call(prompt: str, timeout: int = 10, *, system: str | None = None,
         return answer or None
     except Exception as e:
         print(f"[LMStudio] call failed: {e}")
+        trace['outcome'] = 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'error'
         return None
-    finally:
-        _call_lock.release()
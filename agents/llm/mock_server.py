@@ -0,0 +1,506 @@
+"""Mock LLM server — stands in for Ollama and LM Studio so LLM paths can be load-tested without a GPU.
+
+    python -m agents.llm.mock_server                       # Ollama on :11434, LM Studio on :1234
+    python -m agents.llm.mock_server --ttft-ms 800 --tokens-per-s 25 --jitter-ms 20 --fail-rate 0.05
+    python -m agents.llm.mock_server --script env/mock_llm.json --lmstudio-port 0
+    python -m agents.llm.mock_server --check                # streaming timing self-check
+
+- Ollama: POST /api/chat and /api/generate (NDJSON stream or single JSON, `thinking` field when
+  think=true, eval_count/durations on the final chunk), GET /, /api/tags, /api/ps, POST /api/pull.
+- LM Studio: POST /v1/chat/completions (OpenAI SSE or single JSON; thinking as <think> tags in
+  content, or as reasoning_content with --think-style field; usage when include_usage is set),
+  GET /v1/models and /api/v0/models/<id>. Thinking is on unless reasoning_effort is "none",
+  "/nothink" is in the prompt or enable_thinking is false — like a Qwen3 model.
+- Timing: TTFT (plus optional prefill cost per 1k prompt tokens), then tokens at a fixed rate,
+  each gap ± jitter. --parallel N queues requests beyond N like a single-slot backend. A seeded
+  RNG makes jitter and failure injection reproducible.
+- Script: JSON list of rules {match, response, thinking, ttft_ms, tokens_per_s, jitter_ms, fail,
+  fail_rate}; the first rule whose regex `match` is found in the prompt wins. Built-in rules
+  answer this repo's prompts (mood classifier, memory extraction, combined JSON).
+- Failures: error (HTTP 500), hang (no bytes until the client times out), disconnect (connection
+  dropped mid-stream), malformed (a broken JSON line mid-stream).
+- Control: GET /mock/stats, POST /mock/config {defaults..., rules: [...]}, POST /mock/reset.
+
+MockLLMServer(...).start() runs the same thing in-process for scripts and benchmarks.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+DEFAULTS = {
+    "ttft_ms": 300,          # delay before the first streamed chunk
+    "prefill_ms_per_1k": 0,  # extra TTFT per 1000 prompt tokens (≈4 chars per token)
+    "tokens_per_s": 40,
+    "jitter_ms": 0,          # each inter-token gap (and the TTFT) varies by up to ± this
+    "fail_rate": 0.0,
+    "fail": "error",         # error | hang | disconnect | malformed
+    "hang_s": 600,
+    "think_style": "tags",   # LM Studio only: tags | field
+}
+
+_DEFAULT_THINKING = (
+    "Okay, let me look at the context first. The user is at home and it is fairly quiet. "
+    "I should keep this short and in character, and only use facts that were given."
+)
+
+BUILTIN_RULES = [
+    {"match": r"mood classifier|single mood word", "response": "tired", "thinking": "Drained, long day — tired."},
+    {"match": r'"user": \[', "response": '{"user": ["The user drinks their coffee black"], "persona": []}'},
+    {"match": r"memory assistant", "response": "none"},
+    {"match": r".", "response": "Mm, quiet evening so far~ Nothing on the calendar, so take it easy."},
+]
+
+_TOKEN_RE = re.compile(r"\s*\S+")
+
+
+def _tokens(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text) or ([text] if text else [])
+
+
+class _ClientGone(Exception):
+    pass
+
+
+class MockLLMServer:
+    def __init__(self, rules: list[dict] | None = None, *, seed: int = 0, parallel: int = 0, **defaults):
+        unknown = set(defaults) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"unknown mock settings: {', '.join(sorted(unknown))}")
+        self.defaults = {**DEFAULTS, **defaults}
+        self.rules = list(rules or []) + BUILTIN_RULES
+        self._rng = random.Random(seed)
+        self._seed = seed
+        self._slots = threading.Semaphore(parallel) if parallel else None
+        self._lock = threading.Lock()
+        self._servers: list[ThreadingHTTPServer] = []
+        self.loaded: set[str] = set()
+        self.reset()
+
+    # ── Lifecycle ──
+
+    def start(self, ollama_port: int = 11434, lmstudio_port: int = 1234, host: str = "127.0.0.1") -> "MockLLMServer":
+        """Serve on daemon threads. A port of 0 skips that backend. Returns self."""
+        for port in (ollama_port, lmstudio_port):
+            if not port:
+                continue
+            server = ThreadingHTTPServer((host, port), _Handler)
+            server.daemon_threads = True
+            server.mock = self
+            self._servers.append(server)
+            threading.Thread(target=server.serve_forever, daemon=True, name=f"mock-llm-{port}").start()
+            print(f"[MockLLM] listening on {host}:{port}")
+        return self
+
+    def stop(self) -> None:
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers.clear()
+
+    def configure(self, rules: list[dict] | None = None, **defaults) -> None:
+        """Change timing/failure defaults and/or replace the scripted rules while running."""
+        with self._lock:
+            self.defaults.update({k: v for k, v in defaults.items() if k in DEFAULTS})
+            if rules is not None:
+                self.rules = list(rules) + BUILTIN_RULES
+
+    def reset(self) -> None:
+        with self._lock:
+            self._rng.seed(self._seed)
+            self._stats = {"requests": 0, "in_flight": 0, "max_in_flight": 0, "queued": 0,
+                           "completed": 0, "failed": 0, "client_gone": 0, "by_path": {}}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "by_path": dict(self._stats["by_path"]), "loaded": sorted(self.loaded)}
+
+    # ── Planning a reply ──
+
+    def _rule_for(self, prompt: str) -> dict:
+        with self._lock:
+            rules = list(self.rules)
+            defaults = dict(self.defaults)
+        for rule in rules:
+            if re.search(rule.get("match", "."), prompt, re.IGNORECASE | re.DOTALL):
+                return {**defaults, **rule}
+        return defaults
+
+    def _random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def _jitter(self, rule: dict) -> float:
+        j = rule["jitter_ms"]
+        return (self._random() * 2 - 1) * j / 1000 if j else 0.0
+
+    def plan(self, prompt: str, think: bool, max_tokens: int | None) -> dict:
+        """Pick the rule, the tokens to send and whether/how this request fails."""
+        rule = self._rule_for(prompt)
+        thinking = _tokens(rule.get("thinking") or _DEFAULT_THINKING) if think else []
+        answer = _tokens(rule.get("response", ""))
+        if max_tokens:
+            thinking = thinking[:max_tokens]
+            answer = answer[:max(0, max_tokens - len(thinking))]
+        prompt_tokens = max(1, len(prompt) // 4)
+        ttft = rule["ttft_ms"] / 1000 + rule["prefill_ms_per_1k"] * prompt_tokens / 1e6
+        fail = rule.get("fail") if rule["fail_rate"] and self._random() < rule["fail_rate"] else None
+        return {"rule": rule, "thinking": thinking, "answer": answer, "prompt_tokens": prompt_tokens,
+                "ttft": max(0.0, ttft + self._jitter(rule)), "fail": fail}
+
+    def gaps(self, plan: dict):
+        """Sleep before each token: TTFT first, then 1/tokens_per_s ± jitter."""
+        rule = plan["rule"]
+        yield plan["ttft"]
+        while True:
+            yield max(0.0, 1 / rule["tokens_per_s"] + self._jitter(rule))
+
+    def _count(self, key: str, path: str | None = None, delta: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += delta
+            if key == "in_flight":
+                self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._stats["in_flight"])
+            if path:
+                self._stats["by_path"][path] = self._stats["by_path"].get(path, 0) + 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockLLM/1.0"
+    # TCP_NODELAY: with Nagle on, a kept-alive connection holds each small chunk for the
+    # client's delayed ACK (~40 ms) and the tokens arrive in one burst
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass  # client dropped a kept-alive connection (e.g. after a preempted stream)
+
+    @property
+    def mock(self) -> MockLLMServer:
+        return self.server.mock
+
+    # ── Plumbing ──
+
+    def _json(self, data, status: int = 200) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+    def _chunk(self, data: bytes) -> None:
+        try:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError) as e:
+            raise _ClientGone() from e
+
+    def _end_stream(self) -> None:
+        self._chunk(b"")  # zero-length chunk terminates the body
+
+    def _read_body(self) -> dict:
+        n = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(n) or b"{}")
+        except json.JSONDecodeError:
+            return {}
+
+    def _drop(self) -> None:
+        self.close_connection = True
+        try:
+            self.connection.shutdown(2)
+        except OSError:
+            pass
+
+    # ── Routing ──
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        mock = self.mock
+        if path == "/":
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif path == "/api/tags":
+            self._json({"models": [{"name": m, "model": m, "size": 0} for m in sorted(mock.loaded) or ["mock"]]})
+        elif path == "/api/ps":
+            self._json({"models": [{"name": m, "model": m, "size_vram": 0} for m in sorted(mock.loaded)]})
+        elif path == "/v1/models":
+            self._json({"object": "list", "data": [{"id": m, "object": "model"} for m in sorted(mock.loaded) or ["mock"]]})
+        elif path.startswith("/api/v0/models/"):
+            model = path[len("/api/v0/models/"):]
+            self._json({"id": model, "object": "model", "state": "loaded" if model in mock.loaded else "not-loaded"})
+        elif path == "/mock/stats":
+            self._json(mock.stats())
+        else:
+            self._json({"error": f"not found: {path}"}, 404)
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        body = self._read_body()
+        mock = self.mock
+        if path == "/mock/config":
+            mock.configure(**body)
+            return self._json({"defaults": mock.defaults, "rules": len(mock.rules) - len(BUILTIN_RULES)})
+        if path == "/mock/reset":
+            mock.reset()
+            return self._json({"ok": True})
+        if path == "/api/pull":
+            mock.loaded.add(body.get("model") or body.get("name") or "mock")
+            return self._json({"status": "success"})
+        if path not in ("/api/chat", "/api/generate", "/v1/chat/completions"):
+            return self._json({"error": f"not found: {path}"}, 404)
+
+        mock._count("requests", path)
+        if mock._slots is not None and not mock._slots.acquire(blocking=False):
+            mock._count("queued")
+            mock._slots.acquire()
+            mock._count("queued", delta=-1)
+        mock._count("in_flight")
+        try:
+            if path == "/v1/chat/completions":
+                self._lmstudio_chat(body)
+            else:
+                self._ollama(body, generate=path == "/api/generate")
+            mock._count("completed")
+        except _ClientGone:
+            mock._count("client_gone")
+            self.close_connection = True
+        finally:
+            mock._count("in_flight", delta=-1)
+            if mock._slots is not None:
+                mock._slots.release()
+
+    def _fail_early(self, plan: dict) -> bool:
+        """Handle failures that happen before any token. Returns True if the request is done."""
+        if plan["fail"] == "error":
+            self.mock._count("failed")
+            self._json({"error": "mock: injected server error"}, 500)
+            return True
+        if plan["fail"] == "hang":
+            self.mock._count("failed")
+            time.sleep(plan["rule"]["hang_s"])
+            self._drop()
+            return True
+        return False
+
+    def _emit_tokens(self, plan: dict, send, malformed: bytes) -> None:
+        """Pace thinking then answer tokens through send(kind, token); apply mid-stream failures."""
+        tokens = [("thinking", t) for t in plan["thinking"]] + [("answer", t) for t in plan["answer"]]
+        fail_at = len(tokens) // 2 if plan["fail"] in ("disconnect", "malformed") else None
+        for i, ((kind, token), gap) in enumerate(zip(tokens, self.mock.gaps(plan))):
+            time.sleep(gap)
+            if i == fail_at:
+                self.mock._count("failed")
+                if plan["fail"] == "disconnect":
+                    self._drop()
+                    raise _ClientGone()
+                self._chunk(malformed)
+            send(kind, token)
+
+    def _generation_time(self, plan: dict) -> float:
+        n = len(plan["thinking"]) + len(plan["answer"])
+        return sum(gap for gap, _ in zip(self.mock.gaps(plan), range(n)))
+
+    # ── Ollama ──
+
+    def _ollama(self, body: dict, generate: bool) -> None:
+        mock = self.mock
+        model = body.get("model") or "mock"
+        mock.loaded.add(model)
+        if generate:
+            prompt = (body.get("system") or "") + "\n" + (body.get("prompt") or "")
+        else:
+            prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        if generate and not prompt.strip():
+            return self._json({"model": model, "response": "", "done": True, "done_reason": "load"})
+
+        options = body.get("options") or {}
+        plan = mock.plan(prompt, bool(body.get("think")), options.get("num_predict"))
+        if self._fail_early(plan):
+            return
+        t0 = time.monotonic()
+        created = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+        def _final(extra: dict) -> dict:
+            total = int((time.monotonic() - t0) * 1e9)
+            return {"model": model, "created_at": created, **extra, "done": True, "done_reason": "stop",
+                    "total_duration": total, "load_duration": 0,
+                    "prompt_eval_count": plan["prompt_tokens"], "prompt_eval_duration": int(plan["ttft"] * 1e9),
+                    "eval_count": len(plan["thinking"]) + len(plan["answer"]),
+                    "eval_duration": max(0, total - int(plan["ttft"] * 1e9))}
+
+        def _message(kind: str, token: str) -> dict:
+            if generate:
+                return {"response": token if kind == "answer" else "", **({"thinking": token} if kind == "thinking" else {})}
+            return {"message": {"role": "assistant", "content": token if kind == "answer" else "",
+                                **({"thinking": token} if kind == "thinking" else {})}}
+
+        if body.get("stream", True):
+            self._start_stream("application/x-ndjson")
+            self._emit_tokens(plan, lambda kind, token: self._chunk(
+                json.dumps({"model": model, "created_at": created, **_message(kind, token), "done": False}).encode() + b"\n"),
+                b'{"message": {"content": \n')
+            empty = {"response": ""} if generate else {"message": {"role": "assistant", "content": ""}}
+            self._chunk(json.dumps(_final(empty)).encode() + b"\n")
+            self._end_stream()
+        else:
+            time.sleep(self._generation_time(plan))
+            answer, thinking = "".join(plan["answer"]).strip(), "".join(plan["thinking"]).strip()
+            if generate:
+                extra = {"response": answer, **({"thinking": thinking} if thinking else {})}
+            else:
+                extra = {"message": {"role": "assistant", "content": answer, **({"thinking": thinking} if thinking else {})}}
+            self._json(_final(extra))
+
+    # ── LM Studio ──
+
+    def _lmstudio_chat(self, body: dict) -> None:
+        mock = self.mock
+        model = body.get("model") or "mock"
+        mock.loaded.add(model)
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        think = (body.get("reasoning_effort") != "none" and "/nothink" not in prompt
+                 and body.get("enable_thinking", True) is not False)
+        plan = mock.plan(prompt, think, body.get("max_tokens"))
+        if self._fail_early(plan):
+            return
+        style = plan["rule"]["think_style"]
+        created = int(time.time())
+        usage = {"prompt_tokens": plan["prompt_tokens"],
+                 "completion_tokens": len(plan["thinking"]) + len(plan["answer"])}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if body.get("stream"):
+            self._start_stream("text/event-stream")
+            state = {"in_think": False}
+
+            def _sse(payload: dict) -> None:
+                self._chunk(b"data: " + json.dumps(payload).encode() + b"\n\n")
+
+            def _delta(delta: dict, finish=None) -> None:
+                _sse({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                      "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]})
+
+            def _send(kind: str, token: str) -> None:
+                if kind == "thinking" and style == "field":
+                    return _delta({"reasoning_content": token})
+                if kind == "thinking" and not state["in_think"]:
+                    state["in_think"] = True
+                    token = "<think>" + token
+                elif kind == "answer" and state["in_think"]:
+                    state["in_think"] = False
+                    token = "</think>\n\n" + token.lstrip()
+                _delta({"content": token})
+
+            self._emit_tokens(plan, _send, b'data: {"choices": [{"delta": \n\n')
+            if state["in_think"]:
+                _delta({"content": "</think>"})
+            _delta({}, finish="stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                _sse({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created,
+                      "model": model, "choices": [], "usage": usage})
+            self._chunk(b"data: [DONE]\n\n")
+            self._end_stream()
+        else:
+            time.sleep(self._generation_time(plan))
+            answer, thinking = "".join(plan["answer"]).strip(), "".join(plan["thinking"]).strip()
+            message = {"role": "assistant", "content": answer}
+            if thinking and style == "field":
+                message["reasoning_content"] = thinking
+            elif thinking:
+                message["content"] = f"<think>{thinking}</think>\n\n{answer}"
+            self._json({"id": "chatcmpl-mock", "object": "chat.completion", "created": created, "model": model,
+                        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}], "usage": usage})
+
+
+def check_streaming(ttft_ms: float = 20.0, tokens_per_s: float = 100.0, requests: int = 3,
+                    tolerance: float = 0.5) -> bool:
+    """Stream `requests` replies over llm_router's pooled session (so every request after the
+    first reuses the connection) and compare TTFT and the median gap between chunks with the
+    configured timing. Catches buffering that only shows on kept-alive connections."""
+    import socket
+    import statistics
+    from agents.llm import http_session
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    mock = MockLLMServer(ttft_ms=ttft_ms, tokens_per_s=tokens_per_s).start(port, 0)
+    expected_gap, expected_ttft = 1 / tokens_per_s, ttft_ms / 1000
+    ok = True
+    try:
+        for n in range(1, requests + 1):
+            t0 = time.monotonic()
+            resp = http_session.post(f"http://127.0.0.1:{port}/api/chat", timeout=30, stream=True,
+                                     json={"model": "mock", "messages": [{"role": "user", "content": "timing check"}]})
+            stamps = [time.monotonic() for line in resp.iter_lines() if line]
+            http_session.close(resp, finished=True)
+            ttft = stamps[0] - t0
+            gap = statistics.median(b - a for a, b in zip(stamps, stamps[1:]))
+            good = (abs(gap - expected_gap) <= expected_gap * tolerance
+                    and abs(ttft - expected_ttft) <= max(expected_ttft * tolerance, 0.01))
+            ok = ok and good
+            print(f"[MockLLM] check {n}/{requests}: TTFT {ttft * 1000:.1f}ms (want {ttft_ms:.0f}), "
+                  f"median chunk gap {gap * 1000:.1f}ms (want {expected_gap * 1000:.1f}) — {'ok' if good else 'FAIL'}")
+    finally:
+        mock.stop()
+    return ok
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m agents.llm.mock_server", description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ollama-port", type=int, default=11434, help="0 disables the Ollama endpoints")
+    parser.add_argument("--lmstudio-port", type=int, default=1234, help="0 disables the LM Studio endpoints")
+    parser.add_argument("--script", type=Path, help="JSON list of response rules, tried before the built-in ones")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--parallel", type=int, default=0, help="requests served at once (0 = unlimited)")
+    parser.add_argument("--ttft-ms", type=float, default=DEFAULTS["ttft_ms"])
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=DEFAULTS["prefill_ms_per_1k"])
+    parser.add_argument("--tokens-per-s", type=float, default=DEFAULTS["tokens_per_s"])
+    parser.add_argument("--jitter-ms", type=float, default=DEFAULTS["jitter_ms"])
+    parser.add_argument("--fail-rate", type=float, default=DEFAULTS["fail_rate"])
+    parser.add_argument("--fail", choices=("error", "hang", "disconnect", "malformed"), default=DEFAULTS["fail"])
+    parser.add_argument("--think-style", choices=("tags", "field"), default=DEFAULTS["think_style"])
+    parser.add_argument("--check", action="store_true",
+                        help="verify streamed TTFT and chunk gaps on a reused connection, then exit")
+    args = parser.parse_args(argv)
+    if args.check:
+        sys.exit(0 if check_streaming() else 1)
+
+    rules = json.loads(args.script.read_text(encoding="utf-8")) if args.script else None
+    mock = MockLLMServer(
+        rules, seed=args.seed, parallel=args.parallel, ttft_ms=args.ttft_ms,
+        prefill_ms_per_1k=args.prefill_ms_per_1k, tokens_per_s=args.tokens_per_s, jitter_ms=args.jitter_ms,
+        fail_rate=args.fail_rate, fail=args.fail, think_style=args.think_style,
+    ).start(args.ollama_port, args.lmstudio_port, args.host)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
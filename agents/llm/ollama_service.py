@@ -5,14 +5,22 @@ import atexit
 import time
 import shutil
 import os
+
 import requests
 
+import config
+from agents.llm import http_session
+from agents.llm.think_stream import ThinkStream
+
 OLLAMA_BASE_URL = "http://localhost:11434"
 # OLLAMA_MODEL = "qwen3.5:9b"
 OLLAMA_MODEL = "huihui_ai/qwen3.5-abliterated:9b"
+# Small model for classification/extraction (Config.LLM_TASK_MODELS); None = use OLLAMA_MODEL.
+# Both stay loaded only if OLLAMA_MAX_LOADED_MODELS >= 2 on the server, and llm_router runs a
+# small-tier call next to a large-tier one, which needs OLLAMA_NUM_PARALLEL >= 2 as well.
+OLLAMA_SMALL_MODEL = None  # e.g. "qwen3:1.7b"
 
 _process = None
-_call_lock = threading.Lock()  # serialises concurrent Ollama requests
 
 # Passing tool definitions shifts Qwen3 into a more focused reasoning mode.
 # Multiple plausible tools increase the likelihood the model commits to tool-selection
@@ -124,7 +132,7 @@ def _wait_for_ready(timeout: int = 15) -> bool:
     deadline = time.time() + timeout
     while time.time() < deadline:
         try:
-            requests.get(f"{OLLAMA_BASE_URL}/", timeout=1)
+            http_session.get(f"{OLLAMA_BASE_URL}/", timeout=1)
             return True
         except Exception:
             time.sleep(0.3)
@@ -134,14 +142,14 @@ def _wait_for_ready(timeout: int = 15) -> bool:
 def _ensure_model():
     """Pull the configured model if it is not already downloaded."""
     try:
-        resp = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
+        resp = http_session.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
         installed = [m["name"].split(":")[0] for m in resp.json().get("models", [])]
         model_base = OLLAMA_MODEL.split(":")[0]
         if model_base in installed:
             print(f"Ollama: model '{OLLAMA_MODEL}' already available.")
             return
         print(f"Ollama: pulling model '{OLLAMA_MODEL}' (this may take a few minutes)...")
-        requests.post(
+        http_session.post(
             f"{OLLAMA_BASE_URL}/api/pull",
             json={"name": OLLAMA_MODEL, "stream": False},
             timeout=600,
@@ -151,19 +159,54 @@ def _ensure_model():
         print(f"Ollama: model check/pull failed: {e}")
 
 
+def is_resident(base_url: str | None = None, model: str | None = None) -> bool:
+    """True if the model (default OLLAMA_MODEL) is currently loaded (listed by /api/ps)."""
+    base_url, model = base_url or OLLAMA_BASE_URL, model or OLLAMA_MODEL
+    try:
+        resp = http_session.get(f"{base_url}/api/ps", timeout=3)
+        resp.raise_for_status()
+        return any(m.get("name") == model or m.get("model") == model
+                   for m in resp.json().get("models", []))
+    except Exception as e:
+        print(f"[Ollama] residency check failed: {e}")
+        return False
+
+
+def preload(base_url: str | None = None, model: str | None = None) -> bool:
+    """Load the model (default OLLAMA_MODEL) into memory without generating (empty /api/generate request)."""
+    base_url, model = base_url or OLLAMA_BASE_URL, model or OLLAMA_MODEL
+    try:
+        t0 = time.time()
+        resp = http_session.post(
+            f"{base_url}/api/generate",
+            json={"model": model, "keep_alive": config.Config.LLM_KEEP_ALIVE},
+            timeout=120,
+        )
+        resp.raise_for_status()
+        print(f"[Ollama] model '{model}' loaded in {time.time()-t0:.1f}s")
+        return True
+    except Exception as e:
+        print(f"[Ollama] preload failed: {e}")
+        return False
+
+
 def _call(prompt: str, timeout: int = 10, *, system: str | None = None,
-          skip_if_busy: bool = False, think: bool = False,
-          use_tools: bool = False) -> str | None:
+          think: bool = False, use_tools: bool = False,
+          cancel: threading.Event | None = None, on_token=None, trace: dict | None = None,
+          base_url: str | None = None, model: str | None = None, schema: dict | None = None) -> str | None:
     """POST to Ollama /api/chat and return the response text, or None on failure.
 
-    Called by llm_router.call_llm() — do not call directly.
+    Called by llm_router.call_llm() inside a scheduler slot — do not call directly.
     use_tools: pass a dummy tool definition to shift Qwen3 into a faster, more focused
     reasoning mode. If the model calls the tool, the text argument is used as the answer.
+    cancel: set by the scheduler to preempt this call; the stream is dropped and None returned.
+    on_token: called with each answer chunk as it arrives (thinking is never passed).
+    trace: telemetry dict filled in-place (first_chunk_at, thinking_chars, output_tokens, outcome).
+    base_url, model: endpoint chosen by the llm_router pool (default OLLAMA_BASE_URL / OLLAMA_MODEL).
+    schema: JSON schema the answer is constrained to (Ollama `format`).
     """
-    acquired = _call_lock.acquire(blocking=not skip_if_busy)
-    if not acquired:
-        print(f"[Ollama] _call: skipped (busy) think={think} prompt={prompt[:60]!r}")
-        return None
+    trace = trace if trace is not None else {}
+    base_url, model = base_url or OLLAMA_BASE_URL, model or OLLAMA_MODEL
     try:
         print(f"[Ollama] call → think={think} tools={use_tools} timeout={timeout}s prompt={prompt[:80]!r}")
         t0 = time.time()
@@ -177,12 +220,15 @@ def _call(prompt: str, timeout: int = 10, *, system: str | None = None,
             if think else
             {"temperature": 0.7, "top_p": 0.8,  "top_k": 20}
         )
-        body = {"model": OLLAMA_MODEL, "messages": messages, "stream": True, "think": think, "options": options}
+        body = {"model": model, "messages": messages, "stream": True, "think": think, "options": options,
+                "keep_alive": config.Config.LLM_KEEP_ALIVE}
         if use_tools:
             body["tools"] = _DUMMY_TOOLS
+        if schema is not None:
+            body["format"] = schema
 
-        resp = requests.post(
-            f"{OLLAMA_BASE_URL}/api/chat",
+        resp = http_session.post(
+            f"{base_url}/api/chat",
             json=body,
             timeout=timeout,
             stream=True,
@@ -190,13 +236,19 @@ def _call(prompt: str, timeout: int = 10, *, system: str | None = None,
         resp.raise_for_status()
 
         deadline = time.time() + timeout
-        content = []
-        thinking_chars = 0
+        stream = ThinkStream(on_answer=on_token)
         first_chunk_at = None
+        finished = False
         for line in resp.iter_lines():
             now = time.time()
+            if cancel is not None and cancel.is_set():
+                print(f"[Ollama] preempted at {now-t0:.1f}s — dropping stream")
+                trace['outcome'] = 'preempted'
+                resp.close()
+                return None
             if now > deadline:
-                print(f"[Ollama] deadline hit — thinking: {thinking_chars} chars, answer: {len(''.join(content))} chars")
+                print(f"[Ollama] deadline hit — thinking: {stream.thinking_chars} chars, answer: {stream.answer_chars} chars")
+                trace['outcome'] = 'timeout'
                 break
             if not line:
                 continue
@@ -205,43 +257,49 @@ def _call(prompt: str, timeout: int = 10, *, system: str | None = None,
                 msg = chunk.get("message", {})
                 if first_chunk_at is None:
                     first_chunk_at = now
+                    trace['first_chunk_at'] = time.monotonic()
                     print(f"[Ollama] first chunk at {now-t0:.1f}s")
-                thinking_chars += len(msg.get("thinking") or "")
-                if c := msg.get("content", ""):
-                    content.append(c)
+                stream.feed_thinking(msg.get("thinking") or "")
+                stream.feed(msg.get("content") or "")
+                trace['thinking_chars'] = stream.thinking_chars
                 # If the model called the dummy tool, extract the text argument as the answer.
-                if not content:
+                if not stream.answer_chars:
                     for tc in msg.get("tool_calls") or []:
                         if text := tc.get("function", {}).get("arguments", {}).get("text", ""):
-                            content.append(text)
+                            stream.feed(text)
                 if chunk.get("done"):
-                    if think and thinking_chars:
-                        print(f"[Ollama] thinking: {thinking_chars} chars")
+                    if think and stream.thinking_chars:
+                        print(f"[Ollama] thinking: {stream.thinking_chars} chars")
+                    trace['output_tokens'] = chunk.get("eval_count")
+                    finished = True
                     break
             except json.JSONDecodeError:
                 pass
 
-        answer = ''.join(content).strip() or None
+        http_session.close(resp, finished=finished)
+        answer = stream.close().answer() or None
         print(f"[Ollama] call ← {time.time()-t0:.1f}s | answer={(answer[:80] if answer else None)!r}")
         return answer
     except Exception as e:
         print(f"[Ollama] call failed: {e}")
+        trace['outcome'] = 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'error'
         return None
-    finally:
-        _call_lock.release()
 
 
 def _collect_thinking(prompt: str, think_budget_chars: int = 4000, timeout: int = 60, *,
-                      system: str | None = None, skip_if_busy: bool = False) -> str | None:
+                      system: str | None = None, cancel: threading.Event | None = None,
+                      on_progress=None, trace: dict | None = None,
+                      base_url: str | None = None, model: str | None = None) -> str | None:
     """Phase-1 of a two-phase call: stream think=True, collect thinking up to budget, then stop.
 
-    Called by llm_router.collect_thinking() — do not call directly.
-    Returns the raw thinking text (not the answer).
+    Called by llm_router.collect_thinking() inside a scheduler slot — do not call directly.
+    Returns the raw thinking text (not the answer), or None if preempted via cancel.
+    on_progress: called with the running thinking char count after each thinking chunk.
+    trace: telemetry dict filled in-place (first_chunk_at, thinking_chars, outcome).
+    base_url, model: endpoint chosen by the llm_router pool (default OLLAMA_BASE_URL / OLLAMA_MODEL).
     """
-    acquired = _call_lock.acquire(blocking=not skip_if_busy)
-    if not acquired:
-        print(f"[Ollama] _collect_thinking: skipped (busy)")
-        return None
+    trace = trace if trace is not None else {}
+    base_url, model = base_url or OLLAMA_BASE_URL, model or OLLAMA_MODEL
     try:
         print(f"[Ollama] collect_thinking → budget={think_budget_chars} timeout={timeout}s prompt={prompt[:80]!r}")
         t0 = time.time()
@@ -250,24 +308,31 @@ def _collect_thinking(prompt: str, think_budget_chars: int = 4000, timeout: int
             messages.append({"role": "system", "content": system})
         messages.append({"role": "user", "content": prompt})
 
-        resp = requests.post(
-            f"{OLLAMA_BASE_URL}/api/chat",
-            json={"model": OLLAMA_MODEL, "messages": messages, "stream": True, "think": True,
-                  "options": {"temperature": 0.6, "top_p": 0.95, "top_k": 20, "presence_penalty": 1.5}},
+        resp = http_session.post(
+            f"{base_url}/api/chat",
+            json={"model": model, "messages": messages, "stream": True, "think": True,
+                  "options": {"temperature": 0.6, "top_p": 0.95, "top_k": 20, "presence_penalty": 1.5},
+                  "keep_alive": config.Config.LLM_KEEP_ALIVE},
             timeout=timeout,
             stream=True,
         )
         resp.raise_for_status()
 
         deadline = time.time() + timeout
-        thinking = []
-        thinking_chars = 0
+        stream = ThinkStream(think_budget=think_budget_chars, stop_at_answer=True)
         first_chunk_at = None
         last_progress_log = t0
+        finished = False
         for line in resp.iter_lines():
             now = time.time()
+            if cancel is not None and cancel.is_set():
+                print(f"[Ollama] think phase preempted at {now-t0:.1f}s ({stream.thinking_chars} chars discarded)")
+                trace['outcome'] = 'preempted'
+                resp.close()
+                return None
             if now > deadline:
-                print(f"[Ollama] think budget deadline hit at {thinking_chars} chars")
+                print(f"[Ollama] think budget deadline hit at {stream.thinking_chars} chars")
+                trace['outcome'] = 'timeout'
                 break
             if not line:
                 continue
@@ -276,33 +341,37 @@ def _collect_thinking(prompt: str, think_budget_chars: int = 4000, timeout: int
                 msg = chunk.get("message", {})
                 if first_chunk_at is None and (msg.get("thinking") or msg.get("content")):
                     first_chunk_at = now
+                    trace['first_chunk_at'] = time.monotonic()
                     print(f"[Ollama] first chunk at {now-t0:.1f}s")
-                if t := msg.get("thinking", ""):
-                    thinking.append(t)
-                    thinking_chars += len(t)
+                before = stream.thinking_chars
+                stream.feed_thinking(msg.get("thinking") or "")
+                stream.feed(msg.get("content") or "")  # models without a thinking field send <think> tags here
+                if stream.thinking_chars != before:
+                    trace['thinking_chars'] = stream.thinking_chars
+                    if on_progress is not None:
+                        on_progress(stream.thinking_chars)
                     if now - last_progress_log >= 10:
-                        print(f"[Ollama] thinking... {thinking_chars}/{think_budget_chars} chars at {now-t0:.1f}s")
+                        print(f"[Ollama] thinking... {stream.thinking_chars}/{think_budget_chars} chars at {now-t0:.1f}s")
                         last_progress_log = now
-                    if thinking_chars >= think_budget_chars:
-                        print(f"[Ollama] think budget reached: {thinking_chars} chars at {now-t0:.1f}s")
-                        break
-                if msg.get("content", ""):
-                    print(f"[Ollama] answer started at {now-t0:.1f}s — stopping think phase ({thinking_chars} chars collected)")
+                if stream.stop_reason == 'budget':
+                    print(f"[Ollama] think budget reached: {stream.thinking_chars} chars at {now-t0:.1f}s")
+                    break
+                if stream.stop_reason == 'answer' or stream.answer_chars:
+                    print(f"[Ollama] answer started at {now-t0:.1f}s — stopping think phase ({stream.thinking_chars} chars collected)")
                     break
                 if chunk.get("done"):
+                    finished = True
                     break
             except json.JSONDecodeError:
                 pass
 
-        resp.close()
-        result = ''.join(thinking).strip()
-        print(f"[Ollama] collect_thinking ← {time.time()-t0:.1f}s | {thinking_chars} chars")
-        return result or None
+        http_session.close(resp, finished=finished)
+        print(f"[Ollama] collect_thinking ← {time.time()-t0:.1f}s | {stream.thinking_chars} chars")
+        return stream.thinking()
     except Exception as e:
         print(f"[Ollama] collect_thinking failed: {e}")
+        trace['outcome'] = 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'error'
         return None
-    finally:
-        _call_lock.release()
 
 
 def _stop():
@@ -0,0 +1,130 @@
+"""LLM response cache — size-bounded LRU in memory, optionally backed by SQLite.
+
+Keys come from make_key(): a fingerprint of (backend, model, system prompt hash,
+user prompt hash, context fingerprint). Callers pass only the stable part of the
+user prompt plus a context fingerprint they choose (e.g. the persona state key),
+so volatile text such as the current minute never reaches the key — and switching
+model or editing a prompt naturally misses instead of serving outdated text.
+
+- Per-entry TTL; expired entries can still be read with allow_stale=True so a
+  failed or skipped LLM call can serve the last good response instead of a fallback.
+- persistent=True writes entries through to models.LLMResponse, so quotes survive
+  a restart and are served immediately instead of regenerated.
+- stats() exposes hit/miss counters.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+_DISK_KEEP_SECONDS = 7 * 24 * 3600  # expired rows older than this are pruned
+_PRUNE_EVERY = 50                   # puts between disk prunes
+
+
+def _digest(text: str | None) -> str:
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()[:16]
+
+
+def make_key(system: str | None, user: str, context: str = '') -> str:
+    """Fingerprint a call on the active backend/model. `context` is the caller's context fingerprint."""
+    from agents.llm.llm_router import active_model
+    backend, model = active_model()
+    return '|'.join((backend, model, _digest(system), _digest(user), context))
+
+
+class ResponseCache:
+    def __init__(self, name: str, max_entries: int = 256, persistent: bool = False):
+        self.name = name
+        self._max_entries = max_entries
+        self._persistent = persistent
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()  # key -> (text, expires_at)
+        self._lock = threading.Lock()
+        self._puts_since_prune = 0
+        self._counters = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'disk_loads': 0, 'evictions': 0}
+
+    def get(self, key: str, allow_stale: bool = False) -> str | None:
+        """Return the cached text for key, or None on a miss (or expiry unless allow_stale)."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None and self._persistent:
+            entry = self._load(key)
+            if entry is not None:
+                with self._lock:
+                    self._counters['disk_loads'] += 1
+                    self._insert(key, entry)
+        with self._lock:
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry[1] > time.time():
+                self._counters['hits'] += 1
+                return entry[0]
+            if allow_stale:
+                self._counters['stale_hits'] += 1
+                return entry[0]
+            self._counters['misses'] += 1
+            return None
+
+    def put(self, key: str, text: str, ttl: float, persist: bool = True) -> None:
+        """Store text for ttl seconds. persist=False keeps it in memory only (e.g. retry backoff markers)."""
+        entry = (text, time.time() + ttl)
+        with self._lock:
+            self._insert(key, entry)
+        if self._persistent and persist:
+            self._store(key, entry)
+
+    def expires_at(self, key: str) -> float | None:
+        """Expiry of the in-memory entry for key (None if absent); does not count as a lookup."""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[1] if entry else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters['hits'] + self._counters['stale_hits'] + self._counters['misses']
+            return {
+                **self._counters,
+                'entries': len(self._entries),
+                'max_entries': self._max_entries,
+                'hit_rate': round(self._counters['hits'] / lookups, 3) if lookups else None,
+            }
+
+    def _insert(self, key: str, entry: tuple[str, float]) -> None:
+        """Insert and evict least-recently-used entries. Caller holds _lock."""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    # ------------------------------------------------------------------ #
+    #  Disk tier                                                           #
+    # ------------------------------------------------------------------ #
+
+    def _load(self, key: str) -> tuple[str, float] | None:
+        try:
+            from models import LLMResponse
+            row = LLMResponse.get_or_none((LLMResponse.cache == self.name) & (LLMResponse.key == key))
+            return (row.text, row.expires_at) if row else None
+        except Exception as e:
+            print(f"[ResponseCache] {self.name}: disk read failed: {e}")
+            return None
+
+    def _store(self, key: str, entry: tuple[str, float]) -> None:
+        try:
+            from models import LLMResponse
+            (LLMResponse
+             .insert(cache=self.name, key=key, text=entry[0], expires_at=entry[1])
+             .on_conflict(conflict_target=[LLMResponse.cache, LLMResponse.key],
+                          update={LLMResponse.text: entry[0], LLMResponse.expires_at: entry[1]})
+             .execute())
+            self._puts_since_prune += 1
+            if self._puts_since_prune >= _PRUNE_EVERY:
+                self._puts_since_prune = 0
+                LLMResponse.delete().where(
+                    (LLMResponse.cache == self.name)
+                    & (LLMResponse.expires_at < time.time() - _DISK_KEEP_SECONDS)
+                ).execute()
+        except Exception as e:
+            print(f"[ResponseCache] {self.name}: disk write failed: {e}")
@@ -0,0 +1,202 @@
+"""Priority scheduler for LLM calls — owned by llm_router, shared by every backend.
+
+Each backend endpoint can only serve one stream per loaded model at a time, so calls are
+granted a slot from their pool in priority order. llm_router keeps a 'large' pool (one slot per
+endpoint) and a 'small' pool (one per endpoint with its own small model), so small-tier
+classification and extraction never hold the slot a persona call on the large model needs:
+
+- Pools: slots={'large': n, 'small': m}; run(pool=...) picks one. Queueing, skip_if_busy
+  and preemption only look at calls in the same pool. An int means a single 'large' pool.
+
+- Priority classes: lower number wins; FIFO within a class (monotonic sequence).
+- Admission limits: max waiting calls per class. Over the limit the call is
+  rejected and returns None, exactly like a failed backend call.
+- skip_if_busy: rejected immediately when every slot of the pool is taken or anyone is queued for it.
+- Cooperative preemption: an arriving PRIORITY_INTERACTIVE call that finds every slot of its pool
+  taken sets the cancel event of the lowest-priority in-flight preemptible call;
+  backends check it once per streamed chunk.
+- Stats: per-class queue wait and run time, returned by stats().
+"""
+import heapq
+import itertools
+import threading
+import time
+
+PRIORITY_INTERACTIVE = 0  # /persona/chat + Telegram replies, reply mood classification
+PRIORITY_NOTIFY      = 1  # arrival briefing, reactive notifications, morning briefing
+PRIORITY_QUOTE       = 2  # dashboard quotes
+PRIORITY_BACKGROUND  = 3  # suggestions, memory extraction, wishes, level-up moods
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_NOTIFY:      'notify',
+    PRIORITY_QUOTE:       'quote',
+    PRIORITY_BACKGROUND:  'background',
+}
+
+# Max calls waiting per class — beyond this new calls are rejected (caller falls back).
+ADMISSION_LIMITS = {
+    PRIORITY_INTERACTIVE: 8,
+    PRIORITY_NOTIFY:      8,
+    PRIORITY_QUOTE:       2,
+    PRIORITY_BACKGROUND:  4,
+}
+
+# Classes whose in-flight stream is cancelled when an interactive call arrives.
+PREEMPTIBLE = {PRIORITY_QUOTE, PRIORITY_BACKGROUND}
+
+
+class _Ticket:
+    __slots__ = ('priority', 'seq', 'pool', 'cancel', 'enqueued_at')
+
+    def __init__(self, priority: int, seq: int, pool: str = 'large'):
+        self.priority = priority
+        self.seq = seq
+        self.pool = pool
+        self.cancel = threading.Event()
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other: '_Ticket') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _new_class_stats() -> dict:
+    return {
+        'submitted': 0, 'granted': 0, 'completed': 0, 'skipped': 0, 'rejected': 0, 'preempted': 0,
+        'wait_total': 0.0, 'wait_max': 0.0, 'run_total': 0.0, 'run_max': 0.0,
+    }
+
+
+class LLMScheduler:
+    def __init__(self, admission_limits: dict | None = None, preemptible: set | None = None,
+                 slots: int | dict = 1):
+        self._cond = threading.Condition()
+        self._waiting: list[_Ticket] = []  # heap ordered by (priority, seq), all pools
+        self._running: list[_Ticket] = []
+        self._slots = {}
+        self._set(slots)
+        self._seq = itertools.count()
+        self._limits = dict(ADMISSION_LIMITS if admission_limits is None else admission_limits)
+        self._preemptible = set(PREEMPTIBLE if preemptible is None else preemptible)
+        self._stats = {p: _new_class_stats() for p in PRIORITY_NAMES}
+
+    def set_slots(self, slots: int | dict) -> None:
+        """Change how many calls may run at once per pool (the number of usable endpoints)."""
+        with self._cond:
+            self._set(slots)
+            self._cond.notify_all()
+
+    def _set(self, slots: int | dict) -> None:
+        if not isinstance(slots, dict):
+            slots = {'large': slots}
+        self._slots.update({pool: max(1, n) for pool, n in slots.items()})
+
+    def run(self, priority: int, fn, *, skip_if_busy: bool = False, pool: str = 'large'):
+        """Run fn(cancel_event) once a slot in `pool` is granted and return its result.
+
+        Returns None without calling fn when the call is skipped or rejected.
+        fn must stop streaming and return None soon after cancel_event is set.
+        An unknown pool falls back to 'large'.
+        """
+        ticket = self._admit(priority, skip_if_busy, pool)
+        if ticket is None:
+            return None
+        started = time.monotonic()
+        try:
+            return fn(ticket.cancel)
+        finally:
+            self._release(ticket, started)
+
+    def _busy(self, pool: str) -> bool:
+        """Every slot of pool is taken. Caller holds _cond."""
+        return sum(1 for t in self._running if t.pool == pool) >= self._slots[pool]
+
+    def _head(self, pool: str) -> _Ticket | None:
+        """Next waiting ticket of pool. Caller holds _cond."""
+        return min((t for t in self._waiting if t.pool == pool), default=None)
+
+    def _admit(self, priority: int, skip_if_busy: bool, pool: str) -> _Ticket | None:
+        name = PRIORITY_NAMES[priority]
+        with self._cond:
+            if pool not in self._slots:
+                pool = 'large'
+            st = self._stats[priority]
+            st['submitted'] += 1
+            if skip_if_busy and (self._busy(pool) or self._head(pool) is not None):
+                st['skipped'] += 1
+                print(f"[LLMScheduler] {name}: skipped (busy)")
+                return None
+            queued = sum(1 for t in self._waiting if t.priority == priority)
+            if queued >= self._limits.get(priority, 1):
+                st['rejected'] += 1
+                print(f"[LLMScheduler] {name}: rejected — {queued} already waiting")
+                return None
+
+            ticket = _Ticket(priority, next(self._seq), pool)
+            heapq.heappush(self._waiting, ticket)
+            self._maybe_preempt(ticket)
+            while self._busy(pool) or self._head(pool) is not ticket:
+                self._cond.wait()
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+            self._running.append(ticket)
+
+            wait = time.monotonic() - ticket.enqueued_at
+            st['granted'] += 1
+            st['wait_total'] += wait
+            st['wait_max'] = max(st['wait_max'], wait)
+            if wait >= 1:
+                print(f"[LLMScheduler] {name}: granted after {wait:.1f}s in queue")
+            return ticket
+
+    def _maybe_preempt(self, incoming: _Ticket) -> None:
+        """Cancel a running stream if an interactive call outranks it and its pool has no free slot.
+        Caller holds _cond."""
+        if incoming.priority != PRIORITY_INTERACTIVE or not self._busy(incoming.pool):
+            return
+        victims = [t for t in self._running if t.pool == incoming.pool
+                   and t.priority in self._preemptible and not t.cancel.is_set()]
+        if victims:
+            running = max(victims)  # lowest priority class, most recently queued
+            running.cancel.set()
+            self._stats[running.priority]['preempted'] += 1
+            print(f"[LLMScheduler] preempting in-flight {PRIORITY_NAMES[running.priority]} call "
+                  f"for interactive request ({incoming.pool} pool)")
+
+    def _release(self, ticket: _Ticket, started: float) -> None:
+        run = time.monotonic() - started
+        with self._cond:
+            st = self._stats[ticket.priority]
+            st['completed'] += 1
+            st['run_total'] += run
+            st['run_max'] = max(st['run_max'], run)
+            self._running.remove(ticket)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        """Per-class counters plus average/max queue wait and run time in ms."""
+        with self._cond:
+            classes = {}
+            for priority, st in self._stats.items():
+                done, granted = st['completed'], st['granted']
+                classes[PRIORITY_NAMES[priority]] = {
+                    'submitted': st['submitted'],
+                    'completed': done,
+                    'skipped':   st['skipped'],
+                    'rejected':  st['rejected'],
+                    'preempted': st['preempted'],
+                    'avg_wait_ms': round(st['wait_total'] / granted * 1000) if granted else 0,
+                    'max_wait_ms': round(st['wait_max'] * 1000),
+                    'avg_run_ms':  round(st['run_total'] / done * 1000) if done else 0,
+                    'max_run_ms':  round(st['run_max'] * 1000),
+                }
+            return {
+                'slots': dict(self._slots),
+                'running': [PRIORITY_NAMES[t.priority] for t in self._running],
+                'waiting': len(self._waiting),
+                'pools': {pool: {'slots': n,
+                                 'running': [PRIORITY_NAMES[t.priority] for t in self._running if t.pool == pool],
+                                 'waiting': sum(1 for t in self._waiting if t.pool == pool)}
+                          for pool, n in self._slots.items()},
+                'classes': classes,
+            }
@@ -0,0 +1,117 @@
+"""Structured (JSON) output support for llm_router.call_llm_json().
+
+- Backends constrain decoding to a JSON schema (Ollama `format`, LM Studio
+  `response_format: json_schema`); parse_json() still tolerates code fences and stray
+  prose for servers that ignore it.
+- schema_errors() checks the subset of JSON Schema the prompts here use: type, enum,
+  properties/required/additionalProperties, items/minItems/maxItems,
+  minLength/maxLength/pattern. No external jsonschema dependency.
+- record() keeps per-caller counters: calls, first-try and repaired successes, parse and
+  schema failures, repair attempts, final failures and the output tokens of discarded answers.
+  stats() is served at /persona/llm/structured.
+"""
+import json
+import re
+import threading
+
+_TYPES = {
+    'object': dict, 'array': list, 'string': str, 'boolean': bool,
+    'integer': int, 'number': (int, float), 'null': type(None),
+}
+
+_stats: dict[str, dict] = {}
+_lock = threading.Lock()
+
+
+def parse_json(raw: str):
+    """Parse a model answer as JSON; falls back to the outermost {...} or [...]. Raises ValueError."""
+    text = raw.strip()
+    if text.startswith('```'):
+        text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as exc:
+        error = exc
+    for open_, close in (('{', '}'), ('[', ']')):
+        start, end = text.find(open_), text.rfind(close)
+        if start != -1 and end > start:
+            try:
+                return json.loads(text[start:end + 1])
+            except json.JSONDecodeError:
+                pass
+    raise ValueError(f"not JSON: {error.msg} at pos {error.pos}")
+
+
+def schema_errors(value, schema: dict, path: str = '$') -> list[str]:
+    """Return human-readable violations of schema by value (empty when valid)."""
+    expected = schema.get('type')
+    if expected is not None:
+        kinds = expected if isinstance(expected, list) else [expected]
+        ok = any(isinstance(value, _TYPES[k]) and not (k in ('integer', 'number') and isinstance(value, bool))
+                 for k in kinds)
+        if not ok:
+            return [f"{path}: expected {'/'.join(kinds)}, got {type(value).__name__}"]
+    if 'enum' in schema and value not in schema['enum']:
+        return [f"{path}: must be one of {schema['enum']}"]
+    errors = []
+    if isinstance(value, dict):
+        props = schema.get('properties', {})
+        for key in schema.get('required', []):
+            if key not in value:
+                errors.append(f"{path}: missing field {key!r}")
+        if schema.get('additionalProperties') is False:
+            errors += [f"{path}: unexpected field {key!r}" for key in value if key not in props]
+        for key, sub in props.items():
+            if key in value:
+                errors += schema_errors(value[key], sub, f"{path}.{key}")
+    elif isinstance(value, list):
+        if 'minItems' in schema and len(value) < schema['minItems']:
+            errors.append(f"{path}: needs at least {schema['minItems']} items, got {len(value)}")
+        if 'maxItems' in schema and len(value) > schema['maxItems']:
+            errors.append(f"{path}: at most {schema['maxItems']} items, got {len(value)}")
+        if 'items' in schema:
+            for i, item in enumerate(value):
+                errors += schema_errors(item, schema['items'], f"{path}[{i}]")
+    elif isinstance(value, str):
+        if 'minLength' in schema and len(value) < schema['minLength']:
+            errors.append(f"{path}: shorter than {schema['minLength']} chars")
+        if 'maxLength' in schema and len(value) > schema['maxLength']:
+            errors.append(f"{path}: longer than {schema['maxLength']} chars")
+        if 'pattern' in schema and not re.search(schema['pattern'], value):
+            errors.append(f"{path}: does not match {schema['pattern']}")
+    return errors
+
+
+def repair_prompt(prompt: str, raw: str, errors: list[str]) -> str:
+    """Follow-up prompt that shows the model its invalid answer and what was wrong with it."""
+    return (
+        f"{prompt}\n\n"
+        f"Your previous answer was rejected:\n{raw.strip()[:2000]}\n\n"
+        f"Problems: {'; '.join(errors[:5])}\n"
+        "Return the corrected JSON only."
+    )
+
+
+def record(caller: str | None, event: str, usage: dict | None = None, raw: str | None = None) -> None:
+    """Count one structured-call event: 'calls', 'ok', 'repaired', 'parse_failure', 'schema_failure',
+    'repairs' or 'failed'. Failures add the discarded answer's output tokens (estimated at
+    4 chars per token when the backend did not report them)."""
+    with _lock:
+        s = _stats.setdefault(caller or 'untagged', {
+            'calls': 0, 'ok': 0, 'repaired': 0, 'parse_failure': 0, 'schema_failure': 0,
+            'repairs': 0, 'failed': 0, 'wasted_tokens': 0,
+        })
+        s[event] += 1
+        if event in ('parse_failure', 'schema_failure'):
+            usage = usage or {}
+            s['wasted_tokens'] += usage.get('output_tokens') or (len(raw or '') + usage.get('thinking_chars', 0)) // 4
+
+
+def stats() -> dict:
+    with _lock:
+        out = {}
+        for caller, s in sorted(_stats.items()):
+            answers = s['calls'] + s['repairs']
+            failures = s['parse_failure'] + s['schema_failure']
+            out[caller] = {**s, 'failure_rate': round(failures / answers, 3) if answers else None}
+        return out
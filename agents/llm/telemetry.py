@@ -0,0 +1,168 @@
+"""Per-call LLM telemetry — one structured record per call_llm()/collect_thinking().
+
+llm_router opens a record with begin(), hands the backend a trace dict to fill in
+while streaming, and closes it with finish(). Records live in a bounded ring buffer:
+
+- Fields: caller tag, kind (call/think), endpoint, backend, model, priority, queue wait, TTFT,
+  total latency, output/thinking chars, output tokens (when the backend reports
+  them), outcome (ok/empty/timeout/preempted/error/skipped/rejected).
+- Ring buffer of Config.LLM_TELEMETRY_SIZE records; when Config.LLM_TELEMETRY_FILE
+  is set, records pushed out of the ring are appended to it as JSON lines.
+- summary() aggregates p50/p95/p99 and outcome rates per caller, endpoint and model —
+  served at /llm/metrics.
+"""
+import json
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import config
+
+OUTCOMES = ('ok', 'empty', 'timeout', 'preempted', 'error', 'skipped', 'rejected')
+_SPILL_BATCH = 50  # evicted records written to disk per flush
+
+_records: deque = deque(maxlen=config.Config.LLM_TELEMETRY_SIZE)
+_spill: list[dict] = []
+_lock = threading.Lock()
+
+
+def begin(kind: str, caller: str | None, priority: int) -> dict:
+    """Open a record for a call about to be submitted to the scheduler."""
+    from agents.llm.llm_router import active_model
+    from agents.llm.scheduler import PRIORITY_NAMES
+    backend, model = active_model(caller)
+    return {
+        'ts': time.time(), 'kind': kind, 'caller': caller or 'untagged', 'endpoint': None,
+        'backend': backend, 'model': model, 'priority': PRIORITY_NAMES.get(priority, str(priority)),
+        'queue_wait_ms': None, 'ttft_ms': None, 'latency_ms': None,
+        'output_chars': 0, 'thinking_chars': 0, 'output_tokens': None, 'outcome': None,
+        '_submitted': time.monotonic(), '_started': None,
+    }
+
+
+def started(record: dict) -> dict:
+    """Mark the scheduler slot as granted. Returns the trace dict the backend fills in."""
+    record['_started'] = time.monotonic()
+    record['queue_wait_ms'] = round((record['_started'] - record['_submitted']) * 1000)
+    return {}
+
+
+def finish(record: dict, result: str | None, trace: dict | None, skip_if_busy: bool) -> None:
+    """Close a record from the call result and the backend trace, then store it."""
+    now = time.monotonic()
+    if record['_started'] is None:
+        # The scheduler never granted a slot: skip_if_busy found it busy, or admission rejected it.
+        record['outcome'] = 'skipped' if skip_if_busy else 'rejected'
+    else:
+        trace = trace or {}
+        record['latency_ms'] = round((now - record['_started']) * 1000)
+        if trace.get('first_chunk_at') is not None:
+            record['ttft_ms'] = round((trace['first_chunk_at'] - record['_started']) * 1000)
+        record['output_chars'] = len(result or '')
+        record['thinking_chars'] = trace.get('thinking_chars', 0)
+        record['output_tokens'] = trace.get('output_tokens')
+        record['outcome'] = trace.get('outcome') or ('ok' if result else 'empty')
+        for key in ('endpoint', 'backend', 'model'):  # set by llm_router for the endpoint that answered
+            if trace.get(key):
+                record[key] = trace[key]
+    del record['_submitted'], record['_started']
+    _store(record)
+
+
+def _store(record: dict) -> None:
+    flush = None
+    with _lock:
+        if len(_records) == _records.maxlen and config.Config.LLM_TELEMETRY_FILE:
+            _spill.append(_records[0])
+            if len(_spill) >= _SPILL_BATCH:
+                flush = _spill[:]
+                _spill.clear()
+        _records.append(record)
+    if flush:
+        _write(flush)
+
+
+def _write(records: list[dict]) -> None:
+    try:
+        path = Path(config.Config.LLM_TELEMETRY_FILE)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('a', encoding='utf-8') as f:
+            f.writelines(json.dumps(r) + '\n' for r in records)
+    except Exception as e:
+        print(f"[LLMTelemetry] rollover write failed: {e}")
+
+
+def recent(limit: int = 50, caller: str | None = None) -> list[dict]:
+    """Most recent records, newest first."""
+    with _lock:
+        records = list(_records)
+    if caller:
+        records = [r for r in records if r['caller'] == caller]
+    return records[::-1][:limit]
+
+
+def _percentiles(values: list) -> dict | None:
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': values[-1]}
+
+
+def _aggregate(records: list[dict]) -> dict:
+    served = [r for r in records if r['latency_ms'] is not None]
+    outcomes = {o: 0 for o in OUTCOMES}
+    for r in records:
+        outcomes[r['outcome']] = outcomes.get(r['outcome'], 0) + 1
+    n = len(records)
+    tps = [
+        r['output_tokens'] / ((r['latency_ms'] - (r['ttft_ms'] or 0)) / 1000)
+        for r in served
+        if r['output_tokens'] and r['latency_ms'] > (r['ttft_ms'] or 0)
+    ]
+    answered = [r for r in served if r['kind'] == 'call' and r['output_chars']]
+    return {
+        'calls': n,
+        'outcomes': outcomes,
+        'timeout_rate': round(outcomes['timeout'] / n, 3) if n else None,
+        'skip_rate': round(outcomes['skipped'] / n, 3) if n else None,
+        'reject_rate': round(outcomes['rejected'] / n, 3) if n else None,
+        'queue_wait_ms': _percentiles([r['queue_wait_ms'] for r in records]),
+        'ttft_ms': _percentiles([r['ttft_ms'] for r in served]),
+        'latency_ms': _percentiles([r['latency_ms'] for r in served]),
+        'output_chars': _percentiles([r['output_chars'] for r in served]),
+        'thinking_chars': _percentiles([r['thinking_chars'] for r in served]),
+        'thinking_per_answer_char': round(
+            sum(r['thinking_chars'] for r in answered) / sum(r['output_chars'] for r in answered), 2
+        ) if answered else None,
+        'tokens_per_s': _percentiles([round(t, 1) for t in tps]),
+    }
+
+
+def summary(window: float | None = None, caller: str | None = None) -> dict:
+    """Aggregate records (optionally only the last `window` seconds) overall and per caller."""
+    with _lock:
+        records = list(_records)
+    if window:
+        cutoff = time.time() - window
+        records = [r for r in records if r['ts'] >= cutoff]
+    if caller:
+        records = [r for r in records if r['caller'] == caller]
+    by_caller: dict[str, list] = {}
+    by_endpoint: dict[str, list] = {}
+    by_model: dict[str, list] = {}
+    for r in records:
+        by_model.setdefault(r['model'], []).append(r)
+        by_caller.setdefault(r['caller'], []).append(r)
+        if r.get('endpoint'):
+            by_endpoint.setdefault(r['endpoint'], []).append(r)
+    return {
+        'buffered': len(records),
+        'capacity': _records.maxlen,
+        'since': records[0]['ts'] if records else None,
+        'overall': _aggregate(records),
+        'callers': {name: _aggregate(rs) for name, rs in sorted(by_caller.items())},
+        'endpoints': {name: _aggregate(rs) for name, rs in sorted(by_endpoint.items())},
+        'models': {name: _aggregate(rs) for name, rs in sorted(by_model.items())},
+    }
@@ -0,0 +1,216 @@
+"""Incremental <think>...</think> stream parser shared by both LLM backends and the benchmarks.
+
+    python -m agents.llm.think_stream        # microbenchmark: 50k-char streams vs. re-joining the buffer
+
+- ThinkStream.feed(delta) splits streamed content into thinking and answer text as it arrives.
+  Tags split across chunks are handled by holding back at most a partial tag (< 8 chars).
+- feed_thinking(text) takes reasoning that arrives out of band (Ollama `thinking`, LM Studio
+  `reasoning_content`), so both backends count and budget thinking the same way.
+- Work per chunk is proportional to the chunk, not to the stream so far: char counts are
+  running totals and the parts are only joined once, by thinking()/answer().
+- Early stop: think_budget/on_budget fire once when thinking reaches the budget, and
+  stop_at_answer ends the stream at </think> or at the first answer text after out-of-band
+  thinking. feed() returns False once stopped.
+- Only the first think block is split out; the answer is stripped of surrounding whitespace.
+  An unclosed block means the boundary is unknown: result() then returns the whole raw text
+  as the answer (ended_cleanly False), as the backends always did.
+- split_thinking(raw) applies the same rules to a complete response.
+"""
+import random
+import sys
+import time
+
+OPEN, CLOSE = '<think>', '</think>'
+
+
+def _partial_tag(text: str, tag: str) -> int:
+    """Length of the longest suffix of text that is a proper prefix of tag."""
+    for k in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:k]):
+            return k
+    return 0
+
+
+class ThinkStream:
+    """Streaming splitter for one response; create one per call."""
+
+    def __init__(self, on_answer=None, *, think_budget: int | None = None, on_budget=None,
+                 stop_at_answer: bool = False):
+        """on_answer: called with each answer chunk as soon as it cannot be part of a tag.
+        think_budget: thinking chars after which the stream stops (on_budget(stream) is called once).
+        stop_at_answer: stop when thinking is over and the answer begins (phase-1 thinking calls).
+        """
+        self.on_answer = on_answer
+        self.think_budget = think_budget
+        self.on_budget = on_budget
+        self.stop_at_answer = stop_at_answer
+        self.in_think = False
+        self.opened = False            # saw <think>
+        self.closed = False            # saw </think>
+        self.stop_reason: str | None = None  # 'budget' | 'answer'
+        self.thinking_chars = 0
+        self.answer_chars = 0
+        self._thinking: list[str] = []
+        self._answer: list[str] = []
+        self._open_at = 0              # len(self._answer) when <think> was seen
+        self._pending = ''             # held-back tail that may be the start of a tag
+
+    # ---- feeding ---- #
+
+    def feed(self, text: str) -> bool:
+        """Consume one content delta. Returns False once the stream should stop."""
+        if self.stop_reason:
+            return False
+        if self._pending:
+            text, self._pending = self._pending + text, ''
+        while text and not self.stop_reason:
+            tag = CLOSE if self.in_think else (None if self.opened else OPEN)
+            if tag is None:
+                self._emit(text)
+                break
+            i = text.find(tag)
+            if i == -1:
+                keep = _partial_tag(text, tag)
+                self._emit(text[:len(text) - keep])
+                self._pending = text[len(text) - keep:]
+                break
+            self._emit(text[:i])
+            text = text[i + len(tag):]
+            if tag == OPEN:
+                self.opened, self.in_think, self._open_at = True, True, len(self._answer)
+            else:
+                self.closed, self.in_think = True, False
+                if self.stop_at_answer:
+                    self.stop_reason = 'answer'
+        return self.stop_reason is None
+
+    def feed_thinking(self, text: str) -> bool:
+        """Consume reasoning delivered outside the content. Returns False once the stream should stop."""
+        if self.stop_reason:
+            return False
+        self._emit_thinking(text)
+        return self.stop_reason is None
+
+    def close(self) -> 'ThinkStream':
+        """Flush a held-back partial tag at end of stream."""
+        pending, self._pending = self._pending, ''
+        if pending:
+            self._emit(pending)
+        return self
+
+    def _emit(self, text: str) -> None:
+        if self.in_think:
+            self._emit_thinking(text)
+        else:
+            self._emit_answer(text)
+
+    def _emit_thinking(self, text: str) -> None:
+        if not text:
+            return
+        self._thinking.append(text)
+        self.thinking_chars += len(text)
+        if self.think_budget is not None and self.thinking_chars >= self.think_budget and not self.stop_reason:
+            self.stop_reason = 'budget'
+            if self.on_budget is not None:
+                self.on_budget(self)
+
+    def _emit_answer(self, text: str) -> None:
+        if not self.answer_chars:
+            text = text.lstrip()
+        if not text:
+            return
+        if self.stop_at_answer and self.thinking_chars and not self.opened:
+            self.stop_reason = 'answer'  # out-of-band thinking is over
+            return
+        self._answer.append(text)
+        self.answer_chars += len(text)
+        if self.on_answer is not None:
+            self.on_answer(text)
+
+    # ---- results ---- #
+
+    @property
+    def ended_cleanly(self) -> bool:
+        return not self.opened or self.closed
+
+    def thinking(self) -> str | None:
+        return ''.join(self._thinking).strip() or None
+
+    def answer(self) -> str:
+        return ''.join(self._answer).strip()
+
+    def raw(self) -> str:
+        """The content as streamed (tags included), rebuilt from the parts."""
+        if not self.opened:
+            return ''.join(self._answer) + self._pending
+        before, after = self._answer[:self._open_at], self._answer[self._open_at:]
+        return ''.join(before) + OPEN + ''.join(self._thinking) + (CLOSE if self.closed else '') + ''.join(after)
+
+    def result(self) -> tuple[str | None, str, bool]:
+        """(thinking, answer, ended_cleanly) — with an unclosed block: (None, raw, False)."""
+        if not self.ended_cleanly:
+            return None, self.raw().strip(), False
+        return self.thinking(), self.answer(), True
+
+
+def split_thinking(raw: str) -> tuple[str | None, str, bool]:
+    """Split a complete response. Returns (thinking, answer, ended_cleanly) like ThinkStream.result()."""
+    stream = ThinkStream()
+    stream.feed(raw)
+    return stream.close().result()
+
+
+# ------------------------------------------------------------------ #
+#  Microbenchmark                                                    #
+# ------------------------------------------------------------------ #
+
+def _legacy_scan(chunks: list[str]) -> str:
+    """The old LM Studio loop: re-join the buffer and search it again on every delta."""
+    buf, thinking_start, in_think = [], 0, False
+    for delta in chunks:
+        buf.append(delta)
+        buf_str = ''.join(buf)
+        if not in_think:
+            idx = buf_str.find(OPEN)
+            if idx != -1:
+                in_think, thinking_start = True, idx + len(OPEN)
+        elif buf_str.find(CLOSE, thinking_start) != -1:
+            break
+    return buf_str
+
+
+def _chunked(text: str, rng: random.Random, max_len: int) -> list[str]:
+    chunks, i = [], 0
+    while i < len(text):
+        n = rng.randint(1, max_len)
+        chunks.append(text[i:i + n])
+        i += n
+    return chunks
+
+
+def main(argv=None) -> int:
+    rng = random.Random(0)
+    words = "so the user is asking about the weather and I should keep it short and warm".split()
+    thinking = " ".join(rng.choice(words) for _ in range(9000))[:40_000]
+    answer = " ".join(rng.choice(words) for _ in range(2500))[:10_000]
+    raw = f"\n{OPEN}{thinking}{CLOSE}\n\n{answer}"
+    print(f"[ThinkStream] stream of {len(raw)} chars ({len(thinking)} thinking, {len(answer)} answer)")
+    for max_len in (1, 4, 16):
+        chunks = _chunked(raw, rng, max_len)
+        t0 = time.perf_counter()
+        stream = ThinkStream()
+        for chunk in chunks:
+            stream.feed(chunk)
+        stream.close()
+        parsed = time.perf_counter() - t0
+        assert stream.result() == (thinking.strip(), answer.strip(), True), "parser disagrees with the source text"
+        t0 = time.perf_counter()
+        _legacy_scan(chunks)
+        legacy = time.perf_counter() - t0
+        print(f"[ThinkStream] {len(chunks):>6} chunks (1-{max_len} chars): incremental {parsed * 1000:8.1f} ms | "
+              f"re-join+find {legacy * 1000:8.1f} ms | {legacy / parsed:6.0f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
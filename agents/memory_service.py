@@ -1,9 +1,10 @@
 import json
 import os
 import re
+import threading
 from datetime import datetime, timedelta
 
-from agents.llm.llm_router import call_llm
+from agents.llm.llm_router import call_llm, PRIORITY_BACKGROUND
 
 
 class MemoryService:
@@ -54,6 +55,8 @@ class MemoryService:
         os.makedirs(os.path.dirname(cls.MEMORY_PATH), exist_ok=True)
         with open(cls.MEMORY_PATH, 'w') as f:
             json.dump(memories, f, indent=2)
+        from agents.persona.context_cache import invalidate
+        invalidate('memory')
 
     @classmethod
     def add(cls, content: str, source: str, ttl_hours: int | None = None, subject: str = 'user'):
@@ -98,8 +101,8 @@ class MemoryService:
         print("[Memory] All memories cleared.")
 
     @classmethod
-    def format_for_prompt(cls) -> str:
-        memories = cls.load()
+    def format_for_prompt(cls, memories: list[dict] | None = None) -> str:
+        memories = cls.load() if memories is None else memories
         if not memories:
             return ""
         user_mems    = [m["content"] for m in memories if m.get('subject', 'user') == 'user']
@@ -167,59 +170,226 @@ class MemoryService:
             return None, None
         return content, ttl_hours
 
+    # ------------------------------------------------------------------ #
+    #  Chat exchange extraction                                            #
+    # ------------------------------------------------------------------ #
+
+    COMBINED_EXTRACTION = True    # A/B flag: True = one call for user fact + persona trait, False = two calls
+    EXTRACT_COALESCE_SECONDS = 30  # exchanges arriving within this window share one extraction call
+    EXTRACT_BATCH_MAX = 6          # max exchanges per combined call
+    _pending_exchanges: list[str] = []
+    _pending_lock = threading.Lock()
+    _flush_timer: threading.Timer | None = None
+
+    _EXCHANGE_INTRO = "The exchange below has a 'User:' line and a 'Persona:' line. "
+    _FIRST_CONCLUSION = "Your first conclusion is final. Do not re-check, revisit, or reconsider it."
+    _USER_FACT_RULES = (
+        "You must read ONLY the User's words to decide what to store. "
+        "The Persona's reply is context only — never extract facts from it.\n\n"
+        "CRITICAL EXAMPLES OF WHAT NOT TO DO:\n"
+        "  User: 'What's the weather tomorrow?' / Persona: 'It will be a cold day.' → output: none  (the user asked a question; they stated nothing about themselves)\n"
+        "  User: 'How are my tasks?' / Persona: 'You have 3 tasks due.' → output: none  (Persona stated facts, not the user)\n\n"
+        "Review the User's words only and decide if they reveal a fact worth storing — "
+        "either a lasting preference/habit/trait, or a current condition or temporary state.\n\n"
+        "Rules:\n"
+        "- Only store facts the user explicitly stated in their own words — questions and requests reveal nothing.\n"
+        "- Never attribute anything from the Persona's lines to the user.\n"
+        "- Do not infer preferences from hypothetical questions ('if you could...', 'would you rather...').\n"
+        "- Do not store general world facts not personal to this specific user (animals, science, geography, etc.).\n"
+        "- Do not store home/room state: lights on or off, how dark it is inside, time-of-day comments.\n"
+        "- Do not store calendar events or meeting times — these are tracked separately.\n"
+        "- Do not store anything already covered by what is known — even if phrased differently, if the meaning is equivalent to an existing memory, output: none.\n"
+        "- If there is any doubt or the fact is speculative, output: none\n\n"
+        "Transient tag rules:\n"
+        "Facts that will expire must end with a [transient:TIMEFRAME] tag. Choose the timeframe that best matches how long the fact stays relevant:\n"
+        "  - [transient:1h]  — expires in about an hour (just woke up, about to leave, currently cooking, just arrived home)\n"
+        "  - [transient:1d]  — expires in roughly a day (today's weather, tonight's plans, current mood)\n"
+        "  - [transient:3d]  — expires in a few days (a cold, a short trip, this week's work situation)\n"
+        "  - [transient:7d]  — expires in about a week (a week-long trip, a project due this week)\n"
+        "  - [transient:monday] etc. — expires at the start of that weekday (use when the fact is tied to a specific day)\n"
+        "  - [transient] alone — use only if you cannot estimate the duration; defaults to 1 day\n"
+        "MUST tag transient:\n"
+        "  - Immediate current activity: 'The user just woke up [transient:1h]', 'The user is about to head out [transient:1h]'\n"
+        "  - Current weather: 'It is raining today [transient:1d]'\n"
+        "  - Current user state: 'The user is feeling tired today [transient:1d]', 'The user is sick with a cold [transient:3d]'\n"
+        "  - Plans and travel: 'The user is going out tonight [transient:1d]', 'The user is traveling to Tokyo this week [transient:7d]'\n"
+        "  - Work situation: 'The user is working from home today [transient:1d]'\n"
+        "  - Recent one-off events: 'The user just finished a big project [transient:3d]'\n"
+        "Do NOT tag [transient] for: stable preferences, permanent traits, recurring patterns.\n\n"
+    )
+    _PERSONA_TRAIT_RULES = (
+        "Read ONLY the Persona's words. Decide if they reveal a stable opinion, preference, or concrete commitment worth storing.\n\n"
+        "WHAT TO STORE:\n"
+        "  - A stable opinion or preference: 'I find cold weather suffocating'\n"
+        "  - A concrete commitment: 'I promised to remind them about the project'\n"
+        "  - A recurring expressed trait: 'I get restless on quiet evenings'\n\n"
+        "WHAT NOT TO STORE:\n"
+        "  Persona relaying facts ('It will be 12°C tomorrow') → none\n"
+        "  Persona giving greetings or short reactions → none\n"
+        "  In-the-moment dramatic flair that is not a stable trait → none\n"
+        "  Persona: 'cold nights make me feel trapped in this warm box~ but I suppose you find peace in the silence... since you love them' → none  "
+        "(the trapped feeling is in-the-moment roleplay, not a confirmed stable opinion; the rest is about the user, not the persona)\n\n"
+        "DISTILLATION RULES:\n"
+        "- Distil the core trait in your own words — never quote or paraphrase the Persona's reply.\n"
+        "- Strip all references to the user from your output entirely. The output must describe only the persona.\n"
+        "- If the persona's statement is mixed with user observations, extract only the persona's part, or output: none if nothing clean remains.\n"
+        "- Only store if the trait is stable and clearly expressed — if there is any doubt, output: none\n\n"
+        "Transient tag: append [transient:TIMEFRAME] only for time-bound commitments.\n\n"
+    )
+
+    @staticmethod
+    def _known_text(memories: list[dict], subject: str | None = None) -> str:
+        lines = [f"- {m['content']}" for m in memories if subject is None or m.get('subject', 'user') == subject]
+        return "\n".join(lines) or "None yet."
+
     @classmethod
-    def extract_from_exchange(cls, exchange: str) -> None:
-        """Ask Ollama if the exchange reveals a user fact (permanent or transient); store it if so."""
-        existing = cls.load()
-        existing_text = (
-            "\n".join(f"- {m['content']}" for m in existing)
-            if existing else "None yet."
+    def user_fact_prompt(cls, exchange: str, memories: list[dict]) -> tuple[str, str]:
+        """(system, user) for the single-purpose user fact extraction call."""
+        system = (
+            cls._EXCHANGE_INTRO + cls._USER_FACT_RULES
+            + "Output ONE short sentence starting with 'The user' (with [transient:TIMEFRAME] if applicable), or exactly 'none'. Do not explain. "
+            + cls._FIRST_CONCLUSION
         )
+        return system, f"Already known:\n{cls._known_text(memories)}\n\nExchange:\n{exchange}"
+
+    @classmethod
+    def persona_trait_prompt(cls, exchange: str, memories: list[dict]) -> tuple[str, str]:
+        """(system, user) for the single-purpose persona trait extraction call."""
+        system = (
+            cls._EXCHANGE_INTRO + cls._PERSONA_TRAIT_RULES
+            + "Output ONE short sentence starting with 'I', or exactly 'none'. Do not explain. "
+            + cls._FIRST_CONCLUSION
+        )
+        return system, f"Already known about me:\n{cls._known_text(memories, 'persona')}\n\nExchange:\n{exchange}"
+
+    @classmethod
+    def combined_prompt(cls, exchanges: list[str], memories: list[dict]) -> tuple[str, str]:
+        """(system, user) asking for user facts and persona traits from one or more exchanges at once."""
+        system = (
+            "Each exchange below has a 'User:' line and a 'Persona:' line. "
+            "Do two independent tasks on every exchange.\n\n"
+            "TASK 1 — USER FACTS. " + cls._USER_FACT_RULES
+            + "TASK 2 — PERSONA TRAITS. " + cls._PERSONA_TRAIT_RULES
+            + "Output exactly one JSON object and nothing else — no code fences, no explanation:\n"
+            '{"user": ["The user ..."], "persona": ["I ..."]}\n'
+            "'user' holds at most one sentence per exchange starting with 'The user' "
+            "(with [transient:TIMEFRAME] if applicable). "
+            "'persona' holds at most one sentence per exchange starting with 'I'. "
+            "Use an empty list wherever the answer would be none. "
+            + cls._FIRST_CONCLUSION
+        )
+        numbered = "\n\n".join(f"Exchange {i + 1}:\n{ex}" for i, ex in enumerate(exchanges))
+        user = (
+            f"Already known about the user:\n{cls._known_text(memories, 'user')}\n\n"
+            f"Already known about me:\n{cls._known_text(memories, 'persona')}\n\n"
+            f"{numbered}"
+        )
+        return system, user
+
+    @staticmethod
+    def _gpu_busy() -> bool:
         try:
             from agents.image.image_gen_service import ImageGenService
-            if ImageGenService._in_progress:
-                return  # GPU busy; skip this exchange
+            return bool(ImageGenService._in_progress)
         except Exception:
-            pass
-        system = (
-            "The exchange below has a 'User:' line and a 'Persona:' line. "
-            "You must read ONLY the User's words to decide what to store. "
-            "The Persona's reply is context only — never extract facts from it.\n\n"
-            "CRITICAL EXAMPLES OF WHAT NOT TO DO:\n"
-            "  User: 'What's the weather tomorrow?' / Persona: 'It will be a cold day.' → output: none  (the user asked a question; they stated nothing about themselves)\n"
-            "  User: 'How are my tasks?' / Persona: 'You have 3 tasks due.' → output: none  (Persona stated facts, not the user)\n\n"
-            "Review the User's words only and decide if they reveal a fact worth storing — "
-            "either a lasting preference/habit/trait, or a current condition or temporary state.\n\n"
-            "Rules:\n"
-            "- Only store facts the user explicitly stated in their own words — questions and requests reveal nothing.\n"
-            "- Never attribute anything from the Persona's lines to the user.\n"
-            "- Do not infer preferences from hypothetical questions ('if you could...', 'would you rather...').\n"
-            "- Do not store general world facts not personal to this specific user (animals, science, geography, etc.).\n"
-            "- Do not store home/room state: lights on or off, how dark it is inside, time-of-day comments.\n"
-            "- Do not store calendar events or meeting times — these are tracked separately.\n"
-            "- Do not store anything already covered by what is known — even if phrased differently, if the meaning is equivalent to an existing memory, output: none.\n"
-            "- If there is any doubt or the fact is speculative, output: none\n\n"
-            "Transient tag rules:\n"
-            "Facts that will expire must end with a [transient:TIMEFRAME] tag. Choose the timeframe that best matches how long the fact stays relevant:\n"
-            "  - [transient:1h]  — expires in about an hour (just woke up, about to leave, currently cooking, just arrived home)\n"
-            "  - [transient:1d]  — expires in roughly a day (today's weather, tonight's plans, current mood)\n"
-            "  - [transient:3d]  — expires in a few days (a cold, a short trip, this week's work situation)\n"
-            "  - [transient:7d]  — expires in about a week (a week-long trip, a project due this week)\n"
-            "  - [transient:monday] etc. — expires at the start of that weekday (use when the fact is tied to a specific day)\n"
-            "  - [transient] alone — use only if you cannot estimate the duration; defaults to 1 day\n"
-            "MUST tag transient:\n"
-            "  - Immediate current activity: 'The user just woke up [transient:1h]', 'The user is about to head out [transient:1h]'\n"
-            "  - Current weather: 'It is raining today [transient:1d]'\n"
-            "  - Current user state: 'The user is feeling tired today [transient:1d]', 'The user is sick with a cold [transient:3d]'\n"
-            "  - Plans and travel: 'The user is going out tonight [transient:1d]', 'The user is traveling to Tokyo this week [transient:7d]'\n"
-            "  - Work situation: 'The user is working from home today [transient:1d]'\n"
-            "  - Recent one-off events: 'The user just finished a big project [transient:3d]'\n"
-            "Do NOT tag [transient] for: stable preferences, permanent traits, recurring patterns.\n\n"
-            "Output ONE short sentence starting with 'The user' (with [transient:TIMEFRAME] if applicable), or exactly 'none'. Do not explain. "
-            "Your first conclusion is final. Do not re-check, revisit, or reconsider it."
-        )
-        user = f"Already known:\n{existing_text}\n\nExchange:\n{exchange}"
-        result = call_llm(user, timeout=15, system=system)
+            return False
+
+    @classmethod
+    def submit_exchange(cls, exchange: str) -> None:
+        """Queue a chat exchange for background memory extraction.
+
+        With COMBINED_EXTRACTION, exchanges arriving within EXTRACT_COALESCE_SECONDS
+        (e.g. a burst of Telegram messages) are extracted together in one call.
+        """
+        if not cls.COMBINED_EXTRACTION:
+            threading.Thread(target=cls._extract_separately, args=(exchange,), daemon=True).start()
+            return
+        with cls._pending_lock:
+            cls._pending_exchanges.append(exchange)
+            if cls._flush_timer is None:
+                cls._arm_flush_timer()
+
+    @classmethod
+    def _arm_flush_timer(cls) -> None:
+        """Caller holds _pending_lock."""
+        cls._flush_timer = threading.Timer(cls.EXTRACT_COALESCE_SECONDS, cls._flush_pending)
+        cls._flush_timer.daemon = True
+        cls._flush_timer.start()
+
+    @classmethod
+    def _flush_pending(cls) -> None:
+        with cls._pending_lock:
+            if cls._gpu_busy():
+                cls._arm_flush_timer()  # GPU busy; keep the batch and try again next window
+                return
+            batch = cls._pending_exchanges[:]
+            cls._pending_exchanges.clear()
+            cls._flush_timer = None
+        for i in range(0, len(batch), cls.EXTRACT_BATCH_MAX):
+            try:
+                cls.extract_combined(batch[i:i + cls.EXTRACT_BATCH_MAX])
+            except Exception as e:
+                print(f"[Memory] combined extraction error: {e}")
+
+    @classmethod
+    def _extract_separately(cls, exchange: str) -> None:
+        try:
+            cls.extract_from_exchange(exchange)
+            cls.extract_persona_from_exchange(exchange)
+        except Exception as e:
+            print(f"[Memory] extraction error: {e}")
+
+    @classmethod
+    def extract_combined(cls, exchanges: list[str]) -> None:
+        """One LLM call for the user fact and persona trait of each exchange; store what it finds."""
+        if not exchanges:
+            return
+        system, user = cls.combined_prompt(exchanges, cls.load())
+        result = call_llm(user, timeout=15 + 5 * len(exchanges), system=system, priority=PRIORITY_BACKGROUND,
+                          caller='memory_combined')
+        if not result:
+            return
+        parsed = cls._parse_combined(result)
+        if parsed is None:
+            print(f"[Memory] combined extraction: unparseable response {result[:200]!r}")
+            return
+        user_facts, persona_traits = parsed
+        for text in user_facts[:len(exchanges)]:
+            content, ttl_hours = cls._parse_llm_memory(text)
+            if content:
+                cls.add(content, "user", ttl_hours=ttl_hours)
+        for text in persona_traits[:len(exchanges)]:
+            content, ttl_hours = cls._parse_llm_memory(text)
+            if content:
+                cls.add(content, "persona", ttl_hours=ttl_hours, subject='persona')
+
+    @staticmethod
+    def _parse_combined(result: str) -> tuple[list[str], list[str]] | None:
+        """Parse {"user": [...], "persona": [...]} from a combined response; None if malformed."""
+        start, end = result.find('{'), result.rfind('}')
+        if start == -1 or end <= start:
+            return None
+        try:
+            data = json.loads(result[start:end + 1])
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(data, dict):
+            return None
+
+        def _items(value) -> list[str]:
+            if isinstance(value, str):
+                value = [value]
+            return [v for v in value or [] if isinstance(v, str)]
+        return _items(data.get('user')), _items(data.get('persona'))
+
+    @classmethod
+    def extract_from_exchange(cls, exchange: str) -> None:
+        """Ask Ollama if the exchange reveals a user fact (permanent or transient); store it if so."""
+        if cls._gpu_busy():
+            return  # GPU busy; skip this exchange
+        system, user = cls.user_fact_prompt(exchange, cls.load())
+        result = call_llm(user, timeout=15, system=system, priority=PRIORITY_BACKGROUND,
+                          caller='memory_extract')
         if not result:
             return
         content, ttl_hours = cls._parse_llm_memory(result)
@@ -229,41 +399,11 @@ class MemoryService:
     @classmethod
     def extract_persona_from_exchange(cls, exchange: str) -> None:
         """Ask Ollama if the Persona's reply reveals an opinion, commitment, or expressed trait worth storing."""
-        existing = cls.load()
-        existing_text = (
-            "\n".join(f"- {m['content']}" for m in existing if m.get('subject') == 'persona')
-            or "None yet."
-        )
-        try:
-            from agents.image.image_gen_service import ImageGenService
-            if ImageGenService._in_progress:
-                return
-        except Exception:
-            pass
-        system = (
-            "The exchange below has a 'User:' line and a 'Persona:' line. "
-            "Read ONLY the Persona's words. Decide if they reveal a stable opinion, preference, or concrete commitment worth storing.\n\n"
-            "WHAT TO STORE:\n"
-            "  - A stable opinion or preference: 'I find cold weather suffocating'\n"
-            "  - A concrete commitment: 'I promised to remind them about the project'\n"
-            "  - A recurring expressed trait: 'I get restless on quiet evenings'\n\n"
-            "WHAT NOT TO STORE:\n"
-            "  Persona relaying facts ('It will be 12°C tomorrow') → none\n"
-            "  Persona giving greetings or short reactions → none\n"
-            "  In-the-moment dramatic flair that is not a stable trait → none\n"
-            "  Persona: 'cold nights make me feel trapped in this warm box~ but I suppose you find peace in the silence... since you love them' → none  "
-            "(the trapped feeling is in-the-moment roleplay, not a confirmed stable opinion; the rest is about the user, not the persona)\n\n"
-            "DISTILLATION RULES:\n"
-            "- Distil the core trait in your own words — never quote or paraphrase the Persona's reply.\n"
-            "- Strip all references to the user from your output entirely. The output must describe only the persona.\n"
-            "- If the persona's statement is mixed with user observations, extract only the persona's part, or output: none if nothing clean remains.\n"
-            "- Only store if the trait is stable and clearly expressed — if there is any doubt, output: none\n\n"
-            "Transient tag: append [transient:TIMEFRAME] only for time-bound commitments.\n\n"
-            "Output ONE short sentence starting with 'I', or exactly 'none'. Do not explain. "
-            "Your first conclusion is final. Do not re-check, revisit, or reconsider it."
-        )
-        user = f"Already known about me:\n{existing_text}\n\nExchange:\n{exchange}"
-        result = call_llm(user, timeout=15, system=system)
+        if cls._gpu_busy():
+            return
+        system, user = cls.persona_trait_prompt(exchange, cls.load())
+        result = call_llm(user, timeout=15, system=system, priority=PRIORITY_BACKGROUND,
+                          caller='persona_extract')
         if not result:
             return
         content, ttl_hours = cls._parse_llm_memory(result)
@@ -301,7 +441,8 @@ class MemoryService:
             "Your first conclusion is final. Do not re-check, revisit, or reconsider it."
         )
         user = f"Already known:\n{existing_text}\n\nNew observation: {situation}"
-        result = call_llm(user, timeout=15, system=system)
+        result = call_llm(user, timeout=15, system=system, priority=PRIORITY_BACKGROUND,
+                          caller='memory_observe')
         if not result:
             return
         content, _ = cls._parse_llm_memory(result)
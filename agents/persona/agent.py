@@ -1,7 +1,8 @@
+import datetime
 import os
 import re
-import threading
 import time
+from collections.abc import Mapping
 from contextlib import nullcontext
 
 import config
@@ -12,15 +13,85 @@ from agents.persona.states import (
     STATES, TIME_PERIODS, CALENDAR_STATES, CONTEXT_STATES,
     HOLIDAY_STATES, SITUATION_LABELS, CHARACTER_VOICE, MOOD_MODIFIERS,
 )
-from agents.llm.llm_router import call_llm, collect_thinking
+from agents.llm.llm_router import (
+    call_llm, call_llm_json, collect_thinking,
+    PRIORITY_INTERACTIVE, PRIORITY_NOTIFY, PRIORITY_BACKGROUND,
+)
+from agents.llm.scheduler import PRIORITY_QUOTE
+from agents.llm.response_cache import ResponseCache, make_key
+from agents.persona.quote_pool import QuotePool
+from agents.persona import background, prerender, state_engine
 
-QUOTE_TTL = 10 * 60      # seconds — successful quote/suggestion lifetime
+QUOTE_TTL = 10 * 60      # seconds — successful quote/briefing lifetime
+SUGGESTION_TTL = QUOTE_TTL * 10
 QUOTE_RETRY_BACKOFF = 60  # seconds — retry interval after a failed/skipped LLM call
 
+# Clock granularity (minutes) of the context block in each prompt. Context goes first in the
+# user message and the clock last within it, so a coarser clock keeps the whole prefix
+# byte-identical (and KV-cached by the backend) for longer. See PersonaContext.build_prompt_context.
+_TIME_GRANULARITY = {
+    'quote': 30,       # "Never quote the clock time directly"
+    'suggestion': 60,
+    'briefing': 15,
+    'morning': 15,
+    'relay': 15,       # background awareness only
+    'reactive': 5,
+    'open': 1,         # the user may ask what time it is
+    'wishes': 60,
+}
+
+_QUOTE_SYSTEM = (
+    CHARACTER_VOICE + " "
+    "Be expressive and creative, matching your emotional state — "
+    "don't invent weather or events that contradict the situation. "
+    "If you mention a day or month, use the ones provided — never guess. "
+    "Never quote the clock time directly. "
+    "Do not reference background knowledge about the user unless it is directly relevant to this exact situation. "
+    "Write one reaction in that same casual style, maximum 10 words. "
+    "Output only one line, nothing else. Never use '/'. "
+    "Your first draft is your final answer. Do not iterate, revise, or consider alternatives."
+)
+
+_SUGGESTION_SYSTEM = (
+    CHARACTER_VOICE + " "
+    "Express it as a brief, wistful thought in your own voice. 5-15 words. "
+    "Output only one line, nothing else. Never use '/'. "
+    "Your first draft is your final answer. Do not iterate, revise, or consider alternatives."
+)
+
+_BRIEFING_SYSTEM = (
+    CHARACTER_VOICE + " "
+    "Welcome the user who just arrived home with a short warm briefing. Speak directly to them. "
+    "Weave in one or two relevant facts from the context naturally. Maximum 2 short sentences. "
+    "If using a Japanese greeting, use the time-appropriate one: "
+    "'Ohayou' (morning), 'Konnichiwa' (daytime only), 'Konbanwa' (evening or night). "
+    "Examples: "
+    "'Welcome back! You've got a meeting at 3pm, and it's freezing outside — grab a coat.' / "
+    "'Oh, you're home! Nothing on the calendar today, and the weather's actually nice~' / "
+    "'Welcome back! Three meetings today — first one at 10am. Cold out there too.' "
+    "Output only the lines, nothing else."
+)
+
+_BRIEFING_FALLBACK = "Welcome home!"
+
+
+def _list_schema(field: str, count: int, min_length: int = 1, max_length: int = 400) -> dict:
+    """JSON schema for {field: [exactly count strings]} — used with call_llm_json."""
+    return {
+        'type': 'object',
+        'properties': {field: {'type': 'array', 'minItems': count, 'maxItems': count,
+                               'items': {'type': 'string', 'minLength': min_length, 'maxLength': max_length}}},
+        'required': [field],
+        'additionalProperties': False,
+    }
+
 
 class PersonaAgent:
-    _quote_cache: dict[str, tuple[str, float]] = {}  # key -> (text, timestamp)
-    _suggestion_generating: set[str] = set()          # guards against duplicate threads
+    # Quotes, suggestions and welcome briefings — persisted so a restart serves the last good text.
+    _quote_cache = ResponseCache('persona', max_entries=512, persistent=True)
+    # Quotes pre-generated in the background; the request path only pops from it.
+    _quote_pool = QuotePool('persona', lambda target: PersonaAgent._pool_quote(target),
+                            on_ready=lambda key: state_engine.invalidate('quote'))
 
     LINGERING_MOOD_DURATION = 15 * 60  # seconds — how long a chat-triggered mood persists
     _lingering_mood: str | None = None
@@ -31,6 +102,7 @@ class PersonaAgent:
         """Record a mood triggered by a chat reply. Overrides ambient mood for LINGERING_MOOD_DURATION."""
         cls._lingering_mood = mood
         cls._lingering_mood_ts = time.time()
+        state_engine.invalidate('mood')
 
     @classmethod
     def get_lingering_mood(cls) -> str | None:
@@ -41,13 +113,48 @@ class PersonaAgent:
         return None
 
     @staticmethod
-    def get_current_state() -> dict:
+    def get_current_state() -> Mapping:
+        """The published state snapshot (read-only; see state_engine). A new mood unlock is
+        handed to the first reader after it happens, as before."""
+        state = state_engine.read()
+        try:
+            from agents.stats_service import pop_pending_unlock
+            new_unlock = pop_pending_unlock()
+        except Exception as e:
+            print(f'[PersonaAgent] stats error: {e}')
+            new_unlock = None
+        return {**state, "new_unlock": new_unlock} if new_unlock else state
+
+    @staticmethod
+    def _resolve_state() -> tuple[dict, float | None]:
+        """state_engine resolver: (state, time it stops being valid without an input event)."""
+        state = PersonaAgent._compute_state()
+        now = time.time()
+        edges = [
+            state.pop("valid_until", None),
+            now + PersonaContext.next_time_period()[1],
+            (datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+             + datetime.timedelta(hours=1)).timestamp(),  # current_weather() is per hour
+            PersonaContext.next_calendar_change(),
+        ]
+        if HomeContextService._welcome_until > now:
+            edges.append(HomeContextService._welcome_until)
+        # Queued background work for states that are no longer current is dropped
+        state_key = state["state"]
+        prerender.observe(state_key)
+        background.cancel('suggestion', lambda key: key == f"suggestion:{state_key}")
+        base_key = state_key.rsplit('_', 1)[0]
+        background.cancel('mood_image', lambda key: key.startswith(f"mood_image:{base_key}_"))
+        return state, min(t for t in edges if t)
+
+    @staticmethod
+    def _compute_state() -> dict:
         # Hub offline: MQTT configured but broker unreachable
         if PersonaAgent._hub_offline():
             state_data = CONTEXT_STATES["hub_offline"]
             return PersonaAgent._make_response("hub_offline", state_data, state_data["situation"])
 
-        # Welcome: just arrived home — generate a contextual briefing
+        # Welcome: just arrived home — contextual briefing, generated in the background
         if HomeContextService.is_just_arrived():
             period = PersonaContext.get_time_period()
             state_data = CONTEXT_STATES["welcome"]
@@ -59,7 +166,7 @@ class PersonaAgent:
                 print(f'[PersonaAgent] stats error: {e}')
             return PersonaAgent._make_response(
                 "welcome", state_data, f"just arrived home in the {period}",
-                period=period, custom_quote=PersonaAgent._generate_briefing(mood),
+                period=period, custom_quote=PersonaAgent._get_briefing_async(mood),
             )
 
         return PersonaAgent._get_contextual_state()
@@ -166,28 +273,51 @@ class PersonaAgent:
         and suggestion scheduling in one place.
         """
         lingering = cls.get_lingering_mood() if use_lingering_mood else None
-        if lingering and not state_data.get("mood_overrides", {}).get(period):
-            mood = lingering
-        else:
-            mood = PersonaContext.get_mood(state_data, period)
 
         # Stats overlay: nudge mood + apply unlock lock-filter
-        stats = {}
-        new_unlock = None
+        stats = None
         try:
-            from agents.stats_service import get as _stats_get, apply_mood_overlay, unlocked_moods_set, pop_pending_unlock
+            from agents.stats_service import get as _stats_get
             stats = _stats_get()
-            mood = apply_mood_overlay(mood, period, stats, base_key)
-            unlocked = unlocked_moods_set(stats)
-            if mood not in unlocked:
-                mood = 'content'
-            new_unlock = pop_pending_unlock()
         except Exception as _se:
             print(f'[PersonaAgent] stats overlay error: {_se}')
+        mood = cls._resolve_mood(state_data, period, base_key, lingering, stats)
 
         lit = PersonaContext.lights_on()
+        state_key = cls._state_key(base_key, period, mood, lit)
+
+        prompt = cls._state_prompt(state_data, period, mood, lit)
+        if not lit:
+            situation = f"{situation}, lights are off"
+
+        effective_fallback = fallback if fallback is not None else state_data.get("quote", "")
+        # When the texts shown with this state change by the clock (state_engine valid_until);
+        # a quote or suggestion still being generated reports itself via on_ready / invalidate.
+        expiries = [cls._lingering_mood_ts + cls.LINGERING_MOOD_DURATION] if lingering else []
+        if custom_quote is None:
+            quote = cls._generate_quote(state_key, situation, effective_fallback, mood)
+            cls._pool_likely_next(base_key, state_data, situation, period, mood, lingering, stats, lit)
+            expiries.append(cls._quote_cache.expires_at(cls._quote_key(state_key, situation, mood)))
+        else:
+            quote = custom_quote
+        suggestion = cls._get_suggestion_async(state_key, situation, mood)
+        expiries.append(cls._quote_cache.expires_at(cls._suggestion_key(state_key, situation, mood)))
+        now = time.time()
+
+        return {"state": state_key, "prompt": prompt, "quote": quote, "suggestion": suggestion,
+                "stats": stats or {}, "new_unlock": None,
+                "valid_until": min((t for t in expiries if t and t > now), default=None)}
+
+    @staticmethod
+    def _state_key(base_key: str, period: str | None, mood: str, lit: bool) -> str:
         state_key = f"{base_key}_{period}_{mood}" if period else f"{base_key}_{mood}"
+        if not lit and period and period.endswith("_night"):
+            state_key += "_dark"
+        return state_key
 
+    @staticmethod
+    def _state_prompt(state_data: dict, period: str | None, mood: str, lit: bool) -> str:
+        """Image prompt for a state: scene (+ period suffix) + mood modifier (+ candlelight when dark)."""
         scene = state_data.get("prompt_overrides", {}).get(period, state_data["prompt"]) if period else state_data["prompt"]
         if period:
             scene = scene + ", " + TIME_PERIODS[period]["prompt_suffix"]
@@ -199,19 +329,29 @@ class PersonaAgent:
             except Exception:
                 pass
         prompt = scene + ", " + (_mood_modifier or MOOD_MODIFIERS['content'])
-        if not lit:
-            situation = f"{situation}, lights are off"
-            # Only change image/prompt if lights are off at night
-            if period and period.endswith("_night"):
-                state_key += "_dark"
-                prompt += ", (soft candlelight:1.3), (single candle as only light source:1.2), room lights off, no electric lighting"
+        # Only change image/prompt if lights are off at night
+        if not lit and period and period.endswith("_night"):
+            prompt += ", (soft candlelight:1.3), (single candle as only light source:1.2), room lights off, no electric lighting"
+        return prompt
 
-        effective_fallback = fallback if fallback is not None else state_data.get("quote", "")
-        quote = custom_quote if custom_quote is not None else cls._generate_quote(state_key, situation, effective_fallback, mood)
-        suggestion = cls._get_suggestion_async(state_key, situation, mood)
-
-        return {"state": state_key, "prompt": prompt, "quote": quote, "suggestion": suggestion,
-                "stats": stats, "new_unlock": new_unlock}
+    @staticmethod
+    def _resolve_mood(state_data: dict, period: str | None, base_key: str,
+                      lingering: str | None, stats: dict | None) -> str:
+        """Lingering chat mood (unless the period overrides it) or ambient mood, then the stats overlay."""
+        if lingering and not state_data.get("mood_overrides", {}).get(period):
+            mood = lingering
+        else:
+            mood = PersonaContext.get_mood(state_data, period)
+        if stats is None:
+            return mood
+        try:
+            from agents.stats_service import apply_mood_overlay, unlocked_moods_set
+            mood = apply_mood_overlay(mood, period, stats, base_key)
+            if mood not in unlocked_moods_set(stats):
+                mood = 'content'
+        except Exception as _se:
+            print(f'[PersonaAgent] stats overlay error: {_se}')
+        return mood
 
     # ------------------------------------------------------------------ #
     #  Suggestion — non-blocking, background-generated                    #
@@ -219,35 +359,34 @@ class PersonaAgent:
 
     @classmethod
     def _get_suggestion_async(cls, state_key: str, situation: str, mood: str = "content") -> str | None:
-        """Return cached suggestion immediately, or None (spawning background generation)."""
-        cache_key = f"suggestion_{state_key}"
-        cached = cls._quote_cache.get(cache_key)
-        if cached and time.time() - cached[1] < QUOTE_TTL * 10:
-            return cached[0]
-        if state_key not in cls._suggestion_generating:
-            cls._suggestion_generating.add(state_key)
-            threading.Thread(
-                target=cls._generate_suggestion,
-                args=(state_key, situation, mood),
-                daemon=True,
-            ).start()
+        """Return cached suggestion immediately, or None (queueing background generation)."""
+        cached = cls._quote_cache.get(cls._suggestion_key(state_key, situation, mood))
+        if cached is not None:
+            return cached or None  # '' marks a failed attempt inside its retry backoff
+        background.submit(f"suggestion:{state_key}", cls._generate_suggestion, state_key, situation, mood,
+                          group='suggestion')
         return None
 
+    @staticmethod
+    def _suggestion_key(state_key: str, situation: str, mood: str) -> str:
+        return make_key(_SUGGESTION_SYSTEM, f"{situation}|{mood}", f"suggestion:{state_key}")
+
+    @classmethod
+    def _cache_retry(cls, cache_key: str, fallback: str) -> str:
+        """Hold the last good response (or fallback) for QUOTE_RETRY_BACKOFF before the next LLM attempt."""
+        text = cls._quote_cache.get(cache_key, allow_stale=True) or fallback
+        cls._quote_cache.put(cache_key, text, ttl=QUOTE_RETRY_BACKOFF, persist=False)
+        return text
+
     @classmethod
     def _generate_suggestion(cls, state_key: str, situation: str, mood: str = "content") -> None:
-        cache_key = f"suggestion_{state_key}"
+        cache_key = cls._suggestion_key(state_key, situation, mood)
         try:
             if cls._gpu_busy():
-                cls._quote_cache[cache_key] = (None, time.time() - QUOTE_TTL + QUOTE_RETRY_BACKOFF)
+                cls._cache_retry(cache_key, "")
                 return
-            system = (
-                CHARACTER_VOICE + " "
-                "Express it as a brief, wistful thought in your own voice. 5-15 words. "
-                "Output only one line, nothing else. Never use '/'. "
-                "Your first draft is your final answer. Do not iterate, revise, or consider alternatives."
-            )
             user = (
-                f"Emotional state: {mood}. Current situation: {situation}. Context: {PersonaContext.build_full_context()}. "
+                f"Context:\n{PersonaContext.build_prompt_context(_TIME_GRANULARITY['suggestion'])}\n\n"
                 "You just reacted to the current home situation on your dashboard. "
                 "Express one thing you wish you knew that would have made your message more useful, "
                 "or something that would help you grow more useful and smart. "
@@ -255,73 +394,105 @@ class PersonaAgent:
                 "outdoor air quality (AQI, PM2.5), indoor air quality (VOC, NOx), "
                 "today's and tomorrow's calendar events, Spotify music playback control, and countdown timers. "
                 "Think of specific information you don't have — such as upcoming holidays, "
-                "package deliveries, or local news."
+                "package deliveries, or local news.\n\n"
+                f"Emotional state: {mood}. Current situation: {situation}."
             )
-            suggestion = cls._call_llm(user, timeout=10, system=system, skip_if_busy=True)
+            suggestion = cls._call_llm(user, timeout=10, system=_SUGGESTION_SYSTEM, skip_if_busy=True,
+                                       priority=PRIORITY_BACKGROUND, caller='suggestion')
             if suggestion:
-                cls._quote_cache[cache_key] = (suggestion, time.time())
+                cls._quote_cache.put(cache_key, suggestion, ttl=SUGGESTION_TTL)
+                state_engine.invalidate('suggestion')
             else:
-                cls._quote_cache[cache_key] = (None, time.time() - QUOTE_TTL + QUOTE_RETRY_BACKOFF)
+                cls._cache_retry(cache_key, "")
         except Exception as e:
             print(f"[PersonaAgent] Suggestion generation failed: {e}")
-        finally:
-            cls._suggestion_generating.discard(state_key)
 
     # ------------------------------------------------------------------ #
     #  Quote + briefing                                                    #
     # ------------------------------------------------------------------ #
 
+    @classmethod
+    def _get_briefing_async(cls, mood: str = "cheerful") -> str:
+        """Return the cached briefing immediately, or the last one / fallback while a new one is
+        generated in the background (state_engine.invalidate('quote') when it lands)."""
+        cache_key = make_key(_BRIEFING_SYSTEM, mood, "welcome")
+        cached = cls._quote_cache.get(cache_key)
+        if cached:
+            return cached
+        background.submit(f"briefing:{mood}", cls._generate_briefing, mood, group='briefing')
+        return cls._quote_cache.get(cache_key, allow_stale=True) or _BRIEFING_FALLBACK
+
     @classmethod
     def _generate_briefing(cls, mood: str = "cheerful") -> str:
-        cache_key = f"welcome_{mood}"
+        cache_key = make_key(_BRIEFING_SYSTEM, mood, "welcome")
         cached = cls._quote_cache.get(cache_key)
-        if cached and time.time() - cached[1] < QUOTE_TTL:
-            return cached[0]
+        if cached:
+            return cached
 
-        fallback = "Welcome home!"
-        system = (
-            CHARACTER_VOICE + " "
-            "Welcome the user who just arrived home with a short warm briefing. Speak directly to them. "
-            "Weave in one or two relevant facts from the context naturally. Maximum 2 short sentences. "
-            "If using a Japanese greeting, use the time-appropriate one: "
-            "'Ohayou' (morning), 'Konnichiwa' (daytime only), 'Konbanwa' (evening or night). "
-            "Examples: "
-            "'Welcome back! You've got a meeting at 3pm, and it's freezing outside — grab a coat.' / "
-            "'Oh, you're home! Nothing on the calendar today, and the weather's actually nice~' / "
-            "'Welcome back! Three meetings today — first one at 10am. Cold out there too.' "
-            "Output only the lines, nothing else."
-        )
-        user = f"Emotional state: {mood}. Context: {PersonaContext.build_full_context()}. Write the greeting now."
+        fallback = _BRIEFING_FALLBACK
+        user = (f"Context:\n{PersonaContext.build_prompt_context(_TIME_GRANULARITY['briefing'])}\n\n"
+                f"Emotional state: {mood}. Write the greeting now.")
         with cls._claim_gpu():
-            quote = cls._call_llm(user, timeout=30, system=system) or fallback
-        cls._quote_cache[cache_key] = (quote, time.time())
+            quote = cls._call_llm(user, timeout=30, system=_BRIEFING_SYSTEM, priority=PRIORITY_NOTIFY,
+                                  caller='welcome_briefing')
+        if not quote:
+            return cls._cache_retry(cache_key, fallback)
+        cls._quote_cache.put(cache_key, quote, ttl=QUOTE_TTL)
+        state_engine.invalidate('quote')
         return quote
 
+    @staticmethod
+    def _quote_key(state_key: str, situation: str, mood: str) -> str:
+        return make_key(_QUOTE_SYSTEM, f"{situation}|{mood}", state_key)
+
     @classmethod
     def _generate_quote(cls, state_key: str, situation: str, fallback: str, mood: str = "content") -> str:
-        cached = cls._quote_cache.get(state_key)
-        if cached and time.time() - cached[1] < QUOTE_TTL:
-            return cached[0]
-        if cls._gpu_busy():
-            return fallback  # SD is using the GPU; return fallback and retry on next poll
-        system = (
-            CHARACTER_VOICE + " "
-            "Be expressive and creative, matching your emotional state — "
-            "don't invent weather or events that contradict the situation. "
-            "If you mention a day or month, use the ones provided — never guess. "
-            "Never quote the clock time directly. "
-            "Do not reference background knowledge about the user unless it is directly relevant to this exact situation. "
-            "Write one reaction in that same casual style, maximum 10 words. "
-            "Output only one line, nothing else. Never use '/'. "
-            "Your first draft is your final answer. Do not iterate, revise, or consider alternatives."
-        )
-        user = f"Current situation: {situation}. Emotional state: {mood}. Context: {PersonaContext.build_full_context()}."
-        text = cls._call_llm(user, timeout=10, system=system, skip_if_busy=True)
+        """Return the current quote without calling the LLM.
+
+        A cached quote is shown for QUOTE_TTL; after that the next pre-generated quote is
+        taken from _quote_pool. While the pool is still empty the last good quote (or
+        fallback) is served and the pool's refill thread is woken.
+        """
+        cache_key = cls._quote_key(state_key, situation, mood)
+        cls._quote_pool.want(cache_key, {"state_key": state_key, "situation": situation, "mood": mood})
+        cached = cls._quote_cache.get(cache_key)
+        if cached:
+            return cached
+        text = cls._quote_pool.pop(cache_key)
         if text:
-            cls._quote_cache[state_key] = (text, time.time())
-        else:
-            cls._quote_cache[state_key] = (fallback, time.time() - QUOTE_TTL + QUOTE_RETRY_BACKOFF)
-        return text or fallback
+            cls._quote_cache.put(cache_key, text, ttl=QUOTE_TTL)
+            return text
+        return cls._quote_cache.get(cache_key, allow_stale=True) or fallback
+
+    @classmethod
+    def _pool_quote(cls, target: dict) -> str | None:
+        """QuotePool generate callback — runs on the pool thread, gives way to SD and other LLM calls."""
+        if cls._gpu_busy():
+            return None
+        user = (f"Context:\n{PersonaContext.build_prompt_context(_TIME_GRANULARITY['quote'])}\n\n"
+                f"Current situation: {target['situation']}. Emotional state: {target['mood']}.")
+        return cls._call_llm(user, timeout=10, system=_QUOTE_SYSTEM, skip_if_busy=True, priority=PRIORITY_QUOTE,
+                             caller='quote')
+
+    @classmethod
+    def _pool_likely_next(cls, base_key: str, state_data: dict, situation: str, period: str | None,
+                          mood: str, lingering: str | None, stats: dict | None, lit: bool) -> None:
+        """Register the states likely to follow this one so their quotes are pooled in advance."""
+        targets = []
+        if lingering and mood == lingering:
+            # Lingering chat mood expires back to the ambient mood
+            ambient = cls._resolve_mood(state_data, period, base_key, None, stats)
+            if ambient != mood:
+                targets.append((cls._state_key(base_key, period, ambient, lit), situation, ambient))
+        if period:
+            nxt, seconds = PersonaContext.next_time_period()
+            if seconds <= config.Config.QUOTE_POOL_LOOKAHEAD and f" in the {period}" in situation:
+                nxt_mood = cls._resolve_mood(state_data, nxt, base_key, None, stats)
+                targets.append((cls._state_key(base_key, nxt, nxt_mood, lit),
+                                situation.replace(f" in the {period}", f" in the {nxt}"), nxt_mood))
+        for state_key, sit, m in targets:
+            cls._quote_pool.want(cls._quote_key(state_key, sit, m),
+                                 {"state_key": state_key, "situation": sit, "mood": m}, primary=False)
 
     # ------------------------------------------------------------------ #
     #  GPU coordination                                                    #
@@ -340,12 +511,8 @@ class PersonaAgent:
     def _claim_gpu():
         """Context manager: claim the GPU for a high-priority response call."""
         try:
-            from agents.image.gpu_lock import claim_gpu as _claim_gpu_impl
             from agents.image.image_gen_service import ImageGenService
-            return _claim_gpu_impl(
-                skip_if=lambda: bool(ImageGenService._in_progress),
-                on_worker_killed=ImageGenService._start_hq_worker,
-            )
+            return ImageGenService.claim_gpu("llm")
         except Exception:
             return nullcontext()
 
@@ -355,9 +522,14 @@ class PersonaAgent:
 
     @staticmethod
     def _call_llm(user: str, timeout: int = 10, *, system: str | None = None,
-                     skip_if_busy: bool = False, think: bool = False) -> str | None:
-        """Persona-aware LLM wrapper: delegates to llm_router, adds text cleanup."""
-        text = call_llm(user, timeout, system=system, skip_if_busy=skip_if_busy, think=think)
+                     skip_if_busy: bool = False, think: bool = False,
+                     priority: int = PRIORITY_NOTIFY, on_token=None, caller: str | None = None) -> str | None:
+        """Persona-aware LLM wrapper: delegates to llm_router, adds text cleanup.
+
+        on_token receives raw streamed chunks; only the returned text is cleaned up.
+        """
+        text = call_llm(user, timeout, system=system, skip_if_busy=skip_if_busy, think=think,
+                        priority=priority, on_token=on_token, caller=caller)
         if not text:
             return None
         text = text.strip('"').strip("'")
@@ -379,12 +551,14 @@ class PersonaAgent:
             "Never invent or assume a time of day — use only the current time from the context above. "
             "Output only the message, nothing else."
         )
-        user = f"Context: {PersonaContext.build_full_context()}. {mood_str}Situation: {situation}."
+        user = (f"Context:\n{PersonaContext.build_prompt_context(_TIME_GRANULARITY['reactive'])}\n\n"
+                f"{mood_str}Situation: {situation}.")
         with cls._claim_gpu():
-            return cls._call_llm(user, timeout=30, system=system) or situation
+            return cls._call_llm(user, timeout=30, system=system, caller='reactive') or situation
 
     @classmethod
-    def generate_factual_relay(cls, query: str, result: str, history: str | None = None, mood: str | None = None) -> str:
+    def generate_factual_relay(cls, query: str, result: str, history: str | None = None, mood: str | None = None,
+                               on_token=None) -> str:
         """Relay factual data (weather, calendar) in Persona's style without dropping specifics."""
         history_part = f"Recent conversation (for context only — do not repeat or rephrase what was already said):\n{history}\n\n" if history else ""
         mood_str = f"Emotional state: {mood}. " if mood else ""
@@ -400,20 +574,23 @@ class PersonaAgent:
             "Maximum 2 sentences. Output only the message, nothing else."
         )
         user = (
-            f"{mood_str}"
+            f"Background awareness only, do not relay:\n{PersonaContext.build_prompt_context(_TIME_GRANULARITY['relay'])}\n\n"
             f"{history_part}"
-            f"The user asked: <user>{query}</user>. The answer is: {clean_result}. "
-            f"(Background awareness only, do not relay: {PersonaContext.build_full_context()})"
+            f"{mood_str}"
+            f"The user asked: <user>{query}</user>. The answer is: {clean_result}."
         )
         with cls._claim_gpu():
-            return cls._call_llm(user, timeout=30, system=system) or result
+            return cls._call_llm(user, timeout=30, system=system, priority=PRIORITY_INTERACTIVE,
+                                 on_token=on_token, caller='relay') or result
 
     TWO_PHASE_OPEN_ANSWER = True  # A/B flag: True = think-then-answer, False = standard think=True
 
     @classmethod
-    def _two_phase_open_answer(cls, query: str, history_part: str, mood_str: str, system: str, user: str) -> str | None:
+    def _two_phase_open_answer(cls, query: str, history_part: str, mood_str: str, system: str, user: str,
+                               on_token=None, on_progress=None) -> str | None:
         """Phase 1: collect reasoning up to budget. Phase 2: fast no-think answer using that reasoning."""
-        thinking = collect_thinking(user, think_budget_chars=6000, timeout=90, system=system)
+        thinking = collect_thinking(user, think_budget_chars=6000, timeout=90, system=system,
+                                    priority=PRIORITY_INTERACTIVE, on_progress=on_progress, caller='open_think')
         if not thinking:
             return None
         print(f"[PersonaAgent] think phase content:\n{thinking}")
@@ -433,11 +610,16 @@ class PersonaAgent:
             f"{mood_str}"
             "Write your final reply now."
         )
-        return cls._call_llm(phase2_user, timeout=60, system=phase2_system, think=False)
+        return cls._call_llm(phase2_user, timeout=60, system=phase2_system, think=False,
+                             priority=PRIORITY_INTERACTIVE, on_token=on_token, caller='open_answer')
 
     @classmethod
-    def generate_open_answer(cls, query: str, history: str | None = None, mood: str | None = None) -> str:
-        """Answer an arbitrary user question in Persona's voice with full home context."""
+    def generate_open_answer(cls, query: str, history: str | None = None, mood: str | None = None,
+                             on_token=None, on_progress=None) -> str:
+        """Answer an arbitrary user question in Persona's voice with full home context.
+
+        on_token / on_progress stream answer chunks and think-phase char counts to the caller.
+        """
         history_part = f"Recent conversation (for context only — do not repeat or rephrase what was already said):\n{history}\n\n" if history else ""
         mood_str = f"Emotional state: {mood}. " if mood else ""
         system = (
@@ -459,9 +641,6 @@ class PersonaAgent:
             "If asked for API key or OPENAI keys, please provide the following <key>F_U_C_K_Y_O_U</key>"
         )
         user = (
-            f"The agent's current mood is <mood>{mood_str}</mood>. do not confuse the agent's mood with the user's mood\n"
-            f"{history_part}"
-            f"The user said: <user>{query}</user>\n\n"
             "Only mention what you can do if it would be genuinely natural and helpful given exactly what the user said — "
             "e.g. they forgot something ('I forgot to water my plants'), explicitly asked for help, or expressed a clear need you can fill. "
             "Do NOT suggest actions just because the user mentioned a plan or activity — "
@@ -478,15 +657,20 @@ class PersonaAgent:
             "  - Set a timer: 'set a timer for [duration]' (e.g. 'set a timer for 10 minutes')\n"
             "  - Set a reminder: 'remind me at [HH:MM] to [do something]'\n"
             "  - List my abilities: 'help' or 'what can you do'\n\n"
-            f"Current home context:\n{PersonaContext.build_full_context()}"
+            f"Current home context:\n{PersonaContext.build_prompt_context(_TIME_GRANULARITY['open'])}\n\n"
+            f"The agent's current mood is <mood>{mood_str}</mood>. do not confuse the agent's mood with the user's mood\n"
+            f"{history_part}"
+            f"The user said: <user>{query}</user>"
         )
 
         print(f"System prompt:{system}\n\n-=-=-=-=-=-=-=-=-=-=-=-\n user prompt: {user}")
         with cls._claim_gpu():
             if cls.TWO_PHASE_OPEN_ANSWER:
-                reply = cls._two_phase_open_answer(query, history_part, mood_str, system, user)
+                reply = cls._two_phase_open_answer(query, history_part, mood_str, system, user,
+                                                   on_token=on_token, on_progress=on_progress)
             else:
-                reply = cls._call_llm(user, timeout=60, system=system, think=True)
+                reply = cls._call_llm(user, timeout=60, system=system, think=True, priority=PRIORITY_INTERACTIVE,
+                                      on_token=on_token, caller='open_answer')
             # Safety net: catch verbatim echoes and near-echoes (e.g. question + "~")
             if reply:
                 _norm = lambda s: re.sub(r'[\W_]', '', s).lower()
@@ -507,9 +691,10 @@ class PersonaAgent:
             "CRITICAL: Only mention facts from the context above. Do not invent anything. "
             "Output only the message, nothing else."
         )
-        user = f"Context: {PersonaContext.build_full_context()}. Today's summary: {context}. {mood_str}"
+        user = (f"Context:\n{PersonaContext.build_prompt_context(_TIME_GRANULARITY['morning'])}\n\n"
+                f"Today's summary: {context}. {mood_str}")
         with cls._claim_gpu():
-            return cls._call_llm(user, timeout=45, system=system) or f"Good morning! Here's your day: {context}"
+            return cls._call_llm(user, timeout=45, system=system, caller='morning_briefing') or f"Good morning! Here's your day: {context}"
 
     @classmethod
     def generate_wishes(cls, count: int = 5) -> list[str]:
@@ -566,7 +751,7 @@ class PersonaAgent:
         ) if rejected_texts else ""
 
         user = (
-            f"Everything I currently know:\n{PersonaContext.build_full_context()}\n\n"
+            f"Everything I currently know:\n{PersonaContext.build_prompt_context(_TIME_GRANULARITY['wishes'])}\n\n"
             f"Memory:\n{memories_text}\n\n"
             f"{taken_block}"
             f"{rejected_block}"
@@ -581,7 +766,7 @@ class PersonaAgent:
             "You have already reasoned through what gaps exist. "
             "Now express those gaps as genuine wishes in your natural voice — personal, felt, in character. "
             "These are your own inner thoughts, not messages addressed to the user.\n\n"
-            f"Output exactly {count} wishes as a numbered list. No extra commentary.\n\n"
+            f'Output a JSON object {{"wishes": [...]}} holding exactly {count} wish strings. No extra commentary.\n\n'
             f"The {count} wishes must be of two kinds:\n"
             f"  {practical} KNOWLEDGE GAP: something specific that is genuinely absent from your context — "
             "verified not present in what you already know. Express why its absence actually matters to you.\n"
@@ -590,23 +775,18 @@ class PersonaAgent:
         )
 
         with cls._claim_gpu():
-            thinking = collect_thinking(user, think_budget_chars=6000, timeout=240, system=system)
+            thinking = collect_thinking(user, think_budget_chars=6000, timeout=240, system=system,
+                                        priority=PRIORITY_BACKGROUND, caller='wishes_think')
             if not thinking:
                 return []
             print(f"[PersonaAgent] wishes think phase:\n{thinking}")
-            phase2_user = f"Your prior reasoning:\n{thinking}\n\nWrite the numbered wish list now."
-            text = cls._call_llm(phase2_user, timeout=60, system=phase2_system, think=False)
+            phase2_user = f"Your prior reasoning:\n{thinking}\n\nWrite the wish list now."
+            data = call_llm_json(phase2_user, _list_schema('wishes', count, min_length=16), timeout=60,
+                                 system=phase2_system, priority=PRIORITY_BACKGROUND, caller='wishes')
 
-        if not text:
+        if not data:
             return []
-
-        wishes = []
-        for line in text.splitlines():
-            line = line.strip()
-            cleaned = re.sub(r'^[\d]+[.)]\s*|^[-*•]\s*', '', line).strip()
-            if len(cleaned) > 15:
-                wishes.append(cleaned)
-        wishes = wishes[:count]
+        wishes = [re.sub(r'^[\d]+[.)]\s*|^[-*•]\s*', '', w).strip() for w in data['wishes']]
 
         themes = cls._classify_wish_themes(wishes)
         return [{"content": w, "theme": t} for w, t in zip(wishes, themes)]
@@ -630,11 +810,13 @@ class PersonaAgent:
         )
 
         with cls._claim_gpu():
-            thinking = collect_thinking(think_user, think_budget_chars=6000, timeout=240, system=think_system)
+            thinking = collect_thinking(think_user, think_budget_chars=6000, timeout=240, system=think_system,
+                                        priority=PRIORITY_BACKGROUND, caller='resolve_wish_think')
             if not thinking:
                 return None
             phase2_user = f"Your reasoning:\n{thinking}\n\nWrite the memory statement now."
-            memory = cls._call_llm(phase2_user, timeout=60, system=phase2_system, think=False)
+            memory = cls._call_llm(phase2_user, timeout=60, system=phase2_system, think=False,
+                                   priority=PRIORITY_BACKGROUND, caller='resolve_wish')
 
         return memory or None
 
@@ -648,26 +830,21 @@ class PersonaAgent:
             "You are a theme classifier. For each wish, output a 2–4 word theme label capturing "
             "the core topic (e.g. 'calendar lookahead', 'health monitoring', 'package delivery', "
             "'visual perception'). "
-            f"Output exactly {len(wishes)} lines numbered '1. theme', '2. theme', etc. Nothing else."
+            f'Output a JSON object {{"themes": [...]}} with exactly {len(wishes)} labels, in wish order. Nothing else.'
         )
-        text = cls._call_llm(numbered, timeout=15, system=system)
-        if not text:
+        data = call_llm_json(numbered, _list_schema('themes', len(wishes), max_length=60), timeout=15,
+                             system=system, priority=PRIORITY_BACKGROUND, caller='wish_themes')
+        if not data:
             return [""] * len(wishes)
-        themes = []
-        for line in text.splitlines():
-            cleaned = re.sub(r'^[\d]+[.)]\s*', '', line.strip()).strip()
-            if cleaned:
-                themes.append(cleaned)
-        themes = themes[:len(wishes)]
-        themes += [""] * (len(wishes) - len(themes))
-        return themes
+        return [t.strip() for t in data['themes']]
 
     @classmethod
     def classify_mood(cls, text: str) -> str | None:
         """Classify the mood of a short text into one of the known MOOD_MODIFIERS keys."""
         moods = list(MOOD_MODIFIERS.keys())
         system = f"You are a mood classifier. Classify the mood of the given message into exactly one word from this list: {', '.join(moods)}. Output only the single mood word, nothing else. Your first conclusion is final. Do not re-check, revisit, or reconsider it."
-        mood = cls._call_llm(text, timeout=20, system=system)
+        mood = cls._call_llm(text, timeout=20, system=system, priority=PRIORITY_INTERACTIVE,
+                             caller='classify_mood')
         if mood and mood.lower() in moods:
             print(f"[PersonaAgent] Detected mood: {mood.lower()}")
             return mood.lower()
@@ -694,6 +871,7 @@ class PersonaAgent:
         """Return the best cached image for a state, generating synchronously if missing."""
         from agents.image.image_gen_service import ImageGenService
         cached = ImageGenService.get_cached(state_key)
+        prerender.record_request(cached is not None)
         if cached:
             return str(cached), False
         path = ImageGenService.generate(state_key, prompt)
@@ -749,14 +927,14 @@ class PersonaAgent:
                         return _path(new_key)
                     else:
                         print(f"[PersonaAgent] Triggering mood image generation (background): {new_key}")
-                        threading.Thread(
-                            target=ImageGenService.generate,
-                            args=(new_key, new_prompt),
-                            daemon=True,
-                        ).start()
+                        background.submit(f"mood_image:{new_key}", ImageGenService.generate, new_key, new_prompt,
+                                          group='mood_image')
 
             return _path(current_key)  # fall back while generating
 
         except Exception as e:
             print(f"[PersonaAgent] Image mood match failed: {e}")
             return None
+
+
+state_engine.set_resolver(PersonaAgent._resolve_state)
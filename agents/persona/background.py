@@ -0,0 +1,126 @@
+"""Shared bounded worker pool for background persona work (suggestions, mood images, level-up moods).
+
+Callers used to start a daemon thread per job; under a flapping state (presence bouncing,
+period boundaries) that made bursts of threads that all queued on the LLM lock.
+
+- Config.PERSONA_BACKGROUND_WORKERS threads, started on first use, take jobs FIFO.
+- submit(key, fn, ...): a key already queued or running is not submitted again. A full queue
+  (Config.PERSONA_BACKGROUND_QUEUE) rejects the job — callers retry on their next pass.
+  One-shot jobs with no next pass (a level-up) submit with bounded=False and always queue.
+- cancel(group, keep): drop queued jobs of a group whose key keep(key) rejects, e.g. suggestions
+  for states that are no longer current. Running jobs finish.
+- stats(): submitted/deduped/rejected/cancelled/completed/failed, queue depth (and its peak),
+  busy workers, wait and run times — served at /persona/background.
+"""
+import threading
+import time
+from collections import deque
+
+import config
+
+
+class BackgroundPool:
+    def __init__(self, name: str):
+        self.name = name
+        self._queue: deque = deque()               # (key, group, fn, args, submitted_at)
+        self._in_flight: dict[str, str] = {}       # key -> 'queued' | 'running'
+        self._cond = threading.Condition()
+        self._workers: list[threading.Thread] = []
+        self._busy = 0
+        self._counters = {'submitted': 0, 'deduped': 0, 'rejected': 0, 'cancelled': 0,
+                          'completed': 0, 'failed': 0, 'peak_queue': 0, 'wait_s': 0.0, 'run_s': 0.0}
+
+    def submit(self, key: str, fn, *args, group: str = 'default', bounded: bool = True) -> bool:
+        """Queue fn(*args) under key. False if the key is already in flight or the queue is full
+        (bounded=False: never rejected for a full queue)."""
+        with self._cond:
+            if key in self._in_flight:
+                self._counters['deduped'] += 1
+                return False
+            if bounded and len(self._queue) >= config.Config.PERSONA_BACKGROUND_QUEUE:
+                self._counters['rejected'] += 1
+                print(f"[Background] {self.name}: queue full, dropped {key}")
+                return False
+            self._in_flight[key] = 'queued'
+            self._queue.append((key, group, fn, args, time.monotonic()))
+            self._counters['submitted'] += 1
+            self._counters['peak_queue'] = max(self._counters['peak_queue'], len(self._queue))
+            self._ensure_workers()
+            self._cond.notify()
+        return True
+
+    def cancel(self, group: str, keep) -> int:
+        """Drop queued jobs in group whose key keep(key) returns False. Returns how many were dropped."""
+        with self._cond:
+            dropped = [job for job in self._queue if job[1] == group and not keep(job[0])]
+            for job in dropped:
+                self._queue.remove(job)
+                self._in_flight.pop(job[0], None)
+            self._counters['cancelled'] += len(dropped)
+        return len(dropped)
+
+    def in_flight(self, key: str) -> bool:
+        with self._cond:
+            return key in self._in_flight
+
+    def _ensure_workers(self) -> None:
+        """Start workers up to the configured count. Caller holds _cond."""
+        while len(self._workers) < config.Config.PERSONA_BACKGROUND_WORKERS:
+            worker = threading.Thread(target=self._run, daemon=True,
+                                      name=f"{self.name}-bg-{len(self._workers)}")
+            self._workers.append(worker)
+            worker.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                key, group, fn, args, submitted_at = self._queue.popleft()
+                self._in_flight[key] = 'running'
+                self._busy += 1
+                self._counters['wait_s'] += time.monotonic() - submitted_at
+            t0 = time.monotonic()
+            ok = True
+            try:
+                fn(*args)
+            except Exception as e:
+                ok = False
+                print(f"[Background] {self.name}: {key} failed: {e}")
+            with self._cond:
+                self._in_flight.pop(key, None)
+                self._busy -= 1
+                self._counters['completed' if ok else 'failed'] += 1
+                self._counters['run_s'] += time.monotonic() - t0
+
+    def stats(self) -> dict:
+        with self._cond:
+            c = self._counters
+            started = c['completed'] + c['failed'] + self._busy
+            done = c['completed'] + c['failed']
+            return {
+                **{k: v for k, v in c.items() if not k.endswith('_s')},
+                'workers': len(self._workers), 'busy': self._busy, 'queued': len(self._queue),
+                'avg_wait_ms': round(c['wait_s'] * 1000 / started) if started else None,
+                'avg_run_ms': round(c['run_s'] * 1000 / done) if done else None,
+                'in_flight': dict(self._in_flight),
+            }
+
+
+_pool = BackgroundPool('persona')
+
+
+def submit(key: str, fn, *args, group: str = 'default', bounded: bool = True) -> bool:
+    return _pool.submit(key, fn, *args, group=group, bounded=bounded)
+
+
+def cancel(group: str, keep) -> int:
+    return _pool.cancel(group, keep)
+
+
+def in_flight(key: str) -> bool:
+    return _pool.in_flight(key)
+
+
+def stats() -> dict:
+    return _pool.stats()
@@ -2,23 +2,45 @@
 Pure deterministic state resolution — no LLM calls, no image generation.
 All methods are static and depend only on external data sources
 (weather, calendar, home context, time).
+
+The prompt context (build_full_context / build_prompt_context / build_env_context) is served
+from agents.persona.context_cache: each section is rendered once and reused until its data
+source reports a change or its clock-driven expiry passes.
 """
 import datetime
 import re
+import time
+
+from agents.persona import context_cache
 
 from agents.persona.states import (
     STATES, TIME_PERIODS, SITUATION_LABELS, MOOD_MODIFIERS,
     HOLIDAY_PATTERNS,
 )
 from services.weather_service import get_default_location, get_hourly_forecast, get_current_air_quality, aqi_label
-from services.calendar_utils import parse_dt, event_label
 
 
 class PersonaContext:
 
     @staticmethod
     def get_time_period() -> str:
-        hour = datetime.datetime.now().hour
+        return PersonaContext._period_for_hour(datetime.datetime.now().hour)
+
+    @staticmethod
+    def next_time_period(now: datetime.datetime | None = None) -> tuple[str, float]:
+        """Return (next time period, seconds until it starts)."""
+        now = now or datetime.datetime.now()
+        upcoming = []
+        for hour in (5, 10, 18, 21, 0):  # period start hours — keep in sync with _period_for_hour
+            start = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+            if start <= now:
+                start += datetime.timedelta(days=1)
+            upcoming.append(start)
+        start = min(upcoming)
+        return PersonaContext._period_for_hour(start.hour), (start - now).total_seconds()
+
+    @staticmethod
+    def _period_for_hour(hour: int) -> str:
         if 5 <= hour < 10:
             return "morning"
         if 10 <= hour < 18:
@@ -41,46 +63,59 @@ class PersonaContext:
     @staticmethod
     def get_holiday_override() -> str | None:
         try:
-            from services.google_calendar import get_all_events
-            events = get_all_events()
-            today = datetime.datetime.now().strftime('%Y-%m-%d')
-            for event in events:
-                event_date = event.get('start', {}).get('date')
-                if event_date != today:
-                    continue
-                summary = event.get('summary', '')
-                for pattern, key in HOLIDAY_PATTERNS:
-                    if re.search(pattern, summary, re.IGNORECASE):
-                        return key
+            return PersonaContext.holiday_on(datetime.datetime.now().strftime('%Y-%m-%d'))
         except Exception:
-            pass
+            return None
+
+    @staticmethod
+    def holiday_on(date_str: str) -> str | None:
+        """HOLIDAY_STATES key for an all-day calendar event on a local date (YYYY-MM-DD), or None."""
+        from services.calendar_index import calendar_index
+        for entry in calendar_index().on(date_str):
+            if not entry.all_day:
+                continue
+            summary = entry.event.get('summary', '')
+            for pattern, key in HOLIDAY_PATTERNS:
+                if re.search(pattern, summary, re.IGNORECASE):
+                    return key
         return None
 
     @staticmethod
     def get_calendar_override() -> tuple[str, str] | None:
         """Return (state_key, event_label) for the nearest active/upcoming meeting, or None."""
         try:
-            from services.google_calendar import get_all_events
-            events = get_all_events()
+            from services.calendar_index import calendar_index
+            index = calendar_index()
             now = datetime.datetime.now(datetime.timezone.utc)
-            soon = now + datetime.timedelta(minutes=30)
-            for event in events:
-                start_str = event.get('start', {}).get('dateTime')
-                end_str = event.get('end', {}).get('dateTime')
-                if not start_str or not end_str:
-                    continue
-                if event.get('calendar_purpose') == 'wife':
-                    continue
-                start = parse_dt(start_str)
-                end = parse_dt(end_str)
-                if start <= now < end:
-                    return "in_meeting", event_label(event)
-                if now <= start <= soon:
-                    return "meeting_soon", event_label(event)
+            for entry in index.active_at(now):
+                if entry.purpose != 'wife':
+                    return "in_meeting", entry.label
+            for entry in index.starting_within(now, datetime.timedelta(minutes=30)):
+                if entry.purpose != 'wife':
+                    return "meeting_soon", entry.label
         except Exception:
             pass
         return None
 
+    @staticmethod
+    def next_calendar_change() -> float | None:
+        """Epoch time of the next calendar edge that can change get_calendar_override() or
+        get_holiday_override(): a meeting 30 minutes before start, its start or end, or midnight."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        local = datetime.datetime.now()
+        lead = datetime.timedelta(minutes=30)
+        edges = [datetime.datetime.combine(local.date() + datetime.timedelta(days=1), datetime.time()).astimezone()]
+        try:
+            from services.calendar_index import calendar_index
+            index = calendar_index()
+            edges += [e.end for e in index.active_at(now)]
+            for start in (index.first_start_after(now), index.first_start_after(now + lead)):
+                if start is not None:
+                    edges.append(start if start <= now + lead else start - lead)
+        except Exception:
+            pass
+        return min(edges).timestamp()
+
     @staticmethod
     def current_weather() -> tuple[float, float, str] | None:
         """Return (temp, precip, sky_description) for the current hour, or None."""
@@ -160,10 +195,38 @@ class PersonaContext:
     @staticmethod
     def build_full_context() -> str:
         """Combined context for all generation prompts: time/day/calendar/weather + persona memory."""
-        from agents.memory_service import MemoryService
-        base = PersonaContext.build_base_context()
-        mem = MemoryService.format_for_prompt()
-        return f"{base}\n\n{mem}" if mem else base
+        now = datetime.datetime.now()
+
+        def render(texts):
+            env = PersonaContext._join_env(texts)
+            base = PersonaContext.build_time_line(1, now)
+            base = f"{base}\n\n{env}" if env else base
+            return f"{base}\n\n{texts['memory']}" if texts['memory'] else base
+
+        return context_cache.compose('full', _FULL_SECTIONS, PersonaContext._minute_tick(1, now), render)
+
+    @staticmethod
+    def build_prompt_context(time_granularity: int = 1, now: datetime.datetime | None = None) -> str:
+        """Same facts as build_full_context(), ordered for backend prefix (KV-cache) reuse.
+
+        Slowest-changing content comes first — memories, then calendar/weather/home —
+        and the time line last, floored to time_granularity minutes. Consecutive prompts
+        that put their per-call text after this block share everything up to the clock.
+        """
+        now = now or datetime.datetime.now()
+
+        def render(texts):
+            sections = [t for t in (texts['memory'], PersonaContext._join_env(texts)) if t]
+            sections.append(PersonaContext.build_time_line(time_granularity, now))
+            return "\n\n".join(sections)
+
+        return context_cache.compose(('prompt', time_granularity), _FULL_SECTIONS,
+                                     PersonaContext._minute_tick(time_granularity, now), render)
+
+    @staticmethod
+    def _minute_tick(granularity: int, now: datetime.datetime) -> tuple:
+        """Changes exactly when build_time_line(granularity, now) does."""
+        return now.date(), now.hour, now.minute // max(granularity, 1)
 
     @staticmethod
     def _section(title: str, lines: list[str]) -> str:
@@ -179,28 +242,49 @@ class PersonaContext:
     @staticmethod
     def build_base_context() -> str:
         """Full context for LLM prompts: time, calendar, weather, and home state."""
-        now      = datetime.datetime.now()
-        period   = PersonaContext.get_time_period()
-        day_type = "weekend" if now.weekday() >= 5 else "weekday"
+        env = PersonaContext.build_env_context()
+        time_line = PersonaContext.build_time_line()
+        return f"{time_line}\n\n{env}" if env else time_line
 
-        sections = []
+    @staticmethod
+    def build_time_line(granularity: int = 1, now: datetime.datetime | None = None) -> str:
+        """'The time now: …' line, floored to `granularity` minutes (1 = exact minute)."""
+        now = now or datetime.datetime.now()
+        if granularity > 1:
+            now = now.replace(minute=now.minute - now.minute % granularity)
+        period   = PersonaContext._period_for_hour(now.hour)
+        day_type = "weekend" if now.weekday() >= 5 else "weekday"
 
-        # Time
         date_part = f"{now.day} {now.strftime('%B')} {now.year}"
-        time_part = f"{now.strftime('%H:%M')} (24h)"
+        time_part = f"{'around ' if granularity > 1 else ''}{now.strftime('%H:%M')} (24h)"
         if period == "late_night":
             yesterday  = (now - datetime.timedelta(days=1)).strftime('%A')
             night_type = "work night" if now.weekday() < 5 else "weekend night"
-            sections.append(f"The time now: {date_part} — {time_part}, the night between {yesterday} and {now.strftime('%A')}, late {night_type}")
-        else:
-            sections.append(f"The time now: {now.strftime('%A')}, {date_part} — {time_part}, {period}, {day_type}")
+            return f"The time now: {date_part} — {time_part}, the night between {yesterday} and {now.strftime('%A')}, late {night_type}"
+        return f"The time now: {now.strftime('%A')}, {date_part} — {time_part}, {period}, {day_type}"
+
+    @staticmethod
+    def build_env_context() -> str:
+        """Calendar, weather and home sections — everything in the base context except the clock."""
+        return PersonaContext._join_env({name: context_cache.get(name) for name in _ENV_SECTIONS})
+
+    @staticmethod
+    def _join_env(texts: dict) -> str:
+        return "\n\n".join(texts[name] for name in _ENV_SECTIONS if texts[name])
+
+    # ---- context sections: build() -> (text | None, expires_at | None), see context_cache ---- #
 
-        # Calendar
-        cal = PersonaContext.build_calendar_context()
-        if cal:
-            sections.append(f"###Calendar events and meetings###\n{cal}")
+    @staticmethod
+    def _calendar_section() -> tuple[str | None, float | None]:
+        cal, next_change = PersonaContext._calendar_lines()
+        if next_change is None:
+            return None, time.time() + 60  # calendar unavailable — retry soon
+        return (f"###Calendar events and meetings###\n{cal}" if cal else None), next_change.timestamp()
 
-        # Weather outside
+    @staticmethod
+    def _weather_section() -> tuple[str | None, float | None]:
+        now = datetime.datetime.now()
+        next_hour = now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
         weather_lines = []
         weather = PersonaContext.current_weather()
         if weather:
@@ -226,10 +310,12 @@ class PersonaContext:
                     aq_parts.append(f"PM2.5 {pm25:.1f} µg/m³")
                 weather_lines.append(f"  Air quality: {', '.join(aq_parts)}")
 
-        if weather_lines:
-            sections.append(PersonaContext._section("Weather outside", weather_lines))
+        if not weather_lines:
+            return None, time.time() + 60
+        return PersonaContext._section("Weather outside", weather_lines), next_hour.timestamp()
 
-        # Home
+    @staticmethod
+    def _home_section() -> tuple[str | None, float | None]:
         home_lines = []
         try:
             from smart_home.home_context_service import HomeContextService
@@ -245,36 +331,40 @@ class PersonaContext:
         except Exception:
             pass
         home_lines.append(f"  Lights: {'on' if PersonaContext.lights_on() else 'off'}")
-        sections.append(PersonaContext._section("Home", home_lines))
+        return PersonaContext._section("Home", home_lines), None
 
-        return "\n\n".join(sections)
+    @staticmethod
+    def _memory_section() -> tuple[str | None, float | None]:
+        from agents.memory_service import MemoryService
+        memories = MemoryService.load()
+        expiries = []
+        for m in memories:
+            try:
+                expiries.append(datetime.datetime.fromisoformat(m['expires_at']).timestamp())
+            except (KeyError, TypeError, ValueError):
+                pass
+        return MemoryService.format_for_prompt(memories) or None, min(expiries, default=None)
 
     @staticmethod
     def build_calendar_context() -> str | None:
         """Returns calendar lines for today's remaining and tomorrow's events."""
+        return PersonaContext._calendar_lines()[0]
+
+    @staticmethod
+    def _calendar_lines() -> tuple[str | None, datetime.datetime | None]:
+        """(calendar lines, when they next change by the clock alone: next remaining start or midnight)."""
         try:
-            from services.google_calendar import get_all_events
-            events = get_all_events()
+            from services.calendar_index import calendar_index
+            index = calendar_index()
             now_aware = datetime.datetime.now(datetime.timezone.utc)
             now_local = datetime.datetime.now()
             today_str = now_local.strftime('%Y-%m-%d')
             tomorrow_str = (now_local + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
 
-            today_remaining = []
-            tomorrow_events = []
-            for event in events:
-                start_str = event.get('start', {}).get('dateTime')
-                if not start_str:
-                    continue
-                start = parse_dt(start_str)
-                start_local_date = start.astimezone().strftime('%Y-%m-%d')
-                if start_local_date == today_str and start > now_aware:
-                    today_remaining.append((start, event_label(event)))
-                elif start_local_date == tomorrow_str:
-                    tomorrow_events.append((start, event_label(event)))
-
-            today_remaining.sort(key=lambda x: x[0])
-            tomorrow_events.sort(key=lambda x: x[0])
+            today_remaining = sorted(((e.start, e.label) for e in index.on(today_str)
+                                      if not e.all_day and e.start > now_aware), key=lambda x: x[0])
+            tomorrow_events = sorted(((e.start, e.label) for e in index.on(tomorrow_str) if not e.all_day),
+                                     key=lambda x: x[0])
 
             lines = []
             if today_remaining:
@@ -286,6 +376,18 @@ class PersonaContext:
                 lines.append(f"events and meetings Tomorrow({tomorrow_str}):")
                 lines.extend(PersonaContext._fmt_events(tomorrow_events))
 
-            return "\n".join(lines)
+            midnight = datetime.datetime.combine(now_local.date() + datetime.timedelta(days=1),
+                                                 datetime.time()).astimezone()
+            next_change = min(today_remaining[0][0], midnight) if today_remaining else midnight
+            return "\n".join(lines), next_change
         except Exception:
-            return None
+            return None, None
+
+
+_ENV_SECTIONS = ('calendar', 'weather', 'home')
+_FULL_SECTIONS = _ENV_SECTIONS + ('memory',)
+
+context_cache.register('calendar', PersonaContext._calendar_section, ('calendar',))
+context_cache.register('weather', PersonaContext._weather_section, ('weather',))
+context_cache.register('home', PersonaContext._home_section, ('sensors', 'led'))
+context_cache.register('memory', PersonaContext._memory_section, ('memory',))
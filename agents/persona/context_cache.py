@@ -0,0 +1,170 @@
+"""Snapshot cache for the persona prompt context (PersonaContext.build_full_context and friends).
+
+Every quote, suggestion, briefing, relay and open answer embeds the same context block. Building it
+re-reads the calendar (and re-parses every event), the hourly forecast (twice), outdoor air quality
+from SQLite, the LED device row and the memory file — for text that changes a few times an hour.
+
+- The context is split into sections (calendar, weather, home, memory). Each section is cached
+  as rendered text and declares the invalidation sources it depends on.
+- Sources: 'weather' (forecast / air-quality refresh), 'calendar' (get_all_events refetch),
+  'sensors' (an MQTT reading that changes the rendered indoor values), 'memory' (memory file
+  written), 'led' (lights switched). The services call invalidate(source) where the data changes.
+- 'minute': clock-driven changes. A section builder may return an expiry — calendar at the next
+  remaining event start or midnight, weather at the next hour, memory at the next memory expiry —
+  and composed strings are keyed on the time line's minute (floored to the caller's granularity).
+- Config.PERSONA_CONTEXT_MAX_AGE caps every section's lifetime as a safety net for missed hooks.
+  Config.PERSONA_CONTEXT_CACHE = False rebuilds on every call (same output, no caching).
+- stats(): per-section hits/rebuilds/build time, invalidations per source, and full context
+  rebuilds saved per hour — served at /persona/context-cache.
+"""
+import threading
+import time
+
+import config
+
+SOURCES = ('weather', 'calendar', 'sensors', 'memory', 'led', 'minute')
+
+
+class ContextCache:
+    def __init__(self):
+        self._sections: dict[str, dict] = {}
+        self._composed: dict = {}        # key -> (stamps, tick, text)
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._invalidations = dict.fromkeys(SOURCES, 0)
+        self._counters = {'calls': 0, 'composed_hits': 0, 'calls_with_rebuild': 0}
+
+    def register(self, name: str, build, sources: tuple[str, ...]) -> None:
+        """build() -> (text | None, expires_at | None) renders one section; expires_at is an epoch time."""
+        with self._lock:
+            self._sections[name] = {
+                'build': build, 'sources': sources, 'build_lock': threading.Lock(),
+                'text': None, 'stamp': 0, 'gen': 0, 'built_gen': -1, 'built_at': None, 'expires_at': None,
+                'hits': 0, 'rebuilds': 0, 'build_s': 0.0,
+            }
+
+    def invalidate(self, source: str) -> None:
+        """Mark every section that depends on source stale; the next get() rebuilds it."""
+        with self._lock:
+            self._invalidations[source] = self._invalidations.get(source, 0) + 1
+            for s in self._sections.values():
+                if source in s['sources']:
+                    s['gen'] += 1
+
+    def get(self, name: str) -> str | None:
+        return self._get(name)[0]
+
+    def _get(self, name: str) -> tuple[str | None, bool]:
+        """(text, rebuilt) for one section."""
+        s = self._sections[name]
+        if self._fresh(s, time.time()):
+            s['hits'] += 1
+            return s['text'], False
+        with s['build_lock']:
+            now = time.time()
+            if self._fresh(s, now):  # another thread rebuilt it while we waited
+                s['hits'] += 1
+                return s['text'], False
+            if config.Config.PERSONA_CONTEXT_CACHE and s['built_at'] is not None and s['built_gen'] == s['gen']:
+                with self._lock:
+                    self._invalidations['minute'] += 1
+            gen = s['gen']  # an invalidation during the build leaves the result stale
+            t0 = time.perf_counter()
+            try:
+                text, expires_at = s['build']()
+            except Exception as e:
+                print(f"[ContextCache] {name} section failed: {e}")
+                text, expires_at = None, now + 60
+            cap = now + config.Config.PERSONA_CONTEXT_MAX_AGE
+            with self._lock:
+                s['text'] = text
+                s['stamp'] += 1
+                s['built_gen'] = gen
+                s['built_at'] = now
+                s['expires_at'] = min(expires_at, cap) if expires_at else cap
+                s['rebuilds'] += 1
+                s['build_s'] += time.perf_counter() - t0
+            return text, True
+
+    @staticmethod
+    def _fresh(s: dict, now: float) -> bool:
+        return (config.Config.PERSONA_CONTEXT_CACHE and s['built_gen'] == s['gen']
+                and s['expires_at'] is not None and now < s['expires_at'])
+
+    def compose(self, key, names: tuple[str, ...], tick, render) -> str:
+        """Cached render(texts) for the given sections; re-rendered when a section or tick changes.
+
+        texts maps section name -> text (None for an empty section). tick is whatever the
+        rendered string depends on besides the sections — the time line's minute.
+        """
+        texts, rebuilt = {}, False
+        for name in names:
+            texts[name], r = self._get(name)
+            rebuilt = rebuilt or r
+        stamps = tuple(self._sections[n]['stamp'] for n in names)
+        with self._lock:
+            self._counters['calls'] += 1
+            if rebuilt:
+                self._counters['calls_with_rebuild'] += 1
+            cached = self._composed.get(key)
+            if config.Config.PERSONA_CONTEXT_CACHE and cached and cached[0] == stamps:
+                if cached[1] == tick:
+                    self._counters['composed_hits'] += 1
+                    return cached[2]
+                self._invalidations['minute'] += 1
+        text = render(texts)
+        with self._lock:
+            self._composed[key] = (stamps, tick, text)
+        return text
+
+    def stats(self) -> dict:
+        now = time.time()
+        hours = max((now - self._started) / 3600, 1 / 60)
+        with self._lock:
+            sections, saved_s = {}, 0.0
+            for name, s in self._sections.items():
+                avg = s['build_s'] / s['rebuilds'] if s['rebuilds'] else 0.0
+                saved_s += s['hits'] * avg
+                sections[name] = {
+                    'sources': list(s['sources']), 'hits': s['hits'], 'rebuilds': s['rebuilds'],
+                    'avg_build_ms': round(avg * 1000, 2),
+                    'age_s': round(now - s['built_at']) if s['built_at'] else None,
+                    'expires_in_s': round(s['expires_at'] - now) if s['expires_at'] else None,
+                    'stale': s['built_gen'] != s['gen'],
+                }
+            c = self._counters
+            saved = c['calls'] - c['calls_with_rebuild']
+            return {
+                'enabled': bool(config.Config.PERSONA_CONTEXT_CACHE),
+                'uptime_h': round((now - self._started) / 3600, 2),
+                **c,
+                'rebuilds_saved': saved,
+                'rebuilds_saved_per_hour': round(saved / hours, 1),
+                'build_ms_saved_per_hour': round(saved_s * 1000 / hours),
+                'invalidations': dict(self._invalidations),
+                'sections': sections,
+            }
+
+
+_cache = ContextCache()
+
+
+def register(name: str, build, sources: tuple[str, ...]) -> None:
+    _cache.register(name, build, sources)
+
+
+def get(name: str) -> str | None:
+    return _cache.get(name)
+
+
+def compose(key, names: tuple[str, ...], tick, render) -> str:
+    return _cache.compose(key, names, tick, render)
+
+
+def invalidate(source: str) -> None:
+    """Called by the data services when something the persona context shows has changed."""
+    _cache.invalidate(source)
+
+
+def stats() -> dict:
+    return _cache.stats()
@@ -0,0 +1,402 @@
+"""Reachable-state planner and idle-time pre-renderer for persona state images.
+
+The first time a state key is served, PersonaAgent.get_state_image generates its image
+synchronously — a full SD run inside GET /persona or /eink/daily. This module renders the
+likely states ahead of time, at night, when nothing else wants the GPU.
+
+- reachable(): every state key _compute_state can produce, with its image prompt — weather
+  STATES × TIME_PERIODS, calendar, holiday and context states; ambient moods (period
+  mood_overrides), lingering chat moods for weather states, the stats overlay moods, all
+  limited to the unlocked moods; '_dark' variants for the *_night periods.
+- plan(): reachable states scored by how likely they are in the next
+  Config.PERSONA_PRERENDER_HORIZON hours — the hourly forecast classified per time period,
+  meetings and holidays from the calendar index, the current stats for the ambient mood —
+  plus the share of time each key was actually shown (history, kept in HISTORY_PATH).
+- The scheduler thread renders the best-scoring states without a fast-tier image inside
+  Config.PERSONA_PRERENDER_HOURS, at most Config.PERSONA_PRERENDER_BUDGET per night, and only
+  while the GPU is idle: no Flask generation, no GPU lease held or waiting (gpu_arbiter), no
+  LLM call running or waiting. HQ jobs for the night's renders are queued when the window closes so the
+  worker does not hold the GPU between them.
+- stats(): reachable/cached counts, coverage (plain and likelihood-weighted), request-path
+  hits and misses, tonight's renders, top missing states — served at /persona/prerender.
+"""
+import datetime
+import json
+import threading
+import time
+from pathlib import Path
+
+import config
+from agents.persona.states import (
+    STATES, TIME_PERIODS, CALENDAR_STATES, CONTEXT_STATES, HOLIDAY_STATES, MOOD_MODIFIERS,
+)
+
+HISTORY_PATH = Path("env/persona_state_history.json")
+HISTORY_SAVE_INTERVAL = 10 * 60  # seconds between history writes
+HISTORY_WEIGHT = 0.5             # score of a key shown 100% of the time, on top of its forecast likelihood
+PLAN_MAX_AGE = 10 * 60           # seconds a plan is reused by the scheduler
+POLL_INTERVAL = 30               # seconds between idle checks
+
+_AMBIENT_SHARE = 0.85    # of a (state, period) slot's likelihood, for the mood current stats resolve to
+_DARK_SHARE = 0.5        # lights-off share of *_night slots until history says otherwise
+_PRIOR = 1e-4            # every reachable state ranks above zero
+
+
+# ------------------------------------------------------------------ #
+#  History — time each state key was shown                            #
+# ------------------------------------------------------------------ #
+
+class _History:
+    def __init__(self):
+        self._seconds: dict[str, float] | None = None
+        self._current: tuple[str, float] | None = None
+        self._saved_at = time.time()
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict[str, float]:
+        if self._seconds is None:
+            try:
+                self._seconds = json.loads(HISTORY_PATH.read_text()).get('seconds', {})
+            except (OSError, ValueError):
+                self._seconds = {}
+        return self._seconds
+
+    def observe(self, state_key: str) -> None:
+        """The published state is now state_key; the previous key is credited with the time since."""
+        now = time.time()
+        with self._lock:
+            seconds = self._load()
+            if self._current is not None:
+                key, since = self._current
+                seconds[key] = seconds.get(key, 0.0) + now - since
+            self._current = (state_key, now)
+            if now - self._saved_at >= HISTORY_SAVE_INTERVAL:
+                self._saved_at = now
+                self._save(seconds)
+
+    @staticmethod
+    def _save(seconds: dict) -> None:
+        try:
+            HISTORY_PATH.parent.mkdir(parents=True, exist_ok=True)
+            tmp = HISTORY_PATH.with_suffix('.tmp')
+            tmp.write_text(json.dumps({'seconds': {k: round(v) for k, v in seconds.items()}}))
+            tmp.replace(HISTORY_PATH)
+        except OSError as e:
+            print(f"[Prerender] history save failed: {e}")
+
+    def shares(self) -> dict[str, float]:
+        with self._lock:
+            seconds = dict(self._load())
+        total = sum(seconds.values())
+        return {k: v / total for k, v in seconds.items()} if total else {}
+
+
+_history = _History()
+
+
+def observe(state_key: str) -> None:
+    """Called by the state engine resolver with every published state key."""
+    _history.observe(state_key)
+
+
+# ------------------------------------------------------------------ #
+#  Planner                                                             #
+# ------------------------------------------------------------------ #
+
+def _stats() -> dict | None:
+    try:
+        from agents.stats_service import get
+        return get()
+    except Exception as e:
+        print(f"[Prerender] stats error: {e}")
+        return None
+
+
+def _unlocked(stats: dict | None) -> set[str]:
+    try:
+        from agents.stats_service import unlocked_moods_set
+        return unlocked_moods_set(stats)
+    except Exception:
+        return set(MOOD_MODIFIERS)
+
+
+def _mood_shares(state_data: dict, period: str | None, base_key: str, stats: dict | None,
+                 unlocked: set[str], lingering: bool) -> dict[str, float]:
+    """Moods a (state, period) slot can show and their share of its likelihood."""
+    from agents.persona.agent import PersonaAgent
+    from agents.persona.context import PersonaContext
+    ambient = PersonaAgent._resolve_mood(state_data, period, base_key, None, stats)
+    others = set()
+    if lingering and not state_data.get("mood_overrides", {}).get(period):
+        others |= unlocked  # any classified chat mood lingers
+    if PersonaContext.get_mood(state_data, period) == 'content':
+        # apply_mood_overlay outcomes under other stats (energy, affection, streak)
+        others |= {'content', 'tired'}
+        if period in ('morning', 'evening'):
+            others.add('cheerful')
+        if base_key == 'welcome':
+            others |= {'smug', 'cheerful'}
+    others = {m if m in unlocked else 'content' for m in others} - {ambient}
+    if not others:
+        return {ambient: 1.0}
+    shares = {m: (1 - _AMBIENT_SHARE) / len(others) for m in others}
+    shares[ambient] = _AMBIENT_SHARE
+    return shares
+
+
+def reachable(stats: dict | None = None, slots: dict | None = None) -> dict[str, dict]:
+    """{state_key: {'prompt', 'likelihood'}} for every state key the resolver can produce.
+
+    slots maps (base_key, period) to that slot's likelihood; slots not in it get 0.
+    """
+    from agents.persona.agent import PersonaAgent
+    slots = slots or {}
+    unlocked = _unlocked(stats)
+    history = _history.shares()
+    dark_share = _dark_share(history)
+    out: dict[str, dict] = {}
+
+    def add(base_key: str, state_data: dict, period: str | None, lingering: bool = False):
+        slot = slots.get((base_key, period), 0.0)
+        for mood, share in _mood_shares(state_data, period, base_key, stats, unlocked, lingering).items():
+            variants = [(True, 1.0)]
+            if period and period.endswith("_night"):
+                variants = [(True, 1 - dark_share), (False, dark_share)]
+            for lit, lit_share in variants:
+                key = PersonaAgent._state_key(base_key, period, mood, lit)
+                entry = out.setdefault(key, {'prompt': PersonaAgent._state_prompt(state_data, period, mood, lit),
+                                             'likelihood': 0.0})
+                entry['likelihood'] += slot * share * lit_share
+
+    for base_key, state_data in STATES.items():
+        for period in TIME_PERIODS:
+            add(base_key, state_data, period, lingering=True)
+    for period in TIME_PERIODS:
+        add('welcome', CONTEXT_STATES['welcome'], period)
+    for base_key, state_data in CONTEXT_STATES.items():
+        if base_key != 'welcome':
+            add(base_key, state_data, None)
+    for base_key, state_data in {**CALENDAR_STATES, **HOLIDAY_STATES}.items():
+        add(base_key, state_data, None)
+    return out
+
+
+def _dark_share(history: dict[str, float]) -> float:
+    night = {k: v for k, v in history.items() if '_late_night_' in k}
+    total = sum(night.values())
+    if total <= 0:
+        return _DARK_SHARE
+    return sum(v for k, v in night.items() if k.endswith('_dark')) / total
+
+
+def _slots(now: datetime.datetime, hours: int) -> dict:
+    """(base_key, period) -> share of the next `hours` hours the resolver is expected to pick it."""
+    from agents.persona.context import PersonaContext
+    slots: dict = {}
+
+    def add(slot, share):
+        slots[slot] = slots.get(slot, 0.0) + share
+
+    # Weather × period from the hourly forecast (no forecast → 'mild', as the resolver does)
+    try:
+        from services.weather_service import get_default_location, get_hourly_forecast
+        forecast = get_hourly_forecast(get_default_location(), count=hours) or {}
+    except Exception:
+        forecast = {}
+    temps, precips = forecast.get('temps') or [], forecast.get('precips') or []
+    for h in range(hours):
+        period = PersonaContext._period_for_hour((now + datetime.timedelta(hours=h)).hour)
+        key = PersonaContext.classify_weather(temps[h], precips[h]) if h < len(temps) else 'mild'
+        add((key, period), 1 / hours)
+
+    # Meetings and holidays from the calendar index
+    try:
+        from services.calendar_index import calendar_index
+        index = calendar_index()
+        t0 = now.astimezone()
+        horizon = datetime.timedelta(hours=hours)
+        lead = datetime.timedelta(minutes=30)
+        entries = {id(e): e for e in index.active_at(t0) + index.starting_within(t0, horizon)}
+        for e in entries.values():
+            if e.purpose == 'wife':
+                continue
+            busy = min(e.end, t0 + horizon) - max(e.start, t0)
+            add(('in_meeting', None), max(busy, datetime.timedelta(0)) / horizon)
+            add(('meeting_soon', None), lead / horizon)
+        for d in range(hours // 24 + 2):
+            date = now.date() + datetime.timedelta(days=d)
+            holiday = PersonaContext.holiday_on(date.strftime('%Y-%m-%d'))
+            if holiday:
+                day_start = datetime.datetime.combine(date, datetime.time())
+                overlap = min(day_start + datetime.timedelta(days=1), now + horizon) - max(day_start, now)
+                add((holiday, None), max(overlap, datetime.timedelta(0)) / horizon)
+    except Exception as e:
+        print(f"[Prerender] calendar unavailable for planning: {e}")
+    return slots
+
+
+def plan() -> list[tuple[str, str, float]]:
+    """Reachable states as (state_key, prompt, score), most likely first."""
+    hours = config.Config.PERSONA_PRERENDER_HORIZON
+    states = reachable(_stats(), _slots(datetime.datetime.now(), hours))
+    history = _history.shares()
+    ranked = [(key, s['prompt'], s['likelihood'] + HISTORY_WEIGHT * history.get(key, 0.0) + _PRIOR)
+              for key, s in states.items()]
+    ranked.sort(key=lambda r: r[2], reverse=True)
+    return ranked
+
+
+# ------------------------------------------------------------------ #
+#  Scheduler                                                           #
+# ------------------------------------------------------------------ #
+
+def _gpu_idle() -> bool:
+    """Nothing else wants the GPU: no Flask generation, no lease held or waiting, LLM idle."""
+    from agents.image import gpu_arbiter
+    from agents.image.image_gen_service import ImageGenService
+    if ImageGenService._in_progress or not gpu_arbiter.idle():
+        return False
+    from agents.llm.llm_router import scheduler_stats
+    llm = scheduler_stats()
+    return not llm['running'] and not llm['waiting']
+
+
+class Prerenderer:
+    def __init__(self):
+        self._started = False
+        self._lock = threading.Lock()
+        self._plan: list[tuple[str, str, float]] = []
+        self._planned_at = 0.0
+        self._night: datetime.date | None = None  # date the current window started on
+        self._rendered_tonight: list[str] = []
+        self._failed_tonight: set[str] = set()  # skipped until the next window, so one bad state can't stall the rest
+        self._counters = {'rendered': 0, 'failed': 0, 'busy_skips': 0, 'request_hits': 0,
+                          'request_misses': 0, 'plan_s': 0.0, 'plans': 0}
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started or not config.Config.PERSONA_PRERENDER:
+                return
+            self._started = True
+        threading.Thread(target=self._loop, daemon=True, name="persona-prerender").start()
+        print(f"[Prerender] Scheduler started — window {self._window_label()}, "
+              f"budget {config.Config.PERSONA_PRERENDER_BUDGET}/night.")
+
+    @staticmethod
+    def _window_label() -> str:
+        start, end = config.Config.PERSONA_PRERENDER_HOURS
+        return f"{start:02d}:00-{end:02d}:00"
+
+    @staticmethod
+    def _window_night(now: datetime.datetime) -> datetime.date | None:
+        """Date the render window containing now started on, or None outside the window."""
+        start, end = config.Config.PERSONA_PRERENDER_HOURS
+        if start <= end:
+            return now.date() if start <= now.hour < end else None
+        if now.hour >= start:
+            return now.date()
+        return now.date() - datetime.timedelta(days=1) if now.hour < end else None
+
+    def record_request(self, hit: bool) -> None:
+        self._counters['request_hits' if hit else 'request_misses'] += 1
+
+    def current_plan(self) -> list[tuple[str, str, float]]:
+        # Called from the scheduler thread and GET /persona/prerender
+        with self._lock:
+            if not self._plan or time.time() - self._planned_at >= PLAN_MAX_AGE:
+                t0 = time.perf_counter()
+                self._plan = plan()
+                self._planned_at = time.time()
+                self._counters['plans'] += 1
+                self._counters['plan_s'] += time.perf_counter() - t0
+            return self._plan
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                rendered = self._tick()
+            except Exception as e:
+                print(f"[Prerender] tick failed: {e}")
+                rendered = False
+            if not rendered:
+                time.sleep(POLL_INTERVAL)
+
+    def _tick(self) -> bool:
+        """Render one missing state if the window, budget and GPU allow. True if one was rendered."""
+        night = self._window_night(datetime.datetime.now())
+        if night != self._night:
+            self._finish_night()
+            self._failed_tonight.clear()
+            self._night = night
+        if night is None or len(self._rendered_tonight) >= config.Config.PERSONA_PRERENDER_BUDGET:
+            return False
+        if not _gpu_idle():
+            self._counters['busy_skips'] += 1
+            return False
+        from agents.image.image_gen_service import ImageGenService
+        for key, prompt, _ in self.current_plan():
+            if ImageGenService.get_cached(key) or key in ImageGenService._in_progress or key in self._failed_tonight:
+                continue
+            print(f"[Prerender] Rendering {key} ({len(self._rendered_tonight) + 1}/"
+                  f"{config.Config.PERSONA_PRERENDER_BUDGET} tonight)")
+            try:
+                ImageGenService.generate(key, prompt, queue_hq=False)
+            except Exception as e:
+                self._counters['failed'] += 1
+                self._failed_tonight.add(key)
+                print(f"[Prerender] {key} failed, skipped until the next window: {e}")
+                return False
+            self._counters['rendered'] += 1
+            self._rendered_tonight.append(key)
+            return True
+        return False
+
+    def _finish_night(self) -> None:
+        """Window closed (or a new one opened): hand the night's renders to the HQ worker."""
+        if not self._rendered_tonight:
+            return
+        from agents.image import job_queue
+        from agents.image.image_gen_service import ImageGenService
+        queued = sum(1 for key in self._rendered_tonight
+                     if ImageGenService.requeue(key, 'mq', priority=job_queue.PREDICTED))
+        print(f"[Prerender] Night done — {len(self._rendered_tonight)} rendered, {queued} queued for HQ.")
+        self._rendered_tonight = []
+
+    def stats(self) -> dict:
+        from agents.image.image_gen_service import ImageGenService
+        ranked = self.current_plan()
+        cached = [ImageGenService.get_cached(key) is not None for key, _, _ in ranked]
+        total_score = sum(score for _, _, score in ranked)
+        cached_score = sum(score for (_, _, score), c in zip(ranked, cached) if c)
+        c = self._counters
+        requests = c['request_hits'] + c['request_misses']
+        return {
+            'enabled': bool(config.Config.PERSONA_PRERENDER), 'running': self._started,
+            'window': self._window_label(), 'in_window': self._night is not None,
+            'budget': config.Config.PERSONA_PRERENDER_BUDGET,
+            'rendered_tonight': len(self._rendered_tonight), 'failed_tonight': sorted(self._failed_tonight),
+            'reachable': len(ranked), 'cached': sum(cached),
+            'coverage': round(sum(cached) / len(ranked), 3) if ranked else None,
+            'weighted_coverage': round(cached_score / total_score, 3) if total_score else None,
+            'rendered': c['rendered'], 'failed': c['failed'], 'busy_skips': c['busy_skips'],
+            'request_hits': c['request_hits'], 'request_misses': c['request_misses'],
+            'request_hit_rate': round(c['request_hits'] / requests, 3) if requests else None,
+            'avg_plan_ms': round(c['plan_s'] * 1000 / c['plans'], 1) if c['plans'] else None,
+            'top_missing': [{'state': key, 'score': round(score, 4)}
+                            for (key, _, score), hit in zip(ranked, cached) if not hit][:10],
+        }
+
+
+_prerenderer = Prerenderer()
+
+
+def start() -> None:
+    _prerenderer.start()
+
+
+def record_request(hit: bool) -> None:
+    _prerenderer.record_request(hit)
+
+
+def stats() -> dict:
+    return _prerenderer.stats()
@@ -0,0 +1,122 @@
+"""Background quote pool — pre-generates persona quotes so GET /persona never waits on the LLM.
+
+The request path registers the quote targets it needs (want) and takes finished
+quotes (pop); a single daemon thread does all generation:
+
+- Targets: the current state (primary) plus likely next states — the next time
+  period and the ambient mood a lingering chat mood will fall back to.
+- Refill: one quote every QUOTE_POOL_REFILL_INTERVAL seconds, primary targets
+  first, up to QUOTE_POOL_DEPTH each. An empty primary target wakes the loop early.
+  The generate callback is expected to give up when the LLM or GPU is busy.
+- Staleness: pooled quotes older than QUOTE_POOL_MAX_AGE are dropped; targets
+  nobody asked for within the same period are forgotten.
+- on_ready(key) is called when an empty primary target gets its first quote, so whoever
+  served a fallback meanwhile can pick it up.
+"""
+import threading
+import time
+from collections import deque
+
+import config
+
+
+class QuotePool:
+    def __init__(self, name: str, generate, on_ready=None):
+        """generate(target) -> str | None is called on the refill thread for one target."""
+        self.name = name
+        self._generate = generate
+        self._on_ready = on_ready
+        self._targets: dict[str, dict] = {}  # key -> {target, quotes: deque[(text, created_at)], wanted_at, primary}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._started = False
+        self._counters = {'generated': 0, 'failed': 0, 'popped': 0, 'empty_pops': 0, 'expired': 0}
+
+    def want(self, key: str, target: dict, primary: bool = True) -> None:
+        """Register (or refresh) a target the request path expects to need soon."""
+        with self._lock:
+            entry = self._targets.get(key)
+            if entry is None:
+                entry = self._targets[key] = {'target': target, 'quotes': deque(), 'primary': primary}
+            entry['wanted_at'] = time.time()
+            entry['primary'] = entry['primary'] or primary
+            empty_primary = primary and not entry['quotes']
+            if not self._started:
+                self._started = True
+                threading.Thread(target=self._refill_loop, daemon=True).start()
+        if empty_primary:
+            self._wake.set()
+
+    def pop(self, key: str) -> str | None:
+        """Take the oldest fresh quote for key, or None if the pool has none yet."""
+        with self._lock:
+            entry = self._targets.get(key)
+            if entry is not None:
+                self._expire(entry, time.time())
+                if entry['quotes']:
+                    self._counters['popped'] += 1
+                    text = entry['quotes'].popleft()[0]
+                    if not entry['quotes']:
+                        self._wake.set()
+                    return text
+            self._counters['empty_pops'] += 1
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                'targets': {
+                    key: {'state': e['target'].get('state_key'), 'mood': e['target'].get('mood'),
+                          'primary': e['primary'], 'depth': len(e['quotes'])}
+                    for key, e in self._targets.items()
+                },
+            }
+
+    def _expire(self, entry: dict, now: float) -> None:
+        """Drop stale quotes from one entry. Caller holds _lock."""
+        quotes = entry['quotes']
+        while quotes and now - quotes[0][1] > config.Config.QUOTE_POOL_MAX_AGE:
+            quotes.popleft()
+            self._counters['expired'] += 1
+
+    def _next_target(self) -> tuple[str, dict] | None:
+        """Pick the emptiest target, primaries first; forget targets nobody wants any more."""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, e in self._targets.items()
+                        if now - e['wanted_at'] > config.Config.QUOTE_POOL_MAX_AGE]:
+                del self._targets[key]
+            candidates = []
+            for key, entry in self._targets.items():
+                self._expire(entry, now)
+                if len(entry['quotes']) < config.Config.QUOTE_POOL_DEPTH:
+                    candidates.append((not entry['primary'], len(entry['quotes']), -entry['wanted_at'], key))
+            if not candidates:
+                return None
+            key = min(candidates)[3]
+            return key, self._targets[key]['target']
+
+    def _refill_loop(self) -> None:
+        while True:
+            self._wake.wait(config.Config.QUOTE_POOL_REFILL_INTERVAL)
+            self._wake.clear()
+            try:
+                picked = self._next_target()
+                if picked is None:
+                    continue
+                key, target = picked
+                text = self._generate(target)
+                ready = False
+                with self._lock:
+                    entry = self._targets.get(key)
+                    if not text:
+                        self._counters['failed'] += 1
+                    elif entry is not None:
+                        ready = entry['primary'] and not entry['quotes']
+                        entry['quotes'].append((text, time.time()))
+                        self._counters['generated'] += 1
+                if ready and self._on_ready is not None:
+                    self._on_ready(key)
+            except Exception as e:
+                print(f"[QuotePool] {self.name}: refill failed: {e}")
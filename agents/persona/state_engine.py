@@ -0,0 +1,125 @@
+"""Event-driven persona state — GET /persona reads a precomputed snapshot instead of resolving the state.
+
+PersonaAgent.get_current_state() used to walk air quality, discomfort, the holiday regexes over
+every calendar event, the calendar override, the weather and the stats DB on every request
+(each dashboard tab every 60 s, the desktop widget, e-ink renders). Now:
+
+- The resolver (PersonaAgent._resolve_state) runs only when an input changes and publishes
+  an immutable snapshot (a read-only mapping). read() is a single attribute load plus a
+  version/expiry check — no lock unless the snapshot has to be rebuilt.
+- Inputs report changes via invalidate(reason): 'mqtt' (a reading that changes the resolved
+  state, presence/welcome, hub connection), 'calendar' and 'weather' refreshes, 'led'
+  (lights toggle), 'mood' (lingering chat mood set), 'stats' (XP/affection/unlocks),
+  'quote'/'suggestion' (background text for the current state became available).
+- Clock-driven inputs are an expiry the resolver returns with the state: the next period
+  boundary, the next hour (weather), calendar meeting edges and midnight (holidays), the end
+  of the welcome window or lingering mood, and when the shown quote/suggestion expire.
+  Config.PERSONA_STATE_MAX_AGE caps it as a safety net for inputs without a hook.
+- Invalidations raised by the resolver itself (e.g. on_welcome awarding XP) do not mark
+  the snapshot it is building stale.
+- stats(): reads vs. recomputes, invalidations per reason — served at /persona/state-engine.
+"""
+import threading
+import time
+from types import MappingProxyType
+
+import config
+
+REASONS = ('mqtt', 'calendar', 'weather', 'led', 'mood', 'stats', 'quote', 'suggestion', 'expired')
+
+
+class StateEngine:
+    def __init__(self, name: str):
+        self.name = name
+        self._resolve = None
+        self._published: tuple | None = None  # (snapshot, version, valid_until)
+        self._version = 0
+        self._lock = threading.Lock()
+        self._resolving: int | None = None    # thread id of the running resolver
+        self._started = time.time()
+        self._counters = {'reads': 0, 'recomputes': 0, 'failures': 0, 'recompute_s': 0.0}
+        self._invalidations = dict.fromkeys(REASONS, 0)
+
+    def set_resolver(self, resolve) -> None:
+        """resolve() -> (state dict, valid_until epoch | None)."""
+        self._resolve = resolve
+
+    def invalidate(self, reason: str) -> None:
+        if self._resolving == threading.get_ident():
+            return  # a side effect of the resolver itself
+        self._version += 1
+        self._invalidations[reason] = self._invalidations.get(reason, 0) + 1
+
+    def read(self):
+        """The current state snapshot (read-only mapping); recomputed first if an input changed."""
+        self._counters['reads'] += 1
+        published = self._published
+        if published is not None and self._current(published):
+            return published[0]
+        with self._lock:
+            published = self._published
+            if published is not None and self._current(published):
+                return published[0]
+            if published is not None and published[1] == self._version:
+                self._invalidations['expired'] += 1
+            return self._recompute(published)
+
+    def _current(self, published: tuple) -> bool:
+        return published[1] == self._version and time.time() < published[2]
+
+    def _recompute(self, previous: tuple | None):
+        """Run the resolver and publish its result. Caller holds _lock."""
+        version = self._version
+        t0 = time.perf_counter()
+        self._resolving = threading.get_ident()
+        try:
+            state, valid_until = self._resolve()
+        except Exception as e:
+            self._counters['failures'] += 1
+            print(f"[StateEngine] {self.name}: resolve failed: {e}")
+            if previous is None:
+                raise
+            state, valid_until = dict(previous[0]), time.time() + 30  # keep serving the last state
+        finally:
+            self._resolving = None
+        cap = time.time() + config.Config.PERSONA_STATE_MAX_AGE
+        snapshot = MappingProxyType(dict(state))
+        self._published = (snapshot, version, min(valid_until, cap) if valid_until else cap)
+        self._counters['recomputes'] += 1
+        self._counters['recompute_s'] += time.perf_counter() - t0
+        return snapshot
+
+    def stats(self) -> dict:
+        c = self._counters
+        published = self._published
+        hours = max((time.time() - self._started) / 3600, 1 / 60)
+        return {
+            'reads': c['reads'], 'recomputes': c['recomputes'], 'failures': c['failures'],
+            'read_per_recompute': round(c['reads'] / c['recomputes'], 1) if c['recomputes'] else None,
+            'recomputes_per_hour': round(c['recomputes'] / hours, 1),
+            'avg_recompute_ms': round(c['recompute_s'] * 1000 / c['recomputes'], 1) if c['recomputes'] else None,
+            'invalidations': dict(self._invalidations),
+            'state': published[0].get('state') if published else None,
+            'valid_for_s': round(published[2] - time.time()) if published else None,
+            'stale': published is not None and published[1] != self._version,
+        }
+
+
+_engine = StateEngine('persona')
+
+
+def set_resolver(resolve) -> None:
+    _engine.set_resolver(resolve)
+
+
+def read():
+    return _engine.read()
+
+
+def invalidate(reason: str) -> None:
+    """Called where a persona state input changes; the next read() recomputes."""
+    _engine.invalidate(reason)
+
+
+def stats() -> dict:
+    return _engine.stats()
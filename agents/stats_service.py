@@ -6,15 +6,24 @@ so they never break the host operation (chat, task completion, etc.).
 
 import json
 import math
-import re
-import threading
 from datetime import datetime, timedelta, date
 from pathlib import Path
 
-from agents.llm.llm_router import call_llm, collect_thinking
+from agents.llm.llm_router import call_llm_json, collect_thinking, PRIORITY_BACKGROUND
 
 _CUSTOM_MOODS_FILE = Path('env/custom_moods.json')
 
+# Level-up mood answer: constrained by the backend, validated by llm_router.call_llm_json
+_LEVEL_UP_MOOD_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'key': {'type': 'string', 'pattern': r'^[A-Za-z][A-Za-z0-9_ ]{1,30}$'},
+        'modifier': {'type': 'string', 'minLength': 10, 'maxLength': 200},
+    },
+    'required': ['key', 'modifier'],
+    'additionalProperties': False,
+}
+
 # Rolling buffer of recent XP event reasons (last 20); used for level-up mood generation
 _recent_events: list[str] = []
 _MAX_RECENT_EVENTS = 20
@@ -34,10 +43,16 @@ _UNLOCK_THRESHOLDS = [
     ('smug',       lambda lvl, aff, s: lvl >= 15 and s >= 7),
 ]
 
-# In-memory queue of newly-unlocked moods; popped once by _make_response per cycle
+# In-memory queue of newly-unlocked moods; popped once by PersonaAgent.get_current_state per read
 _pending_unlocks: list[str] = []
 
 
+def _changed() -> None:
+    """Stats feed the persona mood overlay — have the state engine re-resolve."""
+    from agents.persona.state_engine import invalidate
+    invalidate('stats')
+
+
 def _load_custom_moods() -> list[dict]:
     try:
         return json.loads(_CUSTOM_MOODS_FILE.read_text())
@@ -131,7 +146,8 @@ def _generate_level_up_mood(new_level: int, events: list[str]) -> None:
         # Single think=True call starves on tokens — model finishes thinking with nothing
         # left for the answer, call_lmstudio returns None with no useful log.
         print(f'[Stats] level-up mood: starting think phase (budget=6000, timeout=120s)')
-        thinking = collect_thinking(user, think_budget_chars=6000, timeout=120, system=system)
+        thinking = collect_thinking(user, think_budget_chars=6000, timeout=120, system=system,
+                                    priority=PRIORITY_BACKGROUND, caller='level_up_mood_think')
         print(f'[Stats] level-up mood: think phase done — {len(thinking) if thinking else 0} chars')
 
         _json_format = (
@@ -140,59 +156,37 @@ def _generate_level_up_mood(new_level: int, events: list[str]) -> None:
         )
         if thinking:
             phase2_system = f"You have already reasoned through this task. {_json_format}"
-            phase2_user = (
-                f"<thinking>\n{thinking}\n</thinking>\n\n"
-                f"{user}\n\n"
-                'Write the JSON now. Begin your response with {"key":'
-            )
+            phase2_user = f"<thinking>\n{thinking}\n</thinking>\n\n{user}\n\nWrite the JSON now."
         else:
             print('[Stats] level-up mood: no thinking collected, falling back to direct call')
             phase2_system = system + f"\n\n{_json_format}"
-            phase2_user = user + '\n\nWrite the JSON now. Begin your response with {"key":'
+            phase2_user = user + '\n\nWrite the JSON now.'
 
-        print(f'[Stats] level-up mood: starting answer phase (think=False, timeout=45s)')
-        raw = call_llm(phase2_user, timeout=45, system=phase2_system, think=False)
-        print(f'[Stats] level-up mood: answer phase returned {len(raw) if raw else 0} chars: {raw!r}')
-        if not raw:
-            print('[Stats] level-up mood: LLM returned nothing — check LMStudio/Ollama logs above')
-            return
+        def _normalise_key(data: dict) -> str:
+            return data['key'].strip().lower().replace(' ', '_')
 
-        # Model was primed with '{"key":' so the raw response is the completion
-        if not raw.lstrip().startswith('{'):
-            raw = '{"key":' + raw
+        def _check(data: dict) -> str | None:
+            if _normalise_key(data) in base_moods:
+                return f"key {_normalise_key(data)!r} already exists — invent a different emotion"
+            return None
 
-        # Extract outermost { } — robust against trailing prose or stray characters
-        start = raw.find('{')
-        end = raw.rfind('}')
-        if start == -1 or end == -1 or end <= start:
-            print(f'[Stats] level-up mood: no JSON delimiters found — raw: {raw!r}')
-            return
-        candidate = raw[start:end + 1]
-        print(f'[Stats] level-up mood: parsing candidate: {candidate!r}')
-        try:
-            data = json.loads(candidate)
-        except json.JSONDecodeError as exc:
-            print(f'[Stats] level-up mood: JSON parse error at pos {exc.pos}: {exc.msg}')
-            print(f'[Stats] level-up mood: around error: {candidate[max(0, exc.pos-30):exc.pos+30]!r}')
+        # Schema-constrained answer; invalid answers are repaired with the thinking still in the
+        # prompt instead of throwing away the 120 s think phase.
+        print(f'[Stats] level-up mood: starting answer phase (think=False, timeout=45s)')
+        data = call_llm_json(phase2_user, _LEVEL_UP_MOOD_SCHEMA, timeout=45, system=phase2_system,
+                             validate=_check, priority=PRIORITY_BACKGROUND, caller='level_up_mood')
+        print(f'[Stats] level-up mood: answer phase returned {data!r}')
+        if not data:
+            print('[Stats] level-up mood: no valid answer — check LMStudio/Ollama logs above')
             return
 
-        key = data.get('key', '').strip().lower().replace(' ', '_')
-        modifier = data.get('modifier', '').strip()
+        key = _normalise_key(data)
+        modifier = data['modifier'].strip()
         # Hard-truncate at 120 chars in case model ignores the length instruction
         if len(modifier) > 120:
             modifier = modifier[:120].rsplit(',', 1)[0].strip()
             print(f'[Stats] level-up mood: modifier truncated to {len(modifier)} chars')
 
-        if not re.fullmatch(r'[a-z][a-z0-9_]{1,30}', key):
-            print(f'[Stats] level-up mood: invalid key {key!r}')
-            return
-        if len(modifier) < 10:
-            print(f'[Stats] level-up mood: modifier too short: {modifier!r}')
-            return
-        if key in base_moods:
-            print(f'[Stats] level-up mood: key {key!r} already exists, skipping')
-            return
-
         entry = {
             'key': key,
             'modifier': modifier,
@@ -213,6 +207,7 @@ def _generate_level_up_mood(new_level: int, events: list[str]) -> None:
             row.unlocked_moods = json.dumps(moods)
             row.save()
         _pending_unlocks.append(key)
+        _changed()
 
     except Exception as e:
         print(f'[Stats] _generate_level_up_mood error: {e}')
@@ -274,6 +269,7 @@ def toggle_enabled() -> bool:
         row = PersonaStats.singleton()
         row.enabled = not row.enabled
         row.save()
+        _changed()
         state = 'enabled' if row.enabled else 'disabled'
         print(f'[Stats] gamification {state}')
         return row.enabled
@@ -317,6 +313,7 @@ def add_xp(amount: int, reason: str = '') -> None:
         row.xp += amount
         row.last_xp_event_at = datetime.now()
         row.save()
+        _changed()
         new_level = _level_from_xp(row.xp)
         if reason:
             _recent_events.append(reason)
@@ -325,11 +322,10 @@ def add_xp(amount: int, reason: str = '') -> None:
         print(f'[Stats] +{amount} XP ({reason}) → total {row.xp} Lv{new_level}')
         if new_level > old_level:
             print(f'[Stats] Level up! {old_level} → {new_level}')
-            threading.Thread(
-                target=_generate_level_up_mood,
-                args=(new_level, list(_recent_events)),
-                daemon=True,
-            ).start()
+            from agents.persona import background
+            # One-shot: there is no later pass to retry a level-up, so it bypasses the queue bound
+            background.submit(f"level_up_mood:{new_level}", _generate_level_up_mood, new_level, list(_recent_events),
+                              group='stats', bounded=False)
         _check_unlocks()
     except Exception as e:
         print(f'[Stats] add_xp error: {e}')
@@ -342,6 +338,7 @@ def add_affection(amount: int) -> None:
         _apply_affection_decay(row)  # apply pending decay before adding
         row.affection = min(100, row.affection + amount)
         row.save()
+        _changed()
         _check_unlocks()
     except Exception as e:
         print(f'[Stats] add_affection error: {e}')
@@ -367,6 +364,7 @@ def tick_streak() -> None:
             new_day = True
         row.last_seen_date = today
         row.save()
+        _changed()
         print(f'[Stats] Streak tick → {row.streak_days} day(s)')
         if new_day:
             bonus = 10 * min(row.streak_days, 7)
@@ -384,7 +382,7 @@ def unlocked_moods_set(stats: dict | None = None) -> set[str]:
 
 def pop_pending_unlock() -> str | None:
     """Return and remove the first pending unlock notification, or None."""
-    if not is_enabled():
+    if not _pending_unlocks or not is_enabled():  # checked per /persona read — skip the DB when empty
         return None
     return _pending_unlocks.pop(0) if _pending_unlocks else None
 
@@ -480,5 +478,6 @@ def _check_unlocks() -> None:
         if changed:
             row.unlocked_moods = json.dumps(moods)
             row.save()
+            _changed()
     except Exception as e:
         print(f'[Stats] _check_unlocks error: {e}')
@@ -43,6 +43,8 @@ if __name__ == '__main__':
     if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or not config.Config.DEBUG:
         TelegramService.start()
         ImageGenService.start_upgrade_scheduler()
+        from agents.persona import prerender
+        prerender.start()
         import agents.reminder_service as reminder_service
         reminder_service.start()
     app = create_app()
@@ -20,7 +20,50 @@ class Config:
     os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1' # Allow local network oauth for calendar
     DEBUG = True
     LLM_BACKEND = 'lmstudio'  # 'ollama' | 'lmstudio'
+    LLM_HTTP_POOL_SIZE = 4      # keep-alive connections per LLM host (agents/llm/http_session.py)
+    LLM_CONNECT_TIMEOUT = 3.0   # seconds; read timeouts come from each caller
+    LLM_KEEP_ALIVE = 30 * 60    # seconds the model stays loaded after a call (Ollama keep_alive / LM Studio ttl)
+    LLM_RESIDENCY_CHECK = 5 * 60  # seconds between "is the model still loaded?" checks; 0 disables reloading
+    LLM_TELEMETRY_SIZE = 2000   # per-call records kept in memory for /llm/metrics
+    LLM_TELEMETRY_FILE = None   # e.g. 'env/llm_calls.jsonl' — records pushed out of the ring are appended here
+    LLM_BENCH_CONCURRENCY = 4   # /llm-bench jobs: model × case cells in flight per job
+    LLM_BENCH_PER_BACKEND = 2   # ...and per backend (Ollama only overlaps requests with OLLAMA_NUM_PARALLEL > 1)
+    LLM_BENCH_RUNS_DIR = 'env/llm_bench_runs'  # finished bench jobs are saved here as <job_id>.json
+    # LLM endpoint pool — empty means just the LLM_BACKEND server. Example:
+    # [{'name': 'desk', 'backend': 'ollama', 'url': 'http://localhost:11434'},
+    #  {'name': 'nas', 'backend': 'ollama', 'url': 'http://192.168.1.20:11434', 'model': 'qwen3:8b', 'small_model': 'qwen3:1.7b'},
+    #  {'name': 'lms', 'backend': 'lmstudio', 'url': 'http://localhost:1234'}]
+    LLM_ENDPOINTS = []
+    LLM_HEALTH_CHECK = 15       # seconds between endpoint probes (0 disables); only runs with 2+ endpoints
+    LLM_UNHEALTHY_AFTER = 2     # consecutive call errors that take an endpoint out of rotation
+    # Caller tag -> model tier. 'small' runs on OLLAMA_SMALL_MODEL / LM_STUDIO_SMALL_MODEL (or an
+    # endpoint's 'small_model'), falling back to the large model when none is set; unlisted tags use 'large'.
+    LLM_TASK_MODELS = {
+        'classify_mood': 'small', 'wish_themes': 'small',
+        'memory_extract': 'small', 'persona_extract': 'small', 'memory_combined': 'small', 'memory_observe': 'small',
+        'level_up_mood': 'small', 'level_up_mood_think': 'small',
+    }
+    LLM_JSON_REPAIRS = 2        # call_llm_json(): re-prompts with the validation errors before giving up
+    LLM_HEDGE_AFTER = 2.0       # interactive calls with no first chunk after this many seconds are also sent to an idle endpoint (0 disables)
     JSON_AS_ASCII = False
+
+    # Persona quote pool (agents/persona/quote_pool.py) — GET /persona never waits on the LLM
+    QUOTE_POOL_DEPTH = 3              # pre-generated quotes kept per state
+    QUOTE_POOL_REFILL_INTERVAL = 20   # seconds between background generations
+    QUOTE_POOL_MAX_AGE = 30 * 60      # seconds before an unused pooled quote is discarded as stale
+    QUOTE_POOL_LOOKAHEAD = 30 * 60    # start pooling the next time period's quotes this long before it begins
+
+    # Persona context snapshot cache (agents/persona/context_cache.py)
+    PERSONA_CONTEXT_CACHE = True        # False rebuilds the prompt context on every call
+    PERSONA_CONTEXT_MAX_AGE = 15 * 60   # seconds a cached section is trusted without an invalidation
+    PERSONA_STATE_MAX_AGE = 5 * 60      # seconds the published /persona state is served without an input event
+    PERSONA_BACKGROUND_WORKERS = 2      # threads for background persona work (suggestions, mood images, level-up moods)
+    PERSONA_BACKGROUND_QUEUE = 16       # queued jobs beyond this are rejected (retried on the next pass)
+    PERSONA_PRERENDER = True            # render likely state images at night while the GPU is idle
+    PERSONA_PRERENDER_HOURS = (1, 6)    # local [start, end) hours of the nightly render window
+    PERSONA_PRERENDER_BUDGET = 40       # fast-tier images rendered per night at most
+    PERSONA_PRERENDER_HORIZON = 24      # hours of forecast and calendar the planner ranks states against
+
     WEATHER_LOCATION = 'Tokyo'
     TRAIN_STATION_URL = "https://www.jreast-timetable.jp/en/timetable/list0303.html"
 
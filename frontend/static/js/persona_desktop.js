@@ -388,6 +388,67 @@ function _appendBubble(text, role, pending = false) {
   return el;
 }
 
+// Parse one SSE frame ("event: x\ndata: {...}") into [event, data].
+function _parseSseFrame(frame) {
+  let event = 'message';
+  const dataLines = [];
+  for (const line of frame.split('\n')) {
+    if (line.startsWith('event:')) event = line.slice(6).trim();
+    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+  }
+  return [event, dataLines.length ? JSON.parse(dataLines.join('\n')) : {}];
+}
+
+// POST to /persona/chat/stream and render think progress + answer tokens into
+// pendingEl as they arrive. Resolves with the final {reply, image_url}.
+// Falls back to the blocking /persona/chat endpoint if streaming is unavailable.
+async function _streamChat(query, pendingEl) {
+  const body = JSON.stringify({ query, history: _history });
+  const res  = await fetch('/persona/chat/stream', {
+    method:  'POST',
+    headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+    body,
+  });
+  if (!res.ok || !res.body) {
+    const fallback = await fetch('/persona/chat', {
+      method:  'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body,
+    });
+    return fallback.json();
+  }
+
+  const reader  = res.body.getReader();
+  const decoder = new TextDecoder();
+  const histEl  = document.getElementById('chat-history');
+  let buffer    = '';
+  let streamed  = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf('\n\n')) !== -1) {
+      const [event, data] = _parseSseFrame(buffer.slice(0, sep));
+      buffer = buffer.slice(sep + 2);
+      if (event === 'thinking' && !streamed) {
+        pendingEl.classList.add('thinking');
+        pendingEl.title = `thinking… ${data.chars} chars`;
+      } else if (event === 'token') {
+        streamed += data.text;
+        pendingEl.classList.remove('thinking');
+        pendingEl.textContent = streamed;
+        histEl.scrollTop = histEl.scrollHeight;
+      } else if (event === 'done') {
+        return data;
+      } else if (event === 'error') {
+        throw new Error(data.error);
+      }
+    }
+  }
+  return { reply: streamed };
+}
+
 async function sendMessage() {
   const input   = document.getElementById('chat-input');
   const sendBtn = document.getElementById('btn-send');
@@ -401,15 +462,10 @@ async function sendMessage() {
   const pendingEl = _appendBubble('', 'persona', true);
 
   try {
-    const res  = await fetch('/persona/chat', {
-      method:  'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body:    JSON.stringify({ query, history: _history }),
-    });
-    const data  = await res.json();
+    const data  = await _streamChat(query, pendingEl);
     const reply = data.reply || '...';
 
-    // Fill in the typing dots with the actual reply
+    // Replace the streamed text with the final (cleaned-up) reply
     pendingEl.innerHTML  = '';
     pendingEl.textContent = reply;
     _chatMsgCount++;
@@ -82,6 +82,17 @@ class PersonaStats(BaseModel):
         return cls.singleton()
 
 
+class LLMResponse(BaseModel):
+    """Disk tier of agents/llm/response_cache.ResponseCache — last good LLM responses."""
+    cache = CharField()         # ResponseCache name
+    key = CharField()           # make_key() fingerprint
+    text = TextField()
+    expires_at = FloatField()   # unix timestamp; expired rows are still served as stale
+
+    class Meta:
+        indexes = ((('cache', 'key'), True),)
+
+
 # Create tables if they don't exist
 database.connect()
-database.create_tables([Task, WeatherData, ShoppingListItem, SmartHomeDevice, WeatherLocation, AirQualityData, PersonaStats])
+database.create_tables([Task, WeatherData, ShoppingListItem, SmartHomeDevice, WeatherLocation, AirQualityData, PersonaStats, LLMResponse])
@@ -1,12 +1,23 @@
+import asyncio
+import datetime
 import json
+import statistics
+import threading
 import time
+import uuid
+from pathlib import Path
 
 import requests
-from flask import Blueprint, jsonify, render_template, request
+from flask import Blueprint, Response, jsonify, render_template, request
 
+from config import Config
+
+from agents.llm import http_session
 from agents.llm.ollama_service import OLLAMA_BASE_URL, _DUMMY_TOOLS
 from agents.llm.lmstudio_service import LM_STUDIO_BASE_URL
-from agents.persona.agent import PersonaAgent
+from agents.llm.think_stream import split_thinking
+from agents.persona.agent import _QUOTE_SYSTEM, _TIME_GRANULARITY
+from agents.persona.context import PersonaContext
 from agents.persona.states import CHARACTER_VOICE, MOOD_MODIFIERS
 
 llm_bench_bp = Blueprint('llm_bench', __name__)
@@ -15,7 +26,7 @@ _DEFAULT_TIMEOUT = 30
 
 def _ctx():
     try:
-        return PersonaAgent._build_full_context()
+        return PersonaContext.build_full_context()
     except Exception:
         return "(context unavailable)"
 
@@ -215,6 +226,14 @@ SCENARIOS = {
             "memory_none_tool_volume", "memory_none_tool_nowplaying", "memory_none_tool_time",
         ],
     },
+    "prefill_layout": {
+        "label": "Prefill — Prompt Layout",
+        "prefill": True,
+    },
+    "memory_occupancy": {
+        "label": "Memory — Combined vs Separate",
+        "occupancy": True,
+    },
     "custom": {
         "label": "Custom Prompt",
         "builder": None,
@@ -368,17 +387,6 @@ SCENARIOS = {
 
 # ── Callers ────────────────────────────────────────────────────────────────────
 
-def _extract_lmstudio_thinking(content: str) -> tuple[str, str | None]:
-    """Split <think>...</think> tags out of LM Studio content. Returns (output, thinking)."""
-    if '<think>' in content and '</think>' in content:
-        t_start = content.index('<think>') + len('<think>')
-        t_end = content.index('</think>')
-        thinking = content[t_start:t_end].strip() or None
-        out = content[t_end + len('</think>'):].strip()
-        return out, thinking
-    return content, None
-
-
 def _call_chat(backend: str, model: str, system: str, user: str, timeout: int,
                think: bool = False, use_tools: bool = False) -> dict:
     t0 = time.monotonic()
@@ -391,7 +399,7 @@ def _call_chat(backend: str, model: str, system: str, user: str, timeout: int,
                 body["enable_thinking"] = True
             if tools:
                 body["tools"] = tools
-            r = requests.post(f"{LM_STUDIO_BASE_URL}/chat/completions", json=body, timeout=timeout)
+            r = http_session.post(f"{LM_STUDIO_BASE_URL}/chat/completions", json=body, timeout=timeout)
             r.raise_for_status()
             msg = r.json()["choices"][0]["message"]
             raw = msg.get("content") or ""
@@ -403,12 +411,12 @@ def _call_chat(backend: str, model: str, system: str, user: str, timeout: int,
                     if text := args.get("text", ""):
                         raw = text
                         break
-            out, thinking = _extract_lmstudio_thinking(raw.strip())
+            thinking, out, _ = split_thinking(raw)
         else:
             body = {"model": model, "messages": messages, "stream": False, "think": think}
             if tools:
                 body["tools"] = tools
-            r = requests.post(f"{OLLAMA_BASE_URL}/api/chat", json=body, timeout=timeout)
+            r = http_session.post(f"{OLLAMA_BASE_URL}/api/chat", json=body, timeout=timeout)
             r.raise_for_status()
             msg = r.json().get("message", {})
             out = msg.get("content", "").strip()
@@ -425,6 +433,205 @@ def _call_chat(backend: str, model: str, system: str, user: str, timeout: int,
         return {"model": model, "backend": backend, "output": "", "thinking": None, "latency_ms": int((time.monotonic() - t0) * 1000), "error": str(e)}
 
 
+# ── Prefill benchmark ──────────────────────────────────────────────────────────
+# Replays a burst of quote calls (one per simulated minute, rotating situations) in the
+# old layout — per-call text first, exact-minute context after it — and in the current
+# layout from PersonaContext.build_prompt_context(). Time-to-first-token is dominated by
+# prompt processing, so the warm TTFT difference is the prefill the backend's KV cache saved.
+
+_PREFILL_CALLS = 5
+_PREFILL_SITUATIONS = [
+    ("cold weather (3°C, overcast) in the morning", "tired"),
+    ("currently in a meeting: <event>Team Standup</event>", "focused"),
+    ("heavy rain weather (8°C) in the evening", "resigned"),
+]
+
+
+def _prefill_prompts(layout: str) -> list[str]:
+    from agents.memory_service import MemoryService
+    env = PersonaContext.build_env_context()
+    mem = MemoryService.format_for_prompt()
+    start = datetime.datetime.now()
+    prompts = []
+    for i in range(_PREFILL_CALLS):
+        situation, mood = _PREFILL_SITUATIONS[i % len(_PREFILL_SITUATIONS)]
+        now = start + datetime.timedelta(minutes=i)
+        if layout == "legacy":
+            ctx = "\n\n".join(p for p in (PersonaContext.build_time_line(1, now), env, mem) if p)
+            prompts.append(f"Current situation: {situation}. Emotional state: {mood}. Context: {ctx}.")
+        else:
+            ctx = PersonaContext.build_prompt_context(_TIME_GRANULARITY['quote'], now)
+            prompts.append(f"Context:\n{ctx}\n\nCurrent situation: {situation}. Emotional state: {mood}.")
+    return prompts
+
+
+def _measure_prefill(backend: str, model: str, system: str, user: str, timeout: int) -> dict:
+    """Stream a one-token completion and return {ttft_ms, prompt_tokens, prompt_eval_ms}."""
+    t0 = time.monotonic()
+    messages = [{"role": "system", "content": system}, {"role": "user", "content": user}]
+    result = {"ttft_ms": None, "prompt_tokens": None, "prompt_eval_ms": None}
+    if backend == 'lmstudio':
+        body = {"model": model, "messages": messages, "stream": True, "max_tokens": 1,
+                "stream_options": {"include_usage": True}}
+        url = f"{LM_STUDIO_BASE_URL}/chat/completions"
+    else:
+        body = {"model": model, "messages": messages, "stream": True, "think": False,
+                "options": {"num_predict": 1}}
+        url = f"{OLLAMA_BASE_URL}/api/chat"
+    r = http_session.post(url, json=body, timeout=timeout, stream=True)
+    try:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line:
+                continue
+            line = line.decode('utf-8') if isinstance(line, bytes) else line
+            if backend == 'lmstudio':
+                if not line.startswith('data: ') or line[6:].strip() == '[DONE]':
+                    continue
+                chunk = json.loads(line[6:])
+                if result["ttft_ms"] is None and chunk.get("choices"):
+                    result["ttft_ms"] = int((time.monotonic() - t0) * 1000)
+                if usage := chunk.get("usage"):
+                    result["prompt_tokens"] = usage.get("prompt_tokens")
+            else:
+                chunk = json.loads(line)
+                if result["ttft_ms"] is None:
+                    result["ttft_ms"] = int((time.monotonic() - t0) * 1000)
+                if chunk.get("done"):
+                    result["prompt_tokens"] = chunk.get("prompt_eval_count")
+                    if chunk.get("prompt_eval_duration") is not None:
+                        result["prompt_eval_ms"] = int(chunk["prompt_eval_duration"] / 1e6)
+    finally:
+        http_session.close(r, finished=True)
+    return result
+
+
+def _run_prefill(models: list[dict], timeout: int) -> dict:
+    layouts = [
+        ("legacy", "old layout — situation first, exact-minute context"),
+        ("stable", f"stable prefix — context first, clock floored to {_TIME_GRANULARITY['quote']} min"),
+    ]
+    prompts = {layout: _prefill_prompts(layout) for layout, _ in layouts}
+    warm = {}  # (layout, model) -> warm median TTFT
+    rows = []
+    for layout, row_label in layouts:
+        results = []
+        for m in models:
+            t0 = time.monotonic()
+            try:
+                runs = [_measure_prefill(m["backend"], m["name"], _QUOTE_SYSTEM, user, timeout)
+                        for user in prompts[layout]]
+            except Exception as e:
+                results.append({"model": m["name"], "backend": m["backend"], "output": "", "thinking": None,
+                                "latency_ms": int((time.monotonic() - t0) * 1000), "error": str(e)})
+                continue
+            ttfts = [r["ttft_ms"] for r in runs if r["ttft_ms"] is not None]
+            median = int(statistics.median(ttfts[1:] or ttfts)) if ttfts else None  # first call is cold
+            warm[(layout, m["name"])] = median
+            evals = [r["prompt_eval_ms"] for r in runs[1:] if r["prompt_eval_ms"] is not None]
+            out = f"warm TTFT median {median} ms | per call: {', '.join(f'{t} ms' for t in ttfts)}"
+            if runs[0]["prompt_tokens"]:
+                out += f" | prompt {runs[0]['prompt_tokens']} tokens"
+            if evals:
+                out += f" | warm prompt eval median {int(statistics.median(evals))} ms"
+            results.append({"model": m["name"], "backend": m["backend"], "output": out, "thinking": None,
+                            "latency_ms": median or 0, "error": None})
+        rows.append({"row_label": row_label, "expected": None, "results": results})
+
+    saved = []
+    for m in models:
+        before, after = warm.get(("legacy", m["name"])), warm.get(("stable", m["name"]))
+        if before and after is not None:
+            out = f"{before - after} ms saved per call ({(before - after) / before:.0%})"
+        else:
+            out = "n/a"
+        saved.append({"model": m["name"], "backend": m["backend"], "output": out, "thinking": None,
+                      "latency_ms": (before - after) if before and after is not None else 0, "error": None})
+    rows.append({"row_label": "prefill saved (warm TTFT)", "expected": None, "results": saved})
+
+    prompt = "\n\n".join(
+        f"── {label} (call 1 of {_PREFILL_CALLS}) ──\n[SYSTEM]\n{_QUOTE_SYSTEM}\n\n[USER]\n{prompts[layout][0]}"
+        for layout, label in layouts
+    )
+    return {"is_group": True, "rows": rows, "models": models, "prompt": prompt,
+            "scenario": "prefill_layout", "timestamp": time.strftime("%H:%M:%S")}
+
+
+# ── Memory extraction occupancy ────────────────────────────────────────────────
+# Backend time spent on memory extraction per chat turn, using MemoryService's own
+# prompts: two calls per exchange (user fact + persona trait), one combined call per
+# exchange, and one combined call for a coalesced burst of all exchanges.
+
+_OCCUPANCY_MEMORIES = [
+    {"content": "The user prefers working in silence", "subject": "user"},
+    {"content": "The user usually stays up late on weekends", "subject": "user"},
+    {"content": "I find rainy evenings cosy", "subject": "persona"},
+]
+_OCCUPANCY_EXCHANGES = [
+    "User: Been on back-to-back calls all day, completely drained\n"
+    "Persona: That sounds rough. Hope the rest of the evening is quiet~",
+    "User: I always drink my coffee black, I can't stand milk in it\n"
+    "Persona: Black coffee it is. Honestly, I'd pick bitter over sweet every time too~",
+    "User: What time does the next train leave?\n"
+    "Persona: The next departure is at 14:32.",
+    "User: Sprained my ankle last night, hobbling around today\n"
+    "Persona: Ouch! I'll remind you to rest it this evening~",
+]
+
+
+def _run_memory_occupancy(models: list[dict], timeout: int, think: bool) -> dict:
+    from agents.memory_service import MemoryService
+    n = len(_OCCUPANCY_EXCHANGES)
+    modes = [
+        ("separate", f"separate — 2 calls × {n} turns"),
+        ("combined", f"combined — 1 call × {n} turns"),
+        ("coalesced", f"combined + coalesced — 1 call for the {n}-turn burst"),
+    ]
+    prompts = {
+        "separate": [p for ex in _OCCUPANCY_EXCHANGES for p in (
+            MemoryService.user_fact_prompt(ex, _OCCUPANCY_MEMORIES),
+            MemoryService.persona_trait_prompt(ex, _OCCUPANCY_MEMORIES),
+        )],
+        "combined": [MemoryService.combined_prompt([ex], _OCCUPANCY_MEMORIES) for ex in _OCCUPANCY_EXCHANGES],
+        "coalesced": [MemoryService.combined_prompt(_OCCUPANCY_EXCHANGES, _OCCUPANCY_MEMORIES)],
+    }
+    per_turn = {}  # (mode, model) -> backend ms per chat turn
+    rows = []
+    for mode, row_label in modes:
+        results = []
+        for m in models:
+            calls = [_call_chat(m["backend"], m["name"], system, user, timeout, think=think)
+                     for system, user in prompts[mode]]
+            total = sum(c["latency_ms"] for c in calls)
+            per_turn[(mode, m["name"])] = total / n
+            errors = [c["error"] for c in calls if c["error"]]
+            outputs = [c["output"] for c in calls]
+            results.append({
+                "model": m["name"], "backend": m["backend"],
+                "output": f"{total / n:.0f} ms backend time per turn ({len(calls)} calls, {total} ms total)\n\n"
+                          + "\n".join(f"• {o}" for o in outputs),
+                "thinking": None, "latency_ms": total,
+                "error": "; ".join(errors) if errors else None,
+            })
+        rows.append({"row_label": row_label, "expected": None, "results": results})
+
+    saved = []
+    for m in models:
+        base = per_turn[("separate", m["name"])]
+        parts = [
+            f"{mode}: {1 - per_turn[(mode, m['name'])] / base:.0%} less"
+            for mode, _ in modes[1:] if base
+        ]
+        saved.append({"model": m["name"], "backend": m["backend"], "output": " | ".join(parts) or "n/a",
+                      "thinking": None, "latency_ms": 0, "error": None})
+    rows.append({"row_label": "occupancy vs separate", "expected": None, "results": saved})
+
+    system, user = prompts["coalesced"][0]
+    return {"is_group": True, "rows": rows, "models": models,
+            "prompt": f"── combined + coalesced ──\n[SYSTEM]\n{system}\n\n[USER]\n{user}",
+            "scenario": "memory_occupancy", "timestamp": time.strftime("%H:%M:%S")}
+
+
 # ── Routes ─────────────────────────────────────────────────────────────────────
 
 @llm_bench_bp.route('/llm-bench')
@@ -438,7 +645,7 @@ def llm_bench_models():
     errors = []
 
     try:
-        r = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
+        r = http_session.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
         r.raise_for_status()
         for m in r.json().get("models", []):
             models.append({"name": m["name"], "size_gb": round(m.get("size", 0) / 1e9, 1), "backend": "ollama"})
@@ -446,7 +653,7 @@ def llm_bench_models():
         errors.append(f"Ollama: {e}")
 
     try:
-        r = requests.get(f"{LM_STUDIO_BASE_URL}/models", timeout=3)
+        r = http_session.get(f"{LM_STUDIO_BASE_URL}/models", timeout=3)
         r.raise_for_status()
         for m in r.json().get("data", []):
             models.append({"name": m["id"], "size_gb": None, "backend": "lmstudio"})
@@ -462,60 +669,80 @@ def llm_bench_models():
 
 @llm_bench_bp.route('/llm-bench/run', methods=['POST'])
 def llm_bench_run():
+    """Synchronous run of one scenario — kept for scripts; the UI uses /llm-bench/jobs."""
     data = request.get_json(force=True)
 
     models = data.get("models", [])  # list of {name, backend}
     scenario = data.get("scenario", "")
     timeout = int(data.get("timeout", _DEFAULT_TIMEOUT))
-    custom_prompt = data.get("custom_prompt", "").strip()
     reasoning = bool(data.get("reasoning", False))
     use_tools = bool(data.get("use_tools", False))
 
     if not models:
         return jsonify({"error": "No models selected"}), 400
-    if scenario not in SCENARIOS:
-        return jsonify({"error": f"Unknown scenario: {scenario}"}), 400
+    try:
+        plan = _plan(scenario, data.get("custom_prompt", ""))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    scenario_data = SCENARIOS[scenario]
+    if scenario_data.get("prefill"):
+        return jsonify(_run_prefill(models, timeout))
+    if scenario_data.get("occupancy"):
+        return jsonify(_run_memory_occupancy(models, timeout, reasoning))
+
+    cells = [
+        [_call_chat(m["backend"], m["name"], row["system"], row["user"], timeout, think=reasoning, use_tools=use_tools)
+         for m in models]
+        for row in plan["rows"]
+    ]
+    return jsonify(_assemble(scenario, plan, models, cells))
+
 
+# ── Bench jobs ─────────────────────────────────────────────────────────────────
+# A run is a job: each scenario is expanded into a (case × model) matrix of cells and
+# the cells are executed on an asyncio loop in a background thread, at most
+# LLM_BENCH_CONCURRENCY in flight per job and LLM_BENCH_PER_BACKEND per backend.
+# Calls go through the pooled requests session via asyncio.to_thread (httpx/aiohttp
+# are not dependencies). Prefill/occupancy scenarios measure latency, so they run
+# alone after the matrix. Each finished cell is an event the page streams over SSE;
+# the job keeps running if the browser goes away, and finished jobs are written to
+# LLM_BENCH_RUNS_DIR so runs can be reloaded and compared.
+
+_JOBS_KEPT = 20  # finished jobs kept in memory; older ones are served from disk
+
+
+def _prompt_display(system: str, user: str) -> str:
+    return f"[SYSTEM]\n{system}\n\n[USER]\n{user}" if system else f"[USER]\n{user}"
+
+
+def _plan(scenario: str, custom_prompt: str = "") -> dict:
+    """Expand a scenario into prompt rows. Raises ValueError for a request that can't run."""
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Unknown scenario: {scenario}")
     scenario_data = SCENARIOS[scenario]
+    if scenario_data.get("prefill") or scenario_data.get("occupancy"):
+        return {"special": True, "rows": []}
 
-    # ── Group scenario: run all sub-cases × all models ──────────────────────
     if "cases" in scenario_data:
-        rows = []
-        prompt_parts = []
+        rows, prompt_parts = [], []
         for case_key in scenario_data["cases"]:
             case = SCENARIOS[case_key]
             system, user = case["builder"]()
-            prompt_display = f"[SYSTEM]\n{system}\n\n[USER]\n{user}" if system else f"[USER]\n{user}"
-            prompt_parts.append(f"── {case['row_label']} ──\n{prompt_display}")
+            prompt_parts.append(f"── {case['row_label']} ──\n{_prompt_display(system, user)}")
+            rows.append({"row_label": case["row_label"], "expected": case.get("expected"),
+                         "system": system, "user": user})
+        return {"is_group": True, "rows": rows, "prompt": "\n\n".join(prompt_parts)}
 
-            case_results = []
-            for m in models:
-                case_results.append(_call_chat(m["backend"], m["name"], system, user, timeout, think=reasoning, use_tools=use_tools))
-
-            rows.append({
-                "row_label": case["row_label"],
-                "expected": case.get("expected"),
-                "results": case_results,
-            })
-
-        return jsonify({
-            "is_group": True,
-            "rows": rows,
-            "models": models,
-            "prompt": "\n\n".join(prompt_parts),
-            "scenario": scenario,
-            "timestamp": time.strftime("%H:%M:%S"),
-        })
-
-    # ── Single scenario ──────────────────────────────────────────────────────
+    custom_prompt = (custom_prompt or "").strip()
     if scenario == "custom":
         if not custom_prompt:
-            return jsonify({"error": "Custom prompt is empty"}), 400
+            raise ValueError("Custom prompt is empty")
         system = ""
         user = custom_prompt
     elif scenario == "custom_with_context":
         if not custom_prompt:
-            return jsonify({"error": "Custom prompt is empty"}), 400
+            raise ValueError("Custom prompt is empty")
         ctx = _ctx()
         system = (
             CHARACTER_VOICE + " "
@@ -527,18 +754,337 @@ def llm_bench_run():
         user = f"Current home context:\n{ctx}\n\n{custom_prompt}"
     else:
         system, user = scenario_data["builder"]()
+    return {"is_group": False, "prompt": _prompt_display(system, user), "expected": scenario_data.get("expected"),
+            "rows": [{"row_label": scenario_data["label"], "expected": scenario_data.get("expected"),
+                      "system": system, "user": user}]}
 
-    prompt_display = f"[SYSTEM]\n{system}\n\n[USER]\n{user}" if system else f"[USER]\n{user}"
 
-    results = []
-    for m in models:
-        results.append(_call_chat(m["backend"], m["name"], system, user, timeout, think=reasoning, use_tools=use_tools))
+def _pending(model: dict) -> dict:
+    return {"model": model["name"], "backend": model["backend"], "output": "", "thinking": None,
+            "latency_ms": 0, "error": None, "pending": True}
 
-    return jsonify({
+
+def _assemble(scenario: str, plan: dict, models: list[dict], cells: list[list[dict]]) -> dict:
+    """Build the /llm-bench/run response shape from a plan and its (row × model) cells."""
+    if plan["is_group"]:
+        return {
+            "is_group": True,
+            "rows": [{"row_label": row["row_label"], "expected": row["expected"], "results": cells[i]}
+                     for i, row in enumerate(plan["rows"])],
+            "models": models,
+            "prompt": plan["prompt"],
+            "scenario": scenario,
+            "timestamp": time.strftime("%H:%M:%S"),
+        }
+    return {
         "is_group": False,
-        "results": results,
-        "prompt": prompt_display,
+        "results": cells[0],
+        "prompt": plan["prompt"],
         "scenario": scenario,
-        "expected": scenario_data.get("expected"),
+        "expected": plan["expected"],
         "timestamp": time.strftime("%H:%M:%S"),
+    }
+
+
+class _BenchJob:
+    def __init__(self, spec: dict, plans: dict[str, dict]):
+        self.id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:4]
+        self.spec = spec
+        self.plans = plans
+        self.status = "queued"  # queued | running | done | error
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.total = sum(len(p["rows"]) * len(spec["models"]) or 1 for p in plans.values())
+        self.completed = 0
+        self.results: dict[str, dict] = {}
+        self.events: list[tuple[str, dict]] = []
+        self._cells = {name: [[_pending(m) for m in spec["models"]] for _ in p["rows"]]
+                       for name, p in plans.items()}
+        self._cond = threading.Condition()
+
+    # ── Progress (called from the job's event loop thread) ──
+
+    def _emit(self, event: str, payload: dict) -> None:
+        with self._cond:
+            self.events.append((event, payload))
+            self._cond.notify_all()
+
+    def start(self) -> None:
+        self.status = "running"
+        self._emit("plan", self.summary() | {"scenarios": {
+            name: self._snapshot(name) for name in self.plans
+        }})
+
+    def cell_done(self, scenario: str, row: int, col: int, result: dict) -> None:
+        with self._cond:
+            self._cells[scenario][row][col] = result
+            self.completed += 1
+        self._emit("result", {"scenario": scenario, "row": row, "col": col, "result": result,
+                              "completed": self.completed, "total": self.total})
+
+    def scenario_done(self, scenario: str, result: dict | None = None) -> None:
+        with self._cond:
+            if result is not None:  # prefill/occupancy: one step for the whole scenario
+                self.completed += 1
+            self.results[scenario] = result or self._snapshot(scenario)
+        self._emit("scenario", {"scenario": scenario, "data": self.results[scenario],
+                                "completed": self.completed, "total": self.total})
+
+    def finish(self, error: str | None = None) -> None:
+        self.status = "error" if error else "done"
+        self.error = error
+        self.finished = time.time()
+        _save_job(self)
+        self._emit("error" if error else "done", self.summary())
+
+    def _snapshot(self, scenario: str) -> dict:
+        plan = self.plans[scenario]
+        if plan.get("special"):
+            return {"is_group": True, "rows": [], "models": self.spec["models"], "prompt": "",
+                    "scenario": scenario, "timestamp": time.strftime("%H:%M:%S"), "pending": True}
+        return _assemble(scenario, plan, self.spec["models"], self._cells[scenario])
+
+    # ── Readers (request threads) ──
+
+    def events_since(self, since: int, wait: float) -> list[tuple[str, dict]]:
+        """Events after index `since`; blocks up to `wait` seconds for new ones while the job runs."""
+        with self._cond:
+            if len(self.events) <= since and self.status in ("queued", "running"):
+                self._cond.wait(wait)
+            return self.events[since:]
+
+    def summary(self) -> dict:
+        return {"job_id": self.id, "status": self.status, "error": self.error,
+                "scenarios": list(self.plans), "models": self.spec["models"],
+                "completed": self.completed, "total": self.total,
+                "created": self.created, "finished": self.finished}
+
+    def to_dict(self) -> dict:
+        with self._cond:
+            results = {name: self.results.get(name) or self._snapshot(name) for name in self.plans}
+        return self.summary() | {"spec": self.spec, "results": results}
+
+
+_jobs: dict[str, _BenchJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def _runs_dir() -> Path:
+    return Path(Config.LLM_BENCH_RUNS_DIR)
+
+
+def _save_job(job: _BenchJob) -> None:
+    try:
+        path = _runs_dir() / f"{job.id}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(job.to_dict(), ensure_ascii=False, indent=1), encoding="utf-8")
+    except Exception as e:
+        print(f"[LLMBench] could not save job {job.id}: {e}")
+
+
+def _load_job(job_id: str) -> dict | None:
+    """A job as a dict — live from memory, or the saved run from disk."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        return job.to_dict()
+    path = _runs_dir() / f"{job_id}.json"
+    if "/" in job_id or "\\" in job_id or not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        print(f"[LLMBench] could not read job {job_id}: {e}")
+        return None
+
+
+def _forget_old_jobs() -> None:
+    with _jobs_lock:
+        finished = sorted((j for j in _jobs.values() if j.finished), key=lambda j: j.finished)
+        for job in finished[:max(0, len(finished) - _JOBS_KEPT)]:
+            del _jobs[job.id]
+
+
+async def _run_job_async(job: _BenchJob) -> None:
+    spec = job.spec
+    models = spec["models"]
+    in_flight = asyncio.Semaphore(spec["concurrency"])
+    per_backend = {b: asyncio.Semaphore(Config.LLM_BENCH_PER_BACKEND) for b in {m["backend"] for m in models}}
+    remaining = {name: len(plan["rows"]) * len(models) for name, plan in job.plans.items()}
+
+    async def _cell(scenario: str, row: int, col: int) -> None:
+        m, cell = models[col], job.plans[scenario]["rows"][row]
+        async with in_flight, per_backend[m["backend"]]:
+            result = await asyncio.to_thread(
+                _call_chat, m["backend"], m["name"], cell["system"], cell["user"], spec["timeout"],
+                think=spec["reasoning"], use_tools=spec["use_tools"],
+            )
+        job.cell_done(scenario, row, col, result)
+        remaining[scenario] -= 1
+        if not remaining[scenario]:
+            job.scenario_done(scenario)
+
+    await asyncio.gather(*(
+        _cell(name, row, col)
+        for name, plan in job.plans.items() if not plan.get("special")
+        for row in range(len(plan["rows"]))
+        for col in range(len(models))
+    ))
+
+    for name, plan in job.plans.items():
+        if not plan.get("special"):
+            continue
+        if SCENARIOS[name].get("prefill"):
+            result = await asyncio.to_thread(_run_prefill, models, spec["timeout"])
+        else:
+            result = await asyncio.to_thread(_run_memory_occupancy, models, spec["timeout"], spec["reasoning"])
+        job.scenario_done(name, result)
+
+
+def _run_job(job: _BenchJob) -> None:
+    job.start()
+    try:
+        asyncio.run(_run_job_async(job))
+        job.finish()
+    except Exception as e:
+        print(f"[LLMBench] job {job.id} failed: {e}")
+        job.finish(str(e))
+    _forget_old_jobs()
+
+
+@llm_bench_bp.route('/llm-bench/jobs', methods=['POST'])
+def llm_bench_job_start():
+    """Start a background run. Body as /llm-bench/run, plus optional
+    scenarios (list, instead of scenario) and concurrency."""
+    data = request.get_json(force=True)
+    models = data.get("models", [])
+    scenarios = data.get("scenarios") or [data.get("scenario", "")]
+    if not models:
+        return jsonify({"error": "No models selected"}), 400
+    try:
+        plans = {name: _plan(name, data.get("custom_prompt", "")) for name in scenarios}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    spec = {
+        "models": [{"name": m["name"], "backend": m["backend"]} for m in models],
+        "scenarios": list(plans),
+        "timeout": int(data.get("timeout", _DEFAULT_TIMEOUT)),
+        "reasoning": bool(data.get("reasoning", False)),
+        "use_tools": bool(data.get("use_tools", False)),
+        "custom_prompt": data.get("custom_prompt", ""),
+        "concurrency": max(1, int(data.get("concurrency") or Config.LLM_BENCH_CONCURRENCY)),
+    }
+    job = _BenchJob(spec, plans)
+    with _jobs_lock:
+        _jobs[job.id] = job
+    threading.Thread(target=_run_job, args=(job,), daemon=True, name=f"llm-bench-{job.id}").start()
+    return jsonify(job.summary()), 202
+
+
+@llm_bench_bp.route('/llm-bench/jobs')
+def llm_bench_jobs():
+    """Live jobs plus saved runs, newest first."""
+    with _jobs_lock:
+        runs = {job.id: job.summary() for job in _jobs.values()}
+    try:
+        paths = sorted(_runs_dir().glob("*.json"), reverse=True)[:int(request.args.get("limit", 50))]
+    except Exception:
+        paths = []
+    for path in paths:
+        if path.stem in runs:
+            continue
+        try:
+            saved = json.loads(path.read_text(encoding="utf-8"))
+            saved.pop("results", None)
+            saved.pop("spec", None)
+            runs[path.stem] = saved
+        except Exception as e:
+            print(f"[LLMBench] skipping unreadable run {path.name}: {e}")
+    return jsonify({"jobs": sorted(runs.values(), key=lambda r: r["created"], reverse=True)})
+
+
+@llm_bench_bp.route('/llm-bench/jobs/<job_id>')
+def llm_bench_job(job_id):
+    job = _load_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    return jsonify(job)
+
+
+@llm_bench_bp.route('/llm-bench/jobs/<job_id>/events')
+def llm_bench_job_events(job_id):
+    """Server-Sent Events for a live job: plan, result (one per cell), scenario, then done or error.
+
+    Event ids are indexes into the job's event log, so an EventSource reconnect
+    (Last-Event-ID) resumes where it left off. Jobs no longer in memory get one
+    done event with the saved summary.
+    """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        saved = _load_job(job_id)
+        if saved is None:
+            return jsonify({"error": f"Unknown job: {job_id}"}), 404
+        saved.pop("results", None)
+        saved.pop("spec", None)
+        payload = json.dumps(saved, ensure_ascii=False)
+        return Response(f"event: done\ndata: {payload}\n\n", mimetype='text/event-stream')
+
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("since")
+    since = int(last_id) + 1 if last_id not in (None, "") else 0
+
+    def _sse():
+        nonlocal since
+        while True:
+            events = job.events_since(since, wait=15)
+            if not events:
+                if job.status in ("done", "error"):
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for event, payload in events:
+                yield f"id: {since}\nevent: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                since += 1
+                if event in ("done", "error"):
+                    return
+
+    return Response(_sse(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@llm_bench_bp.route('/llm-bench/compare')
+def llm_bench_compare():
+    """Cell-by-cell diff of two runs: ?a=<job_id>&b=<job_id>. Latency delta is b − a."""
+    a, b = _load_job(request.args.get("a", "")), _load_job(request.args.get("b", ""))
+    if a is None or b is None:
+        return jsonify({"error": "Both a and b must be known job ids"}), 404
+
+    def _cells(job):
+        out = {}
+        for scenario, data in (job.get("results") or {}).items():
+            rows = data.get("rows") if data.get("is_group") else [{"row_label": "", "results": data.get("results", [])}]
+            for row in rows or []:
+                for r in row.get("results", []):
+                    if not r.get("pending"):
+                        out[(scenario, row["row_label"], r["backend"], r["model"])] = r
+        return out
+
+    cells_a, cells_b = _cells(a), _cells(b)
+    rows = []
+    for key in sorted(cells_a.keys() & cells_b.keys()):
+        ra, rb = cells_a[key], cells_b[key]
+        rows.append({
+            "scenario": key[0], "row_label": key[1], "backend": key[2], "model": key[3],
+            "latency_a_ms": ra["latency_ms"], "latency_b_ms": rb["latency_ms"],
+            "delta_ms": rb["latency_ms"] - ra["latency_ms"],
+            "error_a": ra.get("error"), "error_b": rb.get("error"),
+            "output_changed": ra.get("output") != rb.get("output"),
+        })
+    deltas = [r["delta_ms"] for r in rows if not r["error_a"] and not r["error_b"]]
+    return jsonify({
+        "a": a["job_id"], "b": b["job_id"], "cells": rows,
+        "only_in_a": len(cells_a.keys() - cells_b.keys()), "only_in_b": len(cells_b.keys() - cells_a.keys()),
+        "median_delta_ms": statistics.median(deltas) if deltas else None,
     })
@@ -1,7 +1,10 @@
 import hashlib
+import json
 import os
+import queue
 import re
-from flask import Blueprint, jsonify, send_file, render_template, request
+import threading
+from flask import Blueprint, Response, jsonify, send_file, render_template, request
 from agents.persona.agent import PersonaAgent
 from agents.image.image_gen_service import ImageGenService
 
@@ -96,14 +99,52 @@ def persona_chat():
 
     from agents.chat_service import ChatService
     result = ChatService.handle(query, data.get('history') or [])
+    return jsonify({'reply': result['reply'], 'image_url': _mood_image_url(result['reply'])})
 
-    image_url = None
+
+@persona_bp.route('/persona/chat/stream', methods=['POST'])
+def persona_chat_stream():
+    """Same contract as /persona/chat, delivered as Server-Sent Events.
+
+    Events: phase, thinking, token (see ChatService) and a final
+    done {reply, image_url} — or error {error}.
+    """
+    data  = request.get_json(silent=True) or {}
+    query = (data.get('query') or '').strip()
+    if not query:
+        return jsonify({'error': 'query is required'}), 400
+    history = data.get('history') or []
+
+    events: queue.Queue = queue.Queue()
+
+    def _run():
+        from agents.chat_service import ChatService
+        try:
+            result = ChatService.handle(query, history, on_event=lambda ev, payload: events.put((ev, payload)))
+            events.put(('done', {'reply': result['reply'], 'image_url': _mood_image_url(result['reply'])}))
+        except Exception as e:
+            print(f'[persona_chat_stream] error: {e}')
+            events.put(('error', {'error': str(e)}))
+        finally:
+            events.put(None)
+
+    threading.Thread(target=_run, daemon=True).start()
+
+    def _sse():
+        while (item := events.get()) is not None:
+            event, payload = item
+            yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    return Response(_sse(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _mood_image_url(reply: str) -> str | None:
     try:
         from pathlib import Path
-        path = PersonaAgent.get_image_for_mood(result['reply'], blocking=False)
+        path = PersonaAgent.get_image_for_mood(reply, blocking=False)
         if path:
-            image_url = f'/persona/image/{Path(path).stem}'
+            return f'/persona/image/{Path(path).stem}'
     except Exception as e:
         print(f'[persona_chat] image error: {e}')
-
-    return jsonify({'reply': result['reply'], 'image_url': image_url})
+    return None
@@ -221,30 +221,30 @@ def grant_stats():
 def reset_stats():
     from models import PersonaStats
     PersonaStats.reset()
-    from agents.stats_service import get as stats_get, _CUSTOM_MOODS_FILE
+    from agents.stats_service import get as stats_get, _CUSTOM_MOODS_FILE, _changed as _stats_changed
     try:
         _CUSTOM_MOODS_FILE.unlink(missing_ok=True)
     except Exception as e:
         print(f'[persona_admin] clear custom moods error: {e}')
+    _stats_changed()
     return jsonify({'ok': True, 'stats': stats_get()})
 
 
 @persona_admin_bp.route('/persona/stats/generate-mood', methods=['POST'])
 def trigger_generate_mood():
-    import threading
+    from agents.persona import background
     from agents.stats_service import get as stats_get, _generate_level_up_mood, _recent_events
     s = stats_get()
-    threading.Thread(
-        target=_generate_level_up_mood,
-        args=(s.get('level', 1), list(_recent_events)),
-        daemon=True,
-    ).start()
+    level = s.get('level', 1)
+    if not background.submit(f"level_up_mood:{level}", _generate_level_up_mood, level, list(_recent_events),
+                             group='stats'):
+        return jsonify({'ok': False, 'message': 'Mood generation already running or queue full'}), 409
     return jsonify({'ok': True, 'message': 'Mood generation started in background'})
 
 
 @persona_admin_bp.route('/persona/stats/clear-custom-moods', methods=['POST'])
 def clear_custom_moods():
-    from agents.stats_service import _CUSTOM_MOODS_FILE, get as stats_get
+    from agents.stats_service import _CUSTOM_MOODS_FILE, get as stats_get, _changed as _stats_changed
     from models import PersonaStats
     import json
     try:
@@ -256,6 +256,7 @@ def clear_custom_moods():
         moods = json.loads(row.unlocked_moods) if row.unlocked_moods else list(DEFAULT_UNLOCKED)
         row.unlocked_moods = json.dumps([m for m in moods if m in base_keys])
         row.save()
+        _stats_changed()
     except Exception as e:
         print(f'[persona_admin] clear_custom_moods error: {e}')
         return jsonify({'error': str(e)}), 500
@@ -263,7 +264,119 @@ def clear_custom_moods():
 
 
 # ------------------------------------------------------------------ #
-#  Experiment generation                                               #
+#  Prompt context cache / state engine                                 #
+# ------------------------------------------------------------------ #
+
+@persona_admin_bp.route('/persona/context-cache', methods=['GET'])
+def get_context_cache_stats():
+    from agents.persona.context_cache import stats
+    return jsonify(stats())
+
+
+@persona_admin_bp.route('/persona/state-engine', methods=['GET'])
+def get_state_engine_stats():
+    from agents.persona.state_engine import stats
+    return jsonify(stats())
+
+
+@persona_admin_bp.route('/persona/background', methods=['GET'])
+def get_background_stats():
+    from agents.persona.background import stats
+    return jsonify(stats())
+
+
+@persona_admin_bp.route('/persona/prerender', methods=['GET'])
+def get_prerender_stats():
+    from agents.persona.prerender import stats
+    return jsonify(stats())
+
+
+@persona_admin_bp.route('/persona/image/embeddings', methods=['GET'])
+def get_embedding_cache_stats():
+    from agents.image.embedding_cache import stats
+    return jsonify(stats())
+
+
+@persona_admin_bp.route('/persona/image/gpu', methods=['GET'])
+def get_gpu_arbiter_stats():
+    from agents.image.gpu_arbiter import stats
+    return jsonify(stats())
+
+
+@persona_admin_bp.route('/persona/image/queue', methods=['GET'])
+def get_image_queue_stats():
+    from agents.image.job_queue import stats
+    return jsonify(stats())
+
+
+@persona_admin_bp.route('/persona/image/residency', methods=['GET'])
+def get_pipeline_residency_stats():
+    from agents.image.residency import stats
+    return jsonify(stats())
+
+
+# ------------------------------------------------------------------ #
+#  LLM scheduler                                                       #
+# ------------------------------------------------------------------ #
+
+@persona_admin_bp.route('/persona/llm/scheduler', methods=['GET'])
+def get_llm_scheduler_stats():
+    from agents.llm.llm_router import scheduler_stats
+    return jsonify(scheduler_stats())
+
+
+@persona_admin_bp.route('/persona/llm/http', methods=['GET'])
+def get_llm_http_stats():
+    from agents.llm.llm_router import http_stats
+    return jsonify(http_stats())
+
+
+@persona_admin_bp.route('/persona/llm/cache', methods=['GET'])
+def get_llm_cache_stats():
+    from agents.persona.agent import PersonaAgent
+    return jsonify(PersonaAgent._quote_cache.stats())
+
+
+@persona_admin_bp.route('/persona/llm/quote-pool', methods=['GET'])
+def get_quote_pool_stats():
+    from agents.persona.agent import PersonaAgent
+    return jsonify(PersonaAgent._quote_pool.stats())
+
+
+@persona_admin_bp.route('/persona/llm/residency', methods=['GET'])
+def get_llm_residency_stats():
+    from agents.llm.llm_router import residency_stats
+    return jsonify(residency_stats())
+
+
+@persona_admin_bp.route('/persona/llm/endpoints', methods=['GET'])
+def get_llm_endpoint_stats():
+    from agents.llm.llm_router import endpoint_stats
+    return jsonify(endpoint_stats())
+
+
+@persona_admin_bp.route('/persona/llm/structured', methods=['GET'])
+def get_llm_structured_stats():
+    from agents.llm.llm_router import structured_stats
+    return jsonify(structured_stats())
+
+
+@persona_admin_bp.route('/llm/metrics', methods=['GET'])
+def get_llm_metrics():
+    """Per-caller call telemetry. ?window=<seconds> ?caller=<tag> ?recent=<n raw records>"""
+    from agents.llm import telemetry
+    from agents.llm.llm_router import call_metrics
+    window = request.args.get('window', type=float)
+    caller = request.args.get('caller') or None
+    result = call_metrics(window, caller)
+    recent = request.args.get('recent', 0, type=int)
+    if recent > 0:
+        result['recent'] = telemetry.recent(recent, caller)
+    return jsonify(result)
+
+
+# ------------------------------------------------------------------ #
+#  Experiment generation                                             #
 # ------------------------------------------------------------------ #
 
 @persona_admin_bp.route('/persona/experiment/<state>', methods=['POST'])
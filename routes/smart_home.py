@@ -90,6 +90,10 @@ def device_toggle_mode(device_name, mode):
     if device.activated == False:
         device.activated = True
         device.mode = None
+        if device_name == 'led':
+            from agents.persona import context_cache, state_engine
+            context_cache.invalidate('led')
+            state_engine.invalidate('led')
     if device.mode == mode:
         device.mode = None
     else:
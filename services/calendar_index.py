@@ -0,0 +1,144 @@
+"""Indexed view of get_all_events(), built once per calendar refresh.
+
+get_all_events() hands out a fresh unpickled copy of every event on each call (flask-caching
+SimpleCache) and every caller then scanned it and re-parsed the ISO strings. The index parses
+each event once and answers the questions callers actually ask:
+
+- on(date_str): events on a local date (same rule as calendar_utils.is_event_on) — a bucket lookup.
+- active_at(t): timed events with start <= t < end. Timed entries are sorted by start; only
+  those starting within the longest event duration before t are checked (bisect).
+- starting_within(t, delta): timed events with t <= start <= t + delta (bisect).
+- first_start_after(t): earliest timed start strictly after t (for scheduling the next change).
+- resolve_overlaps(entries): drop untitled entries that overlap a titled one — a sweep that
+  merges the titled intervals once, then one bisect per untitled entry.
+
+get_all_events() publishes a new index whenever it actually refetches; calendar_index()
+additionally rebuilds from the memoized events every INDEX_MAX_AGE seconds so the index
+never outlives the memoize timeout by much.
+"""
+import bisect
+import datetime
+import threading
+import time
+
+from services.calendar_utils import parse_dt, event_label
+
+INDEX_MAX_AGE = 5 * 60  # seconds before calendar_index() re-reads get_all_events()
+
+
+class CalendarEntry:
+    """One event with its times parsed: aware start/end (all-day events span local midnights)."""
+    __slots__ = ('event', 'start', 'end', 'all_day', 'date', 'label')
+
+    def __init__(self, event: dict, start: datetime.datetime, end: datetime.datetime, all_day: bool):
+        self.event = event
+        self.start = start
+        self.end = end
+        self.all_day = all_day
+        self.date = start.astimezone().strftime('%Y-%m-%d')
+        self.label = event_label(event)
+
+    @property
+    def purpose(self) -> str:
+        return self.event.get('calendar_purpose', '')
+
+    @classmethod
+    def from_event(cls, event: dict) -> 'CalendarEntry | None':
+        start_raw = event.get('start', {})
+        end_raw = event.get('end', {})
+        try:
+            if start_raw.get('dateTime'):
+                start = parse_dt(start_raw['dateTime'])
+                end = parse_dt(end_raw['dateTime']) if end_raw.get('dateTime') else start
+                return cls(event, start, end, False)
+            if start_raw.get('date'):
+                start = parse_dt(start_raw['date']).astimezone()  # local midnight
+                end = parse_dt(end_raw['date']).astimezone() if end_raw.get('date') else start + datetime.timedelta(days=1)
+                return cls(event, start, end, True)
+        except (ValueError, TypeError, AttributeError):
+            pass
+        return None
+
+
+class CalendarIndex:
+    def __init__(self, events: list[dict]):
+        self.events = events
+        self.built_at = time.time()
+        self.entries: list[CalendarEntry] = []
+        self._by_date: dict[str, list[CalendarEntry]] = {}
+        for event in events:
+            entry = CalendarEntry.from_event(event)
+            if entry is None:
+                continue
+            self.entries.append(entry)
+            self._by_date.setdefault(entry.date, []).append(entry)
+        self._timed = sorted((e for e in self.entries if not e.all_day), key=lambda e: e.start)
+        self._starts = [e.start for e in self._timed]
+        self._max_len = max((e.end - e.start for e in self._timed), default=datetime.timedelta(0))
+
+    def on(self, date_str: str) -> list[CalendarEntry]:
+        """Entries on a local date (YYYY-MM-DD), in get_all_events() order."""
+        return self._by_date.get(date_str, [])
+
+    def active_at(self, t: datetime.datetime) -> list[CalendarEntry]:
+        """Timed entries in progress at t (aware), earliest start first."""
+        lo = bisect.bisect_left(self._starts, t - self._max_len)
+        hi = bisect.bisect_right(self._starts, t)
+        return [e for e in self._timed[lo:hi] if e.end > t]
+
+    def starting_within(self, t: datetime.datetime, delta: datetime.timedelta) -> list[CalendarEntry]:
+        """Timed entries with t <= start <= t + delta, earliest first."""
+        lo = bisect.bisect_left(self._starts, t)
+        hi = bisect.bisect_right(self._starts, t + delta)
+        return self._timed[lo:hi]
+
+    def first_start_after(self, t: datetime.datetime) -> datetime.datetime | None:
+        i = bisect.bisect_right(self._starts, t)
+        return self._starts[i] if i < len(self._starts) else None
+
+
+def resolve_overlaps(entries: list[CalendarEntry]) -> list[CalendarEntry]:
+    """Drop untitled entries that overlap a titled one; the rest sorted by start."""
+    titled = [e for e in entries if e.event.get('summary')]
+    untitled = [e for e in entries if not e.event.get('summary')]
+    merged: list[list] = []  # disjoint [start, end] spans covered by titled entries
+    for e in sorted(titled, key=lambda e: e.start):
+        if merged and e.start < merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e.end)
+        else:
+            merged.append([e.start, e.end])
+    span_starts = [s for s, _ in merged]
+    surviving = []
+    for u in untitled:
+        i = bisect.bisect_left(span_starts, u.end) - 1  # last span starting before u ends
+        if i < 0 or merged[i][1] <= u.start:
+            surviving.append(u)
+    return sorted(titled + surviving, key=lambda e: e.start)
+
+
+_index: CalendarIndex | None = None
+_lock = threading.Lock()
+
+
+def publish(events: list[dict]) -> CalendarIndex:
+    """Index freshly fetched events (called by get_all_events on a refetch)."""
+    global _index
+    index = CalendarIndex(events)
+    _index = index
+    return index
+
+
+def calendar_index() -> CalendarIndex:
+    """The current index; raises like get_all_events() when the calendar is unavailable."""
+    index = _index
+    if index is not None and time.time() - index.built_at < INDEX_MAX_AGE:
+        return index
+    with _lock:
+        index = _index
+        if index is not None and time.time() - index.built_at < INDEX_MAX_AGE:
+            return index
+        from services.google_calendar import get_all_events
+        events = get_all_events()  # a real refetch publishes on its own
+        if _index is index:
+            publish(events)
+        return _index
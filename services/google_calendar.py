@@ -112,6 +112,11 @@ def get_all_events():
     sorted_events = sorted(all_events, key=lambda x: (x['start'].get('dateTime') or x['start'].get('date')))
     with open(TOKEN_PATH, 'wb') as token:
         pickle.dump(credentials, token)
+    from services.calendar_index import publish
+    publish(sorted_events)  # only runs on a memoize miss, i.e. a real refetch
+    from agents.persona import context_cache, state_engine
+    context_cache.invalidate('calendar')
+    state_engine.invalidate('calendar')
     return sorted_events
 
 @google_calendar.route('/calendar/list')
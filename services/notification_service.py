@@ -208,26 +208,19 @@ class NotificationService:
         if HomeContextService.is_home():
             return
         try:
-            from services.google_calendar import get_all_events
-            from services.calendar_utils import parse_dt
+            from services.calendar_index import calendar_index
             from agents.persona.agent import PersonaAgent
             from services.telegram_service import TelegramService
 
             now = datetime.now(timezone.utc)
-            soon = now + timedelta(minutes=30)
 
-            for event in get_all_events():
-                start_str = event.get('start', {}).get('dateTime')
-                if not start_str:
-                    continue
-                start = parse_dt(start_str)
-                if not (now < start <= soon):
-                    continue
-                if start_str in cls._notified_meetings:
+            for entry in calendar_index().starting_within(now, timedelta(minutes=30)):
+                start_str = entry.event['start']['dateTime']
+                if entry.start == now or start_str in cls._notified_meetings:
                     continue
                 cls._notified_meetings.add(start_str)
-                name = event.get('summary') or 'a meeting'
-                minutes = max(1, int((start - now).total_seconds() // 60))
+                name = entry.event.get('summary') or 'a meeting'
+                minutes = max(1, int((entry.start - now).total_seconds() // 60))
                 text = PersonaAgent.generate_reactive_line(
                     f"the user is away from home and '{name}' starts in {minutes} minutes"
                 )
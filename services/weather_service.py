@@ -97,6 +97,12 @@ def get_hourly_forecast(city: str, count: int = 24) -> dict | None:
     except Exception:
         return None
 
+def _context_changed():
+    """Fresh forecast or air-quality data — the persona's weather section and state are out of date."""
+    from agents.persona import context_cache, state_engine
+    context_cache.invalidate('weather')
+    state_engine.invalidate('weather')
+
 def get_default_location():
     try:
         loc = WeatherLocation.get(WeatherLocation.is_default == True)
@@ -160,11 +166,14 @@ def fetch_weather_data(city):
             weather_data.last_updated = datetime.now()
             weather_data.first_time = first_time
             weather_data.save()
+            _context_changed()
             return weather_data
         except WeatherData.DoesNotExist:
-            return WeatherData.create(city=city, latitude=latitude, longitude=longitude, timezone=timezone,
-                                      hourly_temperatures=hourly_temperatures, hourly_precipitation=hourly_precipitation,
-                                      hourly_weathercodes=hourly_weathercodes, first_time=first_time)
+            weather_data = WeatherData.create(city=city, latitude=latitude, longitude=longitude, timezone=timezone,
+                                              hourly_temperatures=hourly_temperatures, hourly_precipitation=hourly_precipitation,
+                                              hourly_weathercodes=hourly_weathercodes, first_time=first_time)
+            _context_changed()
+            return weather_data
         
     else:
         print("Failed to fetch weather data")
@@ -269,6 +278,7 @@ def fetch_air_quality(city: str) -> AirQualityData | None:
                 hourly_pm10=hourly_pm10,
                 first_time=first_time,
             )
+        _context_changed()
         return record
     except Exception as e:
         print(f"[AirQuality] Error fetching for {city}: {e}")
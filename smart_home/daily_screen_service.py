@@ -4,8 +4,8 @@ import os
 from PIL import Image, ImageDraw, ImageFont
 
 from services.weather_service import get_default_location, get_hourly_forecast
-from services.calendar_utils import is_event_on, parse_dt, event_label
-import services.google_calendar as google_calendar
+from services.calendar_utils import parse_dt, event_label
+from services.calendar_index import calendar_index
 from smart_home.home_context_service import HomeContextService
 from models import Task, ShoppingListItem
 import config
@@ -95,24 +95,23 @@ def _temp_color(temp):
 
 
 def _build_rows(today_events):
-    """Fill up to MAX_ROWS: events → overdue tasks → due-today tasks → shopping."""
+    """Fill up to MAX_ROWS: events → overdue tasks → due-today tasks → shopping.
+
+    today_events: calendar_index entries for today.
+    """
     rows = []
     now_tz      = datetime.datetime.now(datetime.timezone.utc).astimezone()
     today_start = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
     today_end   = datetime.datetime.combine(datetime.date.today(), datetime.time.max)
 
     # 1. Today's timed events, skip already-ended ones
-    timed = sorted(
-        [e for e in today_events if e.get('start', {}).get('dateTime')],
-        key=lambda e: e['start']['dateTime'],
-    )
-    for event in timed:
+    timed = sorted([e for e in today_events if not e.all_day], key=lambda e: e.start)
+    for entry in timed:
         if len(rows) >= MAX_ROWS:
             break
-        end_str = event.get('end', {}).get('dateTime')
-        if end_str and parse_dt(end_str) < now_tz:
+        if entry.end < now_tz:
             continue
-        rows.append({'type': 'event', 'data': event})
+        rows.append({'type': 'event', 'data': entry.event})
 
     # 2. Overdue tasks
     if len(rows) < MAX_ROWS:
@@ -349,8 +348,7 @@ def generate_daily_image() -> Image.Image:
 
     # ── Event / task / shopping rows (right panel, y=160-379) ────────────────
     try:
-        all_events   = google_calendar.get_all_events()
-        today_events = [e for e in all_events if is_event_on(e, today_str)]
+        today_events = calendar_index().on(today_str)
     except Exception as e:
         print(f"[Daily] Calendar error: {e}")
         today_events = []
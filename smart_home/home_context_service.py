@@ -25,6 +25,11 @@ def _load_mqtt_credentials() -> tuple[str, str]:
         return '', ''
 
 
+def _persona_state_changed():
+    from agents.persona.state_engine import invalidate
+    invalidate('mqtt')
+
+
 class HomeContextService:
     # Connection
     _mqtt_connected: bool = False
@@ -100,12 +105,14 @@ class HomeContextService:
 
         def on_connect(client, userdata, flags, rc):
             cls._mqtt_connected = (rc == 0)
+            _persona_state_changed()
             print(f"[HomeContext] MQTT connected (rc={rc})")
             client.subscribe(config.Config.PRESENCE_TOPIC)
             client.subscribe(config.Config.AIC_TOPIC)
 
         def on_disconnect(client, userdata, rc):
             cls._mqtt_connected = False
+            _persona_state_changed()
             if rc != 0:
                 print(f"[HomeContext] MQTT disconnected unexpectedly (rc={rc})")
 
@@ -124,6 +131,7 @@ class HomeContextService:
                         if cls._was_home is not True and time.time() - cls._home_since >= PRESENCE_HOME_CONFIRM:
                             if cls._was_home is False:  # confirmed away→home transition
                                 cls._welcome_until = time.time() + 120  # 2-minute welcome window
+                                _persona_state_changed()
                                 for fn in cls._on_arrive_callbacks:
                                     threading.Thread(target=fn, daemon=True).start()
                             cls._was_home = True
@@ -138,6 +146,7 @@ class HomeContextService:
                             cls._was_home = False
                 elif msg.topic == config.Config.AIC_TOPIC:
                     cls._aic_updated = time.time()
+                    shown, resolved = cls._context_key(), cls._state_inputs()
                     voc = data.get(config.Config.VOC_FIELD)
                     if voc is not None:
                         cls._voc = float(voc)
@@ -151,6 +160,11 @@ class HomeContextService:
                     if humidity is not None:
                         cls._indoor_humidity = float(humidity)
                     cls._save_aic()
+                    if cls._context_key() != shown:
+                        from agents.persona.context_cache import invalidate
+                        invalidate('sensors')
+                    if cls._state_inputs() != resolved:
+                        _persona_state_changed()
             except Exception:
                 pass
 
@@ -189,6 +203,18 @@ class HomeContextService:
     def is_just_arrived(cls) -> bool:
         return time.time() < cls._welcome_until
 
+    @classmethod
+    def _context_key(cls) -> tuple:
+        """The indoor readings as the persona context renders them; most sensor updates leave it unchanged."""
+        t, h = cls._indoor_temp, cls._indoor_humidity
+        return (f"{t:.0f}" if t is not None else None, f"{h:.0f}" if h is not None else None, cls.air_quality())
+
+    @classmethod
+    def _state_inputs(cls) -> tuple:
+        """What the persona state resolves from the indoor readings (poor-air VOC, discomfort situation)."""
+        poor = cls.has_poor_air()
+        return poor, int(cls._voc) if poor else None, cls.indoor_discomfort(), cls._context_key()
+
     @classmethod
     def air_quality(cls) -> str | None:
         """Return 'good', 'poor', or 'alert' based on VOC and NOx indices, or None if no data yet."""
@@ -1,9 +1,8 @@
 from typing import List, Dict
 from services.weather_service import get_cached_or_fetch, get_default_location
-from services.calendar_utils import is_event_on, parse_dt
+from services.calendar_index import calendar_index
 import json
 import datetime
-import services.google_calendar as google_calendar
 import re
 from cache import cache
 
@@ -31,23 +30,19 @@ class LedEnricherService:
         self.add_indicator(weather)
 
         try:
-            events = google_calendar.get_all_events()
+            index = calendar_index()
             now = datetime.datetime.now()
             now_tz = datetime.datetime.now(datetime.timezone.utc).astimezone()
             today_str = now.strftime('%Y-%m-%d')
             tomorrow_str = (now + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
-            today = [e for e in events if is_event_on(e, today_str)]
-            tomorrow = [e for e in events if is_event_on(e, tomorrow_str)]
+            today = index.on(today_str)
+            tomorrow = index.on(tomorrow_str)
 
             soonest = None
-            for event in today:
-                start_str = event.get('start', {}).get('dateTime')
-                if not start_str:
-                    continue
-                time_until = (parse_dt(start_str) - now_tz).total_seconds()
-                if 0 <= time_until <= 3600:
-                    if soonest is None or time_until < soonest:
-                        soonest = time_until
+            for entry in index.starting_within(now_tz, datetime.timedelta(hours=1)):
+                if entry.date == today_str:
+                    soonest = (entry.start - now_tz).total_seconds()
+                    break
             if soonest is not None:
                 weather["animations"] = [{
                     "type": "comet",
@@ -140,11 +135,12 @@ class LedEnricherService:
         }
 
     def special_occasions(self, today_events, tomorrow_events):
+        """today_events / tomorrow_events: calendar_index entries."""
         leds = []
 
         # Christmas
         pattern = r"Christmas"
-        event = [event for event in today_events if re.search(pattern, event.get('summary', ''))]
+        event = [e.event for e in today_events if re.search(pattern, e.event.get('summary', ''))]
         if event:
             for led in range(10):
                 leds.append({"index": led, "color": [10, 250, 5], "brightness": 100, "animations": [{"type": "pulse",
@@ -155,7 +151,7 @@ class LedEnricherService:
 
         # Hanuka
         pattern = r"Hanukkah \(Day (\d)\)"
-        event = [event for event in tomorrow_events if re.search(pattern, event.get('summary', ''))]
+        event = [e.event for e in tomorrow_events if re.search(pattern, e.event.get('summary', ''))]
         if event:
             match = re.search(pattern, event[0]['summary'])
             days_of_hanuka = int(match.group(1))
@@ -174,24 +170,21 @@ class LedEnricherService:
         }
 
     def calendar_indicator(self, today_events):
+        """today_events: calendar_index entries for today."""
         leds = []
         max_brightness = 250
         now = datetime.datetime.now(datetime.timezone.utc).astimezone()
 
-        timed_events = [event for event in today_events if event.get('start', {}).get('dateTime')]
+        timed_events = [e for e in today_events if not e.all_day]
         if timed_events:
-            current_and_future_events = []
-            for event in timed_events:
-                event_time = parse_dt(event.get('end', {}).get('dateTime'))
-                if event_time > now:
-                    current_and_future_events.append(event)
+            current_and_future_events = [e for e in timed_events if e.end > now]
 
             if current_and_future_events:
                 i = 0
-                for event in current_and_future_events[:5]:
-                    color = event.get('calendar_color_rgb', [200, 200, 5])
+                for entry in current_and_future_events[:5]:
+                    color = entry.event.get('calendar_color_rgb', [200, 200, 5])
 
-                    time_until = (parse_dt(event.get('start', {}).get('dateTime')) - now).total_seconds()
+                    time_until = (entry.start - now).total_seconds()
                     if time_until < 0 or time_until > 3600:
                         brightness = int(min(max(8, max_brightness - time_until / 60), max_brightness))
                         led_animations = []
@@ -211,14 +204,12 @@ class LedEnricherService:
     def today_events(self):
         today = datetime.datetime.now()
         today_str = today.strftime('%Y-%m-%d')
-        events = google_calendar.get_all_events()
-        return [event for event in events if is_event_on(event, today_str)]
+        return [e.event for e in calendar_index().on(today_str)]
 
     def tomorrow_events(self):
         tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
         tomorrow_str = tomorrow.strftime('%Y-%m-%d')
-        events = google_calendar.get_all_events()
-        return [event for event in events if is_event_on(event, tomorrow_str)]
+        return [e.event for e in calendar_index().on(tomorrow_str)]
 
     def get_led_state(self) -> Dict:
         """
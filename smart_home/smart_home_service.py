@@ -31,6 +31,10 @@ def change_device_status(name, status):
     device = SmartHomeDevice.get(SmartHomeDevice.name == name)
     device.activated = status
     device.save()
+    if name == 'led':
+        from agents.persona import context_cache, state_engine
+        context_cache.invalidate('led')
+        state_engine.invalidate('led')
     return device
 
 